@@ -4,7 +4,8 @@
 # Apache 2.0
 
 from __future__ import division
-import os, glob, argparse, sys, re, time
+import os, glob, argparse, sys, re, time, bisect
+import multiprocessing
 from argparse import ArgumentParser
 
 use_numpy = True
@@ -322,12 +323,14 @@ class Stats(object):
     self.noise_only = 0
 
 # Timer class to time functions
+# (time.clock() was removed in python 3.8; process_time() is its equivalent)
+timer_clock = getattr(time, 'process_time', None) or time.clock
 class Timer(object):
   def __enter__(self):
-    self.start = time.clock()
+    self.start = timer_clock()
     return self
   def __exit__(self, *args):
-    self.end = time.clock()
+    self.end = timer_clock()
     self.interval = self.end - self.start
 
 # The main class for post-processing a file.
@@ -1071,6 +1074,11 @@ class JointResegmenter(object):
       global_analysis_final.add(a)
     ############################################################################
 
+    self.write_segments(segments, max_end_time, out_file_handle)
+
+  # Write the segments (a list of (start, end) frame tuples) in the format of
+  # the segments file
+  def write_segments(self, segments, max_end_time, out_file_handle = sys.stdout):
     # we'll be printing the times out in hundredths of a second (regardless of the
     # value of $frame_shift), and first need to know how many digits we need (we'll be
     # printing with "%05d" or similar, for zero-padding.
@@ -1185,6 +1193,347 @@ class JointResegmenter(object):
     return a
   # End function segmentation_analysis
 
+# Returns a boolean lookup table over the 15 frame classes (see the THIS_*
+# constants in JointResegmenter) that is true for the classes in 'classes'
+def class_table(classes):
+  table = np.zeros(15, dtype=bool)
+  table[[int(x) for x in classes]] = True
+  return table
+
+# A NumPy implementation of JointResegmenter, which gives identical segments.
+# The frame classes are stored as int8 arrays (0 ... 14 instead of
+# "0" ... "14") and the segment start and end markers as bool arrays. The
+# per-frame loops are replaced with vectorized operations; the loops that
+# remain (in set_nonspeech_proportion and merge_segments) only visit the
+# segment boundaries.
+# The analysis against a reference RTTM is not supported; JointResegmenter
+# must be used for that.
+class NumpyJointResegmenter(JointResegmenter):
+  def __init__(self, P, A, f, options, phone_map, stats = None, reference = None):
+    assert (reference == None)
+    # The arrays set by JointResegmenter.__init__() are replaced below
+    JointResegmenter.__init__(self, P, [], f, options, phone_map, stats)
+    self.A = np.array(A, dtype=np.int8)    # Predicted classes
+    self.B = self.A.copy()                 # Original predicted classes
+    self.N = len(A)
+    self.S = np.zeros(self.N, dtype=bool)
+    self.E = np.zeros(self.N+1, dtype=bool)
+
+    self.IS_SILENCE = class_table(self.THIS_SILENCE)
+    self.IS_SPEECH = class_table(self.THIS_SPEECH)
+    self.IS_SILENCE_OR_NOISE = class_table(self.THIS_SILENCE_OR_NOISE)
+    self.IS_CONVERT = class_table(self.THIS_CONVERT)
+
+    # The pairs of (previous frame, this frame) class sets that define the
+    # transition types 0 ... 9 in the order they are checked in
+    # transition_type()
+    self.transition_tables = [(class_table(x), class_table(y)) for x, y in [
+      (self.THIS_SPEECH_THAT_NOISE + self.THIS_SPEECH_THAT_SIL,) * 2,
+      (self.THIS_SPEECH,) * 2,
+      (self.THIS_SPEECH + self.THIS_NOISE_CONVERT_THAT_SIL + self.THIS_NOISE_CONVERT_THAT_NOISE,) * 2,
+      (self.THIS_SPEECH + self.THIS_NOISE_CONVERT,) * 2,
+      (self.THIS_SPEECH + self.THIS_NOISE_CONVERT + self.THIS_SIL_CONVERT_THAT_SIL + self.THIS_SIL_CONVERT_THAT_NOISE,) * 2,
+      (self.THIS_SPEECH + self.THIS_CONVERT,) * 2,
+      (self.THIS_SPEECH_PLUS, self.THIS_SPEECH_PLUS + self.THIS_NOISE),
+      (self.THIS_SPEECH_PLUS, self.THIS_SPEECH_PLUS + self.THIS_SILENCE),
+      (self.THIS_SPEECH_PLUS + self.THIS_NOISE, self.THIS_SPEECH_PLUS),
+      (self.THIS_SPEECH_PLUS + self.THIS_SILENCE, self.THIS_SPEECH_PLUS)]]
+
+  def restrict(self, N):
+    self.B = self.B[0:N]
+    self.A = self.A[0:N]
+    self.S = self.S[0:N]
+    self.E = self.E[0:N+1]
+    if self.S.sum() == self.E.sum() + 1:
+      self.E[N] = True
+    self.N = N
+
+  # Returns, for each of the frames n in 'frames', the first frame p > n with
+  # an end marker, or 'default' if there is none
+  def next_segment_ends(self, frames, default):
+    ends = np.flatnonzero(self.E)
+    k = np.searchsorted(ends, frames, side='right')
+    return np.where(k < len(ends), ends[np.minimum(k, len(ends) - 1)], default) \
+        if len(ends) > 0 else np.full(len(frames), default, dtype=int)
+
+  def get_initial_segments(self):
+    is_speech = self.IS_SPEECH[self.A]
+    # Frames that are different from the previous frame.
+    changed = self.A[1:] != self.A[:-1]
+    # A speech frame after a different frame is the beginning of a segment,
+    # and any frame after a different speech frame is the end of one.
+    self.S[0] = is_speech[0]
+    self.S[1:] = changed & is_speech[1:]
+    self.E[1:self.N] = changed & is_speech[:-1]
+    self.E[self.N] = is_speech[self.N-1]
+    assert(self.S.sum() == self.E.sum())
+
+  def set_nonspeech_proportion(self):
+    segment_starts = np.flatnonzero(self.S)
+    segment_ends = np.flatnonzero(self.E)
+    # The segment starts and ends must alternate
+    assert (len(segment_starts) == len(segment_ends))
+    assert (np.all(segment_starts < segment_ends))
+    assert (np.all(segment_ends[:-1] <= segment_starts[1:]))
+    num_speech_frames = int((segment_ends - segment_starts).sum())
+    if num_speech_frames == 0:
+      sys.stderr.write("%s: Warning: no speech found for recording %s\n" % (sys.argv[0], self.file_id))
+
+    # Active frames are the frames that are either segment starts
+    # or segment ends, in order, with a segment end before a segment start
+    # at the same frame.
+    active_frames = (np.sort(np.concatenate((2 * segment_ends, 2 * segment_starts + 1))) // 2).tolist()
+
+    target_segment_frames = int(num_speech_frames/(1.0 - self.options.silence_proportion))
+    num_segment_frames = num_speech_frames
+
+    # This is the same loop as in JointResegmenter.set_nonspeech_proportion(),
+    # on bytearrays, which are faster than numpy arrays for single elements.
+    A = bytearray(self.A.tobytes())
+    B = bytearray(self.B.tobytes())
+    S = bytearray(self.S.tobytes())
+    E = bytearray(self.E.tobytes())
+    N = self.N
+    while num_segment_frames < target_segment_frames:
+      changed = False
+      for i in range(0, len(active_frames)):
+        n = active_frames[i]
+        if E[n] and n < N and not S[n]:
+          assert (not 6 <= A[n] <= 8)
+          A[n] = B[n] + 9
+          if B[n-1] != B[n]:
+            S[n] = True
+            active_frames.append(n+1)
+          else:
+            E[n] = False
+            active_frames[i] = n + 1
+          E[n+1] = True
+          num_segment_frames += 1
+          changed = True
+        if n < N and S[n] and n > 0 and not E[n]:
+          assert (not 6 <= A[n-1] <= 8)
+          A[n-1] = B[n-1] + 9
+          if B[n-1] != B[n]:
+            E[n] = True
+            active_frames.append(n-1)
+          else:
+            S[n] = False
+            active_frames[i] = n - 1
+          S[n-1] = True
+          num_segment_frames += 1
+          changed = True
+        if num_segment_frames >= target_segment_frames:
+          break
+      if not changed:   # avoid an infinite loop. if no changes, then break.
+        break
+    if num_segment_frames < target_segment_frames:
+      proportion = float(num_segment_frames - num_speech_frames)/ num_segment_frames
+      sys.stderr.write("%s: Warning: for recording %s, only got a proportion %f of non-speech frames, versus target %f\n" % (sys.argv[0], self.file_id, proportion, self.options.silence_proportion))
+    self.A = np.frombuffer(A, dtype=np.int8).copy()
+    self.S = np.frombuffer(S, dtype=bool).copy()
+    self.E = np.frombuffer(E, dtype=bool).copy()
+
+  def merge_segments(self):
+    assert (self.S.sum() == self.E.sum())
+
+    if self.options.verbose > 3:
+      sys.stderr.write("Length of segment starts before non-speech adding: %d\n" % self.S.sum())
+
+    if self.min_inter_utt_nonspeech_length > 0.0:
+      # Every segment start and end (and the start and end of the file)
+      # becomes both a segment start and a segment end
+      marks = self.S | self.E[:self.N]
+      marks[0] = True
+      self.S = marks
+      self.E[1:self.N] |= marks[1:]
+      self.E[self.N] = True
+      if self.options.verbose > 3:
+        sys.stderr.write("Length of segment starts after non-speech adding: %d\n" % self.S.sum())
+
+    segment_starts = np.flatnonzero(self.S)
+    segment_ends = np.flatnonzero(self.E)
+    assert (len(segment_starts) == len(segment_ends))
+
+    # A boundary is a frame which is both a segment start and a segment end.
+    # The segment score is the min of the lengths of the segments to the
+    # left and to the right of it.
+    boundaries = np.flatnonzero(self.S & self.E[:self.N])
+    i = np.searchsorted(segment_starts, boundaries)
+    j = np.searchsorted(segment_ends, boundaries)
+    assert (np.all(j + 1 < len(segment_ends)))
+    segment_scores = np.minimum(boundaries - segment_starts[i-1],
+        segment_ends[j+1] - boundaries)
+    transition_types = self.transition_types(boundaries)
+    # Sort the boundaries by the type of transition and then by the segment
+    # score; this is the order that the repeated stable sorts in
+    # JointResegmenter.merge_segments() give.
+    boundaries = sorted(zip(boundaries.tolist(), segment_scores.tolist(),
+                            transition_types.tolist()),
+                        key = lambda x: (x[2], x[1]))
+
+    # The merging loop is the same as in JointResegmenter.merge_segments(),
+    # but the neighbouring segment start and end markers are found by binary
+    # search in sorted lists of them instead of by going through the frames.
+    S = bytearray(self.S.tobytes())
+    E = bytearray(self.E.tobytes())
+    segment_starts = segment_starts.tolist()
+    segment_ends = segment_ends.tolist()
+    N = self.N
+    min_inter_utt_nonspeech_length = self.min_inter_utt_nonspeech_length
+
+    def unset(markers, positions, n):
+      if markers[n]:
+        markers[n] = False
+        del positions[bisect.bisect_left(positions, n)]
+
+    def next_end(n):
+      # The first p > n with E[p], or N + 1
+      k = bisect.bisect_right(segment_ends, n)
+      return segment_ends[k] if k < len(segment_ends) else N + 1
+
+    for b in boundaries:
+      segment_length = 0
+
+      if min_inter_utt_nonspeech_length > 0.0 and not E[b[0]]:
+        continue
+
+      k = bisect.bisect_left(segment_starts, b[0]) - 1
+      p_left = segment_starts[k] if k >= 0 else -1
+      segment_length += b[0] - p_left
+
+      p = next_end(b[0])
+      assert (min_inter_utt_nonspeech_length == 0 or p == N or S[p] or self.IS_SILENCE_OR_NOISE[self.A[p]])
+
+      if min_inter_utt_nonspeech_length > 0 and self.IS_SILENCE_OR_NOISE[self.A[b[0]]]:
+        assert(b[2] == 6 or b[2] == 7)
+        if (p - b[0]) > min_inter_utt_nonspeech_length:
+          unset(S, segment_starts, b[0])
+          unset(E, segment_ends, p)
+          self.stats.inter_utt_nonspeech += 1
+          continue
+
+        p_temp = p
+        p = next_end(p)
+        segment_length += p - b[0]
+        if segment_length < self.max_frames:
+          self.stats.merge_nonspeech_segment += 1
+          if p_temp < N:
+            unset(S, segment_starts, p_temp)
+            unset(E, segment_ends, p_temp)
+          unset(S, segment_starts, b[0])
+          unset(E, segment_ends, b[0])
+          continue
+        else:
+          unset(S, segment_starts, b[0])
+          unset(E, segment_ends, p_temp)
+          continue
+      elif min_inter_utt_nonspeech_length > 0 and (b[2] == 8 or b[2] == 9):
+        assert(p_left == 0)
+        if b[0] - p_left > min_inter_utt_nonspeech_length:
+          unset(S, segment_starts, p_left)
+          unset(E, segment_ends, b[0])
+          continue
+      segment_length += p - b[0]
+
+      if segment_length < self.max_frames:
+        self.stats.merge_segments += 1
+        unset(S, segment_starts, b[0])
+        unset(E, segment_ends, b[0])
+    # End for loop over boundaries
+
+    self.S = np.frombuffer(S, dtype=bool).copy()
+    self.E = np.frombuffer(E, dtype=bool).copy()
+    assert (self.S.sum() == self.E.sum())
+
+  def split_long_segments(self):
+    assert (self.S.sum() == self.E.sum())
+    segment_starts = np.flatnonzero(self.S)
+    segment_ends = self.next_segment_ends(segment_starts, self.N + 1)
+    long_segments = (segment_ends - segment_starts) > self.hard_max_frames
+    for n, p in zip(segment_starts[long_segments].tolist(),
+                    segment_ends[long_segments].tolist()):
+      self.split_segment(n, p)
+    assert (self.S.sum() == self.E.sum())
+
+  # Split the segment from frame n to frame p into pieces of at most
+  # hard_max_frames frames, as JointResegmenter.split_long_segments() does
+  def split_segment(self, n, p):
+    segment_length = p - n
+    if segment_length <= self.hard_max_frames:
+      return
+    self.stats.split_segments += 1
+
+    num_pieces = int((float(segment_length)/self.hard_max_frames) + 0.99999)
+    sys.stderr.write("%s: Warning: for recording %s, " \
+        % (sys.argv[0], self.file_id) \
+        + "splitting segment of length %f seconds into %d pieces " \
+        % (segment_length * self.frame_shift, num_pieces) \
+        + "(--hard-max-segment-length %f)\n" \
+        % self.options.hard_max_segment_length)
+    frames_per_piece = int(segment_length/num_pieces)
+    piece_starts = [n + i * frames_per_piece for i in range(1,num_pieces)]
+    self.S[piece_starts] = True
+    self.E[piece_starts] = True
+    # The pieces are themselves checked for length (the last one may be a
+    # little longer than the others)
+    for q, q_end in zip(piece_starts, piece_starts[1:] + [p]):
+      self.split_segment(q, q_end)
+
+  # Remove the segments that contain no frame with its class in 'table'
+  # and return the number of them
+  def remove_segments_without(self, table, segment_starts):
+    segment_ends = self.next_segment_ends(segment_starts, self.N + 1)
+    counts = np.concatenate(([0], np.cumsum(table[self.A])))
+    keep = counts[np.minimum(segment_ends, self.N)] > counts[segment_starts]
+    self.S[segment_starts[~keep]] = False
+    self.E[segment_ends[~keep]] = False
+    return int((~keep).sum())
+
+  def remove_silence_only_segments(self):
+    self.stats.silence_only += self.remove_segments_without(
+        ~self.IS_SILENCE, np.flatnonzero(self.S))
+
+  def remove_noise_only_segments(self):
+    self.stats.noise_only += self.remove_segments_without(
+        self.IS_SPEECH, np.flatnonzero(self.S))
+
+  # Return the transition types from frame j-1 to frame j for the frames j
+  # in 'frames' (see transition_type())
+  def transition_types(self, frames):
+    assert (np.all(frames > 0))
+    prev = self.A[frames-1]
+    this = self.A[frames]
+    assert (np.all((prev != this) | self.IS_CONVERT[this]))
+    types = np.select([prev_table[prev] & this_table[this]
+                       for prev_table, this_table in self.transition_tables],
+                      list(range(len(self.transition_tables))), -1)
+    assert (np.all(types >= 0))
+    return types
+
+  # Output the final segments
+  def print_segments(self, out_file_handle = sys.stdout):
+    assert (self.N == len(self.S))
+    assert (self.N + 1 == len(self.E))
+
+    segment_starts = np.flatnonzero(self.S)
+    segment_ends = self.next_segment_ends(segment_starts, self.N)
+    segment_ends = np.minimum(segment_ends, self.N)
+    # There must not be segment starts inside a segment
+    assert (np.all(segment_starts[1:] >= segment_ends[:-1]))
+
+    # Segment ends outside of segments
+    bad_ends = np.setdiff1d(np.flatnonzero(self.E[:self.N] & ~self.S),
+                            segment_ends)
+    for n in bad_ends.tolist():
+      sys.stderr.write("%s: Error: Ending segment before starting it: n=%d\n" % (sys.argv[0], n))
+
+    segments = list(zip(segment_starts.tolist(), segment_ends.tolist()))
+    if len(segments) == 0:
+      sys.stderr.write("%s: Warning: no segments for recording %s\n" % (sys.argv[0], self.file_id))
+      sys.exit(1)
+
+    self.write_segments(segments, segments[-1][1], out_file_handle)
+
 def map_prediction(A1, A2, phone_map, speech_cap = None, f = None):
   if A2 == None:
     B = []
@@ -1272,6 +1621,153 @@ def map_prediction(A1, A2, phone_map, speech_cap = None, f = None):
       B2.append("2")
   return (B1, B2)
 
+# A NumPy version of map_prediction() for NumpyJointResegmenter. It returns
+# int8 arrays of the classes 0 ... 8 instead of lists of strings.
+def map_prediction_numpy(A1, A2, phone_map, speech_cap = None, f = None):
+  # Map the phones to integer ids, and the ids to classes
+  phone_ids = {}
+  phone_classes = []
+  for phone, cls in phone_map.items():
+    assert (cls in ("0", "1", "2"))
+    phone_ids[phone] = len(phone_classes)
+    phone_classes.append(int(cls))
+  phone_classes = np.array(phone_classes, dtype=np.int8)
+
+  if A2 == None:
+    # Isolated segmentation
+    if len(A1) == 0:
+      sys.stderr.write("In file %s\n" % f)
+      sys.exit(1)
+    # Find the runs of the same phone
+    phones = np.array([phone_ids[x] for x in A1])
+    run_starts = np.flatnonzero(np.concatenate(([True], phones[1:] != phones[:-1])))
+    run_lengths = np.diff(np.append(run_starts, len(A1)))
+    run_classes = phone_classes[phones[run_starts]]
+    run_classes[(run_classes == 1) | ((run_classes == 2) & (speech_cap != None)
+        & (run_lengths > (speech_cap if speech_cap != None else 0)))] = 4
+    run_classes[run_classes == 2] = 8
+    return np.repeat(run_classes, run_lengths)
+
+  # Assuming len(A1) > len(A2)
+  # Otherwise A1 and A2 must be interchanged before
+  # passing to this function
+  C1 = phone_classes[[phone_ids[x] for x in A1]]
+  C2 = phone_classes[[phone_ids[x] for x in A2]]
+  B1 = 3 * C1
+  B2 = C1.copy()
+  B1[0:len(A2)] += C2
+  B2[0:len(A2)] = 3 * C2 + C1[0:len(A2)]
+  return (B1, B2)
+
+# The options and the phone map used by process_recordings(); they are set
+# by init_worker(), in the worker processes if --num-jobs > 1
+g_options = None
+g_phone_map = None
+g_temp_dir = None
+g_speech_cap = None
+g_use_numpy_resegmenter = False
+
+def init_worker(options, phone_map, temp_dir, speech_cap):
+  global g_options, g_phone_map, g_temp_dir, g_speech_cap, g_use_numpy_resegmenter
+  g_options = options
+  g_phone_map = phone_map
+  g_temp_dir = temp_dir
+  g_speech_cap = speech_cap
+  # The analysis against the reference RTTM needs JointResegmenter
+  g_use_numpy_resegmenter = (use_numpy and options.use_numpy_resegmenter == "true"
+      and options.reference_rttm == None)
+
+def read_prediction(f):
+  try:
+    return open(os.path.join(g_options.prediction_dir, f+".pred")).readline().strip().split()[1:]
+  except IndexError:
+    sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (g_options.prediction_dir, f))
+    sys.exit(1)
+
+def read_reference(f):
+  if g_temp_dir != None:
+    try:
+      return open(os.path.join(g_temp_dir, f+".ref")).readline().strip().split()[1:]
+    except IOError:
+      return None
+  return None
+
+# Collects the segments written by print_segments() for process_recordings()
+# (io.StringIO only takes unicode strings in python2)
+class OutputLines(object):
+  def __init__(self):
+    self.lines = []
+
+  def write(self, line):
+    self.lines.append(line)
+
+  def getvalue(self):
+    return ''.join(self.lines)
+
+# Resegment a recording, or the two channels of a recording jointly, and
+# return the segments as a string in the format of the segments file.
+# 'recordings' is a tuple (f,) or (f1, f2) of prediction file names
+# (without the .pred suffix)
+def process_recordings(recordings):
+  if g_use_numpy_resegmenter:
+    resegmenter_class, map_function = NumpyJointResegmenter, map_prediction_numpy
+  else:
+    resegmenter_class, map_function = JointResegmenter, map_prediction
+  stats = Stats()
+  out_file = OutputLines()
+
+  if len(recordings) == 1:
+    f = recordings[0]
+    A = read_prediction(f)
+    B = map_function(A, None, g_phone_map, g_speech_cap, f)
+    r = resegmenter_class(A, B, f, g_options, g_phone_map, stats, read_reference(f))
+    r.resegment()
+    r.print_segments(out_file)
+    return out_file.getvalue()
+
+  f1, f2 = recordings
+  A1 = read_prediction(f1)
+  A2 = read_prediction(f2)
+
+  if len(A1) < len(A2):
+    A3 = A1
+    A1 = A2
+    A2 = A3
+
+    f3 = f1
+    f1 = f2
+    f2 = f3
+  # End if
+
+  if (len(A1) - len(A2)) > g_options.max_length_diff/g_options.frame_shift:
+    sys.stderr.write( \
+        "%s: Warning: Lengths of %s and %s differ by more than %f. " \
+        % (sys.argv[0], f1,f2, g_options.max_length_diff) \
+        + "So using isolated resegmentation\n")
+    B1 = map_function(A1, None, g_phone_map, g_speech_cap)
+    B2 = map_function(A2, None, g_phone_map, g_speech_cap)
+  else:
+    B1,B2 = map_function(A1, A2, g_phone_map, g_speech_cap)
+  # End if
+
+  r1 = resegmenter_class(A1, B1, f1, g_options, g_phone_map, stats, read_reference(f1))
+  r1.resegment()
+  r1.print_segments(out_file)
+
+  r2 = resegmenter_class(A1, B2, f2, g_options, g_phone_map, stats, read_reference(f2))
+  r2.resegment()
+  r2.restrict(len(A2))
+  r2.print_segments(out_file)
+  return out_file.getvalue()
+
+# process_recordings() for the worker processes, where sys.exit() would not
+# stop the script
+def process_recordings_in_worker(recordings):
+  try:
+    return process_recordings(recordings)
+  except SystemExit:
+    raise Exception("Failed to resegment %s" % ' '.join(recordings))
+
 def main():
   parser = ArgumentParser(description='Get segmentation arguments')
   parser.add_argument('--verbose', type=int, \
@@ -1321,6 +1817,15 @@ def main():
   parser.add_argument('--speech-cap-length', type=float, default=None, \
       help="Maximum length in seconds of a particular speech phone prediction." \
       + "\nAny length above this will be considered as noise")
+  parser.add_argument('--use-numpy-resegmenter', type=str, \
+      dest='use_numpy_resegmenter', default="true", choices=("true", "false"), \
+      help="Use the NumPy implementation of the resegmenter, which gives the " \
+      + "same segments but is much faster. It is not used with " \
+      + "--reference-rttm (default: %(default)s)")
+  parser.add_argument('--num-jobs', type=int, \
+      dest='num_jobs', default=1, \
+      help="Number of processes over which the recordings are resegmented. " \
+      + "With --reference-rttm, only 1 is supported (default: %(default)s)")
   parser.add_argument('prediction_dir', \
       help='Directory where the predicted phones (.pred files) are found')
   parser.add_argument('phone_map', \
@@ -1373,8 +1878,6 @@ def main():
   else:
     temp_dir = None
 
-  stats = Stats()
-
   pred_files = dict([ (f.split('/')[-1][0:-5], False) \
     for f in glob.glob(os.path.join(prediction_dir, "*.pred")) ])
 
@@ -1392,6 +1895,9 @@ def main():
     speech_cap = int(options.speech_cap_length/options.frame_shift)
   # End if
 
+  # Get the list of recordings to resegment, with the two channels of
+  # a recording together for joint resegmentation
+  jobs = []
   for f in pred_files:
     if pred_files[f]:
       continue
@@ -1411,86 +1917,38 @@ def main():
 
     if options.isolated_resegmentation or f2 not in pred_files or f1 not in pred_files:
       pred_files[f] = True
-      try:
-        A = open(os.path.join(prediction_dir, f+".pred")).readline().strip().split()[1:]
-      except IndexError:
-        sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f))
-        sys.exit(1)
-
-      B = map_prediction(A, None, phone_map, speech_cap, f)
-
-      if temp_dir != None:
-        try:
-          reference = open(os.path.join(temp_dir, f+".ref")).readline().strip().split()[1:]
-        except IOError:
-          reference = None
-      else:
-        reference = None
-      r = JointResegmenter(A, B, f, options, phone_map, stats, reference)
-      r.resegment()
-      r.print_segments(out_file)
+      jobs.append((f,))
     else:
       if pred_files[f1] and pred_files[f2]:
         continue
       pred_files[f1] = True
       pred_files[f2] = True
-      try:
-        A1 = open(os.path.join(prediction_dir, f1+".pred")).readline().strip().split()[1:]
-      except IndexError:
-        sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f1))
-        sys.exit(1)
-      try:
-        A2 = open(os.path.join(prediction_dir, f2+".pred")).readline().strip().split()[1:]
-      except IndexError:
-        sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f2))
-        sys.exit(1)
-
-      if len(A1) < len(A2):
-        A3 = A1
-        A1 = A2
-        A2 = A3
-
-        f3 = f1
-        f1 = f2
-        f2 = f3
-      # End if
-
-      if (len(A1) - len(A2)) > options.max_length_diff/options.frame_shift:
-        sys.stderr.write( \
-            "%s: Warning: Lengths of %s and %s differ by more than %f. " \
-            % (sys.argv[0], f1,f2, options.max_length_diff) \
-            + "So using isolated resegmentation\n")
-        B1 = map_prediction(A1, None, phone_map, speech_cap)
-        B2 = map_prediction(A2, None, phone_map, speech_cap)
-      else:
-        B1,B2 = map_prediction(A1, A2, phone_map, speech_cap)
-      # End if
-
-      if temp_dir != None:
-        try:
-          reference1 = open(os.path.join(temp_dir, f1+".ref")).readline().strip().split()[1:]
-        except IOError:
-          reference1 = None
-      else:
-        reference1 = None
-      r1 = JointResegmenter(A1, B1, f1, options, phone_map, stats, reference1)
-      r1.resegment()
-      r1.print_segments(out_file)
-
-      if temp_dir != None:
-        try:
-          reference2 = open(os.path.join(temp_dir, f2+".ref")).readline().strip().split()[1:]
-        except IOError:
-          reference2= None
-      else:
-        reference2 = None
-      r2 = JointResegmenter(A1, B2, f2, options, phone_map, stats, reference2)
-      r2.resegment()
-      r2.restrict(len(A2))
-      r2.print_segments(out_file)
+      jobs.append((f1, f2))
     # End if
   # End for loop over files
 
+  if options.num_jobs > 1 and options.reference_rttm != None:
+    # The global analysis is accumulated in this process.
+    sys.stderr.write("%s: Warning: --num-jobs is ignored with --reference-rttm\n" % sys.argv[0])
+    options.num_jobs = 1
+
+  if options.num_jobs > 1:
+    pool = multiprocessing.Pool(options.num_jobs, init_worker,
+        (options, phone_map, temp_dir, speech_cap))
+    try:
+      for output in pool.imap(process_recordings_in_worker, jobs):
+        out_file.write(output)
+    except Exception as e:
+      sys.stderr.write("%s: %s\n" % (sys.argv[0], e))
+      pool.terminate()
+      sys.exit(1)
+    pool.close()
+    pool.join()
+  else:
+    init_worker(options, phone_map, temp_dir, speech_cap)
+    for job in jobs:
+      out_file.write(process_recordings(job))
+
   if options.reference_rttm != None:
     global_analysis_get_initial_segments.write_confusion_matrix(True)
     global_analysis_get_initial_segments.write_total_stats(True)
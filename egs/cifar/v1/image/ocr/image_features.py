@@ -0,0 +1,248 @@
+# Apache 2.0
+
+""" This module contains the parts of the OCR feature extraction that are
+    shared by image/ocr/make_features.py and the make_features.py scripts of
+    the OCR recipes (iam, ifnenit, uw3, ...):
+
+    - reading and resizing images (with the semantics of scipy's old
+      misc.imread() and misc.imresize(), which were removed in scipy 1.3;
+      they are used if they are available and are emulated with PIL
+      otherwise),
+    - padding images with white pixels,
+    - processing the images of an images.scp in a pool of worker processes,
+      with the random generators seeded separately for each image (from the
+      image-id and --seed), so the features (including any random
+      augmentation) do not depend on the number of workers or on the order
+      in which the images are processed,
+    - writing the features in text form (as the scripts always did) or as
+      binary float matrices, optionally with an scp file.
+
+    The scripts must be run from the recipe directory (where 'steps' and
+    'image' are), and import this module with:
+        sys.path.insert(0, 'image/ocr')
+        import image_features
+"""
+
+import multiprocessing
+import random
+import sys
+import zlib
+
+import numpy as np
+
+try:
+    from scipy import misc
+    if not hasattr(misc, 'imresize'):
+        misc = None
+except ImportError:
+    misc = None
+
+sys.path.insert(0, 'steps')
+import libs.matrix_io as matrix_io
+
+
+def imread(image_path, mode=None, flatten=False):
+    """ Reads an image as a numpy array, like scipy's misc.imread(): 'mode'
+        is a PIL mode to convert the image to (e.g. 'L' for grayscale) and
+        if 'flatten' is true the image is converted to a single float32
+        grayscale layer. """
+    if misc is not None:
+        return misc.imread(image_path, flatten=flatten, mode=mode)
+    from PIL import Image
+    im = Image.open(image_path)
+    # the conversions below are those of scipy's misc.fromimage().
+    if mode is not None:
+        if mode != im.mode:
+            im = im.convert(mode)
+    elif im.mode == 'P':
+        # otherwise we would get the indexes into the palette.
+        im = im.convert('RGBA' if 'transparency' in im.info else 'RGB')
+    if flatten:
+        im = im.convert('F')
+    elif im.mode == '1':
+        # np.array() would give a bool array.
+        im = im.convert('L')
+    return np.array(im)
+
+
+def _bytescale(im):
+    """ Scales an array to uint8 like scipy's misc.bytescale() with the
+        default arguments, which misc.imresize() does for non-uint8 input. """
+    cmin = im.min()
+    cmax = im.max()
+    cscale = cmax - cmin
+    if cscale == 0:
+        cscale = 1
+    scale = 255.0 / cscale
+    bytedata = (im - cmin) * scale
+    return (bytedata.clip(0, 255) + 0.5).astype(np.uint8)
+
+
+def imresize(im, size):
+    """ Resizes an image to 'size', i.e. (height, width), with bilinear
+        interpolation, like scipy's misc.imresize(); the result is uint8. """
+    if misc is not None:
+        return misc.imresize(im, size)
+    from PIL import Image
+    if im.dtype != np.uint8:
+        im = _bytescale(im)
+    pil_im = Image.fromarray(im)
+    return np.array(pil_im.resize((size[1], size[0]),
+                                  resample=Image.BILINEAR))
+
+
+def pad_image(im, left=0, right=0, top=0, bottom=0, value=255):
+    """ Returns the image 'im' with 'left', 'right', 'top' and 'bottom'
+        columns/rows of 'value' (by default white) added on its sides.  The
+        result is an int array (as np.concatenate() with 255 * np.ones(...,
+        dtype=int) used to return) or a float array if 'im' is float. """
+    dim_y, dim_x = im.shape[0], im.shape[1]
+    im_pad = np.full((dim_y + top + bottom, dim_x + left + right) + im.shape[2:],
+                     value, dtype=np.result_type(im.dtype, int))
+    im_pad[top:top + dim_y, left:left + dim_x] = im
+    return im_pad
+
+
+def seed_image(image_id, seed):
+    """ Seeds the random generators of the 'random' module and of numpy from
+        'seed' and the image-id, so that the random augmentation of an image
+        is the same whichever process handles it. """
+    image_seed = zlib.crc32("{0} {1}".format(seed, image_id).encode())
+    random.seed(image_seed)
+    np.random.seed(image_seed)
+
+
+def read_images_scp(images_scp):
+    """ Yields the (image-id, image-path) pairs in an images.scp file. """
+    with open(images_scp) as f:
+        for line in f:
+            line_vect = line.strip().split(' ')
+            yield line_vect[0], line_vect[1]
+
+
+# These are set in the worker processes by _init_worker().
+g_process_image = None
+g_seed = None
+
+
+def _init_worker(process_image, seed, initializer, initargs):
+    global g_process_image, g_seed
+    g_process_image = process_image
+    g_seed = seed
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _process_image(image):
+    image_id, image_path = image
+    if g_seed is not None:
+        seed_image(image_id, g_seed)
+    return image_id, g_process_image(image_id, image_path)
+
+
+def process_images(images, process_image, num_jobs=1, seed=None,
+                   initializer=None, initargs=()):
+    """ Yields (image-id, features) for the (image-id, image-path) pairs in
+        'images', in the same order, where the features are
+        process_image(image-id, image-path) (a matrix whose rows are the
+        columns of the image, or None if the image is to be skipped).
+
+        If num_jobs > 1, the images are processed in a pool of 'num_jobs'
+        worker processes; 'process_image' must then be a module-level
+        function, and initializer(*initargs) is called in each worker
+        (e.g. to set the options of the script there).  If 'seed' is not
+        None, the random generators are seeded for each image with
+        seed_image().
+    """
+    if num_jobs <= 1:
+        _init_worker(process_image, seed, None, ())
+        for image in images:
+            yield _process_image(image)
+        return
+    pool = multiprocessing.Pool(num_jobs, _init_worker,
+                                (process_image, seed, initializer, initargs))
+    try:
+        for result in pool.imap(_process_image, images, chunksize=4):
+            yield result
+    finally:
+        pool.terminate()
+
+
+def write_kaldi_matrix(file_handle, matrix, key):
+    """ Writes 'matrix' to 'file_handle' (opened in text mode) as a Kaldi
+        text matrix with key 'key'.  The values are written with str(), as
+        these scripts have always done. """
+    num_rows = len(matrix)
+    if num_rows == 0:
+        raise Exception("Matrix is empty")
+    if getattr(matrix, 'dtype', None) == np.float64:
+        # str() of python floats and of np.float64 is the same, and
+        # tolist() is much faster than str() on each numpy element.
+        matrix = matrix.tolist()
+    num_cols = len(matrix[0])
+    lines = []
+    for row in matrix:
+        if num_cols != len(row):
+            raise Exception("All the rows of a matrix are expected to "
+                            "have the same length")
+        lines.append(" ".join(map(str, row)))
+    file_handle.write(key + " [ " + "\n".join(lines) + " ]\n")
+
+
+class FeatureWriter(object):
+    """ Writes feature matrices to 'out_ark' ('-' for stdout): as text
+        matrices, or as binary float matrices if 'binary' is true.  If
+        'out_scp' is given, the matrices are written in binary form and an
+        scp file pointing into 'out_ark' (which must then be a file) is
+        written too, like 'ark,scp:<out_ark>,<out_scp>' in Kaldi.
+    """
+
+    def __init__(self, out_ark='-', out_scp=None, binary=False):
+        if out_scp is not None:
+            if out_ark == '-':
+                raise Exception("--out-scp requires --out-ark to be a file")
+            binary = True
+        self.out_ark = out_ark
+        self.binary = binary
+        if out_ark == '-':
+            self.ark_fh = sys.stdout.buffer if binary else sys.stdout
+        else:
+            self.ark_fh = open(out_ark, 'wb' if binary else 'w')
+        self.scp_fh = None if out_scp is None else open(out_scp, 'w')
+
+    def write(self, key, matrix):
+        if not self.binary:
+            write_kaldi_matrix(self.ark_fh, matrix, key)
+            return
+        if len(matrix) == 0:
+            raise Exception("Matrix is empty")
+        offset = matrix_io.write_matrix(
+            self.ark_fh, np.asarray(matrix, dtype=np.float32), key=key,
+            binary=True)
+        if self.scp_fh is not None:
+            print("{0} {1}:{2}".format(key, self.out_ark, offset),
+                  file=self.scp_fh)
+
+    def close(self):
+        if self.ark_fh not in [sys.stdout, sys.stdout.buffer]:
+            self.ark_fh.close()
+        else:
+            self.ark_fh.flush()
+        if self.scp_fh is not None:
+            self.scp_fh.close()
+
+
+def add_output_options(parser):
+    """ Adds the options of the FeatureWriter and process_images() (except
+        --out-ark, which the scripts already have) to an argparse parser. """
+    parser.add_argument('--out-scp', type=str, default=None,
+                        help='If supplied, the features are written in binary '
+                        'form to --out-ark (which must be a file) and an scp '
+                        'file for them is written here.')
+    parser.add_argument('--binary', type=lambda x: (str(x).lower()=='true'),
+                        default=False,
+                        help='Write the features as binary float matrices '
+                        'instead of text.')
+    parser.add_argument('--num-jobs', type=int, default=1,
+                        help='Number of processes used to read and process '
+                        'the images.')
@@ -9,7 +9,8 @@
 """ This script converts images to Kaldi-format feature matrices. The input to
     this script is the path to a data directory, e.g. "data/train". This script
     reads the images listed in images.scp and writes them to standard output
-    (by default) as Kaldi-formatted matrices (in text form). It also scales the
+    (by default) as Kaldi-formatted matrices (in text form, or in binary form
+    via --binary; with --out-scp an scp file is written too). It also scales the
     images so they have the same height (via --feat-dim). It can optionally pad
     the images (on left/right sides) with white pixels. It by default performs 
     augmentation, (directly scaling down and scaling up). It will double the 
@@ -18,6 +19,9 @@
     to enforce the images to have the specified length in that file by padding
     white pixels (the --padding option will be ignored in this case). This relates
     to end2end chain training.
+    The images can be processed in parallel (via --num-jobs); the random
+    augmentation is seeded per image (via --seed), so the features do not
+    depend on the number of jobs.
     eg. local/make_features.py data/train --feat-dim 40
 """
 import random
@@ -25,10 +29,11 @@ import argparse
 import os
 import sys
 import numpy as np
-from scipy import misc
 import math
 from signal import signal, SIGPIPE, SIG_DFL
 signal(SIGPIPE, SIG_DFL)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import image_features
 
 parser = argparse.ArgumentParser(description="""Converts images (in 'dir'/images.scp) to features and
                                                 writes them to standard output in text format.""")
@@ -53,24 +58,19 @@ parser.add_argument('--fliplr', type=lambda x: (str(x).lower()=='true'), default
 parser.add_argument('--augment_type', type=str, default='no_aug',
                     choices=['no_aug', 'random_scale','random_shift'],
                     help='Subset of data to process.')
-args = parser.parse_args()
-
+parser.add_argument('--seed', type=int, default=1,
+                    help='Seed for the random augmentation; the random '
+                    'generators are seeded with it and the image-id for '
+                    'each image.')
+image_features.add_output_options(parser)
+args = None
+allowed_lengths = None
 
-def write_kaldi_matrix(file_handle, matrix, key):
-    file_handle.write(key + " [ ")
-    num_rows = len(matrix)
-    if num_rows == 0:
-        raise Exception("Matrix is empty")
-    num_cols = len(matrix[0])
 
-    for row_index in range(len(matrix)):
-        if num_cols != len(matrix[row_index]):
-            raise Exception("All the rows of a matrix are expected to "
-                            "have the same length")
-        file_handle.write(" ".join(map(lambda x: str(x), matrix[row_index])))
-        if row_index != num_rows - 1:
-            file_handle.write("\n")
-    file_handle.write(" ]\n")
+def init_worker(worker_args, worker_allowed_lengths):
+    global args, allowed_lengths
+    args = worker_args
+    allowed_lengths = worker_allowed_lengths
 
 def horizontal_pad(im, allowed_lengths = None):
     if allowed_lengths is None:
@@ -88,18 +88,7 @@ def horizontal_pad(im, allowed_lengths = None):
         padding = allowed_len - imlen
         left_padding = int(padding // 2)
         right_padding = padding - left_padding
-    dim_y = im.shape[0] # height
-    if args.num_channels in [1,4]:
-        im_pad = np.concatenate((255 * np.ones((dim_y, left_padding),
-                                               dtype=int), im), axis=1)
-        im_pad1 = np.concatenate((im_pad, 255 * np.ones((dim_y, right_padding),
-                                                        dtype=int)), axis=1)
-    else:
-        im_pad = np.concatenate((255 * np.ones((dim_y, left_padding, args.num_channels),
-                                               dtype=int), im), axis=1)
-        im_pad1 = np.concatenate((im_pad, 255 * np.ones((dim_y, right_padding, args.num_channels),
-                                                        dtype=int)), axis=1)
-    return im_pad1
+    return image_features.pad_image(im, left=left_padding, right=right_padding)
 
 def get_scaled_image_aug(im, mode='normal'):
     scale_size = args.feat_dim
@@ -113,11 +102,11 @@ def get_scaled_image_aug(im, mode='normal'):
     down_nx = int(scale_size)
     down_ny = int(scale * sx)
     if mode == 'normal':
-        im = misc.imresize(im, (nx, ny))
+        im = image_features.imresize(im, (nx, ny))
         return im
     else:
-        im_scaled_down = misc.imresize(im, (down_nx, down_ny))
-        im_scaled_up = misc.imresize(im_scaled_down, (nx, ny))
+        im_scaled_down = image_features.imresize(im, (down_nx, down_ny))
+        im_scaled_up = image_features.imresize(im_scaled_down, (nx, ny))
         return im_scaled_up
     return im
 
@@ -149,61 +138,68 @@ def vertical_shift(im, mode='normal'):
          np.random.normal(2, 1, (bottom, width)).astype(int)), axis=0)
     return im_pad
 
-### main ###
-random.seed(1)
-data_list_path = args.images_scp_path
-if args.out_ark == '-':
-    out_fh = sys.stdout
-else:
-    out_fh = open(args.out_ark,'w')
+def process_image(image_id, image_path):
+    """ Returns the features of an image, or None if it is too long. """
+    if args.num_channels == 4:
+        im = image_features.imread(image_path, mode='L')
+    else:
+        im = image_features.imread(image_path)
+    if args.fliplr:
+        im = np.fliplr(im)
+    if args.augment_type == 'no_aug' or 'random_shift':
+        im = get_scaled_image_aug(im, 'normal')
+    elif args.augment_type == 'random_scale':
+        im = get_scaled_image_aug(im, 'scaled')
+    im = horizontal_pad(im, allowed_lengths)
+    if im is None:
+        return None
+    if args.augment_type == 'no_aug' or 'random_scale':
+        im = vertical_shift(im, 'normal')
+    elif args.augment_type == 'random_shift':
+        im = vertical_shift(im, 'notmid')
+    if args.num_channels in [1,4]:
+        data = np.transpose(im, (1, 0))
+    elif args.num_channels == 3:
+        H = im.shape[0]
+        W = im.shape[1]
+        C = im.shape[2]
+        data = np.reshape(np.transpose(im, (1, 0, 2)), (W, H * C))
+    data = np.divide(data, 255.0)
+    return data
 
-allowed_lengths = None
-allowed_len_handle = args.allowed_len_file_path
-if os.path.isfile(allowed_len_handle):
-    print("Found 'allowed_lengths.txt' file...", file=sys.stderr)
-    allowed_lengths = []
-    with open(allowed_len_handle) as f:
-        for line in f:
-            allowed_lengths.append(int(line.strip()))
-    print("Read {} allowed lengths and will apply them to the "
-          "features.".format(len(allowed_lengths)), file=sys.stderr)
-
-num_fail = 0
-num_ok = 0
-with open(data_list_path) as f:
-    for line in f:
-        line = line.strip()
-        line_vect = line.split(' ')
-        image_id = line_vect[0]
-        image_path = line_vect[1]
-        if args.num_channels == 4:
-            im = misc.imread(image_path, mode='L')
-        else:
-            im = misc.imread(image_path)
-        if args.fliplr:
-            im = np.fliplr(im)
-        if args.augment_type == 'no_aug' or 'random_shift':
-            im = get_scaled_image_aug(im, 'normal')
-        elif args.augment_type == 'random_scale':
-            im = get_scaled_image_aug(im, 'scaled')
-        im = horizontal_pad(im, allowed_lengths)
-        if im is None:
+
+def main():
+    global args, allowed_lengths
+    args = parser.parse_args()
+    feature_writer = image_features.FeatureWriter(args.out_ark, args.out_scp,
+                                                  args.binary)
+
+    allowed_len_handle = args.allowed_len_file_path
+    if os.path.isfile(allowed_len_handle):
+        print("Found 'allowed_lengths.txt' file...", file=sys.stderr)
+        allowed_lengths = []
+        with open(allowed_len_handle) as f:
+            for line in f:
+                allowed_lengths.append(int(line.strip()))
+        print("Read {} allowed lengths and will apply them to the "
+              "features.".format(len(allowed_lengths)), file=sys.stderr)
+
+    num_fail = 0
+    num_ok = 0
+    images = image_features.read_images_scp(args.images_scp_path)
+    for image_id, data in image_features.process_images(
+            images, process_image, num_jobs=args.num_jobs, seed=args.seed,
+            initializer=init_worker, initargs=(args, allowed_lengths)):
+        if data is None:
             num_fail += 1
             continue
-        if args.augment_type == 'no_aug' or 'random_scale':
-            im = vertical_shift(im, 'normal')
-        elif args.augment_type == 'random_shift':
-            im = vertical_shift(im, 'notmid')
-        if args.num_channels in [1,4]:
-            data = np.transpose(im, (1, 0))
-        elif args.num_channels == 3:
-            H = im.shape[0]
-            W = im.shape[1]
-            C = im.shape[2]
-            data = np.reshape(np.transpose(im, (1, 0, 2)), (W, H * C))
-        data = np.divide(data, 255.0)
         num_ok += 1
-        write_kaldi_matrix(out_fh, data, image_id)
+        feature_writer.write(image_id, data)
+    feature_writer.close()
+
+    print('Generated features for {} images. Failed for {} (image too '
+          'long).'.format(num_ok, num_fail), file=sys.stderr)
+
 
-print('Generated features for {} images. Failed for {} (image too '
-      'long).'.format(num_ok, num_fail), file=sys.stderr)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Apache 2.0
+
+""" Tests for the reading of images in image/ocr/image_features.py without
+scipy's misc.imread(), i.e. with PIL only, which must convert the images the
+way scipy's misc.fromimage() did.
+
+Usage (from the recipe directory, e.g. egs/cifar/v1):
+    python3 image/ocr/test/image_features_test.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, 'image/ocr')
+import image_features
+
+
+class ImreadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # test the PIL code even if an old scipy is installed.
+        self.misc = image_features.misc
+        image_features.misc = None
+
+    def tearDown(self):
+        image_features.misc = self.misc
+        shutil.rmtree(self.dir)
+
+    def save(self, im, name):
+        path = os.path.join(self.dir, name)
+        im.save(path)
+        return path
+
+    def test_bilevel(self):
+        # IFN/ENIT images are bilevel TIFs.
+        pixels = np.array([[0, 255, 255], [255, 0, 255]], dtype=np.uint8)
+        path = self.save(Image.fromarray(pixels).convert('1'), "im.tif")
+        im = image_features.imread(path)
+        self.assertEqual(im.dtype, np.uint8)
+        self.assertEqual(im.tolist(), pixels.tolist())
+        im = image_features.imread(path, flatten=True)
+        self.assertEqual(im.dtype, np.float32)
+        self.assertEqual(im.tolist(), pixels.tolist())
+        self.assertEqual(image_features.imresize(im, (4, 6)).shape, (4, 6))
+
+    def test_palette(self):
+        palette = [0, 0, 0, 200, 100, 50, 10, 20, 30]
+        indexes = np.array([[0, 1], [2, 1]], dtype=np.uint8)
+        rgb = np.array(palette, dtype=np.uint8).reshape(3, 3)[indexes]
+        im = Image.fromarray(indexes, mode='P')
+        im.putpalette(palette + [0] * (768 - len(palette)))
+        path = self.save(im, "im.png")
+        self.assertEqual(image_features.imread(path).tolist(), rgb.tolist())
+        gray = np.array(Image.fromarray(rgb).convert('L'))
+        self.assertEqual(image_features.imread(path, mode='L').tolist(),
+                         gray.tolist())
+        self.assertEqual(image_features.imread(path, flatten=True).shape,
+                         (2, 2))
+
+        im.info['transparency'] = 0
+        path = self.save(im, "im_transparent.png")
+        rgba = image_features.imread(path)
+        self.assertEqual(rgba.shape, (2, 2, 4))
+        self.assertEqual(rgba[:, :, :3].tolist(), rgb.tolist())
+        self.assertEqual(rgba[:, :, 3].tolist(), [[0, 255], [255, 255]])
+
+    def test_mode_and_flatten(self):
+        rgb = np.array([[[255, 0, 0], [0, 255, 0]]], dtype=np.uint8)
+        path = self.save(Image.fromarray(rgb), "im.png")
+        self.assertEqual(image_features.imread(path).tolist(), rgb.tolist())
+        gray = image_features.imread(path, mode='L')
+        self.assertEqual(gray.tolist(),
+                         np.array(Image.fromarray(rgb).convert('L')).tolist())
+        flat = image_features.imread(path, flatten=True)
+        self.assertEqual(flat.dtype, np.float32)
+        self.assertEqual(flat.shape, (1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,13 +8,16 @@
 """ This script converts images to Kaldi-format feature matrices. The input to
     this script is the path to a data directory, e.g. "data/train". This script
     reads the images listed in images.scp and writes them to standard output
-    (by default) as Kaldi-formatted matrices (in text form). It also scales the
+    (by default) as Kaldi-formatted matrices (in text form, or in binary form
+    via --binary; with --out-scp an scp file is written too). It also scales the
     images so they have the same height (via --feat-dim). It can optionally pad
     the images (on left/right sides) with white pixels.
     If an 'image2num_frames' file is found in the data dir, it will be used
     to enforce the images to have the specified length in that file by padding
     white pixels (the --padding option will be ignored in this case). This relates
     to end2end chain training.
+    The images can be processed in parallel (via --num-jobs); see
+    image/ocr/image_features.py.
     eg. local/make_features.py data/train --feat-dim 40
 """
 import random
@@ -23,11 +26,12 @@ import os
 import sys
 import scipy.io as sio
 import numpy as np
-from scipy import misc
 from scipy.ndimage.interpolation import affine_transform
 import math
 from signal import signal, SIGPIPE, SIG_DFL
 signal(SIGPIPE, SIG_DFL)
+sys.path.insert(0, 'image/ocr')
+import image_features
 
 parser = argparse.ArgumentParser(description="""Converts images (in 'dir'/images.scp) to features and
                                                 writes them to standard output in text format.""")
@@ -47,24 +51,15 @@ parser.add_argument('--fliplr', type=lambda x: (str(x).lower()=='true'), default
                    help="Flip the image left-right for right to left languages")
 parser.add_argument("--augment", type=lambda x: (str(x).lower()=='true'), default=False,
                    help="performs image augmentation")
-args = parser.parse_args()
-
+image_features.add_output_options(parser)
+args = None
+allowed_lengths = None
 
-def write_kaldi_matrix(file_handle, matrix, key):
-    file_handle.write(key + " [ ")
-    num_rows = len(matrix)
-    if num_rows == 0:
-        raise Exception("Matrix is empty")
-    num_cols = len(matrix[0])
 
-    for row_index in range(len(matrix)):
-        if num_cols != len(matrix[row_index]):
-            raise Exception("All the rows of a matrix are expected to "
-                            "have the same length")
-        file_handle.write(" ".join(map(lambda x: str(x), matrix[row_index])))
-        if row_index != num_rows - 1:
-            file_handle.write("\n")
-    file_handle.write(" ]\n")
+def init_worker(worker_args, worker_allowed_lengths):
+    global args, allowed_lengths
+    args = worker_args
+    allowed_lengths = worker_allowed_lengths
 
 
 def horizontal_pad(im, allowed_lengths = None):
@@ -83,12 +78,7 @@ def horizontal_pad(im, allowed_lengths = None):
         padding = allowed_len - imlen
         left_padding = int(padding // 2)
         right_padding = padding - left_padding
-    dim_y = im.shape[0] # height
-    im_pad = np.concatenate((255 * np.ones((dim_y, left_padding),
-                                           dtype=int), im), axis=1)
-    im_pad1 = np.concatenate((im_pad, 255 * np.ones((dim_y, right_padding),
-                                                    dtype=int)), axis=1)
-    return im_pad1
+    return image_features.pad_image(im, left=left_padding, right=right_padding)
 
 def get_scaled_image_aug(im, mode='normal'):
     scale_size = args.feat_dim
@@ -102,34 +92,26 @@ def get_scaled_image_aug(im, mode='normal'):
     down_nx = int(scale_size)
     down_ny = int(scale * sx)
     if mode == 'normal':
-        im = misc.imresize(im, (nx, ny))
+        im = image_features.imresize(im, (nx, ny))
         return im
     else:
-        im_scaled_down = misc.imresize(im, (down_nx, down_ny))
-        im_scaled_up = misc.imresize(im_scaled_down, (nx, ny))
+        im_scaled_down = image_features.imresize(im, (down_nx, down_ny))
+        im_scaled_up = image_features.imresize(im_scaled_down, (nx, ny))
         return im_scaled_up
     return im
 
 def contrast_normalization(im, low_pct, high_pct):
     element_number = im.size
-    rows = im.shape[0]
-    cols = im.shape[1]
-    im_contrast = np.zeros(shape=im.shape)
     low_index = int(low_pct * element_number)
     high_index = int(high_pct * element_number)
     sorted_im = np.sort(im, axis=None)
-    low_thred = sorted_im[low_index]
-    high_thred = sorted_im[high_index]
-    for i in range(rows):
-        for j in range(cols):
-            if im[i, j] > high_thred:
-                im_contrast[i, j] = 255  # lightest to white
-            elif im[i, j] < low_thred:
-                im_contrast[i, j] = 0  # darkest to black
-            else:
-                # linear normalization
-                im_contrast[i, j] = (im[i, j] - low_thred) * \
-                    255 / (high_thred - low_thred)
+    low_thred = float(sorted_im[low_index])
+    high_thred = float(sorted_im[high_index])
+    # linear normalization
+    with np.errstate(divide='ignore', invalid='ignore'):
+        im_contrast = (im - low_thred) * 255 / (high_thred - low_thred)
+    im_contrast[im > high_thred] = 255  # lightest to white
+    im_contrast[im < low_thred] = 0  # darkest to black
     return im_contrast
 
 
@@ -177,15 +159,12 @@ def find_slant_project(im):
     cols = im.shape[1]
     std_max = 0
     alpha_max = 0
-    col_disp = np.zeros(90, int)
     proj = np.zeros(shape=(90, cols + 2 * rows), dtype=int)
-    for r in range(rows):
-        for alpha in range(-45, 45, 1):
-            col_disp[alpha] = int(r * math.tan(alpha / 180.0 * math.pi))
-        for c in range(cols):
-            if im[r, c] < 100:
-                for alpha in range(-45, 45, 1):
-                    proj[alpha + 45, c + col_disp[alpha] + rows] += 1
+    # the rows and columns of the dark pixels.
+    dark_r, dark_c = np.nonzero(im < 100)
+    for alpha in range(-45, 45, 1):
+        col_disp = (dark_r * math.tan(alpha / 180.0 * math.pi)).astype(int)
+        np.add.at(proj[alpha + 45], dark_c + col_disp + rows, 1)
     for alpha in range(-45, 45, 1):
         proj_histogram, bin_array = np.histogram(proj[alpha + 45, :], bins=10)
         proj_std = np.std(proj_histogram)
@@ -214,53 +193,62 @@ def horizontal_shear(im, degree):
     return sheared_im
 
 
-### main ###
-random.seed(1)
-data_list_path = args.images_scp_path
-if args.out_ark == '-':
-    out_fh = sys.stdout
-else:
-    out_fh = open(args.out_ark,'w')
+aug_setting = ['normal', 'scaled']
 
-allowed_lengths = None
-allowed_len_handle = args.allowed_len_file_path
-if os.path.isfile(allowed_len_handle):
-    print("Found 'allowed_lengths.txt' file...", file=sys.stderr)
-    allowed_lengths = []
-    with open(allowed_len_handle) as f:
-        for line in f:
-            allowed_lengths.append(int(line.strip()))
-    print("Read {} allowed lengths and will apply them to the "
-          "features.".format(len(allowed_lengths)), file=sys.stderr)
 
-num_fail = 0
-num_ok = 0
-aug_setting = ['normal', 'scaled']
-with open(data_list_path) as f:
-    for line in f:
-        line = line.strip()
-        line_vect = line.split(' ')
-        image_id = line_vect[0]
-        image_path = line_vect[1]
-        im = misc.imread(image_path)
-        if args.fliplr:
-            im = np.fliplr(im)
-        if args.augment:
-            im_aug = get_scaled_image_aug(im, aug_setting[0])
-            im_contrast = contrast_normalization(im_aug, 0.05, 0.2)
-            slant_degree = find_slant_project(im_contrast)
-            im_sheared = horizontal_shear(im_contrast, slant_degree)
-            im_aug = im_sheared
-        else:
-            im_aug = get_scaled_image_aug(im, aug_setting[0])
-        im_horizontal_padded = horizontal_pad(im_aug, allowed_lengths)
-        if im_horizontal_padded is None:
+def process_image(image_id, image_path):
+    """ Returns the features of an image, or None if it is too long. """
+    im = image_features.imread(image_path)
+    if args.fliplr:
+        im = np.fliplr(im)
+    if args.augment:
+        im_aug = get_scaled_image_aug(im, aug_setting[0])
+        im_contrast = contrast_normalization(im_aug, 0.05, 0.2)
+        slant_degree = find_slant_project(im_contrast)
+        im_sheared = horizontal_shear(im_contrast, slant_degree)
+        im_aug = im_sheared
+    else:
+        im_aug = get_scaled_image_aug(im, aug_setting[0])
+    im_horizontal_padded = horizontal_pad(im_aug, allowed_lengths)
+    if im_horizontal_padded is None:
+        return None
+    data = np.transpose(im_horizontal_padded, (1, 0))
+    data = np.divide(data, 255.0)
+    return data
+
+
+def main():
+    global args, allowed_lengths
+    args = parser.parse_args()
+    feature_writer = image_features.FeatureWriter(args.out_ark, args.out_scp,
+                                                  args.binary)
+
+    allowed_len_handle = args.allowed_len_file_path
+    if os.path.isfile(allowed_len_handle):
+        print("Found 'allowed_lengths.txt' file...", file=sys.stderr)
+        allowed_lengths = []
+        with open(allowed_len_handle) as f:
+            for line in f:
+                allowed_lengths.append(int(line.strip()))
+        print("Read {} allowed lengths and will apply them to the "
+              "features.".format(len(allowed_lengths)), file=sys.stderr)
+
+    num_fail = 0
+    num_ok = 0
+    images = image_features.read_images_scp(args.images_scp_path)
+    for image_id, data in image_features.process_images(
+            images, process_image, num_jobs=args.num_jobs, seed=1,
+            initializer=init_worker, initargs=(args, allowed_lengths)):
+        if data is None:
             num_fail += 1
             continue
-        data = np.transpose(im_horizontal_padded, (1, 0))
-        data = np.divide(data, 255.0)
         num_ok += 1
-        write_kaldi_matrix(out_fh, data, image_id)
+        feature_writer.write(image_id, data)
+    feature_writer.close()
+
+    print('Generated features for {} images. Failed for {} (image too '
+          'long).'.format(num_ok, num_fail), file=sys.stderr)
+
 
-print('Generated features for {} images. Failed for {} (image too '
-      'long).'.format(num_ok, num_fail), file=sys.stderr)
+if __name__ == '__main__':
+    main()
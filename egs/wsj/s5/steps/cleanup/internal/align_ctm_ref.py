@@ -19,6 +19,11 @@ import sys
 sys.path.insert(0, 'steps')
 import libs.common as common_lib
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 logger = logging.getLogger(__name__)
 handler = logging.StreamHandler()
 formatter = logging.Formatter("%(asctime)s [%(pathname)s:%(lineno)s - "
@@ -76,6 +81,25 @@ def get_args():
                         from the normal Smith-Waterman alignment, where the
                         traceback will be from the maximum score.""")
 
+    parser.add_argument("--alignment-engine", type=str,
+                        choices=["python", "numpy"], default="python",
+                        help="""Implementation of the alignment. 'numpy'
+                        computes the dynamic programming with row-wise
+                        vectorization and stores only an int8 traceback;
+                        it gives the same output as 'python' and is much
+                        faster on long recordings.""")
+    parser.add_argument("--band-width", type=int, default=0,
+                        help="""If > 0 and --alignment-engine=numpy,
+                        restrict the alignment to a diagonal band around
+                        the n-grams that occur exactly once in both the
+                        reference and the hypothesis, widened by this many
+                        words on either side. The output is identical to
+                        the unconstrained alignment as long as the best
+                        path stays inside the band.""")
+    parser.add_argument("--band-ngram-order", type=int, default=3,
+                        help="""Order of the matching n-grams used to
+                        seed the band; see --band-width.""")
+
     parser.add_argument("--debug-only", type=str, default="false",
                         choices=["true", "false"],
                         help="Run test functions only")
@@ -100,6 +124,11 @@ def get_args():
 
     args.debug_only = bool(args.debug_only == "true")
 
+    if args.alignment_engine == "numpy" and np is None:
+        raise RuntimeError("--alignment-engine=numpy requires numpy")
+    if args.band_ngram_order < 1:
+        raise ValueError("--band-ngram-order must be >= 1")
+
     global verbose_level
     verbose_level = args.verbose
     if args.verbose > 2:
@@ -344,6 +373,217 @@ def smith_waterman_alignment(ref, hyp, similarity_score_function,
     return (output, max_score)
 
 
+# Traceback codes used by smith_waterman_alignment_vectorized().
+_BP_NONE = 0
+_BP_SUB = 1
+_BP_DEL = 2
+_BP_INS = 3
+
+
+def get_alignment_band(ref_ids, hyp_ids, ngram_order, band_width):
+    """Returns the range (min_offset, max_offset) of diagonals
+    (ref_index - hyp_index) of the alignment matrix that the alignment is
+    restricted to, or None if no band could be found.
+
+    The band is seeded from the n-grams of order 'ngram_order' that occur
+    exactly once in both the reference and the hypothesis, and is widened by
+    'band_width' diagonals on either side.
+    """
+    def unique_ngram_positions(ids):
+        positions = {}
+        counts = {}
+        for i in range(len(ids) - ngram_order + 1):
+            ngram = tuple(ids[i:i+ngram_order])
+            counts[ngram] = counts.get(ngram, 0) + 1
+            positions[ngram] = i
+        return {ngram: pos for ngram, pos in positions.items()
+                if counts[ngram] == 1}
+
+    ref_positions = unique_ngram_positions(ref_ids)
+    hyp_positions = unique_ngram_positions(hyp_ids)
+
+    offsets = [ref_pos - hyp_positions[ngram]
+               for ngram, ref_pos in ref_positions.items()
+               if ngram in hyp_positions]
+    if len(offsets) == 0:
+        return None
+    return (min(offsets) - band_width, max(offsets) + band_width)
+
+
+def smith_waterman_alignment_vectorized(ref, hyp, correct_score,
+                                        substitution_score,
+                                        del_score, ins_score,
+                                        eps_symbol="<eps>",
+                                        align_full_hyp=True,
+                                        band_width=0, band_ngram_order=3):
+    """This is a faster version of smith_waterman_alignment() that gives
+    exactly the same output when the similarity score is 'correct_score' for
+    matching words and 'substitution_score' otherwise.
+
+    The words are mapped to integer ids and the score matrix is computed one
+    reference word at a time with numpy, keeping only two rows of scores. The
+    insertions within a row are resolved with a cumulative maximum. Only the
+    traceback is stored for the full matrix, as int8 codes.
+
+    If band_width > 0, the alignment is restricted to a diagonal band seeded
+    from matching n-grams (see get_alignment_band()); cells outside the band
+    are not computed or stored.
+
+    Returns the same (output, max_score) as smith_waterman_alignment().
+    """
+    ref_len = len(ref)
+    hyp_len = len(hyp)
+
+    word2id = {}
+    ref_ids = np.array([word2id.setdefault(w, len(word2id)) for w in ref],
+                       dtype=np.int64)
+    hyp_ids = np.array([word2id.setdefault(w, len(word2id)) for w in hyp],
+                       dtype=np.int64)
+
+    band = None
+    if band_width > 0:
+        band = get_alignment_band(ref_ids.tolist(), hyp_ids.tolist(),
+                                  band_ngram_order, band_width)
+        if band is None:
+            logger.debug("Could not find any matching %d-grams; "
+                         "not using a band", band_ngram_order)
+
+    # Value for the cells that are outside the band; low enough that they
+    # never win, and far enough from the int64 limits that adding scores
+    # cannot overflow.
+    outside_score = np.iinfo(np.int64).min // 4 if align_full_hyp else 0
+    init_score = -(hyp_len + 2) if align_full_hyp else 0
+
+    # The traceback is stored as a list of (first_hyp_index, codes) for each
+    # row, where codes[k] is the traceback code for the cell
+    # (ref_index, first_hyp_index + k). The cells not covered are _BP_NONE.
+    bp = []
+
+    hyp_positions = np.arange(hyp_len + 1, dtype=np.int64)
+    prev_row = np.zeros(hyp_len + 1, dtype=np.int64)
+    if align_full_hyp:
+        prev_row = hyp_positions * ins_score
+        codes = np.full(hyp_len + 1, _BP_INS, dtype=np.int8)
+        codes[0] = _BP_NONE
+        bp.append((0, codes))
+    else:
+        bp.append((0, np.zeros(hyp_len + 1, dtype=np.int8)))
+
+    max_score = -float("inf")
+    max_score_element = (0, 0)
+
+    for ref_index in range(1, ref_len + 1):
+        first, last = 1, hyp_len
+        if band is not None:
+            first = max(first, ref_index - band[1])
+            last = min(last, ref_index - band[0])
+
+        row = np.full(hyp_len + 1, outside_score, dtype=np.int64)
+        row[0] = 0
+        if first > last:
+            bp.append((0, np.zeros(0, dtype=np.int8)))
+            prev_row = row
+            continue
+
+        similarity = np.where(hyp_ids[first-1:last] == ref_ids[ref_index-1],
+                              correct_score, substitution_score)
+
+        sub_or_ok = prev_row[first-1:last] + similarity
+        if align_full_hyp:
+            take = sub_or_ok >= init_score
+        else:
+            take = sub_or_ok > 0
+        scores = np.where(take, sub_or_ok, init_score)
+        codes = np.where(take, _BP_SUB, _BP_NONE).astype(np.int8)
+
+        deletion = prev_row[first:last+1] + del_score
+        take = deletion > scores
+        scores = np.where(take, deletion, scores)
+        codes[take] = _BP_DEL
+
+        # An insertion from the previous cell in the row is taken only if it
+        # is strictly better. This makes the scores of a row a running
+        # maximum of (scores[j] - j * ins_score), starting from the cell
+        # just before the band.
+        positions = hyp_positions[first-1:last+1]
+        shifted = np.empty(last - first + 2, dtype=np.int64)
+        shifted[0] = row[first-1] - (first - 1) * ins_score
+        shifted[1:] = scores - positions[1:] * ins_score
+        running_max = np.maximum.accumulate(shifted)
+        codes[running_max[:-1] > shifted[1:]] = _BP_INS
+        row[first:last+1] = running_max[1:] + positions[1:] * ins_score
+
+        bp.append((first, codes))
+
+        if not align_full_hyp:
+            row_max = row[first:last+1].max()
+            if row_max >= max_score:
+                max_score = int(row_max)
+                hyp_index = first + int(np.flatnonzero(
+                    row[first:last+1] == row_max)[-1])
+                max_score_element = (ref_index, hyp_index)
+        elif last == hyp_len and row[hyp_len] >= max_score:
+            max_score = int(row[hyp_len])
+            max_score_element = (ref_index, hyp_len)
+
+        prev_row = row
+
+    ref_index, hyp_index = max_score_element
+    score = max_score
+    logger.debug("Alignment score: %s for (%d, %d)",
+                 score, ref_index, hyp_index)
+
+    output = []
+    while ((not align_full_hyp and score >= 0)
+           or (align_full_hyp and hyp_index > 0)):
+        first, codes = bp[ref_index]
+        code = _BP_NONE
+        if first <= hyp_index < first + len(codes):
+            code = codes[hyp_index - first]
+
+        if code == _BP_SUB:
+            prev_ref_index, prev_hyp_index = ref_index - 1, hyp_index - 1
+        elif code == _BP_DEL:
+            prev_ref_index, prev_hyp_index = ref_index - 1, hyp_index
+        elif code == _BP_INS:
+            prev_ref_index, prev_hyp_index = ref_index, hyp_index - 1
+        else:
+            prev_ref_index, prev_hyp_index = 0, 0
+
+        if (prev_ref_index, prev_hyp_index) == (0, 0):
+            # In local alignment, the scores are never negative, so this is
+            # the only way for the traceback to end.
+            score = 0
+            break
+
+        if code == _BP_SUB:
+            # Substitution or correct
+            output.append((ref[ref_index-1], hyp[hyp_index-1],
+                           prev_ref_index, prev_hyp_index,
+                           ref_index, hyp_index))
+        elif code == _BP_DEL:
+            # Deletion
+            output.append((ref[ref_index-1], eps_symbol,
+                           prev_ref_index, prev_hyp_index,
+                           ref_index, hyp_index))
+        else:
+            # Insertion
+            output.append((eps_symbol, hyp[hyp_index-1],
+                           prev_ref_index, prev_hyp_index,
+                           ref_index, hyp_index))
+        ref_index, hyp_index = prev_ref_index, prev_hyp_index
+
+    assert (align_full_hyp or score == 0)
+
+    output.reverse()
+
+    logger.debug("Aligned output:")
+    logger.debug("  -  ".join(["({0},{1})".format(x[4], x[5])
+                               for x in output]))
+
+    return (output, max_score)
+
+
 def print_alignment(recording, alignment, out_file_handle):
     out_text = [recording]
     for line in alignment:
@@ -565,11 +805,21 @@ def run(args):
 
             logger.debug("Running Smith-Waterman alignment for %s", reco)
 
-            output, score = smith_waterman_alignment(
-                ref_text, hyp_array, eps_symbol=args.eps_symbol,
-                similarity_score_function=similarity_score_function,
-                del_score=del_score, ins_score=ins_score,
-                align_full_hyp=args.align_full_hyp)
+            if args.alignment_engine == "numpy":
+                output, score = smith_waterman_alignment_vectorized(
+                    ref_text, hyp_array, eps_symbol=args.eps_symbol,
+                    correct_score=args.correct_score,
+                    substitution_score=-args.substitution_penalty,
+                    del_score=del_score, ins_score=ins_score,
+                    align_full_hyp=args.align_full_hyp,
+                    band_width=args.band_width,
+                    band_ngram_order=args.band_ngram_order)
+            else:
+                output, score = smith_waterman_alignment(
+                    ref_text, hyp_array, eps_symbol=args.eps_symbol,
+                    similarity_score_function=similarity_score_function,
+                    del_score=del_score, ins_score=ins_score,
+                    align_full_hyp=args.align_full_hyp)
 
             if args.hyp_format == "CTM":
                 ctm_edits = get_ctm_edits(output, hyp_lines[reco],
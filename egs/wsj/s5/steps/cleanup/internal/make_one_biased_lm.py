@@ -10,47 +10,40 @@ import argparse
 import math
 from collections import defaultdict
 
-import io
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer,encoding="utf8")
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer,encoding="utf8")
-sys.stdin = io.TextIOWrapper(sys.stdin.buffer,encoding="utf8")
-
-parser = argparse.ArgumentParser(description="""
-This script creates a biased language model suitable for alignment and
-data-cleanup purposes.   It reads (possibly multiple) lines of integerized text
-from the input and writes a text-form FST of a backoff language model to
-the standard output, to be piped into fstcompile.""")
-
-parser.add_argument("--word-disambig-symbol", type = int, required = True,
-                    help = "Integer corresponding to the disambiguation "
-                    "symbol (normally #0) for backoff arcs")
-parser.add_argument("--ngram-order", type = int, default = 4,
-                    choices = [2,3,4,5,6,7],
-                    help = "Maximum order of n-gram to use (but see also "
-                    "--min-lm-state-count; the effective order may be less.")
-parser.add_argument("--min-lm-state-count", type = int, default = 10,
-                    help = "Minimum count below which we will completely "
-                    "discount an LM-state (if it is of order > 2, i.e. "
-                    "history-length > 1).")
-parser.add_argument("--top-words", type = str,
-                    help = "File containing frequent words and probabilities to be added into "
-                    "the language model, with lines in the format '<integer-id-of-word> <prob>'. "
-                    "These probabilities will be added to the probabilities in the unigram "
-                    "backoff state and then renormalized; this option allows you to introduce "
-                    "common words to the LM with specified probabilities.")
-parser.add_argument("--discounting-constant", type = float, default = 0.3,
-                    help = "Discounting constant D for standard (unmodified) Kneser-Ney; "
-                    "must be strictly between 0 and 1.  A value closer to 0 will give "
-                    "you a more-strongly-biased LM.")
-parser.add_argument("--verbose", type = int, default = 0,
-                    choices=[0,1,2,3,4,5], help = "Verbose level")
-
-args = parser.parse_args()
-
-if args.verbose >= 1:
-    print(' '.join(sys.argv), file = sys.stderr)
-
 
+def GetArgs(argv = None):
+    parser = argparse.ArgumentParser(prog = "make_one_biased_lm.py",
+                                     description="""
+    This script creates a biased language model suitable for alignment and
+    data-cleanup purposes.   It reads (possibly multiple) lines of integerized text
+    from the input and writes a text-form FST of a backoff language model to
+    the standard output, to be piped into fstcompile.""")
+
+    parser.add_argument("--word-disambig-symbol", type = int, required = True,
+                        help = "Integer corresponding to the disambiguation "
+                        "symbol (normally #0) for backoff arcs")
+    parser.add_argument("--ngram-order", type = int, default = 4,
+                        choices = [2,3,4,5,6,7],
+                        help = "Maximum order of n-gram to use (but see also "
+                        "--min-lm-state-count; the effective order may be less.")
+    parser.add_argument("--min-lm-state-count", type = int, default = 10,
+                        help = "Minimum count below which we will completely "
+                        "discount an LM-state (if it is of order > 2, i.e. "
+                        "history-length > 1).")
+    parser.add_argument("--top-words", type = str,
+                        help = "File containing frequent words and probabilities to be added into "
+                        "the language model, with lines in the format '<integer-id-of-word> <prob>'. "
+                        "These probabilities will be added to the probabilities in the unigram "
+                        "backoff state and then renormalized; this option allows you to introduce "
+                        "common words to the LM with specified probabilities.")
+    parser.add_argument("--discounting-constant", type = float, default = 0.3,
+                        help = "Discounting constant D for standard (unmodified) Kneser-Ney; "
+                        "must be strictly between 0 and 1.  A value closer to 0 will give "
+                        "you a more-strongly-biased LM.")
+    parser.add_argument("--verbose", type = int, default = 0,
+                        choices=[0,1,2,3,4,5], help = "Verbose level")
+
+    return parser.parse_args(argv)
 
 
 class NgramCounts(object):
@@ -111,19 +104,6 @@ class NgramCounts(object):
             history = tuple(words[history_start:n])
             self.AddCount(history, predicted_word, 1.0)
 
-    def AddRawCountsFromStandardInput(self):
-        lines_processed = 0
-        while True:
-            line = sys.stdin.readline()
-            if line == '':
-                break
-            self.AddRawCountsFromLine(line)
-            lines_processed += 1
-        if lines_processed == 0 or args.verbose > 0:
-            print("make_one_biased_lm.py: processed {0} lines of input".format(
-                    lines_processed), file = sys.stderr)
-
-
     # This function returns a dict from history (as a tuple of integers of
     # length > 1, ignoring lower-order histories), to the total count of this
     # history state plus all history-states which back off to this history state.
@@ -202,29 +182,13 @@ class NgramCounts(object):
         print('total count = {0}, excluding discount = {1}'.format(
                 total, total_excluding_backoff), file = sys.stderr)
 
-    def AddTopWords(self, top_words_file):
+    # 'top_words' is a list of (word, prob) pairs as returned by ReadTopWords().
+    def AddTopWords(self, top_words):
         empty_history = ()
         word_to_count = self.counts[0][empty_history]
         total = sum(word_to_count.values())
-        try:
-            f = open(top_words_file, mode='r', encoding='utf-8')
-        except:
-            sys.exit("make_one_biased_lm.py: error opening top-words file: "
-                     "--top-words=" + top_words_file)
-        while True:
-            line = f.readline()
-            if line == '':
-                break
-            try:
-                [ word_index, prob ] = line.split()
-                word_index = int(word_index)
-                prob = float(prob)
-                assert word_index > 0 and prob > 0.0
-                word_to_count[word_index] += prob * total
-            except Exception as e:
-                sys.exit("make_one_biased_lm.py: could not make sense of the "
-                         "line '{0}' in op-words file: {1} ".format(line, str(e)))
-        f.close()
+        for word_index, prob in top_words:
+            word_to_count[word_index] += prob * total
 
 
     def GetTotalCountMap(self):
@@ -257,8 +221,9 @@ class NgramCounts(object):
             prob += backoff_prob * prob_in_backoff
         return prob
 
-    # This function prints the estimated language model as an FST.
-    def PrintAsFst(self, word_disambig_symbol):
+    # This function prints the estimated language model as an FST, to 'out'
+    # (default: the standard output).
+    def PrintAsFst(self, word_disambig_symbol, out = None):
         # n is the history-length (== order + 1).  We iterate over the
         # history-length in the order 1, 0, 2, 3, and then iterate over the
         # histories of each order in sorted order.  Putting order 1 first
@@ -288,33 +253,85 @@ class NgramCounts(object):
                             next_hist = next_hist[1:]
                         next_fst_state = hist_to_state[next_hist]
                         print(this_fst_state, next_fst_state, word, word,
-                              this_cost)
+                              this_cost, file = out)
                     elif word == self.eos_symbol:
                         # print final-prob for this state.
-                        print(this_fst_state, this_cost)
+                        print(this_fst_state, this_cost, file = out)
                     else:
                         assert word == self.backoff_symbol
                         backoff_fst_state = hist_to_state[hist[1:len(hist)]]
                         print(this_fst_state, backoff_fst_state,
-                              word_disambig_symbol, 0, this_cost)
-
-
-ngram_counts = NgramCounts(args.ngram_order)
-ngram_counts.AddRawCountsFromStandardInput()
-
-if args.verbose >= 3:
-    ngram_counts.Print("Raw counts:")
-ngram_counts.CompletelyDiscountLowCountStates(args.min_lm_state_count)
-if args.verbose >= 3:
-    ngram_counts.Print("Counts after discounting low-count states:")
-ngram_counts.ApplyBackoff(args.discounting_constant)
-if args.verbose >= 3:
-    ngram_counts.Print("Counts after applying Kneser-Ney discounting:")
-if args.top_words != None:
-    ngram_counts.AddTopWords(args.top_words)
+                              word_disambig_symbol, 0, this_cost, file = out)
+
+
+# This reads the --top-words file and returns a list of (word, prob) pairs.
+def ReadTopWords(top_words_file):
+    try:
+        f = open(top_words_file, mode='r', encoding='utf-8')
+    except:
+        sys.exit("make_one_biased_lm.py: error opening top-words file: "
+                 "--top-words=" + top_words_file)
+    top_words = []
+    while True:
+        line = f.readline()
+        if line == '':
+            break
+        try:
+            [ word_index, prob ] = line.split()
+            word_index = int(word_index)
+            prob = float(prob)
+            assert word_index > 0 and prob > 0.0
+            top_words.append((word_index, prob))
+        except Exception as e:
+            sys.exit("make_one_biased_lm.py: could not make sense of the "
+                     "line '{0}' in op-words file: {1} ".format(line, str(e)))
+    f.close()
+    return top_words
+
+
+# This builds the biased LM from 'lines' (an iterable of strings, each
+# containing a sequence of integer word-ids) and prints it as a text-form FST
+# to 'out' (default: the standard output).  'args' are the options as returned
+# by GetArgs(); 'top_words' is the result of ReadTopWords(args.top_words), which
+# may be supplied by callers that build many LMs, to avoid re-reading the file.
+# This is the function that steps/cleanup/make_biased_lms.py calls.
+def MakeBiasedLm(lines, args, top_words = None, out = None):
+    ngram_counts = NgramCounts(args.ngram_order)
+    lines_processed = 0
+    for line in lines:
+        ngram_counts.AddRawCountsFromLine(line)
+        lines_processed += 1
+    if lines_processed == 0 or args.verbose > 0:
+        print("make_one_biased_lm.py: processed {0} lines of input".format(
+                lines_processed), file = sys.stderr)
+
+    if args.verbose >= 3:
+        ngram_counts.Print("Raw counts:")
+    ngram_counts.CompletelyDiscountLowCountStates(args.min_lm_state_count)
+    if args.verbose >= 3:
+        ngram_counts.Print("Counts after discounting low-count states:")
+    ngram_counts.ApplyBackoff(args.discounting_constant)
     if args.verbose >= 3:
-        ngram_counts.Print("Counts after applying top-n-words")
-ngram_counts.PrintAsFst(args.word_disambig_symbol)
+        ngram_counts.Print("Counts after applying Kneser-Ney discounting:")
+    if args.top_words != None:
+        if top_words is None:
+            top_words = ReadTopWords(args.top_words)
+        ngram_counts.AddTopWords(top_words)
+        if args.verbose >= 3:
+            ngram_counts.Print("Counts after applying top-n-words")
+    ngram_counts.PrintAsFst(args.word_disambig_symbol, out = out)
+
+
+if __name__ == '__main__':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer,encoding="utf8")
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer,encoding="utf8")
+    sys.stdin = io.TextIOWrapper(sys.stdin.buffer,encoding="utf8")
+
+    args = GetArgs()
+    if args.verbose >= 1:
+        print(' '.join(sys.argv), file = sys.stderr)
+    MakeBiasedLm(sys.stdin, args)
 
 
 # test comand:
@@ -124,6 +124,24 @@ def get_args():
                         from the neighboring documents is added to the
                         retrieved document.""")
 
+    parser.add_argument("--use-inverted-index", type=str, default="false",
+                        choices=["true", "false"],
+                        help="""If true, the source TF-IDFs are loaded into
+                        an inverted index (requires numpy), which is built
+                        once per file and is used to score each query
+                        against all the source documents at once.""")
+    parser.add_argument("--cache-index-on-disk", type=str, default="true",
+                        choices=["true", "false"],
+                        help="""If true and --use-inverted-index=true, the
+                        inverted index of each source TF-IDF file is saved
+                        next to it as <file>.index.npz and reused by
+                        subsequent runs.""")
+    parser.add_argument("--use-cosine-similarity", type=str, default="false",
+                        choices=["true", "false"],
+                        help="""If true, the similarity scores are
+                        normalized by the norms of the query and source
+                        TF-IDF vectors. Requires --use-inverted-index=true.""")
+
     parser.add_argument("--source-text-id2doc-ids",
                         type=argparse.FileType('r'), required=True,
                         help="""A mapping from the source text to a list of
@@ -158,6 +176,15 @@ def get_args():
         logger.error("--partial-doc-fraction must be in [0,1]")
         raise ValueError
 
+    args.use_inverted_index = bool(args.use_inverted_index == "true")
+    args.cache_index_on_disk = bool(args.cache_index_on_disk == "true")
+    args.use_cosine_similarity = bool(args.use_cosine_similarity == "true")
+
+    if args.use_cosine_similarity and not args.use_inverted_index:
+        logger.error("--use-cosine-similarity=true requires "
+                     "--use-inverted-index=true")
+        raise ValueError
+
     return args
 
 
@@ -247,6 +274,11 @@ def run(args):
     source_text_id2tfidf = read_map(args.source_text_id2tfidf,
                                     num_values_per_key=1)
 
+    # Inverted indexes of the source TF-IDF files, indexed by the file name.
+    # Usually, many source texts share the same file, so each file is
+    # loaded only once.
+    source_indexes = {}
+
     num_queries = 0
     prev_source_text_id = ""
     for query_id, query_tfidf in tf_idf.read_tfidf_ark(args.query_tfidf):
@@ -257,17 +289,30 @@ def run(args):
         source_text_id = query_id2source_text_id[query_id]
 
         if prev_source_text_id != source_text_id:
-            source_tfidf = tf_idf.TFIDF()
-            source_tfidf.read(
-                open(source_text_id2tfidf[source_text_id]))
+            source_tfidf_file = source_text_id2tfidf[source_text_id]
+            if args.use_inverted_index:
+                if source_tfidf_file not in source_indexes:
+                    source_indexes[source_tfidf_file] = (
+                        tf_idf.load_tfidf_index(
+                            source_tfidf_file,
+                            cache_on_disk=args.cache_index_on_disk))
+                source_index = source_indexes[source_tfidf_file]
+            else:
+                source_tfidf = tf_idf.TFIDF()
+                source_tfidf.read(open(source_tfidf_file))
             prev_source_text_id = source_text_id
 
         # The source documents corresponding to the source text.
         # This is set of documents which will be searched over for the query.
         source_doc_ids = source_text_id2doc_ids[source_text_id]
 
-        scores = query_tfidf.compute_similarity_scores(
-            source_tfidf, source_docs=source_doc_ids, query_id=query_id)
+        if args.use_inverted_index:
+            scores = source_index.compute_similarity_scores(
+                query_tfidf, source_docs=source_doc_ids, query_id=query_id,
+                use_cosine=args.use_cosine_similarity)
+        else:
+            scores = query_tfidf.compute_similarity_scores(
+                source_tfidf, source_docs=source_doc_ids, query_id=query_id)
 
         assert len(scores) > 0, (
             "Did not get scores for query {0}".format(query_id))
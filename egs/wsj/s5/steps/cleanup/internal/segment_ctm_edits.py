@@ -7,8 +7,8 @@
 
 from __future__ import print_function
 from __future__ import division
-import sys, operator, argparse, os
-from collections import defaultdict
+import sys, operator, argparse, os, io, multiprocessing
+from collections import defaultdict, deque
 
 # This script reads 'ctm-edits' file format that is produced by get_ctm_edits.py
 # and modified by modify_ctm_edits.py and taint_ctm_edits.py Its function is to
@@ -95,6 +95,11 @@ parser.add_argument("--word-stats-out", type = str,
                     "reference word does not make it into a segment.  It can help reveal words "
                     "that have problematic pronunciations or are associated with "
                     "transcription errors.")
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help = "Number of processes to use.  If >1, the utterances are "
+                    "segmented in batches by a pool of processes, and the statistics "
+                    "are combined at the end; the outputs are the same as with "
+                    "--num-jobs=1, and are written in the original utterance order.")
 
 
 parser.add_argument("non_scored_words_in", metavar = "<non-scored-words-file>",
@@ -643,8 +648,11 @@ class Segment(object):
 def AccumulateSegmentStats(segment_list, text):
     global segment_total_length, num_segments
     for segment in segment_list:
+        length = segment.Length()
         num_segments[text] += 1
-        segment_total_length[text] += segment.Length()
+        segment_total_length[text] += length
+        if segment_lengths is not None:
+            segment_lengths[text].append(length)
 
 def PrintSegmentStats():
     global segment_total_length, num_segments, \
@@ -686,6 +694,8 @@ def GetSegmentsForUtterance(split_lines_of_utt):
 
     utterance_end_time = float(split_lines_of_utt[-1][2]) + float(split_lines_of_utt[-1][3])
     total_length_of_utterances += utterance_end_time
+    if utterance_lengths is not None:
+        utterance_lengths.append(utterance_end_time)
 
     segments = [ Segment(split_lines_of_utt, x[0], x[1])
                  for x in segment_ranges ]
@@ -923,6 +933,134 @@ def PrintWordStats(word_stats_out):
           file = sys.stderr)
 
 
+# This generator reads the ctm-edits input and yields 2-tuples
+# (utterance-id, split-lines-of-utterance), where the split lines are lists of
+# fields, one per line.
+def ReadUtterances(f_in):
+    first_line = f_in.readline()
+    if first_line == '':
+        sys.exit("segment_ctm_edits.py: empty input")
+    split_pending_line = first_line.split()
+    if len(split_pending_line) == 0:
+        sys.exit("segment_ctm_edits.py: bad input line " + first_line)
+    cur_utterance = split_pending_line[0]
+    split_lines_of_cur_utterance = []
+
+    while True:
+        if len(split_pending_line) == 0 or split_pending_line[0] != cur_utterance:
+            yield (cur_utterance, split_lines_of_cur_utterance)
+            split_lines_of_cur_utterance = []
+            if len(split_pending_line) == 0:
+                break
+            else:
+                cur_utterance = split_pending_line[0]
+
+        split_lines_of_cur_utterance.append(split_pending_line)
+        next_line = f_in.readline()
+        split_pending_line = next_line.split()
+        if len(split_pending_line) == 0:
+            if next_line != '':
+                sys.exit("segment_ctm_edits.py: got an empty or whitespace input line")
+
+# This function segments one utterance, accumulating the global stats, and
+# returns a 3-tuple (text-output, segments-output, ctm-edits-output) of strings
+# to be written to the respective files (the last is None if --ctm-edits-out
+# was not specified).
+def ProcessUtterance(cur_utterance, split_lines_of_cur_utterance):
+    text_output_handle = io.StringIO()
+    segments_output_handle = io.StringIO()
+    (segments_for_utterance,
+     deleted_segments_for_utterance) = GetSegmentsForUtterance(split_lines_of_cur_utterance)
+    AccWordStatsForUtterance(split_lines_of_cur_utterance, segments_for_utterance)
+    WriteSegmentsForUtterance(text_output_handle, segments_output_handle,
+                              cur_utterance, segments_for_utterance)
+    ctm_edits_output = None
+    if args.ctm_edits_out != None:
+        ctm_edits_output_handle = io.StringIO()
+        PrintDebugInfoForUtterance(ctm_edits_output_handle,
+                                   split_lines_of_cur_utterance,
+                                   segments_for_utterance,
+                                   deleted_segments_for_utterance)
+        ctm_edits_output = ctm_edits_output_handle.getvalue()
+    return (text_output_handle.getvalue(), segments_output_handle.getvalue(),
+            ctm_edits_output)
+
+def ResetStats(keep_lengths = False):
+    global segment_total_length, num_segments, word_count_pair, \
+       num_utterances, num_utterances_without_segments, \
+       total_length_of_utterances, segment_lengths, utterance_lengths
+    # segment_total_length and num_segments are maps from
+    # 'stage' strings; see AccumulateSegmentStats for details.
+    segment_total_length = defaultdict(int)
+    num_segments = defaultdict(int)
+    # the lambda expression below is an anonymous function that takes no arguments
+    # and returns the new list [0, 0].
+    word_count_pair = defaultdict(lambda: [0, 0])
+    num_utterances = 0
+    num_utterances_without_segments = 0
+    total_length_of_utterances = 0
+    # If keep_lengths is true (in the worker processes with --num-jobs > 1),
+    # the lengths that are added to segment_total_length and
+    # total_length_of_utterances are also kept in order, so that AddStats()
+    # can add them up in the same order as without --num-jobs (the sums are
+    # floats, so they depend on the order).
+    segment_lengths = defaultdict(list) if keep_lengths else None
+    utterance_lengths = [] if keep_lengths else None
+
+def GetStats():
+    return (dict(segment_lengths), dict(num_segments),
+            dict(word_count_pair), num_utterances,
+            num_utterances_without_segments, utterance_lengths)
+
+# This adds the stats returned by GetStats() in another process to the global
+# stats.  The word stats and the lengths are added in order, so that the words
+# are in the same order (which matters for ties in PrintWordStats()) and the
+# total lengths are the same as if all the utterances had been processed in
+# this process.
+def AddStats(stats):
+    global num_utterances, num_utterances_without_segments, \
+       total_length_of_utterances
+    (this_segment_lengths, this_num_segments, this_word_count_pair,
+     this_num_utterances, this_num_utterances_without_segments,
+     this_utterance_lengths) = stats
+    for key, lengths in this_segment_lengths.items():
+        for length in lengths:
+            segment_total_length[key] += length
+    for key, value in this_num_segments.items():
+        num_segments[key] += value
+    for word, pair in this_word_count_pair.items():
+        word_count_pair[word][0] += pair[0]
+        word_count_pair[word][1] += pair[1]
+    num_utterances += this_num_utterances
+    num_utterances_without_segments += this_num_utterances_without_segments
+    for length in this_utterance_lengths:
+        total_length_of_utterances += length
+
+def InitWorker(this_non_scored_words, this_oov_symbol):
+    global non_scored_words, oov_symbol
+    non_scored_words = this_non_scored_words
+    oov_symbol = this_oov_symbol
+
+# This is run in the worker processes with --num-jobs > 1; it processes a
+# list of utterances as given by ReadUtterances() and returns the list of
+# outputs of ProcessUtterance() for them, and the stats.
+def ProcessUtterances(utterances):
+    ResetStats(keep_lengths = True)
+    outputs = [ ProcessUtterance(cur_utterance, split_lines_of_cur_utterance)
+                for (cur_utterance, split_lines_of_cur_utterance) in utterances ]
+    return (outputs, GetStats())
+
+# This yields lists of 'batch_size' consecutive utterances.
+def BatchUtterances(utterances, batch_size):
+    batch = []
+    for utterance in utterances:
+        batch.append(utterance)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
 def ProcessData():
     try:
         f_in = open(args.ctm_edits_in, encoding='utf-8')
@@ -946,42 +1084,54 @@ def ProcessData():
             sys.exit("segment_ctm_edits.py: error opening ctm-edits output "
                      "file {0}".format(args.ctm_edits_out))
 
+    def WriteOutputs(outputs):
+        (text_output, segments_output, ctm_edits_output) = outputs
+        text_output_handle.write(text_output)
+        segments_output_handle.write(segments_output)
+        if ctm_edits_output is not None:
+            ctm_edits_output_handle.write(ctm_edits_output)
+
     # Most of what we're doing in the lines below is splitting the input lines
     # and grouping them per utterance, before giving them to ProcessUtterance()
     # and then printing the modified lines.
-    first_line = f_in.readline()
-    if first_line == '':
-        sys.exit("segment_ctm_edits.py: empty input")
-    split_pending_line = first_line.split()
-    if len(split_pending_line) == 0:
-        sys.exit("segment_ctm_edits.py: bad input line " + first_line)
-    cur_utterance = split_pending_line[0]
-    split_lines_of_cur_utterance = []
-
-    while True:
-        if len(split_pending_line) == 0 or split_pending_line[0] != cur_utterance:
-            (segments_for_utterance,
-             deleted_segments_for_utterance) = GetSegmentsForUtterance(split_lines_of_cur_utterance)
-            AccWordStatsForUtterance(split_lines_of_cur_utterance, segments_for_utterance)
-            WriteSegmentsForUtterance(text_output_handle, segments_output_handle,
-                                      cur_utterance, segments_for_utterance)
-            if args.ctm_edits_out != None:
-                PrintDebugInfoForUtterance(ctm_edits_output_handle,
-                                           split_lines_of_cur_utterance,
-                                           segments_for_utterance,
-                                           deleted_segments_for_utterance)
-            split_lines_of_cur_utterance = []
-            if len(split_pending_line) == 0:
-                break
-            else:
-                cur_utterance = split_pending_line[0]
-
-        split_lines_of_cur_utterance.append(split_pending_line)
-        next_line = f_in.readline()
-        split_pending_line = next_line.split()
-        if len(split_pending_line) == 0:
-            if next_line != '':
-                sys.exit("segment_ctm_edits.py: got an empty or whitespace input line")
+    utterances = ReadUtterances(f_in)
+    if args.num_jobs <= 1:
+        for (cur_utterance, split_lines_of_cur_utterance) in utterances:
+            WriteOutputs(ProcessUtterance(cur_utterance,
+                                          split_lines_of_cur_utterance))
+    else:
+        # The batches are given to the pool in order, and their outputs are
+        # written in the same order; we keep at most 2 * num_jobs batches in
+        # flight so that the memory use is bounded.
+        pool = multiprocessing.Pool(args.num_jobs, InitWorker,
+                                    (non_scored_words, oov_symbol))
+        pending = deque()
+        def WriteBatch(result):
+            (outputs, stats) = result.get()
+            for this_outputs in outputs:
+                WriteOutputs(this_outputs)
+            AddStats(stats)
+        try:
+            for batch in BatchUtterances(utterances, 100):
+                pending.append(pool.apply_async(ProcessUtterances, (batch,)))
+                if len(pending) >= 2 * args.num_jobs:
+                    WriteBatch(pending.popleft())
+            while len(pending) > 0:
+                WriteBatch(pending.popleft())
+        except Exception:
+            # We don't terminate() the pool here, as that can hang while the
+            # pool is still sending batches to the workers; we let the
+            # workers finish the batches they already have instead.
+            for result in pending:
+                result.wait()
+            pool.close()
+            pool.join()
+            raise
+        except BaseException:  # e.g. KeyboardInterrupt
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
     try:
         text_output_handle.close()
         segments_output_handle.close()
@@ -1009,42 +1159,31 @@ def ReadNonScoredWords(non_scored_words_file):
 
 
 
+if __name__ == '__main__':
+    non_scored_words = set()
+    ReadNonScoredWords(args.non_scored_words_in)
 
-non_scored_words = set()
-ReadNonScoredWords(args.non_scored_words_in)
-
-oov_symbol = None
-if args.oov_symbol_file != None:
-    try:
-        with open(args.oov_symbol_file, encoding='utf-8') as f:
-            line = f.readline()
-            assert len(line.split()) == 1
-            oov_symbol = line.split()[0]
-            assert f.readline() == ''
-    except Exception as e:
-        sys.exit("segment_ctm_edits.py: error reading file --oov-symbol-file=" +
-                 args.oov_symbol_file + ", error is: " + str(e))
-elif args.unk_padding != 0.0:
-    sys.exit("segment_ctm_edits.py: if the --unk-padding option is nonzero (which "
-             "it is by default, the --oov-symbol-file option must be supplied.")
-
-# segment_total_length and num_segments are maps from
-# 'stage' strings; see AccumulateSegmentStats for details.
-segment_total_length = defaultdict(int)
-num_segments = defaultdict(int)
-# the lambda expression below is an anonymous function that takes no arguments
-# and returns the new list [0, 0].
-word_count_pair = defaultdict(lambda: [0, 0])
-num_utterances = 0
-num_utterances_without_segments = 0
-total_length_of_utterances = 0
-
-
-ProcessData()
-PrintSegmentStats()
-if args.word_stats_out != None:
-    PrintWordStats(args.word_stats_out)
-if args.ctm_edits_out != None:
-    print("segment_ctm_edits.py: detailed utterance-level debug information "
-          "is in " + args.ctm_edits_out, file = sys.stderr)
-
+    oov_symbol = None
+    if args.oov_symbol_file != None:
+        try:
+            with open(args.oov_symbol_file, encoding='utf-8') as f:
+                line = f.readline()
+                assert len(line.split()) == 1
+                oov_symbol = line.split()[0]
+                assert f.readline() == ''
+        except Exception as e:
+            sys.exit("segment_ctm_edits.py: error reading file --oov-symbol-file=" +
+                     args.oov_symbol_file + ", error is: " + str(e))
+    elif args.unk_padding != 0.0:
+        sys.exit("segment_ctm_edits.py: if the --unk-padding option is nonzero (which "
+                 "it is by default, the --oov-symbol-file option must be supplied.")
+
+    ResetStats()
+
+    ProcessData()
+    PrintSegmentStats()
+    if args.word_stats_out != None:
+        PrintWordStats(args.word_stats_out)
+    if args.ctm_edits_out != None:
+        print("segment_ctm_edits.py: detailed utterance-level debug information "
+              "is in " + args.ctm_edits_out, file = sys.stderr)
@@ -8,10 +8,12 @@ from __future__ import print_function
 from __future__ import division
 import argparse
 import copy
+import io
 import logging
 import heapq
+import multiprocessing
 import sys
-from collections import defaultdict
+from collections import defaultdict, deque
 
 """
 This script reads 'ctm-edits' file format that is produced by align_ctm_ref.py
@@ -232,6 +234,12 @@ def get_args():
 
     parser.add_argument("--verbose", type=int, default=0,
                         help="Use higher verbosity for more debugging output")
+    parser.add_argument("--num-jobs", type=int, default=1,
+                        help="""Number of processes to use.  If >1, the
+                        utterances are segmented in batches by a pool of
+                        processes, and the statistics are combined at the
+                        end; the outputs are the same as with --num-jobs=1,
+                        and are written in the original utterance order.""")
 
     args = parser.parse_args()
 
@@ -1514,7 +1522,7 @@ def get_segments_for_utterance(split_lines_of_utt, args, utterance_stats):
 
     utterance_end_time = (float(split_lines_of_utt[-1][2])
                           + float(split_lines_of_utt[-1][3]))
-    utterance_stats.total_length_of_utterances += utterance_end_time
+    utterance_stats.accumulate_utterance_length(utterance_end_time)
 
     segments = [Segment(split_lines_of_utt, x[0], x[1])
                 for x in segment_ranges]
@@ -1864,6 +1872,16 @@ class WordStats(object):
                 if not line_is_in_segment[i]:
                     self.word_count_pair[this_ref_word][1] += 1
 
+    def add(self, word_count_pair):
+        """Adds the counts in 'word_count_pair' (e.g. the word_count_pair of
+        the WordStats of another process, as a dict) to this object.  The
+        words are added in order, so that they are in the same order (which
+        matters for ties in print()) as if the utterances had been processed
+        here."""
+        for word, pair in word_count_pair.items():
+            self.word_count_pair[word][0] += pair[0]
+            self.word_count_pair[word][1] += pair[1]
+
     def print(self, word_stats_out):
         # Sort from most to least problematic.  We want to give more prominence
         # to words that are most frequently not in segments, but also to
@@ -1893,13 +1911,12 @@ class WordStats(object):
             of the file.""", word_stats_out.name)
 
 
-def process_data(args, oov_symbol, utterance_stats, word_stats):
+def read_utterances(ctm_edits_in):
     """
-    Most of what we're doing in the lines below is splitting the input lines
-    and grouping them per utterance, before giving them to
-    get_segments_for_utterance() and then printing the modified lines.
+    Splits the input lines and groups them per utterance; yields tuples
+    (utterance-id, split-lines-of-utterance).
     """
-    first_line = args.ctm_edits_in.readline()
+    first_line = ctm_edits_in.readline()
     if first_line == '':
         sys.exit("segment_ctm_edits.py: empty input")
     split_pending_line = first_line.split()
@@ -1909,43 +1926,174 @@ def process_data(args, oov_symbol, utterance_stats, word_stats):
     split_lines_of_cur_utterance = []
 
     while True:
-        try:
-            if (len(split_pending_line) == 0
-                    or split_pending_line[0] != cur_utterance):
-                # Read one whole utterance. Now process it.
-                (segments_for_utterance,
-                 deleted_segments_for_utterance) = get_segments_for_utterance(
-                     split_lines_of_cur_utterance, args=args,
-                     utterance_stats=utterance_stats)
-                word_stats.accumulate_for_utterance(
-                    split_lines_of_cur_utterance, segments_for_utterance)
-                write_segments_for_utterance(
-                    args.text_out, args.segments_out, cur_utterance,
-                    segments_for_utterance, oov_symbol=oov_symbol,
-                    frame_length=args.frame_length)
-                if args.ctm_edits_out is not None:
-                    print_debug_info_for_utterance(
-                        args.ctm_edits_out, split_lines_of_cur_utterance,
-                        segments_for_utterance, deleted_segments_for_utterance,
-                        frame_length=args.frame_length)
-
-                split_lines_of_cur_utterance = []
-                if len(split_pending_line) == 0:
-                    break
-                else:
-                    cur_utterance = split_pending_line[0]
+        if (len(split_pending_line) == 0
+                or split_pending_line[0] != cur_utterance):
+            # Read one whole utterance.
+            yield cur_utterance, split_lines_of_cur_utterance
 
-            split_lines_of_cur_utterance.append(split_pending_line)
-            next_line = args.ctm_edits_in.readline()
-            split_pending_line = next_line.split()
+            split_lines_of_cur_utterance = []
             if len(split_pending_line) == 0:
-                if next_line != '':
-                    sys.exit("segment_ctm_edits.py: got an "
-                             "empty or whitespace input line")
-        except Exception:
-            _global_logger.error(
-                "Error with utterance %s", cur_utterance)
-            raise
+                break
+            else:
+                cur_utterance = split_pending_line[0]
+
+        split_lines_of_cur_utterance.append(split_pending_line)
+        next_line = ctm_edits_in.readline()
+        split_pending_line = next_line.split()
+        if len(split_pending_line) == 0:
+            if next_line != '':
+                sys.exit("segment_ctm_edits.py: got an "
+                         "empty or whitespace input line")
+
+
+def _output_buffer():
+    """
+    Returns an in-memory file for the output of one utterance (io.StringIO
+    only takes unicode strings in python2, where str is bytes).
+    """
+    return io.BytesIO() if sys.version_info.major == 2 else io.StringIO()
+
+
+def process_utterance(cur_utterance, split_lines_of_cur_utterance, args,
+                      oov_symbol, utterance_stats, word_stats):
+    """
+    Segments one utterance, accumulating the stats in utterance_stats and
+    word_stats, and returns a tuple (text-output, segments-output,
+    ctm-edits-output) of the strings to be written to the respective files
+    (the last is None if --ctm-edits-out was not specified).
+    """
+    try:
+        text_out = _output_buffer()
+        segments_out = _output_buffer()
+        (segments_for_utterance,
+         deleted_segments_for_utterance) = get_segments_for_utterance(
+             split_lines_of_cur_utterance, args=args,
+             utterance_stats=utterance_stats)
+        word_stats.accumulate_for_utterance(
+            split_lines_of_cur_utterance, segments_for_utterance)
+        write_segments_for_utterance(
+            text_out, segments_out, cur_utterance,
+            segments_for_utterance, oov_symbol=oov_symbol,
+            frame_length=args.frame_length)
+        ctm_edits_output = None
+        if args.ctm_edits_out is not None:
+            ctm_edits_out = _output_buffer()
+            print_debug_info_for_utterance(
+                ctm_edits_out, split_lines_of_cur_utterance,
+                segments_for_utterance, deleted_segments_for_utterance,
+                frame_length=args.frame_length)
+            ctm_edits_output = ctm_edits_out.getvalue()
+        return (text_out.getvalue(), segments_out.getvalue(),
+                ctm_edits_output)
+    except Exception:
+        _global_logger.error(
+            "Error with utterance %s", cur_utterance)
+        raise
+
+
+# the arguments of _process_utterances() in the worker processes, i.e. a tuple
+# (args, oov_symbol); set by _init_worker().
+_worker_args = None
+
+
+def _init_worker(args, non_scored_words_set, oov_symbol):
+    global _worker_args, _global_non_scored_words
+    _worker_args = (args, oov_symbol)
+    _global_non_scored_words = non_scored_words_set
+
+
+def _process_utterances(utterances):
+    """
+    Processes a list of (utterance-id, split-lines-of-utterance) tuples in a
+    worker process; returns a tuple (outputs, utterance-stats,
+    word-count-pairs), where 'outputs' is the list of the outputs of
+    process_utterance() for them.
+    """
+    args, oov_symbol = _worker_args
+    utterance_stats = UtteranceStats(keep_lengths=True)
+    word_stats = WordStats()
+    outputs = [process_utterance(cur_utterance, split_lines_of_cur_utterance,
+                                 args, oov_symbol, utterance_stats, word_stats)
+               for cur_utterance, split_lines_of_cur_utterance in utterances]
+    return (outputs, utterance_stats, dict(word_stats.word_count_pair))
+
+
+def batch_utterances(utterances, batch_size):
+    """Yields lists of batch_size consecutive elements of 'utterances'."""
+    batch = []
+    for utterance in utterances:
+        batch.append(utterance)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def process_data(args, oov_symbol, utterance_stats, word_stats):
+    """
+    Most of what we're doing in the lines below is splitting the input lines
+    and grouping them per utterance, before giving them to
+    get_segments_for_utterance() and then printing the modified lines.
+    With --num-jobs > 1, batches of utterances are processed by a pool of
+    processes; the outputs are written in the original order.
+    """
+    def write_outputs(outputs):
+        text_output, segments_output, ctm_edits_output = outputs
+        args.text_out.write(text_output)
+        args.segments_out.write(segments_output)
+        if ctm_edits_output is not None:
+            args.ctm_edits_out.write(ctm_edits_output)
+
+    utterances = read_utterances(args.ctm_edits_in)
+    if args.num_jobs <= 1:
+        for cur_utterance, split_lines_of_cur_utterance in utterances:
+            write_outputs(process_utterance(
+                cur_utterance, split_lines_of_cur_utterance, args,
+                oov_symbol, utterance_stats, word_stats))
+        return
+
+    # The open files in 'args' cannot be passed to the workers, and they
+    # don't need them.
+    worker_args = argparse.Namespace(**dict(
+        (key, value) for key, value in vars(args).items()
+        if not isinstance(value, io.IOBase)))
+    worker_args.ctm_edits_out = (None if args.ctm_edits_out is None
+                                 else args.ctm_edits_out.name)
+    pool = multiprocessing.Pool(args.num_jobs, _init_worker,
+                                (worker_args, non_scored_words(), oov_symbol))
+    # we keep at most 2 * num_jobs batches in flight, so that the memory use
+    # is bounded.
+    pending = deque()
+
+    def write_batch(result):
+        outputs, this_utterance_stats, word_count_pair = result.get()
+        for this_outputs in outputs:
+            write_outputs(this_outputs)
+        utterance_stats.combine(this_utterance_stats)
+        word_stats.add(word_count_pair)
+
+    try:
+        for batch in batch_utterances(utterances, 100):
+            pending.append(pool.apply_async(_process_utterances, (batch,)))
+            if len(pending) >= 2 * args.num_jobs:
+                write_batch(pending.popleft())
+        while len(pending) > 0:
+            write_batch(pending.popleft())
+    except Exception:
+        # We don't terminate() the pool here, as that can hang while the
+        # pool is still sending batches to the workers; we let the workers
+        # finish the batches they already have instead.
+        for result in pending:
+            result.wait()
+        pool.close()
+        pool.join()
+        raise
+    except BaseException:  # e.g. KeyboardInterrupt
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
 
 
 def read_non_scored_words(non_scored_words_file):
@@ -1961,7 +2109,7 @@ def read_non_scored_words(non_scored_words_file):
 
 class UtteranceStats(object):
 
-    def __init__(self):
+    def __init__(self, keep_lengths=False):
         # segment_total_length and num_segments are maps from
         # 'stage' strings; see accumulate_segment_stats for details.
         self.segment_total_length = defaultdict(int)
@@ -1971,6 +2119,18 @@ class UtteranceStats(object):
         self.num_utterances = 0
         self.num_utterances_without_segments = 0
         self.total_length_of_utterances = 0
+        # If keep_lengths is true (in the worker processes with --num-jobs >
+        # 1), the lengths that are added to segment_total_length and
+        # total_length_of_utterances are also kept in order, so that
+        # combine() can add them up in the same order as without --num-jobs
+        # (the sums are floats, so they depend on the order).
+        self.segment_lengths = defaultdict(list) if keep_lengths else None
+        self.utterance_lengths = [] if keep_lengths else None
+
+    def accumulate_utterance_length(self, length):
+        self.total_length_of_utterances += length
+        if self.utterance_lengths is not None:
+            self.utterance_lengths.append(length)
 
     def accumulate_segment_stats(self, segment_list, text):
         """
@@ -1978,8 +2138,33 @@ class UtteranceStats(object):
         e.g. 'Stage 0: segment cores', 'Stage 1: add tainted lines', etc.
         """
         for segment in segment_list:
+            length = segment.length()
             self.num_segments[text] += 1
-            self.segment_total_length[text] += segment.length()
+            self.segment_total_length[text] += length
+            if self.segment_lengths is not None:
+                self.segment_lengths[text].append(length)
+
+    def combine(self, other):
+        """Merges this stats with another stats object; if 'other' kept its
+        lengths, they are added one by one."""
+        if other.segment_lengths is not None:
+            for key, lengths in other.segment_lengths.items():
+                for length in lengths:
+                    self.segment_total_length[key] += length
+        else:
+            for key, value in other.segment_total_length.items():
+                self.segment_total_length[key] += value
+        for key, value in other.num_segments.items():
+            self.num_segments[key] += value
+        self.num_utterances += other.num_utterances
+        self.num_utterances_without_segments += (
+            other.num_utterances_without_segments)
+        if other.utterance_lengths is not None:
+            for length in other.utterance_lengths:
+                self.total_length_of_utterances += length
+        else:
+            self.total_length_of_utterances += (
+                other.total_length_of_utterances)
 
     def print_segment_stats(self):
         _global_logger.info(
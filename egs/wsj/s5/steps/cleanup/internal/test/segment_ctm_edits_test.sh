@@ -0,0 +1,111 @@
+#!/usr/bin/env bash
+
+# Apache 2.0.
+
+# This script checks the --num-jobs option of segment_ctm_edits.py and
+# segment_ctm_edits_mild.py, on a synthetic ctm-edits file of 3000
+# utterances (so that several batches of utterances are in flight at once):
+#  - with --num-jobs 3, the text, the segments and the statistics printed
+#    to the standard error must be the same as with --num-jobs 1 (with this
+#    data, segment_ctm_edits_mild.py used to print "[+0.00%]" instead of
+#    "[-0.00%]" for stage 4 with --num-jobs 3, as the lengths were summed
+#    in a different order);
+#  - with --num-jobs 3, an utterance that the workers fail on (here, one
+#    with a start time that is not a number) must make the script exit with
+#    an error, and not hang.  This is tried 8 times, 4 at a time, as the
+#    hangs there used to happen only in some runs (about 1 in 40, under
+#    load), so a regression will not always be caught.
+#
+# Usage (from egs/wsj/s5): steps/cleanup/internal/test/segment_ctm_edits_test.sh
+# It exits with status 0 if all the checks pass.
+
+dir=$(dirname $0)/..
+
+tmpdir=$(mktemp -d)
+trap "rm -r $tmpdir" EXIT
+
+echo "<unk>" >$tmpdir/oov
+echo "<unk>" >$tmpdir/non_scored_words
+
+# ctm-edits lines: <utt> <channel> <start> <duration> <hyp-word> <conf>
+# <ref-word> <edit-type>; the times have 3 decimals, which makes the sums of
+# the lengths depend on the order in which they are added up.
+python - >$tmpdir/ctm_edits <<EOF
+import random
+random.seed(6)
+words = ['a', 'b', 'c', 'd', 'e', 'f', '<unk>']
+for u in range(3000):
+    t = 0.0
+    for i in range(random.randint(5, 40)):
+        r = random.random()
+        d = round(random.uniform(0.03, 0.6), 3)
+        if r < 0.15:
+            line = ('<eps>', 1.0, '<eps>', 'sil')
+        elif r < 0.75:
+            w = random.choice(words)
+            line = (w, 1.0, w, 'cor')
+        elif r < 0.85:
+            w = random.choice(words)
+            line = (w, 0.5, random.choice(words), 'sub')
+        elif r < 0.92:
+            line = ('<eps>', 1.0, random.choice(words), 'del')
+            d = 0.0
+        else:
+            w = random.choice(words)
+            line = (w, 0.7, '<eps>', 'ins')
+        print('utt%05d 1 %.3f %.3f %s %s %s %s' % ((u, t, d) + line))
+        t += d
+EOF
+awk '$1 == "utt00100" && $3 != "0.000" && !done { $3 = "abc"; done = 1; } { print; }' \
+  <$tmpdir/ctm_edits >$tmpdir/ctm_edits_bad
+
+# run <script> <num-jobs> <ctm-edits> <name>: runs the script, with the
+# time stamps removed from its standard error.
+run() {
+  timeout 120 python $dir/$1.py --num-jobs=$2 --oov-symbol-file=$tmpdir/oov \
+    $tmpdir/non_scored_words $3 $tmpdir/$4.text $tmpdir/$4.segments \
+    2>$tmpdir/$4.log.full
+  ret=$?
+  sed 's/^[0-9-]* [0-9:,]* //' <$tmpdir/$4.log.full >$tmpdir/$4.log
+  return $ret
+}
+
+status=0
+for script in segment_ctm_edits segment_ctm_edits_mild; do
+  script_status=0
+  for num_jobs in 1 3; do
+    if ! run $script $num_jobs $tmpdir/ctm_edits $num_jobs; then
+      echo "$0: $script.py --num-jobs $num_jobs failed, see below:"
+      tail -n 20 $tmpdir/$num_jobs.log
+      status=1; continue 2
+    fi
+  done
+  for x in text segments log; do
+    if ! cmp -s $tmpdir/1.$x $tmpdir/3.$x; then
+      echo "$0: $script.py gave a different $x with --num-jobs 3; the diff is:"
+      diff $tmpdir/1.$x $tmpdir/3.$x | head -n 20
+      script_status=1
+    fi
+  done
+
+  for n in 1 2 3 4 5 6 7 8; do
+    ( run $script 3 $tmpdir/ctm_edits_bad bad.$n; echo $? >$tmpdir/bad.$n.ret ) &
+    [ $((n % 4)) -eq 0 ] && wait
+  done
+  for n in 1 2 3 4 5 6 7 8; do
+    ret=$(cat $tmpdir/bad.$n.ret)
+    if [ $ret -eq 124 ]; then
+      echo "$0: $script.py --num-jobs 3 hung on a bad utterance"
+      script_status=1; break
+    elif [ $ret -eq 0 ]; then
+      echo "$0: $script.py --num-jobs 3 succeeded on a bad utterance"
+      script_status=1; break
+    fi
+  done
+  if [ $script_status -eq 0 ]; then
+    echo "$0: $script.py OK"
+  else
+    status=1
+  fi
+done
+exit $status
@@ -9,9 +9,15 @@ from __future__ import print_function
 from __future__ import division
 import logging
 import math
+import os
 import re
 import sys
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 sys.path.insert(0, 'steps')
 
 logger = logging.getLogger('__name__')
@@ -337,6 +343,231 @@ class TFIDF(object):
         print ("</TFIDF>", file=tf_idf_file)
 
 
+class TFIDFIndex(object):
+    """An inverted index built from the TF-IDF values of a set of source
+    documents, used to compute the similarity scores of query documents
+    against all the source documents at once.
+
+    The values are stored as postings lists (in compressed sparse row format)
+    indexed by the term, so that scoring a query only touches the postings of
+    the terms that are in the query rather than every
+    (query term, source document) pair.
+
+    Parameters:
+        term2id - A dictionary from the term (a tuple of words) to the
+                  index of its postings list
+        doc_ids - The list of document-ids; the postings store indexes
+                  into this list
+        doc2index - The inverse of doc_ids
+        postings_start - Array of size (num_terms + 1); the postings of the
+                         term with index t are at indexes
+                         postings_start[t] ... postings_start[t+1] - 1
+                         of postings_doc and postings_value
+        postings_doc - Document indexes of the postings
+        postings_value - TF-IDF values of the postings
+        doc_norms - The L2 norm of the TF-IDF vector of each document
+    """
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError("TFIDFIndex requires numpy")
+        self.term2id = {}
+        self.doc_ids = []
+        self.doc2index = {}
+        self.postings_start = np.zeros(1, dtype=np.int64)
+        self.postings_doc = np.zeros(0, dtype=np.int32)
+        self.postings_value = np.zeros(0, dtype=np.float64)
+        self.doc_norms = np.zeros(0, dtype=np.float64)
+
+    def build(self, source_tfidf):
+        """Builds the index from the TFIDF object source_tfidf."""
+        postings = {}
+        for tup, value in source_tfidf.tf_idf.items():
+            term, doc = tup
+            doc_index = self.doc2index.setdefault(doc, len(self.doc2index))
+            postings.setdefault(term, []).append((doc_index, value))
+
+        self.doc_ids = [None] * len(self.doc2index)
+        for doc, doc_index in self.doc2index.items():
+            self.doc_ids[doc_index] = doc
+
+        self.term2id = {}
+        start = [0]
+        docs = []
+        values = []
+        for term, term_postings in postings.items():
+            self.term2id[term] = len(self.term2id)
+            for doc_index, value in term_postings:
+                docs.append(doc_index)
+                values.append(value)
+            start.append(len(docs))
+
+        self.postings_start = np.array(start, dtype=np.int64)
+        self.postings_doc = np.array(docs, dtype=np.int32)
+        self.postings_value = np.array(values, dtype=np.float64)
+        self._compute_doc_norms()
+
+    def _compute_doc_norms(self):
+        self.doc_norms = np.sqrt(np.bincount(
+            self.postings_doc, weights=self.postings_value ** 2,
+            minlength=len(self.doc_ids)))
+
+    def get_scores(self, query_tfidf, query_id=None, use_cosine=False):
+        """Returns an array of the similarity scores of the query document
+        in query_tfidf with all the documents in the index, in the order of
+        self.doc_ids. This is the sum over the terms of the
+        product of the TF-IDF values in the query and the source document.
+        If use_cosine is True, the score is normalized by the norms of the
+        two TF-IDF vectors.
+
+        query_tfidf must contain the values for a single document; if
+        query_id is provided, checks that it is the document with id
+        'query_id'.
+        """
+        term_ids = []
+        query_values = []
+        query_norm = 0.0
+        query_doc = None
+        for tup, value in query_tfidf.tf_idf.items():
+            term, doc = tup
+            if query_doc is None:
+                query_doc = doc
+            if doc != query_doc or (query_id is not None and doc != query_id):
+                raise RuntimeError("TF-IDF contains document {0}, which is "
+                                   "not the required query {1}.".format(
+                                       doc, query_id if query_id is not None
+                                       else query_doc))
+            query_norm += value * value
+            term_id = self.term2id.get(term)
+            if term_id is not None:
+                term_ids.append(term_id)
+                query_values.append(value)
+
+        scores = np.zeros(len(self.doc_ids), dtype=np.float64)
+        if len(term_ids) > 0:
+            term_ids = np.array(term_ids, dtype=np.int64)
+            starts = self.postings_start[term_ids]
+            lengths = self.postings_start[term_ids + 1] - starts
+
+            # Gather the postings of all the query terms at once.
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths,
+                                lengths)
+            positions = offsets + np.arange(lengths.sum())
+            weights = (self.postings_value[positions]
+                       * np.repeat(np.array(query_values), lengths))
+            scores = np.bincount(self.postings_doc[positions],
+                                 weights=weights,
+                                 minlength=len(self.doc_ids))
+
+        if use_cosine:
+            denominator = self.doc_norms * math.sqrt(query_norm)
+            scores = np.divide(scores, denominator,
+                               out=np.zeros_like(scores),
+                               where=denominator > 0)
+        return scores
+
+    def compute_similarity_scores(self, query_tfidf, source_docs=None,
+                                  do_length_normalization=False,
+                                  query_id=None, use_cosine=False):
+        """Computes the same similarity scores as
+        TFIDF.compute_similarity_scores() using the index, for a query_tfidf
+        that contains a single document.
+
+        Returns a dictionary
+            { (query_document_id, source_document_id): similarity_score }
+        """
+        scores = self.get_scores(query_tfidf, query_id=query_id,
+                                 use_cosine=use_cosine)
+        if len(query_tfidf.tf_idf) == 0:
+            return {}
+        query_doc = next(iter(query_tfidf.tf_idf))[1]
+
+        if do_length_normalization:
+            scores = scores / len(query_tfidf.tf_idf)
+
+        if source_docs is None:
+            source_docs = self.doc_ids
+
+        similarity_scores = {}
+        for src_doc in source_docs:
+            doc_index = self.doc2index.get(src_doc)
+            similarity_scores[(query_doc, src_doc)] = (
+                0 if doc_index is None else float(scores[doc_index]))
+        return similarity_scores
+
+    def get_top_documents(self, query_tfidf, num_docs, query_id=None,
+                          use_cosine=False):
+        """Returns a list of up to num_docs tuples
+        (source_document_id, similarity_score) with the highest similarity
+        scores, sorted by decreasing score.
+        """
+        scores = self.get_scores(query_tfidf, query_id=query_id,
+                                 use_cosine=use_cosine)
+        num_docs = min(num_docs, len(scores))
+        if num_docs <= 0:
+            return []
+        top = np.argpartition(-scores, num_docs - 1)[:num_docs]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.doc_ids[i], float(scores[i])) for i in top]
+
+    def write(self, file_name):
+        """Saves the index to the file file_name in numpy's npz format."""
+        terms = [" ".join(term) for term, _ in
+                 sorted(self.term2id.items(), key=lambda x: x[1])]
+        with open(file_name, 'wb') as f:
+            np.savez(f, terms=np.array(terms, dtype=np.str_),
+                     doc_ids=np.array(self.doc_ids, dtype=np.str_),
+                     postings_start=self.postings_start,
+                     postings_doc=self.postings_doc,
+                     postings_value=self.postings_value)
+
+    def read(self, file_name):
+        """Loads the index written by write()."""
+        with np.load(file_name, allow_pickle=False) as data:
+            self.term2id = {tuple(term.split(" ")): i
+                            for i, term in enumerate(data['terms'].tolist())}
+            self.doc_ids = data['doc_ids'].tolist()
+            self.postings_start = data['postings_start']
+            self.postings_doc = data['postings_doc']
+            self.postings_value = data['postings_value']
+        self.doc2index = {doc: i for i, doc in enumerate(self.doc_ids)}
+        self._compute_doc_norms()
+
+
+def load_tfidf_index(tf_idf_file_name, cache_on_disk=True):
+    """Returns a TFIDFIndex for the TF-IDF object in the file
+    tf_idf_file_name.
+
+    If cache_on_disk is True, the index is saved to
+    <tf_idf_file_name>.index.npz the first time it is built and is read from
+    there as long as it is newer than the TF-IDF file.
+    """
+    index = TFIDFIndex()
+    index_file_name = tf_idf_file_name + ".index.npz"
+    if (cache_on_disk and os.path.exists(index_file_name)
+            and (os.path.getmtime(index_file_name)
+                 >= os.path.getmtime(tf_idf_file_name))):
+        index.read(index_file_name)
+        return index
+
+    source_tfidf = TFIDF()
+    with open(tf_idf_file_name) as f:
+        source_tfidf.read(f)
+    index.build(source_tfidf)
+
+    if cache_on_disk:
+        # Write to a temporary file first, since parallel jobs may be
+        # building the same index.
+        tmp_file_name = "{0}.{1}.tmp".format(index_file_name, os.getpid())
+        try:
+            index.write(tmp_file_name)
+            os.rename(tmp_file_name, index_file_name)
+        except (IOError, OSError):
+            logger.warning("Could not write TF-IDF index to %s",
+                           index_file_name)
+    return index
+
+
 def write_tfidf_from_stats(
         tf_stats, idf_stats, tf_idf_file, tf_weighting_scheme="raw",
         idf_weighting_scheme="log", tf_normalization_factor=0.5,
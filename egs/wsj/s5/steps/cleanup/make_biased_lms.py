@@ -3,22 +3,26 @@
 from __future__ import print_function
 import sys
 import argparse
+import io
 import math
-import subprocess
-from collections import defaultdict
+import multiprocessing
+import os
+import shlex
+from collections import defaultdict, deque
 
-import io
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer,encoding="utf8")
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer,encoding="utf8")
-sys.stdin = io.TextIOWrapper(sys.stdin.buffer,encoding="utf8")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                'internal'))
+import make_one_biased_lm
 
 parser = argparse.ArgumentParser(description="""
-This script is a wrapper for make_one_biased_lm.py that reads a Kaldi archive
+This script uses make_one_biased_lm.py to read a Kaldi archive
 of (integerized) text data from the standard input and writes a Kaldi archive of
 backoff-language-model FSTs to the standard-output.  It takes care of
 grouping utterances to respect the --min-words-per-graph option.  It writes
 the graphs to the standard output and also outputs a map from input utterance-ids
-to the per-group utterance-ids that index the output graphs.""")
+to the per-group utterance-ids that index the output graphs.  The LMs are built
+in this process (or in a pool of --num-jobs processes) by calling the
+MakeBiasedLm() function of make_one_biased_lm.py.""")
 
 parser.add_argument("--lm-opts", type = str, default = "",
                     help = "Options to pass in to make_one_biased_lm.py (which "
@@ -27,24 +31,44 @@ parser.add_argument("--min-words-per-graph", type = int, default = 100,
                     help = "Minimum number of words per utterance group; this program "
                     "will try to arrange the input utterances into groups such that each "
                     "one has at least this many words in total.")
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help = "Number of processes in which to build the LMs of the "
+                    "utterance groups; the graphs are written in the input order "
+                    "regardless.")
 parser.add_argument("utterance_map", type = str,
                     help = "Filename to which a map from input utterances to grouped "
                     "utterances, is written")
 
-args = parser.parse_args()
-
-
-
-try:
-    utterance_map_file = open(args.utterance_map, "w", encoding="utf-8")
-except:
-    sys.exit("make_biased_lms.py: error opening {0} to write utterance map".format(
-            args.utterance_map))
+# The options for make_one_biased_lm.py (from --lm-opts) and the contents of
+# the --top-words file; set by InitWorker(), in each process that builds LMs.
+lm_args = None
+top_words = None
+
+def InitWorker(this_lm_args):
+    global lm_args, top_words
+    lm_args = this_lm_args
+    top_words = None
+    if lm_args.top_words != None:
+        top_words = make_one_biased_lm.ReadTopWords(lm_args.top_words)
+
+# This builds the LM for one group of lines of text (without the utterance-ids)
+# and returns it as a text-form FST.
+def MakeLmForGroup(lines):
+    out = io.StringIO()
+    try:
+        make_one_biased_lm.MakeBiasedLm(lines, lm_args, top_words, out = out)
+    except SystemExit as e:
+        # make_one_biased_lm.py exits on errors; this turns that into an
+        # exception, which can be passed from a worker process.
+        raise Exception(str(e.code))
+    return out.getvalue()
 
 # This processes one group of input lines; 'group_of_lines' is
 # an array of lines of input integerized text, e.g.
-# [ 'utt1 67 89 432', 'utt2 89 48 62' ]
-def ProcessGroupOfLines(group_of_lines):
+# [ 'utt1 67 89 432', 'utt2 89 48 62' ].  It writes the map from the utterances
+# to the group utterance-id to 'utterance_map_file' and returns a tuple
+# (group-utterance-id, lines-of-text-without-utterance-ids).
+def SplitGroupOfLines(group_of_lines, utterance_map_file):
     num_lines = len(group_of_lines)
     try:
         first_utterance_id = group_of_lines[0].split()[0]
@@ -52,53 +76,94 @@ def ProcessGroupOfLines(group_of_lines):
         sys.exit("make_biased_lms.py: empty input line")
 
     group_utterance_id = '{0}-group-of-{1}'.format(first_utterance_id, num_lines)
-    # print the group utterance-id to the stdout; it forms the name in
-    # the text-form archive.
+    lines = []
+    for line in group_of_lines:
+        a = line.split()
+        if len(a) == 0:
+            sys.exit("make_biased_lms.py: empty input line")
+        utterance_id = a[0]
+        # print <utt> <utt-group> to utterance-map file
+        print(utterance_id, group_utterance_id, file = utterance_map_file)
+        lines.append(' '.join(a[1:]) + '\n') # get rid of utterance id.
+    return (group_utterance_id, lines)
+
+# This yields the groups of input lines, each with at least
+# --min-words-per-graph words (except possibly the last one).
+def ReadGroupsOfLines(f, min_words_per_graph):
+    num_words_this_group = 0
+    this_group_of_lines = []  # An array of strings, one per line
+
+    while True:
+        line = f.readline();
+        num_words_this_group += len(line.split())
+        if line != '':
+            this_group_of_lines.append(line)
+        if num_words_this_group >= min_words_per_graph or \
+            (line == '' and len(this_group_of_lines) != 0):
+            yield this_group_of_lines
+            num_words_this_group = 0
+            this_group_of_lines = []
+        if line == '':
+            break
+
+# This writes the FST of a group; the group utterance-id forms the name in the
+# text-form archive, and the blank line terminates the FST in the Kaldi
+# fst-archive format.
+def WriteFst(group_utterance_id, fst_text):
     print(group_utterance_id)
-    sys.stdout.flush()
-
-    try:
-        command = "steps/cleanup/internal/make_one_biased_lm.py " + args.lm_opts
-        p = subprocess.Popen(command, shell = True, stdin = subprocess.PIPE,
-                             stdout = sys.stdout, stderr = sys.stderr)
-        for line in group_of_lines:
-            a = line.split()
-            if len(a) == 0:
-                sys.exit("make_biased_lms.py: empty input line")
-            utterance_id = a[0]
-            # print <utt> <utt-group> to utterance-map file
-            print(utterance_id, group_utterance_id, file = utterance_map_file)
-            rest_of_line = ' '.join(a[1:]) + '\n' # get rid of utterance id.
-            p.stdin.write(rest_of_line.encode('utf-8'))
-        p.stdin.close()
-        assert p.wait() == 0
-    except Exception:
-        sys.stderr.write(
-            "make_biased_lms.py: error calling subprocess, command was: " +
-            command)
-        raise
-    # Print a blank line; this terminates the FST in the Kaldi fst-archive
-    # format.
+    sys.stdout.write(fst_text)
     print("")
     sys.stdout.flush()
 
+def Main():
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer,encoding="utf8")
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer,encoding="utf8")
+    sys.stdin = io.TextIOWrapper(sys.stdin.buffer,encoding="utf8")
 
+    args = parser.parse_args()
 
-num_words_this_group = 0
-this_group_of_lines = []  # An array of strings, one per line
+    try:
+        this_lm_args = make_one_biased_lm.GetArgs(shlex.split(args.lm_opts))
+    except SystemExit:
+        sys.exit("make_biased_lms.py: bad --lm-opts: " + args.lm_opts)
 
-while True:
-    line = sys.stdin.readline();
-    num_words_this_group += len(line.split())
-    if line != '':
-        this_group_of_lines.append(line)
-    if num_words_this_group >= args.min_words_per_graph or \
-        (line == '' and len(this_group_of_lines) != 0):
-        ProcessGroupOfLines(this_group_of_lines)
-        num_words_this_group = 0
-        this_group_of_lines = []
-    if line == '':
-        break
+    try:
+        utterance_map_file = open(args.utterance_map, "w", encoding="utf-8")
+    except:
+        sys.exit("make_biased_lms.py: error opening {0} to write utterance map".format(
+                args.utterance_map))
+
+    groups = ReadGroupsOfLines(sys.stdin, args.min_words_per_graph)
+    if args.num_jobs <= 1:
+        InitWorker(this_lm_args)
+        for group_of_lines in groups:
+            (group_utterance_id, lines) = SplitGroupOfLines(group_of_lines,
+                                                            utterance_map_file)
+            WriteFst(group_utterance_id, MakeLmForGroup(lines))
+    else:
+        # The groups are given to the pool in order and their FSTs are written
+        # in the same order; at most 2 * num_jobs groups are in flight, so that
+        # the memory use is bounded.
+        pool = multiprocessing.Pool(args.num_jobs, InitWorker, (this_lm_args,))
+        pending = deque()
+        for group_of_lines in groups:
+            (group_utterance_id, lines) = SplitGroupOfLines(group_of_lines,
+                                                            utterance_map_file)
+            pending.append((group_utterance_id,
+                            pool.apply_async(MakeLmForGroup, (lines,))))
+            if len(pending) >= 2 * args.num_jobs:
+                (group_utterance_id, result) = pending.popleft()
+                WriteFst(group_utterance_id, result.get())
+        while len(pending) > 0:
+            (group_utterance_id, result) = pending.popleft()
+            WriteFst(group_utterance_id, result.get())
+        pool.close()
+        pool.join()
+    utterance_map_file.close()
+
+
+if __name__ == '__main__':
+    Main()
 
 
 # test comand [to be run from ../..]
@@ -17,6 +17,7 @@ from reverberate_data_dir import parse_file_to_dict
 from reverberate_data_dir import write_dict_to_file
 import libs.common as common_lib
 data_lib = imp.load_source('dml', 'steps/data/data_dir_manipulation_lib.py')
+corruption_lib = imp.load_source('wcl', 'steps/data/wav_corruption_lib.py')
 
 def get_args():
     parser = argparse.ArgumentParser(description="Augment the data directory with additive noises. "
@@ -60,6 +61,16 @@ def get_args():
                         help="Background noise data directory")
     parser.add_argument("--fg-noise-dir", type=str, dest="fg_noise_dir",
                         help="Foreground noise data directory")
+    parser.add_argument("--corruption-engine", type=str, dest="corruption_engine",
+                        default="wav-reverberate", choices=["wav-reverberate", "python"],
+                        help='If wav-reverberate, the wav.scp of the output directory '
+                            'contains wav-reverberate pipelines that add the noises whenever '
+                            'the recordings are read. If python, the augmented recordings are '
+                            'computed by this script and written to <output-dir>/wav.ark, '
+                            'and the wav.scp points into it.')
+    parser.add_argument("--num-jobs", type=int, dest="num_jobs", default=1,
+                        help='Number of processes used to augment the recordings '
+                            'if --corruption-engine=python')
     parser.add_argument("input_dir", help="Input data directory")
     parser.add_argument("output_dir", help="Output data directory")
 
@@ -88,6 +99,8 @@ def check_args(args):
         raise Exception("--fg-interval must be 0 or greater")
     if args.bg_noise_dir is None and args.fg_noise_dir is None:
         raise Exception("Either --fg-noise-dir or --bg-noise-dir must be specified")
+    if args.num_jobs <= 0:
+        raise Exception("--num-jobs must be positive")
     return args
 
 def get_noise_list(noise_wav_scp_filename):
@@ -102,7 +115,11 @@ def get_noise_list(noise_wav_scp_filename):
     return noise_utts, noise_wavs
 
 def augment_wav(utt, wav, dur, fg_snr_opts, bg_snr_opts, fg_noise_utts, \
-    bg_noise_utts, noise_wavs, noise2dur, interval, num_opts):
+    bg_noise_utts, noise_wavs, noise2dur, interval, num_opts, corruption=None):
+    """ Returns the wav-reverberate pipeline that augments 'wav'.  If
+        'corruption' is not None, it is a dict that is filled with the
+        equivalent descriptor for steps/data/wav_corruption_lib.py.
+    """
     # This section is common to both foreground and background noises
     new_wav = ""
     dur_str = str(dur)
@@ -110,6 +127,7 @@ def augment_wav(utt, wav, dur, fg_snr_opts, bg_snr_opts, fg_noise_utts, \
     tot_noise_dur = 0
     snrs=[]
     noises=[]
+    noise_descriptors=[]
     start_times=[]
 
     # Now handle the background noises
@@ -123,6 +141,7 @@ def augment_wav(utt, wav, dur, fg_snr_opts, bg_snr_opts, fg_noise_utts, \
             snrs.append(snr)
             start_times.append(0)
             noises.append(noise)
+            noise_descriptors.append({'wav': noise_wavs[noise_utt], 'duration': dur})
 
     # Now handle the foreground noises
     if len(fg_noise_utts) > 0:
@@ -135,10 +154,14 @@ def augment_wav(utt, wav, dur, fg_snr_opts, bg_snr_opts, fg_noise_utts, \
             start_times.append(tot_noise_dur)
             tot_noise_dur += noise_dur + interval
             noises.append(noise)
+            noise_descriptors.append(noise)
 
     start_times_str = "--start-times='" + ",".join([str(i) for i in start_times]) + "'"
     snrs_str = "--snrs='" + ",".join([str(i) for i in snrs]) + "'"
     noises_str = "--additive-signals='" + ",".join(noises).strip() + "'"
+    if corruption is not None:
+        corruption['shift_output'] = True
+        corruption['noises'] = list(zip(noise_descriptors, start_times, snrs))
 
     # If the wav is just a file
     if wav.strip()[-1] != "|":
@@ -230,6 +253,11 @@ def main():
         noise_wavs.update(fg_noise_wavs)
         noise_reco2dur.update(fg_noise_reco2dur)
 
+    corruption_engine = None
+    if args.corruption_engine == "python":
+        corruption_engine = corruption_lib.CorruptionEngine(num_jobs=args.num_jobs)
+    corruption_tasks = []
+
     random.seed(args.random_seed)
     new_utt2wav = {}
     new_utt2spk = {}
@@ -240,17 +268,23 @@ def main():
         utt = toks[0]
         wav = " ".join(toks[1:])
         dur = reco2dur[utt]
+        corruption = {}
         new_wav = augment_wav(utt, wav, dur, fg_snrs, bg_snrs, fg_noise_utts,
             bg_noise_utts, noise_wavs, noise_reco2dur, args.fg_interval,
-            num_bg_noises)
+            num_bg_noises, corruption)
 
         new_utt = get_new_id(utt, args.utt_modifier_type, args.utt_modifier)
 
         new_utt2wav[new_utt] = new_wav
+        corruption_tasks.append((new_utt, wav, corruption))
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
+    if corruption_engine is not None:
+        new_utt2wav.update(corruption_engine.write_archive(corruption_tasks,
+                                                           output_dir + "/wav.ark"))
+
     write_dict_to_file(new_utt2wav, output_dir + "/wav.scp")
     copy_file_if_exists(input_dir + "/reco2dur", output_dir + "/reco2dur",
                                 args.utt_modifier_type, args.utt_modifier)
@@ -8,6 +8,7 @@
 import argparse, shlex, glob, math, os, random, sys, warnings, copy, imp, ast
 
 data_lib = imp.load_source('dml', 'steps/data/data_dir_manipulation_lib.py')
+corruption_lib = imp.load_source('wcl', 'steps/data/wav_corruption_lib.py')
 
 def get_args():
     # we add required arguments as named arguments for readability
@@ -71,6 +72,13 @@ def get_args():
                         "the RIRs/noises will be resampled to the rate of the source data.")
     parser.add_argument("--include-original-data", type=str, help="If true, the output data includes one copy of the original data",
                          choices=['true', 'false'], default = "false")
+    parser.add_argument("--corruption-engine", type=str, default = "wav-reverberate", choices=['wav-reverberate', 'python'],
+                        help="If wav-reverberate, the wav.scp of the output directory contains wav-reverberate pipelines "
+                        "that corrupt the recordings whenever they are read. If python, the corrupted recordings are "
+                        "computed by this script (with numpy, in the same way as wav-reverberate) and written to "
+                        "<out-data-dir>/wav.ark, and the wav.scp points into it.")
+    parser.add_argument("--num-jobs", type=int, default = 1,
+                        help="Number of processes used to corrupt the recordings if --corruption-engine=python")
     parser.add_argument("input_dir",
                         help="Input data directory")
     parser.add_argument("output_dir",
@@ -113,6 +121,9 @@ def check_args(args):
     if args.source_sampling_rate is not None and args.source_sampling_rate <= 0:
         raise Exception("--source-sampling-rate cannot be non-positive")
 
+    if args.num_jobs <= 0:
+        raise Exception("--num-jobs must be positive")
+
     return args
 
 
@@ -221,10 +232,12 @@ def add_point_source_noise(noise_addition_descriptor,  # descriptor to store the
             # if it is a foreground noise, the noise will not extended and be added at a random time of the speech
             if noise.bg_fg_type == "background":
                 noise_rvb_command = """wav-reverberate --impulse-response="{0}" --duration={1}""".format(noise_rir.rir_rspecifier, speech_dur)
+                noise_addition_descriptor['noises'].append({'wav': noise.noise_rspecifier, 'rir': noise_rir.rir_rspecifier, 'duration': speech_dur})
                 noise_addition_descriptor['start_times'].append(0)
                 noise_addition_descriptor['snrs'].append(next(background_snrs))
             else:
                 noise_rvb_command = """wav-reverberate --impulse-response="{0}" """.format(noise_rir.rir_rspecifier)
+                noise_addition_descriptor['noises'].append({'wav': noise.noise_rspecifier, 'rir': noise_rir.rir_rspecifier, 'duration': 0})
                 noise_addition_descriptor['start_times'].append(round(random.random() * speech_dur, 2))
                 noise_addition_descriptor['snrs'].append(next(foreground_snrs))
 
@@ -246,7 +259,8 @@ def generate_reverberation_opts(room_dict,  # the room dictionary, please refer
                               isotropic_noise_addition_probability, # Probability of adding isotropic noises
                               pointsource_noise_addition_probability, # Probability of adding point-source noises
                               speech_dur,  # duration of the recording
-                              max_noises_recording  # Maximum number of point-source noises that can be added
+                              max_noises_recording,  # Maximum number of point-source noises that can be added
+                              corruption = None  # if not None, a dict that is filled with the descriptor of the corruption (see wav_corruption_lib.py)
                               ):
     """ This function randomly decides whether to reverberate, and sample a RIR if it does
         It also decides whether to add the appropriate noises
@@ -254,8 +268,11 @@ def generate_reverberation_opts(room_dict,  # the room dictionary, please refer
     """
     reverberate_opts = ""
     noise_addition_descriptor = {'noise_io': [],
+                                 'noises': [],
                                  'start_times': [],
                                  'snrs': []}
+    if corruption is not None:
+        corruption['rir'] = None
     # Randomly select the room
     # Here the room probability is a sum of the probabilities of the RIRs recorded in the room.
     room = pick_item_with_probability(room_dict)
@@ -264,6 +281,8 @@ def generate_reverberation_opts(room_dict,  # the room dictionary, please refer
     if random.random() < speech_rvb_probability:
         # pick the RIR to reverberate the speech
         reverberate_opts += """--impulse-response="{0}" """.format(speech_rir.rir_rspecifier)
+        if corruption is not None:
+            corruption['rir'] = speech_rir.rir_rspecifier
 
     rir_iso_noise_list = []
     if speech_rir.room_id in iso_noise_dict:
@@ -277,6 +296,7 @@ def generate_reverberation_opts(room_dict,  # the room dictionary, please refer
             noise_addition_descriptor['noise_io'].append("wav-reverberate --duration={1} {0} - |".format(isotropic_noise.noise_rspecifier, speech_dur))
         else:
             noise_addition_descriptor['noise_io'].append("{0} wav-reverberate --duration={1} - - |".format(isotropic_noise.noise_rspecifier, speech_dur))
+        noise_addition_descriptor['noises'].append({'wav': isotropic_noise.noise_rspecifier, 'duration': speech_dur})
         noise_addition_descriptor['start_times'].append(0)
         noise_addition_descriptor['snrs'].append(next(background_snrs))
 
@@ -297,6 +317,11 @@ def generate_reverberation_opts(room_dict,  # the room dictionary, please refer
         reverberate_opts += "--start-times='{0}' ".format(','.join([str(x) for x in noise_addition_descriptor['start_times']]))
         reverberate_opts += "--snrs='{0}' ".format(','.join([str(x) for x in noise_addition_descriptor['snrs']]))
 
+    if corruption is not None:
+        corruption['noises'] = list(zip(noise_addition_descriptor['noises'],
+                                        noise_addition_descriptor['start_times'],
+                                        noise_addition_descriptor['snrs']))
+
     return reverberate_opts
 
 def get_new_id(id, prefix=None, copy=0):
@@ -327,16 +352,20 @@ def generate_reverberated_wav_scp(wav_scp,  # a dictionary whose values are the
                                shift_output, # option whether to shift the output waveform
                                isotropic_noise_addition_probability, # Probability of adding isotropic noises
                                pointsource_noise_addition_probability, # Probability of adding point-source noises
-                               max_noises_per_minute # maximum number of point-source noises that can be added to a recording according to its duration
+                               max_noises_per_minute, # maximum number of point-source noises that can be added to a recording according to its duration
+                               corruption_engine = None # if not None, the wav_corruption_lib.CorruptionEngine that writes the corrupted recordings
                                ):
     """ This is the main function to generate pipeline command for the corruption
         The generic command of wav-reverberate will be like:
         wav-reverberate --duration=t --impulse-response=rir.wav
         --additive-signals='noise1.wav,noise2.wav' --snrs='snr1,snr2' --start-times='s1,s2' input.wav output.wav
+        If corruption_engine is given, the corrupted recordings are instead written to
+        output_dir/wav.ark by the engine, and the wav.scp points into it.
     """
     foreground_snrs = list_cyclic_iterator(foreground_snr_array)
     background_snrs = list_cyclic_iterator(background_snr_array)
     corrupted_wav_scp = {}
+    corruption_tasks = []
     keys = sorted(wav_scp.keys())
     if include_original:
         start_index = 0
@@ -351,6 +380,7 @@ def generate_reverberated_wav_scp(wav_scp,  # a dictionary whose values are the
                 wav_original_pipe = "cat {0} |".format(wav_original_pipe)
             speech_dur = durations[recording_id]
             max_noises_recording = math.floor(max_noises_per_minute * speech_dur / 60)
+            corruption = {'shift_output': shift_output == "true"}
 
             reverberate_opts = generate_reverberation_opts(room_dict,  # the room dictionary, please refer to make_room_dict() for the format
                                                          pointsource_noise_list, # the point source noise list
@@ -361,7 +391,8 @@ def generate_reverberated_wav_scp(wav_scp,  # a dictionary whose values are the
                                                          isotropic_noise_addition_probability, # Probability of adding isotropic noises
                                                          pointsource_noise_addition_probability, # Probability of adding point-source noises
                                                          speech_dur,  # duration of the recording
-                                                         max_noises_recording  # Maximum number of point-source noises that can be added
+                                                         max_noises_recording,  # Maximum number of point-source noises that can be added
+                                                         corruption
                                                          )
 
             # prefix using index 0 is reserved for original data e.g. rvb0_swb0035 corresponds to the swb0035 recording in original data
@@ -372,6 +403,11 @@ def generate_reverberated_wav_scp(wav_scp,  # a dictionary whose values are the
 
             new_recording_id = get_new_id(recording_id, prefix, i)
             corrupted_wav_scp[new_recording_id] = wav_corrupted_pipe
+            if corruption_engine is not None and wav_corrupted_pipe != wav_original_pipe:
+                corruption_tasks.append((new_recording_id, wav_scp[recording_id], corruption))
+
+    if corruption_engine is not None:
+        corrupted_wav_scp.update(corruption_engine.write_archive(corruption_tasks, output_dir + "/wav.ark"))
 
     write_dict_to_file(corrupted_wav_scp, output_dir + "/wav.scp")
 
@@ -412,7 +448,8 @@ def create_reverberated_copy(input_dir,
                            shift_output, # option whether to shift the output waveform
                            isotropic_noise_addition_probability, # Probability of adding isotropic noises
                            pointsource_noise_addition_probability, # Probability of adding point-source noises
-                           max_noises_per_minute  # maximum number of point-source noises that can be added to a recording according to its duration
+                           max_noises_per_minute,  # maximum number of point-source noises that can be added to a recording according to its duration
+                           corruption_engine = None # the wav_corruption_lib.CorruptionEngine, if the recordings are corrupted by this script
                            ):
     """ This function creates multiple copies of the necessary files,
         e.g. utt2spk, wav.scp ...
@@ -430,7 +467,7 @@ def create_reverberated_copy(input_dir,
     generate_reverberated_wav_scp(wav_scp, durations, output_dir, room_dict, pointsource_noise_list, iso_noise_dict,
                foreground_snr_array, background_snr_array, num_replicas, include_original, prefix,
                speech_rvb_probability, shift_output, isotropic_noise_addition_probability,
-               pointsource_noise_addition_probability, max_noises_per_minute)
+               pointsource_noise_addition_probability, max_noises_per_minute, corruption_engine)
 
     add_prefix_to_fields(input_dir + "/utt2spk", output_dir + "/utt2spk", num_replicas, include_original, prefix, field = [0,1])
     data_lib.RunKaldiCommand("utils/utt2spk_to_spk2utt.pl <{output_dir}/utt2spk >{output_dir}/spk2utt"
@@ -658,6 +695,10 @@ def main():
         include_original = True
     else:
         include_original = False
+
+    corruption_engine = None
+    if args.corruption_engine == "python":
+        corruption_engine = corruption_lib.CorruptionEngine(num_jobs = args.num_jobs)
     create_reverberated_copy(input_dir = args.input_dir,
                            output_dir = args.output_dir,
                            room_dict = room_dict,
@@ -672,7 +713,8 @@ def main():
                            shift_output = args.shift_output,
                            isotropic_noise_addition_probability = args.isotropic_noise_addition_probability,
                            pointsource_noise_addition_probability = args.pointsource_noise_addition_probability,
-                           max_noises_per_minute = args.max_noises_per_minute)
+                           max_noises_per_minute = args.max_noises_per_minute,
+                           corruption_engine = corruption_engine)
 
 
     data_lib.RunKaldiCommand("utils/validate_data_dir.sh --no-feats --no-text {output_dir}"
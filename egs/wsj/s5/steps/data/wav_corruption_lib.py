@@ -0,0 +1,440 @@
+# Apache 2.0
+#
+# This module is an in-process replacement for the 'wav-reverberate' pipelines
+# that steps/data/reverberate_data_dir.py and steps/data/augment_data_dir.py
+# write to wav.scp.  It does the same computation as src/featbin/wav-reverberate.cc
+# (FFT-based block convolution with the RIR, additive noises scaled to the
+# requested SNR relative to the early-reverberation energy, output
+# normalization and 16-bit quantization), but with numpy, so that
+#  - each source recording is read only once for all its corrupted copies,
+#  - the RIRs and noises are read only once, into a cache that is shared
+#    (copy-on-write) by the worker processes, and
+#  - the corrupted audio is written directly to a wav archive, with a wav.scp
+#    that points into it, instead of being recomputed by every job that reads
+#    the data directory.
+#
+# The corruption of a recording is given by a "descriptor", a dict with the
+# following keys, which corresponds to the options of wav-reverberate:
+#   'rir': the rspecifier of the impulse response, or None,
+#   'duration': the duration of the output in seconds, or 0 to keep the length,
+#   'shift_output': as --shift-output,
+#   'noises': a list of (noise, start_time, snr) tuples, where 'noise' is the
+#             rspecifier of a noise, or itself a descriptor (with an extra key
+#             'wav' for its rspecifier) if the noise is reverberated or
+#             extended, i.e. if wav-reverberate is applied to it first.
+# The results can differ from wav-reverberate by a few least-significant bits
+# because the FFTs are computed in a different order.
+
+from __future__ import print_function
+from __future__ import division
+import io
+import math
+import multiprocessing
+import os
+import re
+import struct
+import subprocess
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def read_wav(fd):
+    """ Reads a wav file (16-bit PCM) from the binary file object 'fd' the way
+        kaldi's WaveData::Read() does, and returns a tuple (samp_freq, data),
+        where 'data' is a float32 array of shape (num_channels, num_samples)
+        with the samples as integer values.  A RIFF header without proper
+        sizes (e.g. written by sox to a pipe) means that the data extends to
+        the end of the stream.
+    """
+    def read_exactly(num_bytes):
+        buf = fd.read(num_bytes)
+        if len(buf) != num_bytes:
+            raise Exception("Unexpected end of wav file")
+        return buf
+
+    tag = read_exactly(4)
+    if tag == b"RIFF":
+        endian = "<"
+    elif tag == b"RIFX":
+        endian = ">"
+    else:
+        raise Exception("Expected RIFF or RIFX, got {0}".format(tag))
+    riff_chunk_size = struct.unpack(endian + "I", read_exactly(4))[0]
+    if read_exactly(4) != b"WAVE":
+        raise Exception("Expected WAVE in wav header")
+
+    tag = read_exactly(4)
+    while tag != b"fmt ":
+        size = struct.unpack(endian + "I", read_exactly(4))[0]
+        read_exactly(size)
+        tag = read_exactly(4)
+    fmt_size = struct.unpack(endian + "I", read_exactly(4))[0]
+    if fmt_size < 16:
+        raise Exception("Expected PCM format data to have fmt chunk "
+                        "of at least size 16")
+    (audio_format, num_channels, samp_freq, byte_rate, block_align,
+     bits_per_sample) = struct.unpack(endian + "HHIIHH", read_exactly(16))
+    read_exactly(fmt_size - 16)
+    if audio_format not in [1, 0xFFFE]:
+        raise Exception("Can read only PCM data, format id in file is: "
+                        "{0}".format(audio_format))
+    if num_channels == 0:
+        raise Exception("No channels present in wav file")
+    if bits_per_sample != 16:
+        raise Exception("Unsupported bits_per_sample = {0}".format(
+            bits_per_sample))
+
+    tag = read_exactly(4)
+    while tag != b"data":
+        size = struct.unpack(endian + "I", read_exactly(4))[0]
+        read_exactly(size)
+        tag = read_exactly(4)
+    data_chunk_size = struct.unpack(endian + "I", read_exactly(4))[0]
+
+    is_stream_mode = (riff_chunk_size in [0, 0xFFFFFFFF]
+                      or data_chunk_size in [0, 0xFFFFFFFF, 0x7FFFF000])
+    buf = fd.read() if is_stream_mode else fd.read(data_chunk_size)
+    if len(buf) == 0:
+        raise Exception("Empty wav file (no data)")
+    num_samples = len(buf) // block_align
+    data = np.frombuffer(buf, dtype=endian + "i2",
+                         count=num_samples * num_channels)
+    data = data.reshape(num_samples, num_channels).T.astype(np.float32)
+    return float(samp_freq), data
+
+
+g_offset_regex = re.compile(r"^(.+):([0-9]+)$")
+
+
+def read_wav_rxfilename(rxfilename):
+    """ Reads the wav file given by the kaldi rxfilename 'rxfilename', i.e. a
+        file name, a file name with a byte offset (e.g. "foo.ark:1234") or a
+        command whose output is the wav file (e.g. "sox foo.wav -t wav - |").
+    """
+    rxfilename = rxfilename.strip()
+    if rxfilename.endswith("|"):
+        p = subprocess.Popen(rxfilename[:-1], shell=True,
+                             stdout=subprocess.PIPE)
+        try:
+            wav = read_wav(p.stdout)
+            # read the rest, if any, so that the command does not get SIGPIPE.
+            p.stdout.read()
+        finally:
+            p.stdout.close()
+            p.wait()
+        if p.returncode != 0:
+            raise Exception("Command exited with status {0}: {1}".format(
+                p.returncode, rxfilename))
+        return wav
+    if rxfilename == "-":
+        return read_wav(sys.stdin.buffer)
+    offset = 0
+    m = g_offset_regex.match(rxfilename)
+    if m is not None and not os.path.exists(rxfilename):
+        rxfilename, offset = m.group(1), int(m.group(2))
+    with open(rxfilename, 'rb') as f:
+        f.seek(offset)
+        return read_wav(f)
+
+
+def write_wav(fd, samp_freq, data):
+    """ Writes the single-channel signal 'data' as a 16-bit PCM wav file to
+        the binary file object 'fd', the way kaldi's WaveData::Write() does
+        (i.e. truncating the samples and clipping them to the int16 range).
+    """
+    samples = quantize(data).astype('<i2')
+    subchunk2size = 2 * samples.size
+    fd.write(b"RIFF" + struct.pack("<I", 36 + subchunk2size) + b"WAVE"
+             + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, int(samp_freq),
+                                     int(samp_freq) * 2, 2, 16)
+             + b"data" + struct.pack("<I", subchunk2size))
+    fd.write(samples.tobytes())
+
+
+def quantize(data):
+    """ Returns 'data' truncated and clipped to int16 values, as they are
+        when written to a wav file. """
+    return np.clip(np.trunc(data), -32768, 32767).astype(np.int16)
+
+
+def round_up_to_nearest_power_of_two(n):
+    ans = 1
+    while ans < n:
+        ans *= 2
+    return ans
+
+
+class Filter(object):
+    """ An FIR filter (e.g. an RIR) together with the FFT of its zero-padded
+        samples, as used by fft_block_convolve(). """
+
+    def __init__(self, samples):
+        self.samples = np.asarray(samples, dtype=np.float32)
+        self.length = len(self.samples)
+        # the FFT length and block length are as in
+        # FFTbasedBlockConvolveSignals() in src/feat/signal.cc.
+        self.fft_length = round_up_to_nearest_power_of_two(4 * self.length)
+        self.block_length = self.fft_length - self.length + 1
+        self.spectrum = np.fft.rfft(self.samples, self.fft_length)
+
+
+# The number of blocks that are transformed together in
+# fft_block_convolve(); this bounds the memory used for long recordings.
+g_blocks_per_batch = 1024
+
+
+def fft_block_convolve(fir, signal):
+    """ Returns the convolution of 'signal' with the Filter 'fir', whose
+        length is len(signal) + fir.length - 1; it is computed with the
+        overlap-add method, with the FFTs of many blocks computed at once.
+    """
+    signal = np.asarray(signal, dtype=np.float32)
+    output_length = len(signal) + fir.length - 1
+    block_length = fir.block_length
+    tail_length = fir.length - 1
+    num_blocks = (len(signal) + block_length - 1) // block_length
+    output = np.zeros((num_blocks + 1) * block_length, dtype=np.float32)
+    for start in range(0, num_blocks, g_blocks_per_batch):
+        end = min(num_blocks, start + g_blocks_per_batch)
+        blocks = np.zeros((end - start) * block_length, dtype=np.float32)
+        piece = signal[start * block_length:end * block_length]
+        blocks[:len(piece)] = piece
+        blocks = np.fft.irfft(
+            np.fft.rfft(blocks.reshape(end - start, block_length),
+                        fir.fft_length, axis=1) * fir.spectrum,
+            fir.fft_length, axis=1)
+        # Each block contributes its first block_length samples to its own
+        # position and its last fir.length - 1 samples to the next block.
+        output[start * block_length:end * block_length] += (
+            blocks[:, :block_length].ravel())
+        if tail_length > 0:
+            tails = np.zeros((end - start, block_length), dtype=np.float32)
+            tails[:, :tail_length] = blocks[:, block_length:]
+            output[(start + 1) * block_length:(end + 1) * block_length] += (
+                tails.ravel())
+    return output[:output_length]
+
+
+class Rir(object):
+    """ An impulse response, stored as the filters needed by reverberate():
+        the whole RIR, scaled as in wav-reverberate, and its early part
+        (from 1ms before to 50ms after the peak), which is used to compute
+        the energy of the early reverberation. """
+
+    def __init__(self, samp_freq, samples):
+        self.samp_freq = samp_freq
+        rir = np.asarray(samples, dtype=np.float32) * np.float32(1.0 / (1 << 15))
+        self.peak_index = int(np.argmax(rir))
+        start = max(0, int(self.peak_index
+                           - np.float32(0.001) * np.float32(samp_freq)))
+        end = min(len(rir), int(self.peak_index
+                                + np.float32(0.05) * np.float32(samp_freq)))
+        self.filter = Filter(rir)
+        self.early_filter = Filter(rir[start:end])
+
+
+def _power(signal):
+    return float(np.dot(signal, signal)) / len(signal)
+
+
+def reverberate(signal, samp_freq, rir=None, noises=(), snrs=(),
+                start_times=(), shift_output=True, duration=0,
+                normalize_output=True):
+    """ Does what wav-reverberate does to the single-channel signal 'signal',
+        and returns the output signal (not yet quantized).  'rir' is a Rir
+        object or None, 'noises' a list of single-channel signals that are
+        added with the SNRs (in dB) in 'snrs' at the times (in seconds) in
+        'start_times'.
+    """
+    signal = np.asarray(signal, dtype=np.float32)
+    num_samp_input = len(signal)
+    if duration > 0:
+        num_samp_output = int(np.float32(samp_freq) * np.float32(duration))
+    elif shift_output or rir is None:
+        num_samp_output = num_samp_input
+    else:
+        num_samp_output = num_samp_input + rir.filter.length - 1
+
+    power_before_reverb = _power(signal)
+    early_energy = power_before_reverb
+    shift_index = 0
+    if rir is not None:
+        if rir.samp_freq != samp_freq:
+            raise Exception("The sampling rate of the RIR ({0}) differs from "
+                            "that of the signal ({1})".format(rir.samp_freq,
+                                                              samp_freq))
+        early_energy = _power(fft_block_convolve(rir.early_filter, signal))
+        signal = fft_block_convolve(rir.filter, signal)
+        if shift_output:
+            shift_index = rir.peak_index
+    else:
+        signal = signal.copy()
+
+    for noise, snr, start_time in zip(noises, snrs, start_times):
+        scale = math.sqrt(10 ** (-snr / 10.0) * early_energy / _power(noise))
+        offset = int(np.float32(start_time) * np.float32(samp_freq))
+        add_length = min(len(signal) - offset, len(noise))
+        if add_length > 0:
+            signal[offset:offset + add_length] += (
+                np.float32(scale) * noise[:add_length])
+
+    if normalize_output:
+        signal *= np.float32(math.sqrt(power_before_reverb / _power(signal)))
+
+    if num_samp_output <= num_samp_input:
+        return signal[shift_index:shift_index + num_samp_output]
+    # repeat the signal to fill up the duration
+    return np.resize(signal[shift_index:shift_index + num_samp_input],
+                     num_samp_output)
+
+
+def get_rspecifiers(descriptor):
+    """ Returns a tuple (rirs, noises) with the sets of rspecifiers of the
+        RIRs and of the (non-reverberated) noises used in 'descriptor'. """
+    rirs = set()
+    noises = set()
+    if descriptor.get('rir') is not None:
+        rirs.add(descriptor['rir'])
+    for noise, start_time, snr in descriptor.get('noises', []):
+        if isinstance(noise, dict):
+            noises.add(noise['wav'])
+            sub_rirs, sub_noises = get_rspecifiers(noise)
+            rirs.update(sub_rirs)
+            noises.update(sub_noises)
+        else:
+            noises.add(noise)
+    return rirs, noises
+
+
+class CorruptionEngine(object):
+    """ Applies corruption descriptors (see the top of this file) to
+        recordings, with the RIRs and noises read once and cached.
+
+        e.g.:
+            engine = CorruptionEngine(num_jobs=4)
+            engine.load(descriptors)
+            engine.write_archive(tasks, "data/train_rvb/wav.ark")
+    """
+
+    def __init__(self, num_jobs=1):
+        if np is None:
+            raise Exception("numpy is required for the in-process "
+                            "corruption engine")
+        self.num_jobs = num_jobs
+        self.rirs = {}
+        self.noises = {}
+
+    def load(self, descriptors):
+        """ Reads the RIRs and noises used by 'descriptors' that are not
+            cached yet. """
+        rirs = set()
+        noises = set()
+        for descriptor in descriptors:
+            if descriptor is not None:
+                this_rirs, this_noises = get_rspecifiers(descriptor)
+                rirs.update(this_rirs)
+                noises.update(this_noises)
+        for rspecifier in sorted(rirs - set(self.rirs.keys())):
+            samp_freq, data = read_wav_rxfilename(rspecifier)
+            self.rirs[rspecifier] = Rir(samp_freq, data[0])
+        for rspecifier in sorted(noises - set(self.noises.keys())):
+            samp_freq, data = read_wav_rxfilename(rspecifier)
+            self.noises[rspecifier] = (samp_freq, data[0])
+
+    def _get_noise(self, noise, samp_freq):
+        if isinstance(noise, dict):
+            noise_samp_freq, signal = self.noises[noise['wav']]
+            signal = self.corrupt(signal, noise_samp_freq, noise)
+            # the output of the inner wav-reverberate goes through a wav
+            # file.
+            signal = quantize(signal).astype(np.float32)
+        else:
+            noise_samp_freq, signal = self.noises[noise]
+        if noise_samp_freq != samp_freq:
+            raise Exception("The sampling rate of the noise ({0}) differs "
+                            "from that of the signal ({1})".format(
+                                noise_samp_freq, samp_freq))
+        return signal
+
+    def corrupt(self, signal, samp_freq, descriptor):
+        """ Returns the single-channel 'signal' corrupted as specified by
+            'descriptor'. """
+        rir = (self.rirs[descriptor['rir']]
+               if descriptor.get('rir') is not None else None)
+        noises = descriptor.get('noises', [])
+        return reverberate(
+            signal, samp_freq, rir=rir,
+            noises=[self._get_noise(x[0], samp_freq) for x in noises],
+            start_times=[x[1] for x in noises],
+            snrs=[x[2] for x in noises],
+            shift_output=descriptor.get('shift_output', True),
+            duration=descriptor.get('duration', 0))
+
+    def corrupt_recording(self, wav, items):
+        """ Reads the recording with rxfilename 'wav' once, and returns a
+            list of (key, wav-file-contents) for each (key, descriptor) in
+            'items'. """
+        samp_freq, data = read_wav_rxfilename(wav)
+        output = []
+        for key, descriptor in items:
+            buf = io.BytesIO()
+            write_wav(buf, samp_freq,
+                      self.corrupt(data[0], samp_freq, descriptor))
+            output.append((key, buf.getvalue()))
+        return output
+
+    def write_archive(self, tasks, ark_file):
+        """ Corrupts the recordings and writes them to the wav archive
+            'ark_file'.  'tasks' is a list of (key, wav, descriptor), where
+            'key' is the id of the corrupted recording and 'wav' the
+            rxfilename of the original recording; the tasks are grouped by
+            'wav', and the groups are processed by self.num_jobs processes.
+            Returns a dict from each key to the rxfilename of the corrupted
+            recording in the archive (e.g. "wav.ark:1234"), for wav.scp.
+        """
+        self.load([descriptor for key, wav, descriptor in tasks])
+        groups = {}
+        order = []
+        for key, wav, descriptor in tasks:
+            if wav not in groups:
+                groups[wav] = []
+                order.append(wav)
+            groups[wav].append((key, descriptor))
+
+        global g_engine
+        g_engine = self
+        key2rxfilename = {}
+        with open(ark_file, 'wb') as f:
+            jobs = [(wav, groups[wav]) for wav in order]
+            if self.num_jobs > 1:
+                # Using 'fork' makes the workers share the cached RIRs and
+                # noises with this process instead of copying them.
+                pool = multiprocessing.get_context("fork").Pool(self.num_jobs)
+                results = pool.imap(_corrupt_recording, jobs)
+            else:
+                pool = None
+                results = map(_corrupt_recording, jobs)
+            try:
+                for output in results:
+                    for key, wav_data in output:
+                        f.write("{0} ".format(key).encode())
+                        key2rxfilename[key] = "{0}:{1}".format(ark_file,
+                                                               f.tell())
+                        f.write(wav_data)
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+        return key2rxfilename
+
+
+g_engine = None
+
+
+def _corrupt_recording(job):
+    wav, items = job
+    return g_engine.corrupt_recording(wav, items)
@@ -8,10 +8,12 @@ from __future__ import print_function
 from __future__ import division
 import argparse
 import sys, os
-from collections import defaultdict
 from io import open
 import codecs
 
+sys.path.insert(0, 'steps')
+import libs.diagnostic_stats as diagnostic_stats
+
 # reference: http://www.macfreek.nl/memory/Encoding_of_Python_stdout
 if sys.version_info.major == 2:
     sys.stdout = codecs.getwriter('utf-8')(sys.stdout, 'strict')
@@ -30,151 +32,139 @@ parser.add_argument("--frequency-cutoff-percentage", type = float,
                     "(between 0 and 100), of frequency at which we print stats "
                     "for a phone.")
 
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help="Number of processes used to read the stats files, if "
+                    "more than one is given.")
+
 parser.add_argument("lang",
                     help="Language directory, e.g. data/lang.")
 
-args = parser.parse_args()
-
-# set up phone_int2text to map from phone to printed form.
-phone_int2text = {}
-try:
-    f = open(args.lang + "/phones.txt", "r", encoding='utf-8')
-    for line in f.readlines():
-        [ word, number] = line.split()
-        phone_int2text[int(number)] = word
-    f.close()
-except:
-    sys.exit(u"analyze_lattice_depth_stats.py: error opening or reading {0}/phones.txt".format(
-            args.lang))
-# this is a special case... for begin- and end-of-sentence stats,
-# we group all nonsilence phones together.
-phone_int2text[0] = 'nonsilence'
-
-# populate the set and 'nonsilence', which will contain the integer phone-ids of
-# nonsilence phones (and disambig phones, which won't matter).
-nonsilence = set(phone_int2text.keys())
-nonsilence.remove(0)
-try:
-    # open lang/phones/silence.csl-- while there are many ways of obtaining the
-    # silence/nonsilence phones, we read this because it's present in graph
-    # directories as well as lang directories.
-    filename = u"{0}/phones/silence.csl".format(args.lang)
-    f = open(filename, "r")
-    line = f.readline()
-    for silence_phone in line.split(":"):
-        nonsilence.remove(int(silence_phone))
-    f.close()
-except Exception as e:
-    sys.exit(u"analyze_lattice_depth_stats.py: error processing {0}/phones/silence.csl: {1}".format(
-            args.lang, str(e)))
-
-# phone_depth_counts is a dict of dicts.
-# for each integer phone-id 'phone',
-# phone_depth_counts[phone] is a map from depth to count (of frames on which
-# that was the 1-best phone in the alignment, and the lattice depth
-# had that value).  So we'd access it as
-# count = phone_depth_counts[phone][depth].
-
-phone_depth_counts = dict()
-
-# note: -1 is for all phones put in one bucket.
-for p in [ -1 ] + list(phone_int2text.keys()):
-    phone_depth_counts[p] = defaultdict(int)
-
-total_frames = 0
-
-while True:
-    line = sys.stdin.readline()
-    if line == '':
-        break
-    a = line.split()
-    if len(a) != 3:
-        sys.exit(u"analyze_lattice_depth_stats.py: reading stdin, could not interpret line: " + line)
+parser.add_argument("stats_files", nargs = "*", default = [ "-" ],
+                    help="Files of stats, as lines 'phone lattice-depth count' "
+                    "(by default, the standard input); files ending in .gz are "
+                    "decompressed.  The stats of all the files are summed.")
+
+
+# Returns the stats in the file 'f' (opened in binary mode) as a
+# diagnostic_stats.CountHistograms keyed by phone, with histograms of lattice
+# depths.
+def AccumulateDepthStats(f):
+    stats = diagnostic_stats.CountHistograms()
+    for fields in diagnostic_stats.read_int_fields(f, 3):
+        stats.add(fields[:, 0], fields[:, 1], fields[:, 2])
+    return stats
+
+
+def Main():
+    args = parser.parse_args()
+
+    # set up phone_int2text to map from phone to printed form.
+    phone_int2text = {}
+    try:
+        f = open(args.lang + "/phones.txt", "r", encoding='utf-8')
+        for line in f.readlines():
+            [ word, number] = line.split()
+            phone_int2text[int(number)] = word
+        f.close()
+    except:
+        sys.exit(u"analyze_lattice_depth_stats.py: error opening or reading {0}/phones.txt".format(
+                args.lang))
+    # this is a special case... for begin- and end-of-sentence stats,
+    # we group all nonsilence phones together.
+    phone_int2text[0] = 'nonsilence'
+
+    # populate the set and 'nonsilence', which will contain the integer phone-ids of
+    # nonsilence phones (and disambig phones, which won't matter).
+    nonsilence = set(phone_int2text.keys())
+    nonsilence.remove(0)
+    try:
+        # open lang/phones/silence.csl-- while there are many ways of obtaining the
+        # silence/nonsilence phones, we read this because it's present in graph
+        # directories as well as lang directories.
+        filename = u"{0}/phones/silence.csl".format(args.lang)
+        f = open(filename, "r")
+        line = f.readline()
+        for silence_phone in line.split(":"):
+            nonsilence.remove(int(silence_phone))
+        f.close()
+    except Exception as e:
+        sys.exit(u"analyze_lattice_depth_stats.py: error processing {0}/phones/silence.csl: {1}".format(
+                args.lang, str(e)))
+
+    # stats is a diagnostic_stats.CountHistograms: for each integer phone-id
+    # 'phone' seen in the input, stats.histogram(phone) is an array indexed by
+    # depth of the counts (of frames on which that was the 1-best phone in the
+    # alignment, and the lattice depth had that value).
+    stats = diagnostic_stats.CountHistograms()
     try:
-        phone, depth, count = [ int(x) for x in a ]
-
-        phone_depth_counts[phone][depth] += count
-        total_frames += count
-        if phone in nonsilence:
-            nonsilence_phone = 0
-            phone_depth_counts[nonsilence_phone][depth] += count
-        universal_phone = -1
-        phone_depth_counts[universal_phone][depth] += count
+        for file_stats in diagnostic_stats.accumulate_files(
+                args.stats_files, AccumulateDepthStats, args.num_jobs):
+            stats.merge(file_stats)
+    except diagnostic_stats.BadLineError as e:
+        sys.exit(u"analyze_lattice_depth_stats.py: reading stdin, could not interpret line: " + e.line)
     except Exception as e:
-        sys.exit(u"analyze_lattice_depth_stats.py: unexpected phone {0} "
-                 u"seen (lang directory mismatch?): line is {1}, error is {2}".format(phone, line, str(e)))
-
-if total_frames == 0:
-    sys.exit(u"analyze_lattice_depth_stats.py: read no input")
-
-
-# If depth_to_count is a map from depth-in-frames to count,
-# return the depth-in-frames that equals the (fraction * 100)'th
-# percentile of the distribution.
-def GetPercentile(depth_to_count, fraction):
-    this_total_frames = sum(depth_to_count.values())
-    if this_total_frames == 0:
-        return 0
-    else:
-        items = sorted(depth_to_count.items())
-        count_cutoff = int(fraction * this_total_frames)
-        cur_count_total = 0
-        for depth,count in items:
-            assert count >= 0
-            cur_count_total += count
-            if cur_count_total >= count_cutoff:
-                return depth
-        assert false # we shouldn't reach here.
-
-def GetMean(depth_to_count):
-    this_total_frames = sum(depth_to_count.values())
-    if this_total_frames == 0:
-        return 0.0
-    this_total_depth = sum([ float(l * c) for l,c in depth_to_count.items() ])
-    return this_total_depth / this_total_frames
-
-
-print(u"The total amount of data analyzed assuming 100 frames per second "
-      u"is {0} hours".format("%.1f" % (total_frames / 360000.0)))
-
-# the next block prints lines like (to give some examples):
-# Nonsilence phones as a group account for 74.4% of phone occurrences, with lattice depth (10,50,90-percentile)=(1,2,7) and mean=3.1
-# Phone SIL accounts for 25.5% of phone occurrences, with lattice depth (10,50,90-percentile)=(1,1,4) and mean=2.5
-# Phone Z_E accounts for 2.5% of phone occurrences, with lattice depth (10,50,90-percentile)=(1,2,6) and mean=2.9
-# ...
-
-
-# sort the phones in decreasing order of count.
-for phone,depths in sorted(phone_depth_counts.items(), key = lambda x : -sum(x[1].values())):
-
-    frequency_percentage = sum(depths.values()) * 100.0 / total_frames
-    if frequency_percentage < args.frequency_cutoff_percentage:
-        continue
-
-
-    depth_percentile_10 = GetPercentile(depths, 0.1)
-    depth_percentile_50 = GetPercentile(depths, 0.5)
-    depth_percentile_90 = GetPercentile(depths, 0.9)
-    depth_mean = GetMean(depths)
-
-    if phone > 0:
-        try:
+        sys.exit(u"analyze_lattice_depth_stats.py: error reading stats: " + str(e))
+
+    for phone in stats.keys:
+        if phone not in phone_int2text:
+            sys.exit(u"analyze_lattice_depth_stats.py: unexpected phone {0} "
+                     u"seen (lang directory mismatch?)".format(phone))
+
+    # phone_depth_counts is a dict from each integer phone-id 'phone' to the
+    # histogram of depths for it, i.e. an array indexed by depth.
+    # note: -1 is for all phones put in one bucket, and 0 for all the nonsilence
+    # phones.
+    phone_depth_counts = dict()
+    phone_depth_counts[-1] = stats.total_histogram()
+    for p in phone_int2text.keys():
+        if p == 0:
+            phone_depth_counts[p] = stats.sum_histograms([ 0 ] + sorted(nonsilence))
+        else:
+            phone_depth_counts[p] = stats.histogram(p)
+
+    total_frames = int(phone_depth_counts[-1].sum())
+    if total_frames == 0:
+        sys.exit(u"analyze_lattice_depth_stats.py: read no input")
+
+    print(u"The total amount of data analyzed assuming 100 frames per second "
+          u"is {0} hours".format("%.1f" % (total_frames / 360000.0)))
+
+    # the next block prints lines like (to give some examples):
+    # Nonsilence phones as a group account for 74.4% of phone occurrences, with lattice depth (10,50,90-percentile)=(1,2,7) and mean=3.1
+    # Phone SIL accounts for 25.5% of phone occurrences, with lattice depth (10,50,90-percentile)=(1,1,4) and mean=2.5
+    # Phone Z_E accounts for 2.5% of phone occurrences, with lattice depth (10,50,90-percentile)=(1,2,6) and mean=2.9
+    # ...
+
+    # sort the phones in decreasing order of count.
+    for phone,depths in sorted(phone_depth_counts.items(), key = lambda x : -int(x[1].sum())):
+
+        frequency_percentage = int(depths.sum()) * 100.0 / total_frames
+        if frequency_percentage < args.frequency_cutoff_percentage:
+            continue
+
+        depth_percentile_10 = diagnostic_stats.get_percentile(depths, 0.1)
+        depth_percentile_50 = diagnostic_stats.get_percentile(depths, 0.5)
+        depth_percentile_90 = diagnostic_stats.get_percentile(depths, 0.9)
+        depth_mean = diagnostic_stats.get_mean(depths)
+
+        if phone > 0:
             phone_text = phone_int2text[phone]
-        except:
-            sys.exit(u"analyze_lattice_depth_stats.py: phone {0} is not covered on phones.txt "
-                     u"(lang/alignment mismatch?)".format(phone))
-        preamble = u"Phone {phone_text} accounts for {percent}% of frames, with".format(
-            phone_text = phone_text, percent = "%.1f" % frequency_percentage)
-    elif phone == 0:
-        preamble = u"Nonsilence phones as a group account for {percent}% of frames, with".format(
-            percent = "%.1f" % frequency_percentage)
-    else:
-        assert phone == -1
-        preamble = "Overall,";
-
-    print(u"{preamble} lattice depth (10,50,90-percentile)=({p10},{p50},{p90}) and mean={mean}".format(
-            preamble = preamble,
-            p10 = depth_percentile_10,
-            p50 = depth_percentile_50,
-            p90 = depth_percentile_90,
-            mean = "%.1f" % depth_mean))
+            preamble = u"Phone {phone_text} accounts for {percent}% of frames, with".format(
+                phone_text = phone_text, percent = "%.1f" % frequency_percentage)
+        elif phone == 0:
+            preamble = u"Nonsilence phones as a group account for {percent}% of frames, with".format(
+                percent = "%.1f" % frequency_percentage)
+        else:
+            assert phone == -1
+            preamble = "Overall,";
+
+        print(u"{preamble} lattice depth (10,50,90-percentile)=({p10},{p50},{p90}) and mean={mean}".format(
+                preamble = preamble,
+                p10 = depth_percentile_10,
+                p50 = depth_percentile_50,
+                p90 = depth_percentile_90,
+                mean = "%.1f" % depth_mean))
+
+
+if __name__ == "__main__":
+    Main()
@@ -7,5 +7,6 @@
 """
 
 from . import common
+from . import matrix_io
 
-__all__ = ["common"]
+__all__ = ["common", "matrix_io"]
@@ -12,6 +12,7 @@ commonly used in many kaldi python scripts.
 from __future__ import print_function
 from __future__ import division
 import argparse
+import hashlib
 import logging
 import math
 import os
@@ -19,6 +20,9 @@ import subprocess
 import sys
 import threading
 
+from . import kaldi_info
+from . import matrix_io
+
 try:
     import thread as thread_module
 except:
@@ -194,7 +198,7 @@ def wait_for_background_commands():
         if not t == threading.current_thread():
             t.join()
 
-def background_command(command, require_zero_status = False):
+def background_command(command, require_zero_status = False, runner = None):
     """Executes a command in a separate thread, like running with '&' in the shell.
        If you want the program to die if the command eventually returns with
        nonzero status, then set require_zero_status to True.  'command' will be
@@ -212,9 +216,22 @@ def background_command(command, require_zero_status = False):
            at the end of the program to wait for all these commands to terminate.
          - execute_command() and get_command_stdout(), which allow you to
            execute commands in the foreground.
-
+         - libs/job_runner.py, which is more suitable for launching a group
+           of jobs that should all succeed (e.g. parallel training jobs): it
+           limits the number of jobs run at once, kills the remaining jobs if
+           one fails, and records the wall time of each job.
+
+       If 'runner' (a libs.job_runner.JobRunner) is specified, the command is
+       submitted to it instead of being started in a thread of its own, and
+       the Job object is returned instead of the Thread object; the command
+       may then wait for a free slot if the runner limits the number of jobs
+       running at once.
     """
 
+    if runner is not None:
+        return runner.submit(command,
+                             require_zero_status=require_zero_status)
+
     p = subprocess.Popen(command, shell=True)
     thread = threading.Thread(target=background_command_waiter,
                               args=(command, p, require_zero_status))
@@ -242,23 +259,35 @@ def background_command_waiter(command, popen_object, require_zero_status):
 
 
 def get_number_of_leaves_from_tree(alidir):
-    stdout = get_command_stdout(
-        "tree-info {0}/tree 2>/dev/null | grep num-pdfs".format(alidir))
-    parts = stdout.split()
-    assert(parts[0] == "num-pdfs")
-    num_leaves = int(parts[1])
+    try:
+        num_leaves = kaldi_info.get_num_pdfs_from_tree(
+            "{0}/tree".format(alidir))
+    except Exception as e:
+        logger.debug("Could not read {0}/tree directly ({1}); using "
+                     "tree-info".format(alidir, str(e)))
+        stdout = get_command_stdout(
+            "tree-info {0}/tree 2>/dev/null | grep num-pdfs".format(alidir))
+        parts = stdout.split()
+        assert(parts[0] == "num-pdfs")
+        num_leaves = int(parts[1])
     if num_leaves == 0:
         raise Exception("Number of leaves is 0")
     return num_leaves
 
 
 def get_number_of_leaves_from_model(dir):
-    stdout = get_command_stdout(
-        "am-info {0}/final.mdl 2>/dev/null | grep -w pdfs".format(dir))
-    parts = stdout.split()
-    # number of pdfs 7115
-    assert(' '.join(parts[0:3]) == "number of pdfs")
-    num_leaves = int(parts[3])
+    try:
+        num_leaves = kaldi_info.get_num_pdfs_from_model(
+            "{0}/final.mdl".format(dir))
+    except Exception as e:
+        logger.debug("Could not read {0}/final.mdl directly ({1}); using "
+                     "am-info".format(dir, str(e)))
+        stdout = get_command_stdout(
+            "am-info {0}/final.mdl 2>/dev/null | grep -w pdfs".format(dir))
+        parts = stdout.split()
+        # number of pdfs 7115
+        assert(' '.join(parts[0:3]) == "number of pdfs")
+        num_leaves = int(parts[3])
     if num_leaves == 0:
         raise Exception("Number of leaves is 0")
     return num_leaves
@@ -274,48 +303,84 @@ def get_number_of_jobs(alidir):
     return num_jobs
 
 
+def get_feat_dim_from_scp(feat_scp):
+    try:
+        return kaldi_info.get_matrix_dim_from_scp(feat_scp)
+    except Exception as e:
+        logger.debug("Could not read the dimension of {0} directly ({1}); "
+                     "using feat-to-dim".format(feat_scp, str(e)))
+    stdout_val = get_command_stdout(
+        "feat-to-dim --print-args=false "
+        "scp:{feat_scp} -".format(feat_scp=feat_scp))
+    feat_dim = int(stdout_val)
+    return feat_dim
+
+
 def get_ivector_dim(ivector_dir=None):
     if ivector_dir is None:
         return 0
-    stdout_val = get_command_stdout(
-        "feat-to-dim --print-args=false "
-        "scp:{dir}/ivector_online.scp -".format(dir=ivector_dir))
-    ivector_dim = int(stdout_val)
-    return ivector_dim
+    return get_feat_dim_from_scp(
+        "{dir}/ivector_online.scp".format(dir=ivector_dir))
 
 def get_ivector_extractor_id(ivector_dir=None):
+    """Returns the id of the ivector extractor in ivector_dir, like
+    steps/nnet2/get_ivector_id.sh: the contents of final.ie.id if it exists,
+    otherwise the md5sum of final.ie (which is then written to final.ie.id,
+    if possible); None if there is neither."""
     if ivector_dir is None:
         return None
-    stdout_val = get_command_stdout(
-        "steps/nnet2/get_ivector_id.sh {dir}".format(dir=ivector_dir))
+    id_file = "{dir}/final.ie.id".format(dir=ivector_dir)
+    extractor = "{dir}/final.ie".format(dir=ivector_dir)
+    if os.path.isfile(id_file):
+        with open(id_file) as f:
+            ivector_id = f.read().strip()
+    elif os.path.isfile(extractor):
+        md5 = hashlib.md5()
+        with open(extractor, 'rb') as f:
+            while True:
+                block = f.read(1 << 20)
+                if len(block) == 0:
+                    break
+                md5.update(block)
+        ivector_id = md5.hexdigest()
+        try:
+            with open(id_file, 'w') as f:
+                print(ivector_id, file=f)
+        except (IOError, OSError):
+            # e.g. the extractor directory is read-only; we just behave
+            # as if the id is not stored.
+            pass
+    else:
+        return None
 
-    if (stdout_val.strip() == "") or (stdout_val is None):
+    if ivector_id == "":
         return None
 
-    return stdout_val.strip()
+    return ivector_id
 
 def get_feat_dim(feat_dir):
     if feat_dir is None:
         return 0
-    stdout_val = get_command_stdout(
-        "feat-to-dim --print-args=false "
-        "scp:{data}/feats.scp -".format(data=feat_dir))
-    feat_dim = int(stdout_val)
-    return feat_dim
-
-
-def get_feat_dim_from_scp(feat_scp):
-    stdout_val = get_command_stdout(
-        "feat-to-dim --print-args=false "
-        "scp:{feat_scp} -".format(feat_scp=feat_scp))
-    feat_dim = int(stdout_val)
-    return feat_dim
+    return get_feat_dim_from_scp("{data}/feats.scp".format(data=feat_dir))
 
 
 def read_kaldi_matrix(matrix_file):
     """This function reads a kaldi matrix stored in text format from
     'matrix_file' and stores it as a list of rows, where each row is a list.
+    The elements are truncated to integers.
     """
+    if matrix_io.np is None:
+        # numpy is not available; fall back to parsing the text directly.
+        return _read_kaldi_matrix_text(matrix_file)
+    try:
+        mat = matrix_io.read_matrix(matrix_file)
+    except IOError:
+        raise Exception("Error while reading the kaldi matrix file "
+                        "{0}".format(matrix_file))
+    return [[int(x) for x in row] for row in mat.tolist()]
+
+
+def _read_kaldi_matrix_text(matrix_file):
     try:
         lines = [x.split() for x in open(matrix_file).readlines()]
         first_field = lines[0][0]
@@ -357,121 +422,42 @@ def write_kaldi_matrix(output_file, matrix):
 
 def write_matrix_ascii(file_or_fd, mat, key=None):
     """This function writes the matrix 'mat' stored as a list of lists
-    in kaldi matrix text format.
+    (or a numpy array) in kaldi matrix text format.
     The destination can be a file or an opened file descriptor.
     If key is provided, then matrix is written to an archive with the 'key'
     as the index field.
+    See libs/matrix_io.py for the binary format.
     """
-    try:
-        fd = open(file_or_fd, 'w')
-    except TypeError:
-        # 'file_or_fd' is opened file descriptor,
-        fd = file_or_fd
-
-    try:
-        if key is not None:
-            print ("{0} [".format(key),
-                   file=fd)  # ark-files have keys (utterance-id)
-        else:
-            print (" [", file=fd)
-
-        num_cols = 0
-        for i, row in enumerate(mat):
-            line = ' '.join(["{0:f}".format(x) for x in row])
-            if i == 0:
-                num_cols = len(row)
-            elif len(row) != num_cols:
-                raise Exception("All the rows of a matrix are expected to "
-                                "have the same length")
-
-            if i == len(mat) - 1:
-                line += " ]"
-            print (line, file=fd)
-    finally:
-        if fd is not file_or_fd : fd.close()
+    matrix_io.write_matrix(file_or_fd, mat, key=key)
 
 
 def read_matrix_ascii(file_or_fd):
-    """This function reads a matrix in kaldi matrix text format
+    """This function reads a matrix in kaldi matrix format
     and stores it as a list of lists.
-    The input can be a file or an opened file descriptor.
+    The input can be a file or an opened file descriptor (in text or binary
+    mode; binary matrices can only be read from the latter).
+    See libs/matrix_io.py to read it as a numpy array instead.
     """
-    try:
-        fd = open(file_or_fd, 'r')
-        fname = file_or_fd
-    except TypeError:
-        # 'file_or_fd' is opened file descriptor,
-        fd = file_or_fd
-        fname = file_or_fd.name
-
-    first = fd.read(2)
-    if first != ' [':
-        logger.error(
-            "Kaldi matrix file %s has incorrect format, "
-            "only text format matrix files can be read by this script",
-            fname)
-        raise RuntimeError
-
-    rows = []
-    while True:
-        line = fd.readline()
-        if len(line) == 0:
-            logger.error("Kaldi matrix file %s has incorrect format; "
-                         "got EOF before end of matrix", fname)
-        if len(line.strip()) == 0 : continue # skip empty line
-        arr = line.strip().split()
-        if arr[-1] != ']':
-            rows.append([float(x) for x in arr])  # not last line
-        else:
-            rows.append([float(x) for x in arr[:-1]])  # lastline
-            return rows
-    if fd is not file_or_fd:
-        fd.close()
+    return matrix_io.read_matrix(file_or_fd).tolist()
 
 
 def read_key(fd):
-  """ [str] = read_key(fd)
-   Read the utterance-key from the opened ark/stream descriptor 'fd'.
-  """
-  str_ = ''
-  while True:
-    char = fd.read(1)
-    if char == '':
-        break
-    if char == ' ':
-        break
-    str_ += char
-  str_ = str_.strip()
-  if str_ == '':
-      return None   # end of file,
-  return str_
+    """ [str] = read_key(fd)
+    Read the utterance-key from the opened ark/stream descriptor 'fd'.
+    """
+    return matrix_io.read_key(fd)
 
 
 def read_mat_ark(file_or_fd):
-    """This function reads a kaldi matrix archive in text format
+    """This function reads a kaldi matrix archive in text or binary format
     and yields a dictionary output indexed by the key (utterance-id).
     The input can be a file or an opened file descriptor.
 
     Example usage:
     mat_dict = { key: mat for key, mat in read_mat_ark(file) }
     """
-    try:
-        fd = open(file_or_fd, 'r')
-        fname = file_or_fd
-    except TypeError:
-        # 'file_or_fd' is opened file descriptor,
-        fd = file_or_fd
-        fname = file_or_fd.name
-
-    try:
-        key = read_key(fd)
-        while key:
-          mat = read_matrix_ascii(fd)
-          yield key, mat
-          key = read_key(fd)
-    finally:
-        if fd is not file_or_fd:
-            fd.close()
+    for key, mat in matrix_io.read_mat_ark(file_or_fd):
+        yield key, mat.tolist()
 
 
 def force_symlink(file1, file2):
@@ -0,0 +1,298 @@
+# Apache 2.0
+
+""" This module contains the accumulators used by the scripts in
+steps/diagnostic/ (analyze_lattice_depth_stats.py and
+analyze_phone_length_stats.py) for the stats written by analyze_lats.sh and
+analyze_alignments.sh, which are lines of a few integer fields, e.g.
+'<phone> <lattice-depth> <count>'.
+
+The input is read in large chunks and parsed with numpy rather than line by
+line, and the counts are kept as per-key histograms in a 2-D numpy array
+(one row per key, e.g. per phone, and one column per value, e.g. per lattice
+depth), from which percentiles and means are computed.  Partial stats, e.g.
+from the stats files of different jobs, can be accumulated separately (also
+in parallel, see accumulate_files()) and merged.
+
+e.g.:
+    stats = CountHistograms()
+    for fields in read_int_fields(sys.stdin.buffer, 3):
+        stats.add(fields[:, 0], fields[:, 1], fields[:, 2])
+    hist = stats.histogram(phone)
+    median = get_percentile(hist, 0.5)
+"""
+
+from __future__ import print_function
+from __future__ import division
+import gzip
+import multiprocessing
+import sys
+import warnings
+
+import numpy as np
+
+
+# g_is_space[c] is true if the byte c is whitespace for bytes.split().
+g_is_space = np.zeros(256, dtype=bool)
+g_is_space[list(bytearray(b' \t\n\r\x0b\x0c'))] = True
+
+
+class BadLineError(Exception):
+    """ Raised by read_int_fields() for a line that it cannot interpret; the
+        line (including the newline) is in self.line. """
+
+    def __init__(self, line):
+        Exception.__init__(self, line)
+        self.line = line
+
+    def __str__(self):
+        return "could not interpret line: " + self.line
+
+
+def _find_bad_line(chunk, num_fields, word_fields):
+    """ Returns the first line of 'chunk' that is not 'num_fields' integers
+        (or words from 'word_fields'), or None if there is none. """
+    for line in chunk.split(b'\n'):
+        fields = line.split()
+        try:
+            if len(fields) != num_fields:
+                raise ValueError()
+            for i, field in enumerate(fields):
+                if i in word_fields:
+                    word_fields[i].index(field)
+                else:
+                    int(field)
+        except ValueError:
+            return line.decode('utf-8', 'replace') + '\n'
+    return None
+
+
+def _parse_chunk(chunk, num_fields, word_fields):
+    """ Parses 'chunk', some complete lines of 'num_fields' fields each, into
+        an int64 array of shape (num-lines, num_fields). """
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    is_space = g_is_space[buf]
+    # count the fields on each line, i.e. the non-whitespace bytes that follow
+    # whitespace or the start of the chunk, by line-index.
+    field_starts = np.flatnonzero(~is_space & np.concatenate(
+        ([True], is_space[:-1])))
+    line_index = np.cumsum(buf == ord('\n'))[field_starts]
+    num_lines = chunk.count(b'\n') + (0 if chunk.endswith(b'\n') else 1)
+    fields_per_line = np.bincount(line_index, minlength=num_lines)
+    if np.any(fields_per_line != num_fields):
+        raise BadLineError(_find_bad_line(chunk, num_fields, word_fields))
+
+    text = chunk
+    if len(word_fields) > 0:
+        tokens = chunk.split()
+        try:
+            for i, words in word_fields.items():
+                word_to_int = dict((word, str(n).encode())
+                                   for n, word in enumerate(words))
+                tokens[i::num_fields] = [word_to_int[word]
+                                         for word in tokens[i::num_fields]]
+        except KeyError:
+            raise BadLineError(_find_bad_line(chunk, num_fields, word_fields))
+        text = b' '.join(tokens)
+    try:
+        with warnings.catch_warnings():
+            # np.fromstring() only warns if it cannot parse the whole string.
+            warnings.simplefilter('error')
+            values = np.fromstring(text, dtype=np.int64, sep=' ')
+    except (ValueError, DeprecationWarning):
+        values = None
+    if values is None or len(values) != num_lines * num_fields:
+        bad_line = _find_bad_line(chunk, num_fields, word_fields)
+        if bad_line is not None:
+            raise BadLineError(bad_line)
+        # integers that python's int() accepts but np.fromstring() does not.
+        values = np.array([int(x) for x in text.split()], dtype=np.int64)
+    return values.reshape(num_lines, num_fields)
+
+
+def read_int_fields(f, num_fields, word_fields=None, chunk_size=1 << 22):
+    """ Reads lines of 'num_fields' whitespace-separated integers from 'f', a
+        file opened in binary mode, and yields them, a chunk of about
+        'chunk_size' bytes at a time, as int64 arrays of shape
+        (num-lines, num_fields).
+
+        'word_fields', if given, is a dict from field-index to a list of the
+        words that may appear in that field instead of an integer; they are
+        returned as their index in the list.  E.g. with
+        word_fields={1: ['begin', 'end', 'all']}, the line '10 end 35 7' is
+        returned as [10, 1, 35, 7].
+
+        Raises BadLineError for a line that cannot be interpreted this way
+        (including empty lines).
+    """
+    word_fields = dict((i, [word.encode() for word in words])
+                       for i, words in (word_fields or {}).items())
+    remainder = b''
+    while True:
+        data = f.read(chunk_size)
+        if len(data) == 0:
+            if len(remainder) == 0:
+                return
+            chunk, remainder = remainder, b''
+        else:
+            data = remainder + data
+            end = data.rfind(b'\n') + 1
+            chunk, remainder = data[:end], data[end:]
+            if len(chunk) == 0:
+                continue
+        yield _parse_chunk(chunk, num_fields, word_fields)
+
+
+class CountHistograms(object):
+    """ Histograms of counts of non-negative integer values (e.g. phone
+        lengths or lattice depths), one for each of a set of integer keys
+        (e.g. phones).  self.counts[row, value] is the count of 'value' for
+        the key self.keys[row]; the rows are added as keys are seen. """
+
+    def __init__(self):
+        self.keys = []
+        self.key_to_row = {}
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+
+    def _rows(self, keys):
+        """ Returns the rows of 'keys' (a list of ints), adding any rows that
+            are needed. """
+        for key in keys:
+            if key not in self.key_to_row:
+                self.key_to_row[key] = len(self.keys)
+                self.keys.append(key)
+        return np.array([self.key_to_row[key] for key in keys],
+                        dtype=np.int64)
+
+    def resize(self, num_cols):
+        """ Makes self.counts have a row for every key and at least
+            'num_cols' columns, i.e. makes the histograms cover the values
+            0 ... num_cols - 1 (e.g. to give the histograms of different
+            CountHistograms the same size). """
+        old_rows, old_cols = self.counts.shape
+        num_rows = len(self.keys)
+        if num_cols <= old_cols and num_rows == old_rows:
+            return
+        num_cols = max(num_cols, old_cols)
+        counts = np.zeros((num_rows, num_cols), dtype=np.int64)
+        counts[:old_rows, :old_cols] = self.counts
+        self.counts = counts
+
+    def add(self, keys, values, counts):
+        """ Adds counts[i] to the count of values[i] for keys[i], for each i;
+            the arguments are integer arrays of the same length. """
+        if len(keys) == 0:
+            return
+        keys = np.asarray(keys, dtype=np.int64)
+        values = np.asarray(values, dtype=np.int64)
+        if values.min() < 0:
+            raise Exception("Negative value {0} in stats".format(values.min()))
+        unique_keys, key_index = np.unique(keys, return_inverse=True)
+        rows = self._rows(unique_keys.tolist())[key_index.reshape(-1)]
+        num_cols = int(values.max()) + 1
+        if num_cols > self.counts.shape[1]:
+            # grow geometrically, as larger values keep turning up.
+            num_cols = max(num_cols, self.counts.shape[1] * 3 // 2)
+        self.resize(num_cols)
+        np.add.at(self.counts, (rows, values),
+                  np.asarray(counts, dtype=np.int64))
+
+    def merge(self, other):
+        """ Adds the counts of the CountHistograms 'other' to this one. """
+        rows = self._rows(other.keys)
+        self.resize(other.counts.shape[1])
+        self.counts[rows, :other.counts.shape[1]] += other.counts
+
+    def histogram(self, key):
+        """ Returns the histogram of 'key' as an array indexed by value (of
+            zeros if the key was not seen). """
+        row = self.key_to_row.get(key)
+        if row is None:
+            return np.zeros(self.counts.shape[1], dtype=np.int64)
+        return self.counts[row]
+
+    def sum_histograms(self, keys):
+        """ Returns the sum of the histograms of 'keys'; keys that were not
+            seen are ignored. """
+        rows = [self.key_to_row[key] for key in keys if key in self.key_to_row]
+        return self.counts[rows].sum(axis=0)
+
+    def total_histogram(self):
+        """ Returns the sum of the histograms of all keys. """
+        return self.counts.sum(axis=0)
+
+
+def get_percentile(hist, fraction):
+    """ Returns the value that is the (fraction * 100)'th percentile of the
+        histogram 'hist' (an array of counts indexed by value), i.e. the
+        first value at which the total count reaches int(fraction * total);
+        or 0 if the histogram is empty. """
+    total = int(hist.sum())
+    if total == 0:
+        return 0
+    values = np.flatnonzero(hist)
+    cumulative_counts = np.cumsum(hist[values])
+    return int(values[np.searchsorted(cumulative_counts,
+                                      int(fraction * total))])
+
+
+def get_mean(hist):
+    """ Returns the mean value of the histogram 'hist', or 0.0 if it is
+        empty. """
+    total = int(hist.sum())
+    if total == 0:
+        return 0.0
+    return get_total_value(hist) / total
+
+
+def get_total_value(hist):
+    """ Returns the sum of value * count over the histogram 'hist' (e.g. the
+        total number of frames of a histogram of phone lengths), as a
+        float. """
+    return float(np.dot(np.arange(len(hist), dtype=np.int64), hist))
+
+
+def _open_stats_file(filename):
+    if filename == '-':
+        return sys.stdin.buffer if sys.version_info.major > 2 else sys.stdin
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+# set in the worker processes of accumulate_files().
+g_accumulate = None
+
+
+def _init_worker(accumulate):
+    global g_accumulate
+    g_accumulate = accumulate
+
+
+def _accumulate_file(filename):
+    f = _open_stats_file(filename)
+    try:
+        return g_accumulate(f)
+    finally:
+        if filename != '-':
+            f.close()
+
+
+def accumulate_files(filenames, accumulate, num_jobs=1):
+    """ Yields accumulate(f) for each file in 'filenames' (in order), where f
+        is the file opened in binary mode; '-' means the standard input and
+        files ending in .gz are decompressed.  If num_jobs > 1 the files are
+        read in a pool of that many processes; 'accumulate' must then be a
+        module-level function, and the stats it returns must be picklable.
+    """
+    if num_jobs <= 1 or len(filenames) <= 1:
+        _init_worker(accumulate)
+        for filename in filenames:
+            yield _accumulate_file(filename)
+        return
+    pool = multiprocessing.Pool(min(num_jobs, len(filenames)), _init_worker,
+                                (accumulate,))
+    try:
+        for stats in pool.imap(_accumulate_file, filenames):
+            yield stats
+    finally:
+        pool.terminate()
@@ -0,0 +1,383 @@
+# Apache 2.0
+
+""" This module contains a runner for kaldi jobs, i.e. shell commands that
+typically start with 'run.pl' or 'queue.pl'.
+
+It is meant as a replacement for common.background_command() in places where
+a group of jobs is launched together, e.g. the parallel training jobs of one
+iteration of nnet3 training.  Instead of a shell plus a waiter thread per job,
+all the jobs are started and waited on from a single thread of the runner.
+The runner limits the number of jobs that run at the same time, records the
+exit status and wall time of every job, and when a job that is required to
+succeed fails, it kills the other jobs of its group and raises an exception
+in the thread that waits for the jobs (instead of interrupting the main
+thread).
+
+It only uses the threading and subprocess modules, so that it works with
+python2 as well as python3, like the rest of steps/libs.
+
+e.g.:
+    with JobRunner(max_concurrent_jobs=4) as runner:
+        jobs = [runner.submit(command, group="train") for command in commands]
+        # ... do something else while the jobs are running ...
+        runner.wait(jobs)
+    for job in jobs:
+        print(job.name, job.wall_time)
+
+See also: common.background_command(), common.execute_command()
+"""
+
+from __future__ import print_function
+from __future__ import division
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+# The interval in seconds at which the runner thread polls the running jobs
+# for their exit status.
+g_poll_interval = 0.1
+
+# The keyword arguments of subprocess.Popen() that start the command in a new
+# session, so that on cancellation we can kill the whole process group, i.e.
+# run.pl/queue.pl together with the pipeline it runs.
+if sys.version_info >= (3, 2):
+    g_new_session_args = {'start_new_session': True}
+else:
+    g_new_session_args = {'preexec_fn': os.setsid}
+
+
+class JobFailedError(Exception):
+    """ Raised by JobRunner.wait() when a job that was submitted with
+        require_zero_status=True exits with nonzero status. """
+
+    def __init__(self, job):
+        self.job = job
+        Exception.__init__(self, "Command exited with status {0}: {1}".format(
+            job.returncode, job.command))
+
+
+class Job(object):
+    """ Stores the command, exit status and timing of a job submitted to a
+        JobRunner.  The times are as returned by time.time(); 'status' is one
+        of "pending", "running", "done", "failed" or "cancelled".
+    """
+
+    def __init__(self, command, name, group, require_zero_status, after):
+        self.command = command
+        self.name = name
+        self.group = group
+        self.require_zero_status = require_zero_status
+        self.after = after
+        self.status = "pending"
+        self.returncode = None
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self.process = None
+        self.cancelled = False
+        self.finished = threading.Event()
+
+    def done(self):
+        return self.status in ["done", "failed", "cancelled"]
+
+    @property
+    def wall_time(self):
+        """ The time in seconds the job has been running for (so far), or
+            None if it was never started. """
+        if self.start_time is None:
+            return None
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return end_time - self.start_time
+
+    @property
+    def queue_time(self):
+        """ The time in seconds the job spent waiting for a free slot
+            (i.e. because of max_concurrent_jobs) before it was started. """
+        if self.start_time is None:
+            return None
+        return self.start_time - self.submit_time
+
+    def __str__(self):
+        wall_time = self.wall_time
+        return "{name}: status={status} returncode={rc} wall-time={time}".format(
+            name=self.name, status=self.status, rc=self.returncode,
+            time=("{0:.1f}s".format(wall_time) if wall_time is not None
+                  else "n/a"))
+
+
+class _RunnerThread(threading.Thread):
+    """ The thread of a JobRunner, which starts its jobs and waits for them.
+        join() is overridden to first wait for the outstanding jobs and stop
+        the thread, so that common.wait_for_background_commands(), which joins
+        all the threads of the program, works as expected with a JobRunner.
+    """
+
+    def __init__(self, runner, name):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True  # make sure it exits if main thread is terminated
+                            # abnormally.
+        self.runner = runner
+
+    def run(self):
+        self.runner._run()
+
+    def join(self, timeout=None):
+        self.runner.close()
+        threading.Thread.join(self, timeout)
+
+
+class JobRunner(object):
+    """ Runs shell commands asynchronously from a separate thread.
+
+        max_concurrent_jobs: if not None, at most this many of the submitted
+            jobs run at the same time; the rest wait for a free slot in the
+            order in which they were submitted.
+        name: the name of the runner's thread, and the prefix of the default
+            job names.
+
+        A JobRunner can be used in a 'with' construct; at the end of the block
+        it waits for the outstanding jobs and stops its thread.  If the block
+        is left because of an exception, the outstanding jobs are killed
+        instead.
+    """
+
+    def __init__(self, max_concurrent_jobs=None, name="job-runner"):
+        if max_concurrent_jobs is not None and max_concurrent_jobs <= 0:
+            raise ValueError("max_concurrent_jobs must be positive, got "
+                             "{0}".format(max_concurrent_jobs))
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.name = name
+        self.jobs = []
+        # all the state of the runner and its jobs is protected by
+        # self._condition, which is notified whenever it changes.
+        self._condition = threading.Condition()
+        self._pending = []
+        self._running = []
+        self._closed = False
+        self._stopping = False
+        self._thread = _RunnerThread(self, name)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.cancel()
+        self.close()
+
+    def submit(self, command, name=None, group=None,
+               require_zero_status=True, after=None):
+        """ Starts running 'command' (in 'shell' mode) as soon as a slot is
+            free and returns the corresponding Job object without waiting for
+            it.  If require_zero_status is True and the command fails, the
+            other unfinished jobs that were submitted with the same (non-None)
+            'group' are killed, and wait() raises JobFailedError; otherwise
+            a nonzero status just produces a warning, as in
+            common.background_command().
+            If 'after' is a list of Job objects of this runner, the command
+            is not started before all of them have finished (successfully
+            or not).
+        """
+        with self._condition:
+            if self._closed:
+                raise Exception("Cannot submit jobs to a JobRunner that "
+                                "has been closed")
+            if name is None:
+                name = "{0}.{1}".format(self.name, len(self.jobs) + 1)
+            job = Job(command, name, group, require_zero_status,
+                      list(after) if after else [])
+            self.jobs.append(job)
+            self._pending.append(job)
+            self._condition.notify_all()
+        return job
+
+    def unfinished_jobs(self):
+        """ Returns the jobs submitted so far that have not finished yet. """
+        with self._condition:
+            return [job for job in self.jobs if not job.done()]
+
+    def wait(self, jobs=None, timeout=None):
+        """ Waits for 'jobs' (by default, all jobs submitted so far) to
+            finish and returns them.  Raises JobFailedError for the first
+            of them (in order of completion) that failed and was required to
+            succeed; this is done only after all of 'jobs' have finished or
+            were killed, so no processes are left behind.
+            If the wait is interrupted (e.g. by Ctrl-C), the jobs are killed.
+        """
+        if jobs is None:
+            with self._condition:
+                jobs = list(self.jobs)
+        try:
+            finished = self._wait_for_jobs(jobs, timeout)
+        except BaseException:
+            self.cancel(jobs)
+            raise
+        if not finished:
+            raise Exception("Timed out while waiting for jobs of "
+                            "{0}".format(self.name))
+        failed_jobs = [job for job in jobs if job.status == "failed"
+                       and job.require_zero_status]
+        if len(failed_jobs) > 0:
+            raise JobFailedError(min(failed_jobs, key=lambda x: x.end_time))
+        return jobs
+
+    def cancel(self, jobs=None):
+        """ Kills 'jobs' (by default, all the jobs submitted so far) if they
+            have not finished yet, and waits until they have exited. """
+        with self._condition:
+            if jobs is None:
+                jobs = list(self.jobs)
+            for job in jobs:
+                self._cancel_job(job)
+        self._wait_for_jobs(jobs)
+
+    def close(self):
+        """ Waits for all the jobs to finish (without raising an exception
+            if any of them failed; the failures have already been logged)
+            and stops the runner's thread.  It is safe to call this more than
+            once. """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            jobs = list(self.jobs)
+        try:
+            self._wait_for_jobs(jobs)
+        except BaseException:
+            self.cancel(jobs)
+            raise
+        finally:
+            with self._condition:
+                self._stopping = True
+                self._condition.notify_all()
+            if threading.current_thread() is not self._thread:
+                threading.Thread.join(self._thread)
+
+    def _wait_for_jobs(self, jobs, timeout=None):
+        """ Waits for 'jobs' to finish; returns False if they did not finish
+            within 'timeout' seconds.  The wait is done in slices, as
+            Event.wait() without a timeout cannot be interrupted by Ctrl-C in
+            python2. """
+        end_time = None if timeout is None else time.time() + timeout
+        for job in jobs:
+            while not job.finished.is_set():
+                wait_time = 1.0
+                if end_time is not None:
+                    wait_time = min(wait_time, end_time - time.time())
+                    if wait_time <= 0:
+                        return False
+                job.finished.wait(wait_time)
+        return True
+
+    def _run(self):
+        """ The main loop of the runner's thread: starts the jobs that can be
+            started and polls the running jobs until close() is called and
+            all the jobs have finished. """
+        with self._condition:
+            while True:
+                self._start_ready_jobs()
+                if len(self._running) > 0:
+                    self._condition.wait(g_poll_interval)
+                elif self._stopping and len(self._pending) == 0:
+                    return
+                else:
+                    self._condition.wait()
+                for job in list(self._running):
+                    returncode = job.process.poll()
+                    if returncode is not None:
+                        self._finish_job(job, returncode)
+
+    def _start_ready_jobs(self):
+        for job in list(self._pending):
+            if (self.max_concurrent_jobs is not None
+                    and len(self._running) >= self.max_concurrent_jobs):
+                return
+            if not all(x.done() for x in job.after):
+                continue
+            self._pending.remove(job)
+            job.start_time = time.time()
+            job.status = "running"
+            self._running.append(job)
+            try:
+                job.process = subprocess.Popen(job.command, shell=True,
+                                               **g_new_session_args)
+            except OSError as e:
+                logger.error("Could not start command {0}: {1}".format(
+                    job.command, str(e)))
+                self._finish_job(job, -1)
+
+    def _finish_job(self, job, returncode):
+        self._running.remove(job)
+        job.returncode = returncode
+        job.end_time = time.time()
+        job.process = None
+        if job.cancelled:
+            job.status = "cancelled"
+            logger.debug("Job {0} was cancelled".format(job.name))
+        elif job.returncode != 0:
+            job.status = "failed"
+            message = "Command exited with status {0}: {1}".format(
+                job.returncode, job.command)
+            if job.require_zero_status:
+                logger.error(message)
+                self._cancel_group(job)
+            else:
+                logger.warning(message)
+        else:
+            job.status = "done"
+        logger.debug(str(job))
+        job.finished.set()
+        self._condition.notify_all()
+
+    def _cancel_job(self, job):
+        """ Kills 'job' if it is running, or makes sure that it is never
+            started if it is pending. """
+        if job.done() or job.cancelled:
+            return
+        job.cancelled = True
+        if job.status == "pending":
+            self._pending.remove(job)
+            job.status = "cancelled"
+            logger.debug("Job {0} was cancelled".format(job.name))
+            job.finished.set()
+            self._condition.notify_all()
+        else:
+            try:
+                os.killpg(job.process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def _cancel_group(self, failed_job):
+        if failed_job.group is None:
+            return
+        for job in self._pending + self._running:
+            if job.group == failed_job.group and job is not failed_job:
+                logger.info("Killing job {0} because job {1} of the same "
+                            "group failed".format(job.name, failed_job.name))
+                self._cancel_job(job)
+
+
+def summarize_timing(jobs):
+    """ Returns a one-line summary of the wall times of the finished jobs in
+        'jobs', e.g. for logging at the end of a training iteration. """
+    times = [job.wall_time for job in jobs
+             if job.done() and job.wall_time is not None]
+    if len(times) == 0:
+        return "no finished jobs"
+    slowest = max((job for job in jobs if job.done()
+                   and job.wall_time is not None),
+                  key=lambda x: x.wall_time)
+    return ("{num} jobs, wall time min/mean/max = {min:.1f}/{mean:.1f}/"
+            "{max:.1f}s (slowest: {slowest})".format(
+                num=len(times), min=min(times),
+                mean=sum(times) / len(times), max=max(times),
+                slowest=slowest.name))
@@ -0,0 +1,300 @@
+# Apache 2.0
+
+""" This module contains pure-python readers for the few properties of Kaldi
+objects that the training scripts need at startup: the number of pdfs of a
+tree (as printed by 'tree-info'), the number of pdfs of a model (as printed
+by 'am-info', which reads only the transition model at the start of the
+file), and the dimension of the features in a feats.scp or
+ivector_online.scp (as printed by 'feat-to-dim').
+
+Only the parts of the files that are needed are read (e.g. just the header of
+the first matrix of an scp file), which is much faster than starting the
+Kaldi binaries, especially on busy network file systems.  The results are
+cached in memory, keyed by the path and the mtime and size of the file, so
+repeated queries in the same process are free.
+
+The functions raise an exception if the file is in a format they cannot read
+(e.g. an scp file whose first entry is a command); the callers in
+libs/common.py then fall back to the Kaldi binaries.
+
+e.g.:
+    num_pdfs = get_num_pdfs_from_tree("exp/tri3_ali/tree")
+    feat_dim = get_matrix_dim_from_scp("data/train/feats.scp")
+"""
+
+from __future__ import print_function
+from __future__ import division
+from io import open
+import os
+import struct
+
+from . import matrix_io
+
+
+# a dict from (function-name, path) to (mtime, size, result).
+g_cache = {}
+
+
+def _cached(func, path):
+    """ Returns func(path), or the result of an earlier call to it if 'path'
+        has not changed since. """
+    key = (func.__name__, os.path.abspath(path))
+    stat = os.stat(path)
+    entry = g_cache.get(key)
+    if (entry is not None and entry[0] == stat.st_mtime
+            and entry[1] == stat.st_size):
+        return entry[2]
+    result = func(path)
+    g_cache[key] = (stat.st_mtime, stat.st_size, result)
+    return result
+
+
+class ObjectReader(object):
+    """ Reads the tokens and basic types (as written by WriteToken(),
+        WriteBasicType() and WriteIntegerVector() in Kaldi) of a Kaldi object
+        in text or binary format from 'fd', a file opened in binary mode.
+        The format is detected from the '\\0B' header, as in Kaldi.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.binary = (fd.peek(2)[:2] == b'\0B')
+        if self.binary:
+            fd.read(2)
+        self.words = self._text_words()
+
+    def _text_words(self):
+        for line in self.fd:
+            for word in line.split():
+                yield word.decode()
+
+    def _next_word(self):
+        try:
+            return next(self.words)
+        except StopIteration:
+            raise Exception("Got EOF while reading Kaldi object")
+
+    def token(self):
+        if self.binary:
+            return matrix_io._read_token(self.fd)
+        return self._next_word()
+
+    def expect(self, expected):
+        token = self.token()
+        if token != expected:
+            raise Exception("Expected token {0}, got {1}".format(
+                expected, token))
+
+    def int32(self):
+        if self.binary:
+            return matrix_io._read_int32(self.fd)
+        return int(self._next_word())
+
+    def uint32(self):
+        """ Reads a uint32 basic type (e.g. the size of a TableEventMap),
+            which Kaldi writes with the size byte -4 in binary mode; the
+            size byte 4 of an int32 is also accepted. """
+        if not self.binary:
+            return int(self._next_word())
+        buf = matrix_io._read_exactly(self.fd, 5)
+        if buf[0] not in [4, 256 - 4]:
+            raise Exception("Expected a uint32 in binary Kaldi object, got "
+                            "size {0}".format(struct.unpack('<b', bytes(
+                                buf[:1]))[0]))
+        return struct.unpack('<I', bytes(buf[1:]))[0]
+
+    def int32s(self, num_values):
+        """ Reads 'num_values' consecutive int32 basic types. """
+        if not self.binary:
+            return [int(self._next_word()) for i in range(num_values)]
+        buf = bytes(matrix_io._read_exactly(self.fd, 5 * num_values))
+        values = struct.unpack('<' + 'bi' * num_values, buf)
+        if any(size != 4 for size in values[0::2]):
+            raise Exception("Expected int32 values in binary Kaldi object")
+        return list(values[1::2])
+
+    def float(self):
+        if not self.binary:
+            return float(self._next_word())
+        size = matrix_io._read_exactly(self.fd, 1)[0]
+        if size not in [4, 8]:
+            raise Exception("Expected a float in binary Kaldi object, got "
+                            "size {0}".format(size))
+        return struct.unpack('<f' if size == 4 else '<d',
+                             bytes(matrix_io._read_exactly(self.fd, size)))[0]
+
+    def int_vector(self):
+        if not self.binary:
+            self.expect("[")
+            values = []
+            while True:
+                word = self._next_word()
+                if word == "]":
+                    return values
+                values.append(int(word))
+        # the size of the elements, then the number of elements as a raw
+        # int32 (i.e. not as a basic type).
+        size, num_values = struct.unpack(
+            '<bi', bytes(matrix_io._read_exactly(self.fd, 5)))
+        buf = bytes(matrix_io._read_exactly(self.fd, size * num_values))
+        fmt = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}[size]
+        return list(struct.unpack('<{0}{1}'.format(num_values, fmt), buf))
+
+
+def _read_event_map_max_answer(reader):
+    """ Reads an EventMap and returns the largest answer in it (-1 if there
+        are none), like EventMap::MaxResult().  The event map is read
+        iteratively, as it may be quite deep. """
+    max_answer = -1
+    # each element is [number of event-maps still to be read at this level,
+    #                  token that closes the level].
+    pending = [[1, None]]
+    while len(pending) > 0:
+        if pending[-1][0] == 0:
+            closing_token = pending.pop()[1]
+            if closing_token is not None:
+                reader.expect(closing_token)
+            continue
+        pending[-1][0] -= 1
+        token = reader.token()
+        if token == "CE":
+            max_answer = max(max_answer, reader.int32())
+        elif token == "TE":
+            reader.int32()  # key
+            size = reader.uint32()
+            reader.expect("(")
+            pending.append([size, ")"])
+        elif token == "SE":
+            reader.int32()  # key
+            reader.int_vector()  # yes-set
+            reader.expect("{")
+            pending.append([2, "}"])
+        elif token != "NULL":
+            raise Exception("Unexpected token {0} while reading "
+                            "EventMap".format(token))
+    return max_answer
+
+
+def _read_num_pdfs_from_tree(tree_file):
+    with open(tree_file, 'rb') as f:
+        reader = ObjectReader(f)
+        reader.expect("ContextDependency")
+        reader.int32()  # N
+        reader.int32()  # P
+        token = reader.token()
+        if token == "ToLength":  # back-compat, as in ContextDependency::Read()
+            _read_event_map_max_answer(reader)
+            token = reader.token()
+        if token != "ToPdf":
+            raise Exception("Got unexpected token {0} reading "
+                            "context-dependency object".format(token))
+        return max(_read_event_map_max_answer(reader) + 1, 0)
+
+
+def _skip_topology(reader):
+    reader.expect("<Topology>")
+    if not reader.binary:
+        while reader.token() != "</Topology>":
+            pass
+        return
+    reader.int_vector()  # phones
+    reader.int_vector()  # phone2idx
+    num_entries = reader.int32()
+    is_hmm = True
+    if num_entries == -1:
+        is_hmm = False
+        num_entries = reader.int32()
+    for i in range(num_entries):
+        num_states = reader.int32()
+        for j in range(num_states):
+            reader.int32s(1 if is_hmm else 2)  # pdf-classes
+            num_transitions = reader.int32()
+            for k in range(num_transitions):
+                reader.int32()
+                reader.float()
+    reader.expect("</Topology>")
+
+
+def _read_num_pdfs_from_model(model_file):
+    with open(model_file, 'rb') as f:
+        reader = ObjectReader(f)
+        reader.expect("<TransitionModel>")
+        _skip_topology(reader)
+        token = reader.token()
+        if token not in ["<Tuples>", "<Triples>"]:
+            raise Exception("Got unexpected token {0} reading "
+                            "transition model".format(token))
+        num_tuples = reader.int32()
+        # each tuple is (phone, hmm-state, forward-pdf[, self-loop-pdf]).
+        tuple_size = 4 if token == "<Tuples>" else 3
+        values = reader.int32s(num_tuples * tuple_size)
+        pdfs = values[2::tuple_size]
+        if tuple_size == 4:
+            pdfs += values[3::tuple_size]
+        return max(pdfs) + 1 if len(pdfs) > 0 else 0
+
+
+def _read_matrix_num_cols(fd):
+    header = fd.read(2)
+    if header != b'\0B':
+        rows = matrix_io._read_text_rows(fd, header)
+        return len(rows[0].split()) if len(rows) > 0 else 0
+    token = matrix_io._read_token(fd)
+    if token in ["FM", "DM"]:
+        matrix_io._read_int32(fd)  # num-rows
+        return matrix_io._read_int32(fd)
+    if token in ["CM", "CM2", "CM3"]:
+        return struct.unpack('<ffii', bytes(
+            matrix_io._read_exactly(fd, 16)))[3]
+    raise Exception("Unknown binary Kaldi matrix type '{0}'".format(token))
+
+
+def _read_matrix_dim_from_scp(scp_file):
+    with open(scp_file) as f:
+        line = f.readline()
+    parts = line.split(None, 1)
+    if len(parts) != 2:
+        raise Exception("Bad first line in scp file {0}: {1}".format(
+            scp_file, line))
+    rxfilename = parts[1].strip()
+    if rxfilename.endswith("|") or rxfilename == "-":
+        raise Exception("Reading from commands is not supported: "
+                        "{0}".format(rxfilename))
+    range_str = None
+    offset = 0
+    m = matrix_io.g_offset_regex.match(rxfilename)
+    if m is not None:
+        path, offset, range_str = m.group(1), int(m.group(2)), m.group(3)
+    else:
+        m = matrix_io.g_range_regex.match(rxfilename)
+        if m is not None:
+            path, range_str = m.group(1), m.group(2)
+        else:
+            path = rxfilename
+    if range_str is not None:
+        slices = matrix_io._parse_range(range_str)
+        if len(slices) == 2 and slices[1].start is not None:
+            return slices[1].stop - slices[1].start
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return _read_matrix_num_cols(f)
+
+
+def get_num_pdfs_from_tree(tree_file):
+    """ Returns the number of pdfs of the tree in 'tree_file', i.e. the
+        largest pdf-id in it plus one, as printed by 'tree-info'. """
+    return _cached(_read_num_pdfs_from_tree, tree_file)
+
+
+def get_num_pdfs_from_model(model_file):
+    """ Returns the number of pdfs of the transition model at the start of
+        'model_file' (e.g. final.mdl, of any type), as printed by
+        'am-info'. """
+    return _cached(_read_num_pdfs_from_model, model_file)
+
+
+def get_matrix_dim_from_scp(scp_file):
+    """ Returns the number of columns of the first matrix in the scp file
+        'scp_file' (e.g. data/train/feats.scp), as printed by
+        'feat-to-dim scp:<scp_file> -'. """
+    return _cached(_read_matrix_dim_from_scp, scp_file)
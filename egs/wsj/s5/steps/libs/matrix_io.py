@@ -0,0 +1,548 @@
+# Apache 2.0
+
+""" This module contains functions to read and write Kaldi matrices and
+vectors, in text or binary format, as numpy arrays.
+
+Matrices and vectors can be read from plain files, from opened file
+descriptors (e.g. sys.stdin or the stdout of a subprocess), from archives
+(ark) and from scp files.  The following binary formats are supported: 'FM',
+'DM', 'FV' and 'DV', and the compressed matrix formats 'CM', 'CM2' and 'CM3'
+(for reading only).  Reading is done with buffered I/O, and each matrix is
+parsed directly into a numpy array instead of a list of lists of floats.
+
+The list-of-lists functions in libs/common.py (read_matrix_ascii(),
+read_mat_ark(), write_matrix_ascii() etc.) are wrappers around this module.
+
+e.g.:
+    for key, mat in read_mat_ark("exp/foo/targets.ark"):
+        ...
+    for key, mat in read_mat_scp("data/train/feats.scp"):
+        ...
+    with open("out.ark", "wb") as f:
+        offset = write_matrix(f, mat, key="utt1", binary=True)
+"""
+
+from __future__ import print_function
+from __future__ import division
+import io
+import re
+import struct
+import subprocess
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# The factor by which the uint16 values in compressed matrices are scaled;
+# it is 1.0 / 65535.0, as in kaldi's compressed-matrix.cc.
+g_uint16_scale = 1.52590218966964e-05
+
+
+def _check_numpy():
+    if np is None:
+        raise Exception("numpy is required to read or write Kaldi matrices "
+                        "with libs/matrix_io.py")
+
+
+def _open(file_or_fd, mode):
+    """ Returns a tuple (fd, opened) where 'fd' is 'file_or_fd' opened in
+        'mode' if it is a file name ("-" means stdin or stdout) and
+        'file_or_fd' itself otherwise; 'opened' is True if the file was
+        opened here and must be closed by the caller. """
+    if not isinstance(file_or_fd, str):
+        return file_or_fd, False
+    if file_or_fd == "-":
+        fd = sys.stdin if 'r' in mode else sys.stdout
+        return (getattr(fd, 'buffer', fd) if 'b' in mode else fd), False
+    return open(file_or_fd, mode), True
+
+
+def _is_text_fd(fd):
+    return isinstance(fd, io.TextIOBase)
+
+
+def _to_bytes(data):
+    if isinstance(data, str):
+        return data.encode()
+    return data
+
+
+def _read_exactly(fd, num_bytes):
+    """ Reads exactly 'num_bytes' bytes from 'fd' into a bytearray (so that
+        numpy arrays made from it are writable); reads from pipes may return
+        fewer bytes than requested, so this loops. """
+    if _is_text_fd(fd):
+        raise Exception("Binary Kaldi objects cannot be read from a "
+                        "text-mode stream; open it in binary mode")
+    buf = bytearray(num_bytes)
+    view = memoryview(buf)
+    pos = 0
+    while pos < num_bytes:
+        n = fd.readinto(view[pos:])
+        if not n:
+            raise Exception("Got EOF while reading binary Kaldi object "
+                            "(expected {0} bytes, got {1})".format(
+                                num_bytes, pos))
+        pos += n
+    return buf
+
+
+def _read_until_space(fd):
+    """ Reads bytes from 'fd' until a space or EOF and returns them (without
+        the space).  Uses peek() where available, which is much faster than
+        reading one byte at a time. """
+    peek = getattr(fd, 'peek', None)
+    if peek is None:
+        chars = []
+        while True:
+            char = _to_bytes(fd.read(1))
+            if char == b'' or char == b' ':
+                break
+            chars.append(char)
+        return b''.join(chars)
+    pieces = []
+    while True:
+        buf = peek(256)
+        if len(buf) == 0:
+            break
+        end = buf.find(b' ')
+        if end >= 0:
+            pieces.append(fd.read(end + 1)[:-1])
+            break
+        pieces.append(fd.read(len(buf)))
+    return b''.join(pieces)
+
+
+def read_key(fd):
+    """ Reads the key (e.g. utterance-id) of the next object in the opened
+        archive 'fd', which may be in text or binary mode.  Returns the key
+        as a str, or None at end of file.
+    """
+    key = _read_until_space(fd).strip()
+    if key == b'':
+        return None
+    return key.decode()
+
+
+def _read_token(fd):
+    return _read_until_space(fd).decode()
+
+
+def _read_int32(fd):
+    buf = _read_exactly(fd, 5)
+    if buf[0] != 4:
+        raise Exception("Expected an int32 in binary Kaldi object, "
+                        "got size {0}".format(buf[0]))
+    return struct.unpack('<i', bytes(buf[1:]))[0]
+
+
+def _read_text_rows(fd, prefix):
+    """ Reads the rest of a text-format Kaldi matrix or vector, whose first
+        bytes 'prefix' have already been read, up to and including the
+        line with the closing ']'.  Returns the list of non-empty rows, as
+        byte strings without the brackets. """
+    line = prefix
+    if not line.endswith(b'\n'):
+        line += _to_bytes(fd.readline())
+    line = line.lstrip()
+    while line == b'':
+        line = _to_bytes(fd.readline())
+        if line == b'':
+            raise Exception("Got EOF while expecting a Kaldi matrix")
+        line = line.lstrip()
+    if not line.startswith(b'['):
+        raise Exception("Kaldi matrix has incorrect format: expected '[', "
+                        "got '{0}'".format(line[:20].decode(errors='replace')))
+    line = line[1:]
+    rows = []
+    while True:
+        end = line.find(b']')
+        if end >= 0:
+            if line[:end].strip() != b'':
+                rows.append(line[:end])
+            return rows
+        if line.strip() != b'':
+            rows.append(line)
+        line = _to_bytes(fd.readline())
+        if line == b'':
+            raise Exception("Kaldi matrix has incorrect format; "
+                            "got EOF before end of matrix")
+
+
+def _parse_text_rows(rows):
+    if len(rows) == 0:
+        return np.zeros((0, 0))
+    num_cols = len(rows[0].split())
+    data = np.fromstring(b' '.join(rows), dtype=np.float64, sep=' ')
+    if num_cols == 0 or data.size != num_cols * len(rows):
+        raise Exception("Kaldi matrix has incorrect format: all the rows "
+                        "are expected to have {0} numbers".format(num_cols))
+    return data.reshape(len(rows), num_cols)
+
+
+def _read_compressed_matrix(fd, token):
+    min_value, value_range, num_rows, num_cols = struct.unpack(
+        '<ffii', bytes(_read_exactly(fd, 16)))
+    min_value = np.float32(min_value)
+    value_range = np.float32(value_range)
+    if token == "CM":
+        # Each column has a header of 4 uint16 values (the 0th, 25th, 75th
+        # and 100th percentiles), followed by the data as one byte per
+        # element, stored column by column.
+        headers = np.frombuffer(_read_exactly(fd, 8 * num_cols),
+                                dtype='<u2').reshape(num_cols, 4)
+        percentiles = (min_value
+                       + value_range * np.float32(g_uint16_scale)
+                       * headers.astype(np.float32))
+        p0, p25, p75, p100 = [percentiles[:, i:i+1] for i in range(4)]
+        data = np.frombuffer(_read_exactly(fd, num_rows * num_cols),
+                             dtype=np.uint8).reshape(num_cols, num_rows)
+        values = data.astype(np.float32)
+        mat = np.where(
+            data <= 64,
+            p0 + (p25 - p0) * values * np.float32(1.0 / 64.0),
+            np.where(data <= 192,
+                     p25 + (p75 - p25) * (values - np.float32(64.0))
+                     * np.float32(1.0 / 128.0),
+                     p75 + (p100 - p75) * (values - np.float32(192.0))
+                     * np.float32(1.0 / 63.0)))
+        return np.ascontiguousarray(mat.T, dtype=np.float32)
+    elif token == "CM2":
+        data = np.frombuffer(_read_exactly(fd, 2 * num_rows * num_cols),
+                             dtype='<u2').reshape(num_rows, num_cols)
+        return (min_value + value_range * np.float32(g_uint16_scale)
+                * data.astype(np.float32))
+    elif token == "CM3":
+        data = np.frombuffer(_read_exactly(fd, num_rows * num_cols),
+                             dtype=np.uint8).reshape(num_rows, num_cols)
+        return (min_value + value_range * np.float32(1.0 / 255.0)
+                * data.astype(np.float32))
+    raise Exception("Unknown compressed matrix format {0}".format(token))
+
+
+def _read_binary_object(fd):
+    """ Reads a binary Kaldi matrix or vector whose '\\0B' header has
+        already been read, and returns it as a numpy array (2-dimensional for
+        matrices, 1-dimensional for vectors). """
+    token = _read_token(fd)
+    if token in ["FM", "DM", "FV", "DV"]:
+        dtype = np.dtype('<f4' if token[0] == "F" else '<f8')
+        if token[1] == "M":
+            shape = (_read_int32(fd), _read_int32(fd))
+        else:
+            shape = (_read_int32(fd),)
+        num_elements = 1
+        for dim in shape:
+            num_elements *= dim
+        buf = _read_exactly(fd, num_elements * dtype.itemsize)
+        return np.frombuffer(buf, dtype=dtype).reshape(shape).astype(
+            dtype.newbyteorder('='), copy=False)
+    if token.startswith("CM"):
+        return _read_compressed_matrix(fd, token)
+    raise Exception("Unknown binary Kaldi object type '{0}'".format(token))
+
+
+def _read_object(fd):
+    header = _to_bytes(fd.read(2))
+    if header == b'\0B':
+        return _read_binary_object(fd)
+    return _parse_text_rows(_read_text_rows(fd, header))
+
+
+def read_matrix(file_or_fd):
+    """ Reads a Kaldi matrix, in text or binary format (including compressed
+        matrices), from a file or an opened file descriptor and returns it as
+        a 2-dimensional numpy array.  Text matrices and 'DM' matrices are
+        returned as float64, the others as float32.  A vector in text format
+        (e.g. " [ 1 2 3 ]") is read as a matrix with one row.
+    """
+    _check_numpy()
+    fd, opened = _open(file_or_fd, 'rb')
+    try:
+        mat = _read_object(fd)
+    finally:
+        if opened:
+            fd.close()
+    if mat.ndim != 2:
+        raise Exception("Expected a Kaldi matrix, got a vector")
+    return mat
+
+
+def read_vector(file_or_fd):
+    """ Reads a Kaldi vector, in text or binary format, from a file or an
+        opened file descriptor and returns it as a 1-dimensional numpy array.
+    """
+    _check_numpy()
+    fd, opened = _open(file_or_fd, 'rb')
+    try:
+        vec = _read_object(fd)
+    finally:
+        if opened:
+            fd.close()
+    if vec.ndim == 2:
+        if vec.shape[0] > 1:
+            raise Exception("Expected a Kaldi vector, got a matrix")
+        vec = vec.reshape(-1)
+    return vec
+
+
+def _read_ark(file_or_fd, reader):
+    _check_numpy()
+    fd, opened = _open(file_or_fd, 'rb')
+    try:
+        key = read_key(fd)
+        while key is not None:
+            yield key, reader(fd)
+            key = read_key(fd)
+    finally:
+        if opened:
+            fd.close()
+
+
+def read_mat_ark(file_or_fd):
+    """ Reads an archive of Kaldi matrices in text or binary format from a
+        file or an opened file descriptor, and yields (key, matrix) tuples
+        with the matrices as numpy arrays.
+
+        e.g.: mat_dict = { key: mat for key, mat in read_mat_ark(file) }
+    """
+    return _read_ark(file_or_fd, read_matrix)
+
+
+def read_vec_ark(file_or_fd):
+    """ Like read_mat_ark(), for an archive of vectors. """
+    return _read_ark(file_or_fd, read_vector)
+
+
+g_offset_regex = re.compile(r"^(.*):([0-9]+)(\[[0-9:,]*\])?$")
+g_range_regex = re.compile(r"^(.*)(\[[0-9:,]*\])$")
+
+
+def _parse_range(range_str):
+    """ Converts a kaldi range specifier like "[10:19]" (rows) or
+        "[10:19,0:12]" (rows, columns), in which the ends are inclusive, to
+        a tuple of slices. """
+    slices = []
+    for part in range_str[1:-1].split(","):
+        if part in ["", ":"]:
+            slices.append(slice(None))
+            continue
+        fields = part.split(":")
+        if len(fields) != 2:
+            raise Exception("Bad range specifier {0}".format(range_str))
+        slices.append(slice(int(fields[0]), int(fields[1]) + 1))
+    return tuple(slices)
+
+
+class RxfilenameReader(object):
+    """ Reads objects given by kaldi rxfilenames, as they appear in scp files:
+        "foo.ark:1234" (a byte offset into a file), "foo.mat" (a whole file),
+        "some command |" (the output of a command) and "-" (stdin), with an
+        optional range specifier like "[10:19]" or "[10:19,0:12]".
+
+        The files are kept open between calls, so that reading all the
+        entries of an scp file that point into a few large archives does not
+        reopen the archives for each entry; call close() when done, or use
+        the reader in a 'with' construct.
+    """
+
+    def __init__(self):
+        self.open_files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for fd in self.open_files.values():
+            fd.close()
+        self.open_files = {}
+
+    def read(self, rxfilename, reader=read_matrix):
+        """ Reads the object in 'rxfilename' using 'reader' (read_matrix or
+            read_vector). """
+        rxfilename = rxfilename.strip()
+        if rxfilename.endswith("|"):
+            p = subprocess.Popen(rxfilename[:-1], shell=True,
+                                 stdout=subprocess.PIPE)
+            try:
+                obj = reader(p.stdout)
+            finally:
+                p.stdout.close()
+                p.wait()
+            if p.returncode != 0:
+                raise Exception("Command exited with status {0}: "
+                                "{1}".format(p.returncode, rxfilename))
+            return obj
+
+        range_str = None
+        offset = None
+        m = g_offset_regex.match(rxfilename)
+        if m is not None:
+            path, offset, range_str = m.group(1), int(m.group(2)), m.group(3)
+        else:
+            m = g_range_regex.match(rxfilename)
+            if m is not None:
+                path, range_str = m.group(1), m.group(2)
+            else:
+                path = rxfilename
+
+        if path == "-":
+            obj = reader(getattr(sys.stdin, 'buffer', sys.stdin))
+        else:
+            fd = self.open_files.get(path)
+            if fd is None:
+                fd = open(path, 'rb')
+                self.open_files[path] = fd
+            fd.seek(offset if offset is not None else 0)
+            obj = reader(fd)
+        if range_str is not None:
+            obj = obj[_parse_range(range_str)]
+        return obj
+
+
+def _read_scp(file_or_fd, reader):
+    _check_numpy()
+    fd, opened = _open(file_or_fd, 'r')
+    try:
+        with RxfilenameReader() as rx_reader:
+            for line in fd:
+                parts = line.split(None, 1)
+                if len(parts) == 0:
+                    continue
+                if len(parts) != 2:
+                    raise Exception("Bad line in scp file: {0}".format(line))
+                yield parts[0], rx_reader.read(parts[1], reader)
+    finally:
+        if opened:
+            fd.close()
+
+
+def read_mat_scp(file_or_fd):
+    """ Reads the matrices listed in an scp file (lines of the form
+        "<key> <rxfilename>", e.g. "utt1 raw_mfcc.1.ark:12") and yields
+        (key, matrix) tuples with the matrices as numpy arrays.  Entries that
+        point into the same archive are read by seeking to their byte
+        offsets in one open file.
+    """
+    return _read_scp(file_or_fd, read_matrix)
+
+
+def read_vec_scp(file_or_fd):
+    """ Like read_mat_scp(), for an scp file of vectors. """
+    return _read_scp(file_or_fd, read_vector)
+
+
+def _write(fd, data):
+    if _is_text_fd(fd):
+        fd.write(data if isinstance(data, str) else data.decode())
+    else:
+        fd.write(data if isinstance(data, bytes) else data.encode())
+
+
+def _tell(fd):
+    try:
+        return fd.tell()
+    except (IOError, OSError, ValueError):
+        # e.g. a pipe
+        return None
+
+
+def _write_binary(fd, arr):
+    if _is_text_fd(fd):
+        raise Exception("Binary Kaldi objects cannot be written to a "
+                        "text-mode stream; open it in binary mode")
+    if arr.dtype == np.float32:
+        dtype, token = np.dtype('<f4'), b"F"
+    else:
+        dtype, token = np.dtype('<f8'), b"D"
+    header = [b'\0B', token, b"M " if arr.ndim == 2 else b"V "]
+    for dim in arr.shape:
+        header.append(struct.pack('<bi', 4, dim))
+    fd.write(b''.join(header))
+    fd.write(np.ascontiguousarray(arr, dtype=dtype).tobytes())
+
+
+def write_matrix(file_or_fd, mat, key=None, binary=False, float_format="%f"):
+    """ Writes the matrix 'mat' (a 2-dimensional numpy array or a list of
+        lists) in Kaldi text or binary format to a file or an opened file
+        descriptor.  If key is provided, then the matrix is written to an
+        archive with the 'key' as the index field.  In binary format,
+        float32 matrices are written as 'FM' and the others as 'DM'.
+
+        Returns the byte offset of the matrix in the output (i.e. what
+        follows the key in an scp file), or None if the output is not
+        seekable.
+    """
+    _check_numpy()
+    fd, opened = _open(file_or_fd, 'wb' if binary else 'w')
+    try:
+        if key is not None:
+            _write(fd, "{0} ".format(key))
+        offset = _tell(fd)
+        if binary:
+            arr = np.asarray(mat)
+            if arr.ndim == 1 and arr.size == 0:
+                arr = arr.reshape(0, 0)
+            if arr.ndim != 2:
+                raise Exception("All the rows of a matrix are expected to "
+                                "have the same length")
+            if arr.dtype != np.float32:
+                arr = arr.astype(np.float64)
+            _write_binary(fd, arr)
+        else:
+            _write(fd, _format_text_matrix(mat, float_format,
+                                           prefix="[" if key is not None
+                                           else " ["))
+    finally:
+        if opened:
+            fd.close()
+    return offset
+
+
+def _format_text_matrix(mat, float_format, prefix):
+    if hasattr(mat, 'tolist'):
+        mat = mat.tolist()
+    if len(mat) == 0:
+        return prefix + " ]\n"
+    num_cols = len(mat[0])
+    row_format = " ".join([float_format] * num_cols)
+    lines = [prefix]
+    for row in mat:
+        if len(row) != num_cols:
+            raise Exception("All the rows of a matrix are expected to "
+                            "have the same length")
+        lines.append(row_format % tuple(row))
+    lines[-1] += " ]"
+    lines.append("")
+    return "\n".join(lines)
+
+
+def write_vector(file_or_fd, vec, key=None, binary=False, float_format="%f"):
+    """ Writes the vector 'vec' (a 1-dimensional numpy array or a list) in
+        Kaldi text or binary format; see write_matrix(). """
+    _check_numpy()
+    fd, opened = _open(file_or_fd, 'wb' if binary else 'w')
+    try:
+        if key is not None:
+            _write(fd, "{0} ".format(key))
+        offset = _tell(fd)
+        if binary:
+            arr = np.asarray(vec).reshape(-1)
+            if arr.dtype != np.float32:
+                arr = arr.astype(np.float64)
+            _write_binary(fd, arr)
+        else:
+            if hasattr(vec, 'tolist'):
+                vec = vec.tolist()
+            _write(fd, "[ {0} ]\n".format(
+                " ".join([float_format % x for x in vec])))
+    finally:
+        if opened:
+            fd.close()
+    return offset
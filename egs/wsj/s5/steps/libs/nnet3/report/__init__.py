@@ -3,6 +3,7 @@
 # Copyright 2016    Vimal Manohar
 # Apache 2.0.
 
+from . import log_index
 from . import log_parse
 
-__all__ = ["log_parse"]
+__all__ = ["log_index", "log_parse"]
@@ -0,0 +1,297 @@
+# Apache 2.0.
+
+""" This module contains an index of the log files of an nnet3 experiment
+directory, used by log_parse.py and by the training scripts.
+
+Each log file is read once, in a single pass, and the records that the
+reports and plots need are extracted from it: the objective values from the
+compute_prob_{train,valid}.*.log files, the objective and the time from the
+train.*.*.log files, and the non-linearity stats, clipped proportions and
+parameter differences from the progress.*.log files.  The records are cached
+in memory and in a file in the log directory, keyed by the mtime and size of
+each log file, so that on later queries (e.g. the next time
+steps/nnet3/report/generate_plots.py is run, or the next iteration of
+training) only new or modified log files are parsed.
+"""
+
+from __future__ import division
+from __future__ import print_function
+import glob
+import logging
+import os
+import pickle
+import re
+from io import open
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# This is increased whenever the format of the records changes, so that old
+# cache files are ignored.
+g_cache_version = 1
+g_cache_file_name = ".log_index.cache"
+
+# The regular expressions below are the ones that were used on the output of
+# 'grep' over all the log files, so they expect the line to be prefixed by
+# "<log-file-name>:"; the lines are prefixed in the same way before they are
+# matched.
+g_train_accounting_regex = re.compile(
+    ".*train\.([0-9]+)\.([0-9]+)\.log:# "
+    "Accounting: time=([0-9]+) thread.*")
+g_train_objf_regex = re.compile(
+    "LOG .* Overall average objective function for "
+    "'output' is ([0-9e.\-+= ]+) over ([0-9e.\-+]+) frames")
+g_prob_regex = re.compile(
+    ".*compute_prob_.*\.([0-9]+).log:LOG "
+    ".nnet3.*compute-prob.*:PrintTotalStats..:"
+    "nnet.*diagnostics.cc:[0-9]+. Overall ([a-zA-Z\-]+) for "
+    "'([^']*)'.*is ([0-9.\-e]+) .*per frame")
+g_clipped_proportion_regex = re.compile(
+    ".*progress\.([0-9]+)\.log:component "
+    "name=(.*) type=.* "
+    "clipped-proportion=([0-9\.e\-]+)")
+g_param_diff_patterns = ["Relative parameter differences",
+                         "Parameter differences"]
+g_param_diff_regexes = dict(
+    [(pattern, re.compile(".*progress\.([0-9]+)\.log:"
+                          "LOG.*{0}.*\[(.*)\]".format(pattern)))
+     for pattern in g_param_diff_patterns])
+# these correspond to 'grep -e "value-avg.*deriv-avg.*oderiv"' and
+# 'grep -e "value-avg.*deriv-avg"'.
+g_oderiv_grep_regex = re.compile("value-avg.*deriv-avg.*oderiv")
+g_nonlin_grep_regex = re.compile("value-avg.*deriv-avg")
+
+
+def get_log_type(log_file):
+    """ Returns the type of the log file, as far as the index is concerned,
+        i.e. one of "train", "compute_prob", "progress", or None if it is not
+        indexed. """
+    name = os.path.basename(log_file)
+    if not name.endswith(".log"):
+        return None
+    if name.startswith("train."):
+        return "train"
+    if name.startswith("compute_prob_train.") or name.startswith(
+            "compute_prob_valid."):
+        return "compute_prob"
+    if name.startswith("progress."):
+        return "progress"
+    return None
+
+
+def parse_train_log(log_file):
+    """ Returns a dict with the records of a train.<iter>.<job>.log file:
+        'objf' is the last average objective for 'output' printed in it (or
+        None), 'time' the time from its 'Accounting' line (or None). """
+    name = os.path.basename(log_file)
+    records = {'objf': None, 'time': None}
+    with open(log_file, 'r', errors='replace') as f:
+        for line in f:
+            if "Overall average objective function" in line:
+                mat_obj = g_train_objf_regex.search(line)
+                if mat_obj is not None:
+                    records['objf'] = float(mat_obj.groups()[0].split()[-1])
+            elif "Accounting" in line:
+                mat_obj = g_train_accounting_regex.search(
+                    name + ":" + line.rstrip("\n"))
+                if mat_obj is not None:
+                    records['time'] = [int(mat_obj.groups()[0]),
+                                       int(mat_obj.groups()[1]),
+                                       float(mat_obj.groups()[2])]
+    return records
+
+
+def parse_compute_prob_log(log_file):
+    """ Returns a dict with the records of a compute_prob_{train,valid}.*.log
+        file: 'objf' is a list of (iter, objective-name, output-name, value)
+        in the order in which they appear, with 'value' as a string. """
+    name = os.path.basename(log_file)
+    records = {'objf': []}
+    with open(log_file, 'r', errors='replace') as f:
+        for line in f:
+            if "PrintTotalStats" not in line:
+                continue
+            mat_obj = g_prob_regex.search(name + ":" + line.rstrip("\n"))
+            if mat_obj is not None:
+                groups = mat_obj.groups()
+                records['objf'].append((int(groups[0]), groups[1], groups[2],
+                                        groups[3]))
+    return records
+
+
+def parse_progress_log(log_file):
+    """ Returns a dict with the records of a progress.<iter>.log file:
+        'nonlin': the groups of the matches of
+            log_parse.g_normal_nonlin_regex_pattern (or of
+            g_lstmp_nonlin_regex_pattern for LstmNonlinearity components),
+            for lines that contain value-avg and deriv-avg stats;
+        'nonlin_oderiv': the same for
+            g_normal_nonlin_regex_pattern_with_oderiv, for lines that also
+            contain oderiv-rms stats;
+        'has_oderiv': True if there were any lines of the latter kind;
+        'clipped_proportion': a list with an (iter, component-name,
+            proportion) tuple for each line that contains a
+            clipped-proportion, or the line itself (prefixed by the file
+            name) if it was malformed;
+        'param_diff': a dict from "Parameter differences" and
+            "Relative parameter differences" to a tuple (iter, string with
+            the differences per component) from the last such line.
+    """
+    # the import is done here to avoid a circular import.
+    import libs.nnet3.report.log_parse as log_parse
+    name = os.path.basename(log_file)
+    records = {'nonlin': [], 'nonlin_oderiv': [], 'has_oderiv': False,
+               'clipped_proportion': [], 'param_diff': {}}
+    with open(log_file, 'r', errors='replace') as f:
+        for line in f:
+            line = name + ":" + line.rstrip("\n")
+            if "value-avg" in line and "deriv-avg" in line:
+                for key, grep_regex, parse_regex in [
+                        ('nonlin', g_nonlin_grep_regex,
+                         log_parse.g_normal_nonlin_regex),
+                        ('nonlin_oderiv', g_oderiv_grep_regex,
+                         log_parse.g_normal_nonlin_regex_with_oderiv)]:
+                    if grep_regex.search(line) is None:
+                        continue
+                    if key == 'nonlin_oderiv':
+                        records['has_oderiv'] = True
+                    mat_obj = parse_regex.search(line)
+                    if mat_obj is None:
+                        continue
+                    groups = mat_obj.groups()
+                    if groups[2] == 'LstmNonlinearity':
+                        mat_obj = log_parse.g_lstmp_nonlin_regex.search(line)
+                        groups = mat_obj.groups()
+                    records[key].append(groups)
+            if "clipped-proportion" in line:
+                mat_obj = g_clipped_proportion_regex.search(line)
+                if (mat_obj is None
+                        or float(mat_obj.groups()[2]) > 1):
+                    records['clipped_proportion'].append(line)
+                else:
+                    groups = mat_obj.groups()
+                    records['clipped_proportion'].append(
+                        (int(groups[0]), groups[1], float(groups[2])))
+            if "differences" in line:
+                for pattern in g_param_diff_patterns:
+                    if pattern not in line:
+                        continue
+                    mat_obj = g_param_diff_regexes[pattern].search(line)
+                    if mat_obj is not None:
+                        records['param_diff'][pattern] = (
+                            int(mat_obj.groups()[0]), mat_obj.groups()[1])
+    return records
+
+
+g_log_parsers = {"train": parse_train_log,
+                 "compute_prob": parse_compute_prob_log,
+                 "progress": parse_progress_log}
+
+
+class LogIndex(object):
+    """ An index of the log files in the directory 'log_dir' (normally
+        <exp-dir>/log).
+
+        The records of a log file are obtained with get_records(), which
+        parses the file only if it was not seen before or has been modified
+        since.  update() brings the records of all the log files of a given
+        type up to date and saves the index to the cache file, if it has
+        changed.  If 'cache_file' is None, the index is only kept in memory.
+    """
+
+    def __init__(self, log_dir, cache_file=None):
+        self.log_dir = log_dir
+        self.cache_file = cache_file
+        # a dict from the name of the log file (without the directory) to
+        # a tuple (mtime, size, records)
+        self.entries = {}
+        self.modified = False
+        if cache_file is not None and os.path.exists(cache_file):
+            self.read_cache()
+
+    def read_cache(self):
+        try:
+            with open(self.cache_file, 'rb') as f:
+                [version, entries] = pickle.load(f)
+            if version == g_cache_version:
+                self.entries = entries
+        except Exception as e:
+            logger.warning("Ignoring the log index cache {0}, as there was "
+                           "an error reading it: {1}".format(
+                               self.cache_file, str(e)))
+
+    def write_cache(self):
+        """ Writes the index to the cache file if it has changed; failures
+            (e.g. if the directory is not writable) are only logged. """
+        if self.cache_file is None or not self.modified:
+            return
+        tmp_file = "{0}.{1}.tmp".format(self.cache_file, os.getpid())
+        try:
+            with open(tmp_file, 'wb') as f:
+                # protocol 2 can be read by both python2 and python3.
+                pickle.dump([g_cache_version, self.entries], f, protocol=2)
+            os.rename(tmp_file, self.cache_file)
+            self.modified = False
+        except (IOError, OSError) as e:
+            logger.debug("Could not write the log index cache {0}: "
+                         "{1}".format(self.cache_file, str(e)))
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def get_records(self, log_file):
+        """ Returns the records (see parse_*_log()) of 'log_file', which
+            must be in self.log_dir, parsing it if necessary.  Raises
+            IOError/OSError if it does not exist. """
+        name = os.path.basename(log_file)
+        log_type = get_log_type(name)
+        if log_type is None:
+            raise Exception("Log files like {0} are not indexed".format(
+                log_file))
+        stat = os.stat(os.path.join(self.log_dir, name))
+        entry = self.entries.get(name)
+        if (entry is not None and entry[0] == stat.st_mtime
+                and entry[1] == stat.st_size):
+            return entry[2]
+        records = g_log_parsers[log_type](os.path.join(self.log_dir, name))
+        self.entries[name] = (stat.st_mtime, stat.st_size, records)
+        self.modified = True
+        return records
+
+    def update(self, pattern):
+        """ Brings the records of the log files in self.log_dir that match
+            the glob 'pattern' (e.g. "progress.*.log") up to date, writes the
+            cache and returns a list of (file-name, records) sorted by
+            file name.  Files that no longer exist are dropped. """
+        names = sorted([os.path.basename(x) for x in
+                        glob.glob(os.path.join(self.log_dir, pattern))])
+        result = []
+        for name in names:
+            if get_log_type(name) is None:
+                continue
+            try:
+                result.append((name, self.get_records(name)))
+            except (IOError, OSError):
+                # e.g. the file was removed while we were reading the
+                # directory.
+                continue
+        for name in list(self.entries.keys()):
+            if not os.path.exists(os.path.join(self.log_dir, name)):
+                del self.entries[name]
+                self.modified = True
+        self.write_cache()
+        return result
+
+
+g_log_indexes = {}
+
+
+def get_log_index(log_dir, use_cache_file=True):
+    """ Returns the LogIndex of 'log_dir', which is created (and read from the
+        cache file <log_dir>/.log_index.cache, if use_cache_file is True) the
+        first time it is requested in this process. """
+    key = os.path.abspath(log_dir)
+    if key not in g_log_indexes:
+        cache_file = (os.path.join(log_dir, g_cache_file_name)
+                      if use_cache_file else None)
+        g_log_indexes[key] = LogIndex(log_dir, cache_file)
+    return g_log_indexes[key]
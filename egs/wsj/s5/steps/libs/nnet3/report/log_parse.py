@@ -12,6 +12,7 @@ import logging
 import re
 
 import libs.common as common_lib
+from . import log_index
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -45,6 +46,11 @@ g_normal_nonlin_regex_pattern_with_oderiv = ''.join([".*progress.([0-9]+).log:co
     "deriv-avg=\[.*=\((.+)\), mean=([0-9\.\-e]+), stddev=([0-9\.e\-]+)\].*",
     "oderiv-rms=\[.*=\((.+)\), mean=([0-9\.\-e]+), stddev=([0-9\.e\-]+)\]"])
 
+g_lstmp_nonlin_regex = re.compile(g_lstmp_nonlin_regex_pattern)
+g_normal_nonlin_regex = re.compile(g_normal_nonlin_regex_pattern)
+g_normal_nonlin_regex_with_oderiv = re.compile(
+    g_normal_nonlin_regex_pattern_with_oderiv)
+
 class KaldiLogParseException(Exception):
     """ An Exception class that throws an error when there is an issue in
     parsing the log files. Extend this class if more granularity is needed.
@@ -159,42 +165,30 @@ def parse_progress_logs_for_nonlinearity_stats(exp_dir):
     0.19,0.20,0.20,0.21), mean=0.134, stddev=0.0397]
     """
 
-    progress_log_files = "%s/log/progress.*.log" % (exp_dir)
+    index = log_index.get_log_index("{0}/log".format(exp_dir))
+    progress_logs = index.update("progress.*.log")
     stats_per_component_per_iter = {}
 
-    progress_log_lines = common_lib.get_command_stdout(
-        'grep -e "value-avg.*deriv-avg.*oderiv" {0}'.format(progress_log_files),
-        require_zero_status = False)
-
-    if progress_log_lines:
+    if any([records['has_oderiv'] for name, records in progress_logs]):
         # cases with oderiv-rms
-        parse_regex = re.compile(g_normal_nonlin_regex_pattern_with_oderiv)
+        key = 'nonlin_oderiv'
     else:
         # cases with only value-avg and deriv-avg
-        progress_log_lines = common_lib.get_command_stdout(
-        'grep -e "value-avg.*deriv-avg" {0}'.format(progress_log_files),
-        require_zero_status = False)
-        parse_regex = re.compile(g_normal_nonlin_regex_pattern)
-
-    for line in progress_log_lines.split("\n"):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is None:
-            continue
+        key = 'nonlin'
+
+    for name, records in progress_logs:
         # groups = ('9', 'Lstm3_i', 'Sigmoid', '0.05...0.99', '0.502', '0.23',
         # '0.009...0.21', '0.134', '0.0397')
-        groups = mat_obj.groups()
-        component_type = groups[2]
-        if component_type == 'LstmNonlinearity':
-            parse_regex_lstmp = re.compile(g_lstmp_nonlin_regex_pattern)
-            mat_obj = parse_regex_lstmp.search(line)
-            groups = mat_obj.groups()
-            assert len(groups) == 33
-            for i in list(range(0,5)):
-                fill_nonlin_stats_table_with_regex_result(groups, i,
+        for groups in records[key]:
+            component_type = groups[2]
+            if component_type == 'LstmNonlinearity':
+                assert len(groups) == 33
+                for i in list(range(0,5)):
+                    fill_nonlin_stats_table_with_regex_result(groups, i,
+                            stats_per_component_per_iter)
+            else:
+                fill_nonlin_stats_table_with_regex_result(groups, 0,
                         stats_per_component_per_iter)
-        else:
-            fill_nonlin_stats_table_with_regex_result(groups, 0,
-                    stats_per_component_per_iter)
     return stats_per_component_per_iter
 
 
@@ -225,37 +219,23 @@ def parse_progress_logs_for_clipped_proportion(exp_dir):
     self-repair-scale=1
     """
 
-    progress_log_files = "%s/log/progress.*.log" % (exp_dir)
-    component_names = set([])
-    progress_log_lines = common_lib.get_command_stdout(
-        'grep -e "{0}" {1}'.format(
-            "clipped-proportion", progress_log_files),
-        require_zero_status=False)
-    parse_regex = re.compile(".*progress\.([0-9]+)\.log:component "
-                             "name=(.*) type=.* "
-                             "clipped-proportion=([0-9\.e\-]+)")
+    index = log_index.get_log_index("{0}/log".format(exp_dir))
+    progress_logs = index.update("progress.*.log")
 
     cp_per_component_per_iter = {}
 
     max_iteration = 0
     component_names = set([])
-    for line in progress_log_lines.split("\n"):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is None:
-            if line.strip() == "":
-                continue
-            raise MalformedClippedProportionLineException(line)
-        groups = mat_obj.groups()
-        iteration = int(groups[0])
-        max_iteration = max(max_iteration, iteration)
-        name = groups[1]
-        clipped_proportion = float(groups[2])
-        if clipped_proportion > 1:
-            raise MalformedClippedProportionLineException(line)
-        if iteration not in cp_per_component_per_iter:
-            cp_per_component_per_iter[iteration] = {}
-        cp_per_component_per_iter[iteration][name] = clipped_proportion
-        component_names.add(name)
+    for log_name, records in progress_logs:
+        for record in records['clipped_proportion']:
+            if not isinstance(record, tuple):
+                raise MalformedClippedProportionLineException(record)
+            (iteration, name, clipped_proportion) = record
+            max_iteration = max(max_iteration, iteration)
+            if iteration not in cp_per_component_per_iter:
+                cp_per_component_per_iter[iteration] = {}
+            cp_per_component_per_iter[iteration][name] = clipped_proportion
+            component_names.add(name)
     component_names = list(component_names)
     component_names.sort()
 
@@ -308,22 +288,20 @@ def parse_progress_logs_for_param_diff(exp_dir, pattern):
                            "Parameter differences"]):
         raise Exception("Unknown value for pattern : {0}".format(pattern))
 
-    progress_log_files = "%s/log/progress.*.log" % (exp_dir)
+    index = log_index.get_log_index("{0}/log".format(exp_dir))
     progress_per_iter = {}
     component_names = set([])
-    progress_log_lines = common_lib.get_command_stdout(
-        'grep -e "{0}" {1}'.format(pattern, progress_log_files))
-    parse_regex = re.compile(".*progress\.([0-9]+)\.log:"
-                             "LOG.*{0}.*\[(.*)\]".format(pattern))
-    for line in progress_log_lines.split("\n"):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is None:
+    for log_name, records in index.update("progress.*.log"):
+        if pattern not in records['param_diff']:
             continue
-        groups = mat_obj.groups()
-        iteration = groups[0]
-        differences = parse_difference_string(groups[1])
+        (iteration, difference_string) = records['param_diff'][pattern]
+        differences = parse_difference_string(difference_string)
         component_names = component_names.union(list(differences.keys()))
-        progress_per_iter[int(iteration)] = differences
+        progress_per_iter[iteration] = differences
+    if not progress_per_iter:
+        raise KaldiLogParseException("Could not find any lines with {0} in "
+                                     "{1}/log/progress.*.log".format(
+                                         pattern, exp_dir))
 
     component_names = list(component_names)
     component_names.sort()
@@ -364,23 +342,17 @@ def parse_progress_logs_for_param_diff(exp_dir, pattern):
 
 
 def get_train_times(exp_dir):
-    train_log_files = "%s/log/" % (exp_dir)
-    train_log_names = "train.*.log"
-    train_log_lines = common_lib.get_command_stdout(
-        'find {0} -name "{1}" | xargs grep -H -e Accounting'.format(train_log_files,train_log_names))
-    parse_regex = re.compile(".*train\.([0-9]+)\.([0-9]+)\.log:# "
-                             "Accounting: time=([0-9]+) thread.*")
-
+    index = log_index.get_log_index("{0}/log".format(exp_dir))
     train_times = {}
-    for line in train_log_lines.split('\n'):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is not None:
-            groups = mat_obj.groups()
-            try:
-                train_times[int(groups[0])][int(groups[1])] = float(groups[2])
-            except KeyError:
-                train_times[int(groups[0])] = {}
-                train_times[int(groups[0])][int(groups[1])] = float(groups[2])
+    for log_name, records in index.update("train.*.log"):
+        if records['time'] is None:
+            continue
+        [iter, job, time] = records['time']
+        try:
+            train_times[iter][job] = time
+        except KeyError:
+            train_times[iter] = {}
+            train_times[iter][job] = time
     iters = train_times.keys()
     for iter in iters:
         values = train_times[iter].values()
@@ -390,10 +362,7 @@ def get_train_times(exp_dir):
 def parse_prob_logs(exp_dir, key='accuracy', output="output"):
     train_prob_files = "%s/log/compute_prob_train.*.log" % (exp_dir)
     valid_prob_files = "%s/log/compute_prob_valid.*.log" % (exp_dir)
-    train_prob_strings = common_lib.get_command_stdout(
-        'grep -e {0} {1}'.format(key, train_prob_files))
-    valid_prob_strings = common_lib.get_command_stdout(
-        'grep -e {0} {1}'.format(key, valid_prob_files))
+    index = log_index.get_log_index("{0}/log".format(exp_dir))
 
     # LOG
     # (nnet3-chain-compute-prob:PrintTotalStats():nnet-chain-diagnostics.cc:149)
@@ -405,31 +374,21 @@ def parse_prob_logs(exp_dir, key='accuracy', output="output"):
     # Overall log-probability for 'output' is -0.307255 per frame, over 20000
     # frames.
 
-    parse_regex = re.compile(
-        ".*compute_prob_.*\.([0-9]+).log:LOG "
-        ".nnet3.*compute-prob.*:PrintTotalStats..:"
-        "nnet.*diagnostics.cc:[0-9]+. Overall ([a-zA-Z\-]+) for "
-        "'{output}'.*is ([0-9.\-e]+) .*per frame".format(output=output))
-
     train_objf = {}
     valid_objf = {}
 
-    for line in train_prob_strings.split('\n'):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is not None:
-            groups = mat_obj.groups()
-            if groups[1] == key:
-                train_objf[int(groups[0])] = groups[2]
+    for log_name, records in index.update("compute_prob_train.*.log"):
+        for (iter, this_key, this_output, value) in records['objf']:
+            if this_key == key and this_output == output:
+                train_objf[iter] = value
     if not train_objf:
         raise KaldiLogParseException("Could not find any lines with {k} in "
                 " {l}".format(k=key, l=train_prob_files))
 
-    for line in valid_prob_strings.split('\n'):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is not None:
-            groups = mat_obj.groups()
-            if groups[1] == key:
-                valid_objf[int(groups[0])] = groups[2]
+    for log_name, records in index.update("compute_prob_valid.*.log"):
+        for (iter, this_key, this_output, value) in records['objf']:
+            if this_key == key and this_output == output:
+                valid_objf[iter] = value
 
     if not valid_objf:
         raise KaldiLogParseException("Could not find any lines with {k} in "
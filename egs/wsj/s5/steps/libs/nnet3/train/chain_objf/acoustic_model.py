@@ -16,6 +16,7 @@ import os
 import sys
 
 import libs.common as common_lib
+import libs.job_runner as job_runner
 import libs.nnet3.train.common as common_train_lib
 
 logger = logging.getLogger(__name__)
@@ -128,7 +129,7 @@ def train_new_models(dir, iter, srand, num_jobs,
                      shuffle_buffer_size, num_chunk_per_minibatch_str,
                      frame_subsampling_factor, run_opts, train_opts,
                      backstitch_training_scale=0.0, backstitch_training_interval=1,
-                     use_multitask_egs=False):
+                     use_multitask_egs=False, max_concurrent_jobs=None):
     """
     Called from train_one_iteration(), this method trains new models
     with 'num_jobs' jobs, and
@@ -145,6 +146,11 @@ def train_new_models(dir, iter, srand, num_jobs,
                         multilingual egs can be generated using get_egs.sh and
                         steps/nnet3/multilingual/allocate_multilingual_examples.py,
                         those are the top-level scripts.
+    max_concurrent_jobs : if not None, at most this many of the training
+                          jobs are run at the same time.
+
+    Returns the list of libs.job_runner.Job objects of the training jobs,
+    which contain the exit status and wall time of each job.
     """
 
     deriv_time_opts = []
@@ -155,7 +161,12 @@ def train_new_models(dir, iter, srand, num_jobs,
         deriv_time_opts.append("--optimization.max-deriv-time-relative={0}".format(
                                     int(max_deriv_time_relative)))
 
-    threads = []
+    # All the training jobs of the iteration are run from a single
+    # JobRunner: if one of them fails, the others are killed and an exception
+    # is raised here.
+    runner = job_runner.JobRunner(max_concurrent_jobs=max_concurrent_jobs,
+                                  name="train.{0}".format(iter))
+    jobs = []
     # the GPU timing info is only printed if we use the --verbose=1 flag; this
     # slows down the computation slightly, so don't accumulate it on every
     # iteration.  Don't do it on iteration 0 either, because we use a smaller
@@ -184,7 +195,7 @@ def train_new_models(dir, iter, srand, num_jobs,
                          (" --write-cache={0}/cache.{1}".format(dir, iter + 1)
                           if job == 1 else ""))
 
-        thread = common_lib.background_command(
+        jobs.append(runner.submit(
             """{command} {train_queue_opt} {dir}/log/train.{iter}.{job}.log \
                     nnet3-chain-train {parallel_train_opts} {verbose_opt} \
                     --apply-deriv-weights={app_deriv_wts} \
@@ -227,12 +238,13 @@ def train_new_models(dir, iter, srand, num_jobs,
                         num_chunk_per_mb=num_chunk_per_minibatch_str,
                         multitask_egs_opts=multitask_egs_opts,
                         scp_or_ark=scp_or_ark),
-            require_zero_status=True)
-
-        threads.append(thread)
+            name="train.{0}.{1}".format(iter, job), group="train"))
 
-    for thread in threads:
-        thread.join()
+    with runner:
+        runner.wait(jobs)
+    logger.debug("Training jobs of iteration {0}: {1}".format(
+        iter, job_runner.summarize_timing(jobs)))
+    return jobs
 
 
 def train_one_iteration(dir, iter, srand, egs_dir,
@@ -247,10 +259,15 @@ def train_one_iteration(dir, iter, srand, egs_dir,
                         frame_subsampling_factor,
                         run_opts, dropout_edit_string="", train_opts="",
                         backstitch_training_scale=0.0, backstitch_training_interval=1,
-                        use_multitask_egs=False):
+                        use_multitask_egs=False, background_runner=None):
     """ Called from steps/nnet3/chain/train.py for one iteration for
     neural network training with LF-MMI objective
 
+    background_runner : if not None, a libs.job_runner.JobRunner to which the
+                        diagnostic jobs (train/valid probabilities and
+                        progress logs) are submitted, instead of starting
+                        each of them in a thread of its own; it is not
+                        waited for here.
     """
 
     # Set off jobs doing some diagnostics, in the background.
@@ -278,11 +295,13 @@ def train_one_iteration(dir, iter, srand, egs_dir,
         dir=dir, iter=iter, egs_dir=egs_dir,
         l2_regularize=l2_regularize, xent_regularize=xent_regularize,
         leaky_hmm_coefficient=leaky_hmm_coefficient, run_opts=run_opts,
-        use_multitask_egs=use_multitask_egs)
+        use_multitask_egs=use_multitask_egs,
+        background_runner=background_runner)
 
     if iter > 0:
         # Runs in the background
-        compute_progress(dir, iter, run_opts)
+        compute_progress(dir, iter, run_opts,
+                         background_runner=background_runner)
 
     do_average = (iter > 0)
 
@@ -472,7 +491,8 @@ def prepare_initial_acoustic_model(dir, run_opts, srand=-1, input_model=None):
 def compute_train_cv_probabilities(dir, iter, egs_dir, l2_regularize,
                                    xent_regularize, leaky_hmm_coefficient,
                                    run_opts,
-                                   use_multitask_egs=False):
+                                   use_multitask_egs=False,
+                                   background_runner=None):
     model = '{0}/{1}.mdl'.format(dir, iter)
     scp_or_ark = "scp" if use_multitask_egs else "ark"
     egs_suffix = ".scp" if use_multitask_egs else ".cegs"
@@ -495,7 +515,8 @@ def compute_train_cv_probabilities(dir, iter, egs_dir, l2_regularize,
                    xent_reg=xent_regularize,
                    egs_dir=egs_dir,
                    multitask_egs_opts=multitask_egs_opts,
-                   scp_or_ark=scp_or_ark, egs_suffix=egs_suffix))
+                   scp_or_ark=scp_or_ark, egs_suffix=egs_suffix),
+        runner=background_runner)
 
     multitask_egs_opts = common_train_lib.get_multitask_egs_opts(
                              egs_dir,
@@ -514,10 +535,11 @@ def compute_train_cv_probabilities(dir, iter, egs_dir, l2_regularize,
                    xent_reg=xent_regularize,
                    egs_dir=egs_dir,
                    multitask_egs_opts=multitask_egs_opts,
-                   scp_or_ark=scp_or_ark, egs_suffix=egs_suffix))
+                   scp_or_ark=scp_or_ark, egs_suffix=egs_suffix),
+        runner=background_runner)
 
 
-def compute_progress(dir, iter, run_opts):
+def compute_progress(dir, iter, run_opts, background_runner=None):
 
     prev_model = '{0}/{1}.mdl'.format(dir, iter - 1)
     model = '{0}/{1}.mdl'.format(dir, iter)
@@ -530,7 +552,8 @@ def compute_progress(dir, iter, run_opts):
                    dir=dir,
                    iter=iter,
                    model=model,
-                   prev_model=prev_model))
+                   prev_model=prev_model),
+        runner=background_runner)
     if iter % 10 == 0 and iter > 0:
         # Every 10 iters, print some more detailed information.
         # full_progress.X.log contains some diagnostics of the difference in
@@ -542,7 +565,8 @@ def compute_progress(dir, iter, run_opts):
                    dir=dir,
                    iter=iter,
                    model=model,
-                   prev_model=prev_model))
+                   prev_model=prev_model),
+            runner=background_runner)
         # full_info.X.log is just the nnet3-info of the model, with the --verbose=2
         # option which includes stats on the singular values of the parameter matrices.
         common_lib.background_command(
@@ -551,7 +575,8 @@ def compute_progress(dir, iter, run_opts):
         """.format(command=run_opts.command,
                    dir=dir,
                    iter=iter,
-                   model=model))
+                   model=model),
+            runner=background_runner)
 
 
 
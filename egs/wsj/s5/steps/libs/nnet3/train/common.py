@@ -18,6 +18,7 @@ import re
 import shutil
 
 import libs.common as common_lib
+import libs.nnet3.report.log_index as log_index
 from libs.nnet3.train.dropout_schedule import *
 
 logger = logging.getLogger(__name__)
@@ -108,22 +109,16 @@ def get_successful_models(num_models, log_file_pattern,
                           difference_threshold=1.0):
     assert num_models > 0
 
-    parse_regex = re.compile(
-        "LOG .* Overall average objective function for "
-        "'output' is ([0-9e.\-+= ]+) over ([0-9e.\-+]+) frames")
+    # the log files are parsed through the log index, so that the
+    # report-generation code later does not have to parse them again.
+    index = log_index.get_log_index(os.path.dirname(log_file_pattern))
     objf = []
     for i in range(num_models):
         model_num = i + 1
         logfile = re.sub('%', str(model_num), log_file_pattern)
-        lines = open(logfile, 'r').readlines()
-        this_objf = -100000.0
-        for line_num in range(1, len(lines) + 1):
-            # we search from the end as this would result in
-            # lesser number of regex searches. Python regex is slow !
-            mat_obj = parse_regex.search(lines[-1 * line_num])
-            if mat_obj is not None:
-                this_objf = float(mat_obj.groups()[0].split()[-1])
-                break
+        this_objf = index.get_records(logfile)['objf']
+        if this_objf is None:
+            this_objf = -100000.0
         objf.append(this_objf)
     max_index = objf.index(max(objf))
     accepted_models = []
@@ -678,7 +673,14 @@ def clean_nnet_dir(nnet_dir, num_iters, egs_dir,
 
 def remove_model(nnet_dir, iter, num_iters, models_to_combine=None,
                  preserve_model_interval=100,
-                 get_raw_nnet_from_am=True):
+                 get_raw_nnet_from_am=True, runner=None):
+    """ Removes the model of iteration 'iter', unless it needs to be kept.
+
+    If 'runner' (a libs.job_runner.JobRunner, e.g. the one that runs the
+    diagnostic jobs) is specified, the removal is done by a job of that runner
+    that starts only after all the jobs currently submitted to it have
+    finished, since those may still need to read the model.
+    """
     if iter % preserve_model_interval == 0:
         return
     if models_to_combine is not None and iter in models_to_combine:
@@ -688,6 +690,13 @@ def remove_model(nnet_dir, iter, num_iters, models_to_combine=None,
     else:
         file_name = '{0}/{1}.raw'.format(nnet_dir, iter)
 
+    if runner is not None:
+        runner.submit("rm -f {0}".format(file_name),
+                      name="remove_model.{0}".format(iter),
+                      require_zero_status=False,
+                      after=runner.unfinished_jobs())
+        return
+
     if os.path.isfile(file_name):
         os.remove(file_name)
 
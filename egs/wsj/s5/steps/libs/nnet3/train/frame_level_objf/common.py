@@ -19,6 +19,7 @@ import random
 import time
 
 import libs.common as common_lib
+import libs.job_runner as job_runner
 import libs.nnet3.train.common as common_train_lib
 
 logger = logging.getLogger(__name__)
@@ -34,7 +35,8 @@ def train_new_models(dir, iter, srand, num_jobs,
                      run_opts, frames_per_eg=-1,
                      min_deriv_time=None, max_deriv_time_relative=None,
                      use_multitask_egs=False, train_opts="",
-                     backstitch_training_scale=0.0, backstitch_training_interval=1):
+                     backstitch_training_scale=0.0, backstitch_training_interval=1,
+                     max_concurrent_jobs=None):
     """ Called from train_one_iteration(), this model does one iteration of
     training with 'num_jobs' jobs, and writes files like
     exp/tdnn_a/24.{1,2,3,..<num_jobs>}.raw
@@ -64,6 +66,11 @@ def train_new_models(dir, iter, srand, num_jobs,
             be generated using get_egs.sh and
             steps/nnet3/multilingual/allocate_multilingual_examples.py, those
             are the top-level scripts.
+        max_concurrent_jobs: if not None, at most this many of the training
+            jobs are run at the same time.
+
+    Returns the list of libs.job_runner.Job objects of the training jobs,
+    which contain the exit status and wall time of each job.
     """
 
     chunk_level_training = False if frames_per_eg > 0 else True
@@ -76,7 +83,12 @@ def train_new_models(dir, iter, srand, num_jobs,
         deriv_time_opts.append("--optimization.max-deriv-time-relative={0}".format(
                            max_deriv_time_relative))
 
-    threads = []
+    # All the training jobs of the iteration are run from a single
+    # JobRunner: if one of them fails, the others are killed and an exception
+    # is raised here.
+    runner = job_runner.JobRunner(max_concurrent_jobs=max_concurrent_jobs,
+                                  name="train.{0}".format(iter))
+    jobs = []
 
     # the GPU timing info is only printed if we use the --verbose=1 flag; this
     # slows down the computation slightly, so don't accumulate it on every
@@ -134,8 +146,7 @@ def train_new_models(dir, iter, srand, num_jobs,
                 scp_or_ark=scp_or_ark,
                 multitask_egs_opts=multitask_egs_opts))
 
-        # note: the thread waits on that process's completion.
-        thread = common_lib.background_command(
+        jobs.append(runner.submit(
             """{command} {train_queue_opt} {dir}/log/train.{iter}.{job}.log \
                     nnet3-train {parallel_train_opts} {cache_io_opts} \
                      {verbose_opt} --print-interval=10 \
@@ -163,12 +174,13 @@ def train_new_models(dir, iter, srand, num_jobs,
                 deriv_time_opts=" ".join(deriv_time_opts),
                 raw_model=raw_model_string,
                 egs_rspecifier=egs_rspecifier),
-            require_zero_status=True)
-
-        threads.append(thread)
+            name="train.{0}.{1}".format(iter, job), group="train"))
 
-    for thread in threads:
-        thread.join()
+    with runner:
+        runner.wait(jobs)
+    logger.debug("Training jobs of iteration {0}: {1}".format(
+        iter, job_runner.summarize_timing(jobs)))
+    return jobs
 
 
 def train_one_iteration(dir, iter, srand, egs_dir,
@@ -181,7 +193,7 @@ def train_one_iteration(dir, iter, srand, egs_dir,
                         shrinkage_value=1.0, dropout_edit_string="",  train_opts="",
                         get_raw_nnet_from_am=True, use_multitask_egs=False,
                         backstitch_training_scale=0.0, backstitch_training_interval=1,
-                        compute_per_dim_accuracy=False):
+                        compute_per_dim_accuracy=False, background_runner=None):
     """ Called from steps/nnet3/train_*.py scripts for one iteration of neural
     network training
 
@@ -196,6 +208,10 @@ def train_one_iteration(dir, iter, srand, egs_dir,
         get_raw_nnet_from_am: If True, then the network is read and stored as
             acoustic model i.e. along with transition model e.g. 10.mdl
             as against a raw network e.g. 10.raw when the value is False.
+        background_runner: If not None, a libs.job_runner.JobRunner to which
+            the diagnostic jobs (train/valid probabilities and progress logs)
+            are submitted, instead of starting each of them in a thread of
+            its own; it is not waited for here.
     """
 
     # Set off jobs doing some diagnostics, in the background.
@@ -225,13 +241,15 @@ def train_one_iteration(dir, iter, srand, egs_dir,
         run_opts=run_opts,
         get_raw_nnet_from_am=get_raw_nnet_from_am,
         use_multitask_egs=use_multitask_egs,
-        compute_per_dim_accuracy=compute_per_dim_accuracy)
+        compute_per_dim_accuracy=compute_per_dim_accuracy,
+        background_runner=background_runner)
 
     if iter > 0:
         # Runs in the background
         compute_progress(dir=dir, iter=iter, egs_dir=egs_dir,
                          run_opts=run_opts,
-                         get_raw_nnet_from_am=get_raw_nnet_from_am)
+                         get_raw_nnet_from_am=get_raw_nnet_from_am,
+                         background_runner=background_runner)
 
     do_average = (iter > 0)
 
@@ -380,7 +398,8 @@ def compute_preconditioning_matrix(dir, egs_dir, num_lda_jobs, run_opts,
 def compute_train_cv_probabilities(dir, iter, egs_dir, run_opts,
                                    get_raw_nnet_from_am=True,
                                    use_multitask_egs=False,
-                                   compute_per_dim_accuracy=False):
+                                   compute_per_dim_accuracy=False,
+                                   background_runner=None):
     if get_raw_nnet_from_am:
         model = "{dir}/{iter}.mdl".format(dir=dir, iter=iter)
     else:
@@ -411,7 +430,8 @@ def compute_train_cv_probabilities(dir, iter, egs_dir, run_opts,
                                         iter=iter,
                                         egs_rspecifier=egs_rspecifier,
                                         opts=' '.join(opts), model=model,
-                                        multitask_egs_opts=multitask_egs_opts))
+                                        multitask_egs_opts=multitask_egs_opts),
+        runner=background_runner)
 
     egs_rspecifier = ("{0}:{1}/train_diagnostic{2}".format(
         scp_or_ark, egs_dir, egs_suffix))
@@ -432,12 +452,14 @@ def compute_train_cv_probabilities(dir, iter, egs_dir, run_opts,
                                         iter=iter,
                                         egs_rspecifier=egs_rspecifier,
                                         opts=' '.join(opts), model=model,
-                                        multitask_egs_opts=multitask_egs_opts))
+                                        multitask_egs_opts=multitask_egs_opts),
+        runner=background_runner)
 
 
 def compute_progress(dir, iter, egs_dir,
                      run_opts,
-                     get_raw_nnet_from_am=True):
+                     get_raw_nnet_from_am=True,
+                     background_runner=None):
     suffix = "mdl" if get_raw_nnet_from_am else "raw"
     prev_model = '{0}/{1}.{2}'.format(dir, iter - 1, suffix)
     model = '{0}/{1}.{2}'.format(dir, iter, suffix)
@@ -447,7 +469,8 @@ def compute_progress(dir, iter, egs_dir,
                     nnet3-info {model} '&&' \
                     nnet3-show-progress --use-gpu=no {prev_model} {model} """
         ''.format(command=run_opts.command, dir=dir,
-                  iter=iter, model=model, prev_model=prev_model))
+                  iter=iter, model=model, prev_model=prev_model),
+        runner=background_runner)
 
     if iter % 10 == 0 and iter > 0:
         # Every 10 iters, print some more detailed information.
@@ -460,7 +483,8 @@ def compute_progress(dir, iter, egs_dir,
                    dir=dir,
                    iter=iter,
                    model=model,
-                   prev_model=prev_model))
+                   prev_model=prev_model),
+            runner=background_runner)
         # full_info.X.log is just the nnet3-info of the model, with the --verbose=2
         # option which includes stats on the singular values of the parameter matrices.
         common_lib.background_command(
@@ -469,7 +493,8 @@ def compute_progress(dir, iter, egs_dir,
         """.format(command=run_opts.command,
                    dir=dir,
                    iter=iter,
-                   model=model))
+                   model=model),
+            runner=background_runner)
 
 
 
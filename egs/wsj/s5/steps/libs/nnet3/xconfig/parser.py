@@ -7,7 +7,11 @@
 
 from __future__ import print_function
 
+import glob
+import hashlib
 import logging
+import os
+import pickle
 import sys
 import libs.nnet3.xconfig.layers as xlayers
 import libs.nnet3.xconfig.utils as xutils
@@ -110,7 +114,7 @@ def xconfig_line_to_object(config_line, prev_layers = None):
         raise
 
 
-def get_model_component_info(model_filename):
+def get_model_component_info(model_filename, cache=None):
     """
     This function reads existing model (*.raw or *.mdl) and returns array
     of XconfigExistingLayer one per {input,output}-node or component-node
@@ -123,16 +127,44 @@ def get_model_component_info(model_filename):
          'component-node name=tdnn1.affine ... input-dim=1000 '
          'output-dim=500' ->
          'existing name=tdnn1.affine dim=500'
+
+    If 'cache' (an XconfigCache) is given, the names and dims of the nodes
+    are looked up in it by the hash of the contents of the model, and
+    nnet3-info is only run if they are not there.
     """
 
-    all_layers = []
     try:
         f = open(model_filename, 'r')
     except Exception as e:
         sys.exit("{0}: error reading model file '{1}'".format(sys.argv[0],
                                                               model_filename,
                                                               repr(e)))
+    f.close()
+
+    node_info = None
+    if cache is not None:
+        key = get_file_hash(model_filename)
+        node_info = cache.get('model', key)
+    if node_info is None:
+        node_info = get_model_node_info(model_filename)
+        if cache is not None:
+            cache.put('model', key, node_info)
+
+    all_layers = []
+    for layer_name, dim in node_info:
+        key_to_value = {'name': layer_name, 'dim': dim}
+        all_layers.append(xlayers.XconfigExistingLayer('existing', key_to_value, all_layers))
+    if len(all_layers) == 0:
+        raise RuntimeError("{0}: model filename '{1}' is empty.".format(
+            sys.argv[0], model_filename))
+    return all_layers
 
+
+def get_model_node_info(model_filename):
+    """ Returns a list of (name, dim) pairs, one per {input,output}-node or
+    component-node of the model, in the order in which nnet3-info prints
+    them; see get_model_component_info().
+    """
     # use nnet3-info to get component names in the model.
     out = common_lib.get_command_stdout("""nnet3-info {0} | grep '\-node' """
                                         """ """.format(model_filename))
@@ -142,8 +174,9 @@ def get_model_component_info(model_filename):
     # i.e. input-node name=input dim=40
     #   component-node name=tdnn1.affine component=tdnn1.affine input=lda
     #   input-dim=300 output-dim=512
-    layer_names = []
-    key_to_value = dict()
+    node_info = []
+    layer_names = set()
+    layer_name = None
     for line in out.split("\n"):
         parts = line.split(" ")
         dim = -1
@@ -160,16 +193,10 @@ def get_model_component_info(model_filename):
                     dim = int(value)
 
         if layer_name is not None and layer_name not in layer_names:
-            layer_names.append(layer_name)
-            key_to_value['name'] = layer_name
+            layer_names.add(layer_name)
             assert(dim != -1)
-            key_to_value['dim'] = dim
-            all_layers.append(xlayers.XconfigExistingLayer('existing', key_to_value, all_layers))
-    if len(all_layers) == 0:
-        raise RuntimeError("{0}: model filename '{1}' is empty.".format(
-            sys.argv[0], model_filename))
-    f.close()
-    return all_layers
+            node_info.append((layer_name, dim))
+    return node_info
 
 
 # This function reads xconfig file and returns it as a list of layers
@@ -180,7 +207,7 @@ def get_model_component_info(model_filename):
 # layers but are actual component node names from an existing neural net model
 # and created using get_model_component_info function).
 # 'existing' layers can be used as input to component-nodes in layers of xconfig file.
-def read_xconfig_file(xconfig_filename, existing_layers=None):
+def read_xconfig_file(xconfig_filename, existing_layers=None, cache=None):
     if existing_layers is None:
         existing_layers = []
     try:
@@ -188,11 +215,21 @@ def read_xconfig_file(xconfig_filename, existing_layers=None):
     except Exception as e:
         sys.exit("{0}: error reading xconfig file '{1}'; error was {2}".format(
             sys.argv[0], xconfig_filename, repr(e)))
+    lines = f.readlines()
+    f.close()
+
+    # If 'cache' (an XconfigCache) is given, the parsed layers are looked up in
+    # it by the hash of the contents of the xconfig file and of the existing
+    # layers.
+    if cache is not None:
+        key = cache.get_xconfig_key(lines, existing_layers)
+        all_layers = cache.get('xconfig', key)
+        if all_layers is not None:
+            existing_layers.extend(all_layers)
+            return all_layers
+
     all_layers = []
-    while True:
-        line = f.readline()
-        if line == '':
-            break
+    for line in lines:
         # the next call will raise an easy-to-understand exception if
         # it fails.
         this_layer = xconfig_line_to_object(line, existing_layers)
@@ -203,5 +240,123 @@ def read_xconfig_file(xconfig_filename, existing_layers=None):
     if len(all_layers) == 0:
         raise RuntimeError("{0}: xconfig file '{1}' is empty".format(
             sys.argv[0], xconfig_filename))
-    f.close()
+    if cache is not None:
+        cache.put('xconfig', key, all_layers)
     return all_layers
+
+
+# This is increased whenever the format of the cache entries changes, so that
+# old entries are ignored.
+g_cache_version = 1
+
+
+def get_file_hash(filename):
+    """ Returns the sha1 hash of the contents of the file 'filename', as a
+    hex string.
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(1 << 20)
+            if len(block) == 0:
+                break
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def get_code_hash():
+    """ Returns the sha1 hash of the source of the xconfig modules (this
+    directory), which is part of the key of the cached layers so that they are
+    not reused after the layer definitions have changed.
+    """
+    sha1 = hashlib.sha1()
+    for filename in sorted(glob.glob(os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        sha1.update(get_file_hash(filename).encode())
+    return sha1.hexdigest()
+
+
+class XconfigCache(object):
+    """ A cache of the results of get_model_component_info() and
+    read_xconfig_file(), for programs that generate configs for many xconfig
+    files (see the --batch-file option of steps/nnet3/xconfig_to_configs.py).
+
+    The node names and dims of models are keyed by the hash of the contents
+    of the model file; the parsed layers of xconfig files by the hash of the
+    contents of the xconfig file, of the existing layers it may refer to and
+    of the source of the xconfig modules.  The entries are kept in memory in
+    pickled form, so that every lookup returns a new copy of them (the layers
+    are modified later on, e.g. by normalize_descriptors()).  If 'cache_dir'
+    is not None, they are also stored there, one file per entry, so that they
+    can be reused by later invocations; errors reading or writing the
+    directory are only logged.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        # a dict from '<kind>.<key>' to the pickled [version, value].
+        self.entries = {}
+        self.code_hash = get_code_hash()
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # e.g. it was created by another process in the meantime.
+                if not os.path.isdir(cache_dir):
+                    raise
+
+    def get_xconfig_key(self, lines, existing_layers):
+        sha1 = hashlib.sha1()
+        sha1.update(self.code_hash.encode())
+        for layer in existing_layers:
+            sha1.update('{0}\n'.format(layer).encode())
+        sha1.update(b'\n')
+        for line in lines:
+            sha1.update(line.encode())
+        return sha1.hexdigest()
+
+    def get(self, kind, key):
+        """ Returns a copy of the value stored for 'key' of type 'kind' (e.g.
+        'model' or 'xconfig'), or None if there is none. """
+        name = '{0}.{1}'.format(kind, key)
+        data = self.entries.get(name)
+        if data is None and self.cache_dir is not None:
+            filename = os.path.join(self.cache_dir, name)
+            if os.path.exists(filename):
+                try:
+                    with open(filename, 'rb') as f:
+                        data = f.read()
+                except (IOError, OSError) as e:
+                    logging.warning("Could not read the xconfig cache file "
+                                    "{0}: {1}".format(filename, str(e)))
+        if data is None:
+            return None
+        try:
+            [version, value] = pickle.loads(data)
+        except Exception as e:
+            logging.warning("Ignoring the xconfig cache entry {0}, as there "
+                            "was an error reading it: {1}".format(name, str(e)))
+            return None
+        if version != g_cache_version:
+            return None
+        self.entries[name] = data
+        return value
+
+    def put(self, kind, key, value):
+        name = '{0}.{1}'.format(kind, key)
+        data = pickle.dumps([g_cache_version, value],
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        self.entries[name] = data
+        if self.cache_dir is None:
+            return
+        filename = os.path.join(self.cache_dir, name)
+        tmp_file = '{0}.{1}.tmp'.format(filename, os.getpid())
+        try:
+            with open(tmp_file, 'wb') as f:
+                f.write(data)
+            os.rename(tmp_file, filename)
+        except (IOError, OSError) as e:
+            logging.warning("Could not write the xconfig cache file "
+                            "{0}: {1}".format(filename, str(e)))
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
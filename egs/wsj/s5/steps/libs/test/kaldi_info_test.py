@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+# Apache 2.0
+
+""" Tests for libs/kaldi_info.py.  The Kaldi objects are written here the way
+Kaldi's WriteToken(), WriteBasicType() and WriteIntegerVector() write them
+(see src/base/io-funcs-inl.h), in binary and text mode, so that the tests do
+not need the Kaldi binaries.
+
+Usage (from egs/wsj/s5):
+    python steps/libs/test/kaldi_info_test.py
+"""
+
+from __future__ import print_function
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..'))
+import libs.common as common_lib
+import libs.kaldi_info as kaldi_info
+
+
+class KaldiWriter(object):
+    """ Writes the basic types of Kaldi objects in binary or text mode. """
+
+    def __init__(self, binary):
+        self.binary = binary
+        self.parts = [b'\0B'] if binary else []
+
+    def token(self, token):
+        self.parts.append(token.encode() + b' ')
+
+    def int32(self, value):
+        self.parts.append(struct.pack('<bi', 4, value) if self.binary
+                          else '{0} '.format(value).encode())
+
+    def uint32(self, value):
+        # the size byte of unsigned types is negative.
+        self.parts.append(struct.pack('<bI', -4, value) if self.binary
+                          else '{0} '.format(value).encode())
+
+    def float(self, value):
+        self.parts.append(struct.pack('<bf', 4, value) if self.binary
+                          else '{0} '.format(value).encode())
+
+    def int_vector(self, values):
+        if self.binary:
+            self.parts.append(struct.pack('<bi', 4, len(values)))
+            self.parts.append(struct.pack('<{0}i'.format(len(values)),
+                                          *values))
+        else:
+            self.parts.append('[ {0} ] '.format(
+                ' '.join(str(v) for v in values)).encode())
+
+    def newline(self):
+        if not self.binary:
+            self.parts.append(b'\n')
+
+    def write(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(b''.join(self.parts))
+
+
+def write_event_map(writer, event_map):
+    """ Writes 'event_map', a nested tuple: ('CE', answer),
+        ('TE', key, [event-maps]), ('SE', key, yes-set, yes, no) or None, as
+        EventMap::Write() does. """
+    if event_map is None:
+        writer.token("NULL")
+    elif event_map[0] == 'CE':
+        writer.token("CE")
+        writer.int32(event_map[1])
+    elif event_map[0] == 'TE':
+        writer.token("TE")
+        writer.int32(event_map[1])
+        writer.uint32(len(event_map[2]))
+        writer.token("(")
+        for child in event_map[2]:
+            write_event_map(writer, child)
+        writer.token(")")
+    else:
+        assert event_map[0] == 'SE'
+        writer.token("SE")
+        writer.int32(event_map[1])
+        writer.int_vector(event_map[2])
+        writer.token("{")
+        write_event_map(writer, event_map[3])
+        write_event_map(writer, event_map[4])
+        writer.token("}")
+
+
+def write_tree(filename, binary, to_pdf):
+    writer = KaldiWriter(binary)
+    writer.token("ContextDependency")
+    writer.int32(3)  # N
+    writer.int32(1)  # P
+    writer.token("ToPdf")
+    write_event_map(writer, to_pdf)
+    writer.token("EndContextDependency")
+    writer.newline()
+    writer.write(filename)
+
+
+# a tree like the ones from build-tree: a table on the central phone (key 1,
+# with phone 0 unused), splits on the left and right phones (keys 0 and 2),
+# and tables on the pdf-class (key -1).  The largest pdf-id is 9.
+g_tree = ('TE', 1, [
+    None,
+    ('TE', -1, [('CE', 0), ('CE', 1), ('CE', 2)]),
+    ('SE', 0, [1, 3],
+     ('TE', -1, [('CE', 3), ('CE', 4), ('CE', 5)]),
+     ('SE', 2, [2], ('TE', -1, [('CE', 6), ('CE', 9), ('CE', 7)]),
+      ('CE', 8))),
+    ('CE', 2)])
+
+
+def write_model(filename, binary, is_hmm):
+    """ Writes the transition model (followed by some junk instead of the
+        acoustic model) of a 3-state topology for phones 1 and 2 and a
+        1-state topology for phone 3; the largest pdf-id is 11 (or 12 if not
+        'is_hmm'). """
+    # each entry is a list of (forward-pdf-class, self-loop-pdf-class,
+    # [(dest-state, prob)]).
+    entries = [
+        [(0, 0, [(0, 0.75), (1, 0.25)]), (1, 1, [(1, 0.75), (2, 0.25)]),
+         (2, 2, [(2, 0.75), (3, 0.25)]), (-1, -1, [])],
+        [(0, 1, [(0, 0.5), (1, 0.5)]), (-1, -1, [])]]
+    phone2idx = [-1, 0, 0, 1]
+    tuples = [(1, 0, 0, 0), (1, 1, 1, 1), (1, 2, 2, 2),
+              (2, 0, 3, 3), (2, 1, 11, 4), (2, 2, 5, 5),
+              (3, 0, 6, 7 if is_hmm else 12)]
+    writer = KaldiWriter(binary)
+    writer.token("<TransitionModel>")
+    writer.newline()
+    writer.token("<Topology>")
+    writer.newline()
+    if binary:
+        writer.int_vector([1, 2, 3])
+        writer.int_vector(phone2idx)
+        if not is_hmm:
+            writer.int32(-1)
+        writer.int32(len(entries))
+        for entry in entries:
+            writer.int32(len(entry))
+            for forward_pdf_class, self_loop_pdf_class, transitions in entry:
+                writer.int32(forward_pdf_class)
+                if not is_hmm:
+                    writer.int32(self_loop_pdf_class)
+                writer.int32(len(transitions))
+                for dest_state, prob in transitions:
+                    writer.int32(dest_state)
+                    writer.float(prob)
+    else:
+        for i, entry in enumerate(entries):
+            writer.token("<TopologyEntry>")
+            writer.token("<ForPhones>")
+            for phone, idx in enumerate(phone2idx):
+                if idx == i:
+                    writer.int32(phone)
+            writer.token("</ForPhones>")
+            for j, (forward_pdf_class, self_loop_pdf_class,
+                    transitions) in enumerate(entry):
+                writer.token("<State>")
+                writer.int32(j)
+                if forward_pdf_class != -1:
+                    if is_hmm:
+                        writer.token("<PdfClass>")
+                        writer.int32(forward_pdf_class)
+                    else:
+                        writer.token("<ForwardPdfClass>")
+                        writer.int32(forward_pdf_class)
+                        writer.token("<SelfLoopPdfClass>")
+                        writer.int32(self_loop_pdf_class)
+                for dest_state, prob in transitions:
+                    writer.token("<Transition>")
+                    writer.int32(dest_state)
+                    writer.float(prob)
+                writer.token("</State>")
+                writer.newline()
+            writer.token("</TopologyEntry>")
+            writer.newline()
+    writer.token("</Topology>")
+    writer.newline()
+    writer.token("<Triples>" if is_hmm else "<Tuples>")
+    writer.int32(len(tuples))
+    writer.newline()
+    for t in tuples:
+        for value in (t[:3] if is_hmm else t):
+            writer.int32(value)
+        writer.newline()
+    writer.token("</Triples>" if is_hmm else "</Tuples>")
+    writer.token("<LogProbs>")
+    writer.parts.append(b'junk')
+    writer.write(filename)
+
+
+class KaldiInfoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        kaldi_info.g_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_tree(self):
+        for binary in [True, False]:
+            tree = os.path.join(self.dir, "tree")
+            write_tree(tree, binary, g_tree)
+            self.assertEqual(kaldi_info.get_num_pdfs_from_tree(tree), 10)
+            # this must not need tree-info, which is not on the path here.
+            self.assertEqual(common_lib.get_number_of_leaves_from_tree(
+                self.dir), 10)
+            kaldi_info.g_cache.clear()
+
+    def test_small_trees(self):
+        for binary in [True, False]:
+            for to_pdf, num_pdfs in [(('CE', 4), 5),
+                                     (('SE', 1, [2], ('CE', 0), ('CE', 1)), 2),
+                                     (('TE', -1, [None, ('CE', 6)]), 7),
+                                     (None, 0)]:
+                tree = os.path.join(self.dir, "tree")
+                write_tree(tree, binary, to_pdf)
+                kaldi_info.g_cache.clear()
+                self.assertEqual(kaldi_info.get_num_pdfs_from_tree(tree),
+                                 num_pdfs)
+
+    def test_table_size_as_int32(self):
+        # a TE size written with the size byte of an int32 is also accepted.
+        writer = KaldiWriter(True)
+        writer.uint32 = writer.int32
+        writer.token("ContextDependency")
+        writer.int32(3)
+        writer.int32(1)
+        writer.token("ToPdf")
+        write_event_map(writer, ('TE', -1, [('CE', 0), ('CE', 2)]))
+        writer.token("EndContextDependency")
+        tree = os.path.join(self.dir, "tree")
+        writer.write(tree)
+        self.assertEqual(kaldi_info.get_num_pdfs_from_tree(tree), 3)
+
+    def test_bad_tree(self):
+        tree = os.path.join(self.dir, "tree")
+        writer = KaldiWriter(True)
+        writer.token("ContextDependency")
+        writer.int32(3)
+        writer.int32(1)
+        writer.token("ToPdf")
+        writer.token("XE")
+        writer.write(tree)
+        self.assertRaises(Exception, kaldi_info.get_num_pdfs_from_tree, tree)
+
+    def test_model(self):
+        for binary in [True, False]:
+            for is_hmm, num_pdfs in [(True, 12), (False, 13)]:
+                model = os.path.join(self.dir, "final.mdl")
+                write_model(model, binary, is_hmm)
+                kaldi_info.g_cache.clear()
+                self.assertEqual(kaldi_info.get_num_pdfs_from_model(model),
+                                 num_pdfs)
+                self.assertEqual(common_lib.get_number_of_leaves_from_model(
+                    self.dir), num_pdfs)
+
+    def test_matrix_dim_from_scp(self):
+        ark = os.path.join(self.dir, "feats.ark")
+        with open(ark, 'wb') as f:
+            f.write(b'utt1 \0BFM ' + struct.pack('<bibi', 4, 2, 4, 3) +
+                    struct.pack('<6f', *range(6)))
+            offset = f.tell() + len(b'utt2 ')
+            f.write(b'utt2  [\n 1 2 3 4 5\n 6 7 8 9 10 ]\n')
+        scp = os.path.join(self.dir, "feats.scp")
+        for rxfilename, dim in [("{0}:5".format(ark), 3),
+                                ("{0}:{1}".format(ark, offset), 5),
+                                ("{0}:5[0:1,1:2]".format(ark), 2)]:
+            with open(scp, 'w') as f:
+                f.write("utt1 {0}\n".format(rxfilename))
+            kaldi_info.g_cache.clear()
+            self.assertEqual(kaldi_info.get_matrix_dim_from_scp(scp), dim)
+            self.assertEqual(common_lib.get_feat_dim_from_scp(scp), dim)
+
+    def test_cache(self):
+        tree = os.path.join(self.dir, "tree")
+        write_tree(tree, True, ('CE', 4))
+        self.assertEqual(kaldi_info.get_num_pdfs_from_tree(tree), 5)
+        # a changed file (here, of a different size) is read again.
+        write_tree(tree, True, ('SE', 1, [2], ('CE', 0), ('CE', 7)))
+        self.assertEqual(kaldi_info.get_num_pdfs_from_tree(tree), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
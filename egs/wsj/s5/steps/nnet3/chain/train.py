@@ -20,6 +20,7 @@ import traceback
 sys.path.insert(0, 'steps')
 import libs.nnet3.train.common as common_train_lib
 import libs.common as common_lib
+import libs.job_runner as job_runner
 import libs.nnet3.train.chain_objf.acoustic_model as chain_lib
 import libs.nnet3.report.log_parse as nnet3_log_parse
 
@@ -163,6 +164,21 @@ def get_args():
                         steps/nnet3/get_saturation.pl) exceeds this threshold
                         we scale the parameter matrices with the
                         shrink-value.""")
+    parser.add_argument("--trainer.pipelined-iterations", type=str,
+                        dest='pipelined_iterations', default=False,
+                        action=common_lib.StrToBoolAction,
+                        choices=["true", "false"],
+                        help="""If true, the diagnostic jobs of each iteration
+                        (train/valid objectives and progress logs) and the
+                        removal of old models are run in a background lane
+                        that never delays the launch of the training jobs of
+                        the next iteration; see
+                        --trainer.max-background-jobs.""")
+    parser.add_argument("--trainer.max-background-jobs", type=int,
+                        dest='max_background_jobs', default=4,
+                        help="""With --trainer.pipelined-iterations=true, the
+                        maximum number of diagnostic jobs that run at the same
+                        time; further jobs wait for a free slot.""")
     # RNN-specific training options
     parser.add_argument("--trainer.deriv-truncate-margin", type=int,
                         dest='deriv_truncate_margin', default=None,
@@ -225,6 +241,10 @@ def process_args(args):
             "--trainer.deriv-truncate-margin.".format(
                 args.deriv_truncate_margin))
 
+    if args.max_background_jobs < 1:
+        raise Exception("--trainer.max-background-jobs should have a minimum "
+                        "value of 1")
+
     if (not os.path.exists(args.dir)):
         raise Exception("Directory specified with --dir={0} "
                         "does not exist.".format(args.dir))
@@ -484,130 +504,144 @@ def train(args, run_opts):
     logger.info("Training will run for {0} epochs = "
                 "{1} iterations".format(args.num_epochs, num_iters))
 
-    for iter in range(num_iters):
-        if (args.exit_stage is not None) and (iter == args.exit_stage):
-            logger.info("Exiting early due to --exit-stage {0}".format(iter))
-            return
-
-        current_num_jobs = common_train_lib.get_current_num_jobs(
-            iter, num_iters,
-            args.num_jobs_initial, args.num_jobs_step, args.num_jobs_final)
-
-        if args.stage <= iter:
-            model_file = "{dir}/{iter}.mdl".format(dir=args.dir, iter=iter)
-
-            lrate = common_train_lib.get_learning_rate(iter, current_num_jobs,
-                                                       num_iters,
-                                                       num_archives_processed,
-                                                       num_archives_to_process,
-                                                       args.initial_effective_lrate,
-                                                       args.final_effective_lrate)
-            shrinkage_value = 1.0 - (args.proportional_shrink * lrate)
-            if shrinkage_value <= 0.5:
-                raise Exception("proportional-shrink={0} is too large, it gives "
-                                "shrink-value={1}".format(args.proportional_shrink,
-                                                          shrinkage_value))
-            if args.shrink_value < shrinkage_value:
-                shrinkage_value = (args.shrink_value
-                                   if common_train_lib.should_do_shrinkage(
-                                       iter, model_file,
-                                       args.shrink_saturation_threshold)
-                                   else shrinkage_value)
-
-            percent = num_archives_processed * 100.0 / num_archives_to_process
-            epoch = (num_archives_processed * args.num_epochs
-                     / num_archives_to_process)
-            shrink_info_str = ''
-            if shrinkage_value != 1.0:
-                shrink_info_str = 'shrink: {0:0.5f}'.format(shrinkage_value)
-            logger.info("Iter: {0}/{1}   Jobs: {2}   "
-                        "Epoch: {3:0.2f}/{4:0.1f} ({5:0.1f}% complete)   "
-                        "lr: {6:0.6f}   {7}".format(iter, num_iters - 1,
-                                                    current_num_jobs,
-                                                    epoch, args.num_epochs,
-                                                    percent,
-                                                    lrate, shrink_info_str))
-
-            chain_lib.train_one_iteration(
-                dir=args.dir,
-                iter=iter,
-                srand=args.srand,
-                egs_dir=egs_dir,
-                num_jobs=current_num_jobs,
-                num_archives_processed=num_archives_processed,
-                num_archives=num_archives,
-                learning_rate=lrate,
-                dropout_edit_string=common_train_lib.get_dropout_edit_string(
-                    args.dropout_schedule,
-                    float(num_archives_processed) / num_archives_to_process,
-                    iter),
-                train_opts=' '.join(args.train_opts),
-                shrinkage_value=shrinkage_value,
-                num_chunk_per_minibatch_str=args.num_chunk_per_minibatch,
-                apply_deriv_weights=args.apply_deriv_weights,
-                min_deriv_time=min_deriv_time,
-                max_deriv_time_relative=max_deriv_time_relative,
-                l2_regularize=args.l2_regularize,
-                xent_regularize=args.xent_regularize,
-                leaky_hmm_coefficient=args.leaky_hmm_coefficient,
-                momentum=args.momentum,
-                max_param_change=args.max_param_change,
-                shuffle_buffer_size=args.shuffle_buffer_size,
-                frame_subsampling_factor=args.frame_subsampling_factor,
-                run_opts=run_opts,
-                backstitch_training_scale=args.backstitch_training_scale,
-                backstitch_training_interval=args.backstitch_training_interval,
-                use_multitask_egs=use_multitask_egs)
-
-            if args.cleanup:
-                # do a clean up everything but the last 2 models, under certain
-                # conditions
-                common_train_lib.remove_model(
-                    args.dir, iter-2, num_iters, models_to_combine,
-                    args.preserve_model_interval)
-
-            if args.email is not None:
-                reporting_iter_interval = num_iters * args.reporting_interval
-                if iter % reporting_iter_interval == 0:
-                    # lets do some reporting
-                    [report, times, data] = (
-                        nnet3_log_parse.generate_acc_logprob_report(
-                            args.dir, "log-probability"))
-                    message = report
-                    subject = ("Update : Expt {dir} : "
-                               "Iter {iter}".format(dir=args.dir, iter=iter))
-                    common_lib.send_mail(message, subject, args.email)
-
-        num_archives_processed = num_archives_processed + current_num_jobs
-
-    if args.stage <= num_iters:
-        if args.do_final_combination:
-            logger.info("Doing final combination to produce final.mdl")
-            chain_lib.combine_models(
-                dir=args.dir, num_iters=num_iters,
-                models_to_combine=models_to_combine,
-                num_chunk_per_minibatch_str=args.num_chunk_per_minibatch,
-                egs_dir=egs_dir,
-                leaky_hmm_coefficient=args.leaky_hmm_coefficient,
-                l2_regularize=args.l2_regularize,
-                xent_regularize=args.xent_regularize,
-                run_opts=run_opts,
-                max_objective_evaluations=args.max_objective_evaluations,
-                use_multitask_egs=use_multitask_egs)
-        else:
-            logger.info("Copying the last-numbered model to final.mdl")
-            common_lib.force_symlink("{0}.mdl".format(num_iters),
-                                     "{0}/final.mdl".format(args.dir))
-            chain_lib.compute_train_cv_probabilities(
-                dir=args.dir, iter=num_iters, egs_dir=egs_dir,
-                l2_regularize=args.l2_regularize, xent_regularize=args.xent_regularize,
-                leaky_hmm_coefficient=args.leaky_hmm_coefficient,
-                run_opts=run_opts,
-                use_multitask_egs=use_multitask_egs)
-            common_lib.force_symlink("compute_prob_valid.{iter}.log"
-                                     "".format(iter=num_iters),
-                                     "{dir}/log/compute_prob_valid.final.log".format(
-                                         dir=args.dir))
+    background_runner = None
+    if args.pipelined_iterations:
+        background_runner = job_runner.JobRunner(
+            max_concurrent_jobs=args.max_background_jobs, name="diagnostics")
+
+    try:
+        for iter in range(num_iters):
+            if (args.exit_stage is not None) and (iter == args.exit_stage):
+                logger.info("Exiting early due to --exit-stage {0}".format(iter))
+                return
+
+            current_num_jobs = common_train_lib.get_current_num_jobs(
+                iter, num_iters,
+                args.num_jobs_initial, args.num_jobs_step, args.num_jobs_final)
+
+            if args.stage <= iter:
+                model_file = "{dir}/{iter}.mdl".format(dir=args.dir, iter=iter)
+
+                lrate = common_train_lib.get_learning_rate(iter, current_num_jobs,
+                                                           num_iters,
+                                                           num_archives_processed,
+                                                           num_archives_to_process,
+                                                           args.initial_effective_lrate,
+                                                           args.final_effective_lrate)
+                shrinkage_value = 1.0 - (args.proportional_shrink * lrate)
+                if shrinkage_value <= 0.5:
+                    raise Exception("proportional-shrink={0} is too large, it gives "
+                                    "shrink-value={1}".format(args.proportional_shrink,
+                                                              shrinkage_value))
+                if args.shrink_value < shrinkage_value:
+                    shrinkage_value = (args.shrink_value
+                                       if common_train_lib.should_do_shrinkage(
+                                           iter, model_file,
+                                           args.shrink_saturation_threshold)
+                                       else shrinkage_value)
+
+                percent = num_archives_processed * 100.0 / num_archives_to_process
+                epoch = (num_archives_processed * args.num_epochs
+                         / num_archives_to_process)
+                shrink_info_str = ''
+                if shrinkage_value != 1.0:
+                    shrink_info_str = 'shrink: {0:0.5f}'.format(shrinkage_value)
+                logger.info("Iter: {0}/{1}   Jobs: {2}   "
+                            "Epoch: {3:0.2f}/{4:0.1f} ({5:0.1f}% complete)   "
+                            "lr: {6:0.6f}   {7}".format(iter, num_iters - 1,
+                                                        current_num_jobs,
+                                                        epoch, args.num_epochs,
+                                                        percent,
+                                                        lrate, shrink_info_str))
+
+                chain_lib.train_one_iteration(
+                    dir=args.dir,
+                    iter=iter,
+                    srand=args.srand,
+                    egs_dir=egs_dir,
+                    num_jobs=current_num_jobs,
+                    num_archives_processed=num_archives_processed,
+                    num_archives=num_archives,
+                    learning_rate=lrate,
+                    dropout_edit_string=common_train_lib.get_dropout_edit_string(
+                        args.dropout_schedule,
+                        float(num_archives_processed) / num_archives_to_process,
+                        iter),
+                    train_opts=' '.join(args.train_opts),
+                    shrinkage_value=shrinkage_value,
+                    num_chunk_per_minibatch_str=args.num_chunk_per_minibatch,
+                    apply_deriv_weights=args.apply_deriv_weights,
+                    min_deriv_time=min_deriv_time,
+                    max_deriv_time_relative=max_deriv_time_relative,
+                    l2_regularize=args.l2_regularize,
+                    xent_regularize=args.xent_regularize,
+                    leaky_hmm_coefficient=args.leaky_hmm_coefficient,
+                    momentum=args.momentum,
+                    max_param_change=args.max_param_change,
+                    shuffle_buffer_size=args.shuffle_buffer_size,
+                    frame_subsampling_factor=args.frame_subsampling_factor,
+                    run_opts=run_opts,
+                    backstitch_training_scale=args.backstitch_training_scale,
+                    backstitch_training_interval=args.backstitch_training_interval,
+                    use_multitask_egs=use_multitask_egs,
+                    background_runner=background_runner)
+
+                if args.cleanup:
+                    # do a clean up everything but the last 2 models, under certain
+                    # conditions
+                    common_train_lib.remove_model(
+                        args.dir, iter-2, num_iters, models_to_combine,
+                        args.preserve_model_interval,
+                        runner=background_runner)
+
+                if args.email is not None:
+                    reporting_iter_interval = num_iters * args.reporting_interval
+                    if iter % reporting_iter_interval == 0:
+                        # lets do some reporting
+                        [report, times, data] = (
+                            nnet3_log_parse.generate_acc_logprob_report(
+                                args.dir, "log-probability"))
+                        message = report
+                        subject = ("Update : Expt {dir} : "
+                                   "Iter {iter}".format(dir=args.dir, iter=iter))
+                        common_lib.send_mail(message, subject, args.email)
+
+            num_archives_processed = num_archives_processed + current_num_jobs
+
+        if args.stage <= num_iters:
+            if args.do_final_combination:
+                logger.info("Doing final combination to produce final.mdl")
+                chain_lib.combine_models(
+                    dir=args.dir, num_iters=num_iters,
+                    models_to_combine=models_to_combine,
+                    num_chunk_per_minibatch_str=args.num_chunk_per_minibatch,
+                    egs_dir=egs_dir,
+                    leaky_hmm_coefficient=args.leaky_hmm_coefficient,
+                    l2_regularize=args.l2_regularize,
+                    xent_regularize=args.xent_regularize,
+                    run_opts=run_opts,
+                    max_objective_evaluations=args.max_objective_evaluations,
+                    use_multitask_egs=use_multitask_egs)
+            else:
+                logger.info("Copying the last-numbered model to final.mdl")
+                common_lib.force_symlink("{0}.mdl".format(num_iters),
+                                         "{0}/final.mdl".format(args.dir))
+                chain_lib.compute_train_cv_probabilities(
+                    dir=args.dir, iter=num_iters, egs_dir=egs_dir,
+                    l2_regularize=args.l2_regularize, xent_regularize=args.xent_regularize,
+                    leaky_hmm_coefficient=args.leaky_hmm_coefficient,
+                    run_opts=run_opts,
+                    use_multitask_egs=use_multitask_egs)
+                common_lib.force_symlink("compute_prob_valid.{iter}.log"
+                                         "".format(iter=num_iters),
+                                         "{dir}/log/compute_prob_valid.final.log".format(
+                                             dir=args.dir))
+    finally:
+        if background_runner is not None:
+            # wait for the diagnostic jobs (also on --exit-stage or an
+            # error, as the runner's thread would not wait for them), which
+            # may still need models that the cleanup below removes.
+            background_runner.close()
 
     if args.cleanup:
         logger.info("Cleaning up the experiment directory "
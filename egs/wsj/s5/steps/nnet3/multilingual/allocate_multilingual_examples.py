@@ -38,11 +38,19 @@
         --lang2weight  "0.2,0.8" exp/lang1/egs.scp exp/lang2/egs.scp
         exp/multi/egs
 
+    The input scp files are indexed by the byte offsets of their blocks of
+    examples, so the output archives are independent of each other and can
+    be written in parallel (--num-jobs); the output does not depend on the
+    number of jobs.
 """
 
 import os, argparse, sys, random
+import heapq
+import itertools
 import logging
+import multiprocessing
 import traceback
+from array import array
 
 sys.path.insert(0, 'steps')
 
@@ -90,6 +98,9 @@ def get_args():
     parser.add_argument("--lang2weight", type=str,
                         help="Comma-separated list of weights, one per language. "
                         "The language order is as egs_scp_lists.")
+    parser.add_argument("--num-jobs", type=int, default=1,
+                        help="Number of processes used to write the output "
+                        "archives.")
 # now the positional arguments
     parser.add_argument("egs_scp_lists", nargs='+',
                         help="List of egs.scp files per input language."
@@ -104,28 +115,144 @@ def get_args():
     return args
 
 
-def read_lines(file_handle, num_lines):
-    n_read = 0
-    lines = []
-    while n_read < num_lines:
-        line = file_handle.readline()
-        if not line:
-            break
-        lines.append(line.strip())
-        n_read += 1
-    return lines
+def index_scp_file(scp_file, block_size):
+    """Returns a tuple (num_lines, block_offsets), where block_offsets is an
+    array with the byte offset of every block_size'th line of the file
+    'scp_file', i.e. the offsets at which the blocks of examples that are
+    read from this file start."""
+    num_lines = 0
+    offset = 0
+    block_offsets = array('q')
+    with open(scp_file, 'rb') as fh:
+        while True:
+            lines = fh.readlines(1 << 22)
+            if not lines:
+                break
+            # 'line_offsets' yields the offsets of the lines in 'lines'.
+            line_offsets = itertools.accumulate(map(len, lines),
+                                                initial=offset)
+            first = (-num_lines) % block_size
+            block_offsets.extend(itertools.islice(line_offsets, first,
+                                                  len(lines), block_size))
+            num_lines += len(lines)
+            offset = fh.tell()
+    return num_lines, block_offsets
+
+
+def allocate_blocks(lang_to_num_examples, num_archives, block_size):
+    """Decides which blocks of examples go to each of the output archives.
+    Returns a list with, for each archive, a list of tuples
+    (lang, first-line, num-lines), which says that lines first-line to
+    first-line + num-lines - 1 of the input scp file of 'lang' are to be
+    written to the archive, in that order.  The blocks are taken from the
+    language with the highest proportion of remaining examples."""
+    num_langs = len(lang_to_num_examples)
+    for lang in range(num_langs):
+        if lang_to_num_examples[lang] == 0:
+            raise Exception("There are no examples for language {0}"
+                            "".format(lang))
+
+    lang_to_num_remaining_egs = list(lang_to_num_examples)
+    num_remaining_egs = sum(lang_to_num_examples)
+    # The heap contains a tuple (-proportion of remaining examples, lang) for
+    # each language, so its top is the language with the highest
+    # proportion, or the first of them in case of a tie.
+    heap = [(-1.0, lang) for lang in range(num_langs)]
+    heapq.heapify(heap)
+
+    archives = [[] for archive_index in range(num_archives)]
+    for archive_index in range(num_archives + 1):  #  +1 is because we write to the last archive in two rounds
+        num_remaining_archives = num_archives - archive_index
+        num_remaining_blocks = float(num_remaining_egs) / block_size
+
+        last_round = (archive_index == num_archives)
+        if not last_round:
+            num_blocks_this_archive = int(round(float(num_remaining_blocks) / num_remaining_archives))
+            logger.info("Archive {} will contain {} blocks.".format(archive_index, num_blocks_this_archive))
+        else:  # This is the second round for the last archive. Flush all the remaining egs...
+            archive_index = num_archives - 1
+            num_blocks_this_archive = num_langs
+            logger.info("All the {} remaining egs will be written to the last archive.".format(num_remaining_egs))
 
+        blocks = archives[archive_index]
+        for block_index in range(num_blocks_this_archive):
+            lang = heap[0][1]
+            num_read = lang_to_num_examples[lang] - lang_to_num_remaining_egs[lang]
+            num_lines = min(block_size, lang_to_num_remaining_egs[lang])
+            if num_lines > 0:
+                blocks.append((lang, num_read, num_lines))
+
+            num_remaining_egs -= num_lines
+            lang_to_num_remaining_egs[lang] -= num_lines
+            heapq.heapreplace(heap, (-float(lang_to_num_remaining_egs[lang])
+                                     / lang_to_num_examples[lang], lang))
+    return archives, sum(lang_to_num_examples) - num_remaining_egs
+
+
+def write_archive(archive_index, blocks, scp_lists, block_offsets,
+                  lang2weight, egs_dir, egs_prefix, block_size):
+    """Writes the blocks of examples 'blocks' (see allocate_blocks()) to
+    the output files of archive 'archive_index'."""
+    in_scp_file_handles = {}
+    scp_lines = []
+    output_lines = []
+    weight_lines = []
+    try:
+        for lang, first_line, num_lines in blocks:
+            fh = in_scp_file_handles.get(lang)
+            if fh is None:
+                fh = open(scp_lists[lang], 'rb')
+                in_scp_file_handles[lang] = fh
+            # The blocks start at multiples of block_size lines.
+            fh.seek(block_offsets[lang][first_line // block_size])
+            example_lines = [line.strip() for line in
+                             itertools.islice(fh, num_lines)]
+            if len(example_lines) != num_lines:
+                raise Exception("Input scp file {0} is shorter than "
+                                "expected".format(scp_lists[lang]))
+            eg_ids = [eg_line.split()[0] for eg_line in example_lines]
+            output_suffix = " output-{0}\n".format(lang).encode()
+            weight_suffix = " {0}\n".format(lang2weight[lang]).encode()
+            scp_lines.extend(example_lines)
+            output_lines.extend([eg_id + output_suffix for eg_id in eg_ids])
+            weight_lines.extend([eg_id + weight_suffix for eg_id in eg_ids])
+    finally:
+        for fh in in_scp_file_handles.values():
+            fh.close()
+
+    with open('{0}/{1}{2}.scp'.format(egs_dir, egs_prefix, archive_index + 1), 'wb') as fh:
+        fh.write(b"".join([line + b"\n" for line in scp_lines]))
+    with open("{0}/{1}output.{2}.ark".format(egs_dir, egs_prefix, archive_index + 1), 'wb') as fh:
+        fh.write(b"".join(output_lines))
+    with open("{0}/{1}weight.{2}.ark".format(egs_dir, egs_prefix, archive_index + 1), 'wb') as fh:
+        fh.write(b"".join(weight_lines))
+    return archive_index
+
+
+# The arguments of write_archive() that are the same for all the archives;
+# they are set in the worker processes by _init_worker().
+_worker_args = None
+
+
+def _init_worker(args):
+    global _worker_args
+    _worker_args = args
+
+
+def _write_archive(archive):
+    archive_index, blocks = archive
+    return write_archive(archive_index, blocks, *_worker_args)
 
-def process_multilingual_egs(args):
-    args = get_args()
 
+def process_multilingual_egs(args):
     scp_lists = args.egs_scp_lists
     num_langs = len(scp_lists)
 
     lang_to_num_examples = [0] * num_langs
+    block_offsets = [None] * num_langs
     for lang in range(num_langs):
-        with open(scp_lists[lang]) as fh:
-            lang_to_num_examples[lang] = sum([1 for line in fh])
+        lang_to_num_examples[lang], block_offsets[lang] = index_scp_file(
+            scp_lists[lang], args.block_size)
         logger.info("Number of examples for language {0} "
                     "is {1}.".format(lang, lang_to_num_examples[lang]))
 
@@ -166,57 +293,30 @@ def process_multilingual_egs(args):
                                 blocks_per_archive_this_lang,
                                 warning))
 
-    in_scp_file_handles = [open(scp_lists[lang], 'r') for lang in range(num_langs)]
-
-    num_remaining_egs = tot_num_egs
-    lang_to_num_remaining_egs = [n for n in lang_to_num_examples]
-    for archive_index in range(num_archives + 1):  #  +1 is because we write to the last archive in two rounds
-        num_remaining_archives = num_archives - archive_index
-        num_remaining_blocks = float(num_remaining_egs) / args.block_size
-
-        last_round = (archive_index == num_archives)
-        if not last_round:
-            num_blocks_this_archive = int(round(float(num_remaining_blocks) / num_remaining_archives))
-            logger.info("Generating archive {} containing {} blocks...".format(archive_index, num_blocks_this_archive))
-        else:  # This is the second round for the last archive. Flush all the remaining egs...
-            archive_index = num_archives - 1
-            num_blocks_this_archive = num_langs
-            logger.info("Writing all the {} remaining egs to the last archive...".format(num_remaining_egs))
-
-        out_scp_file_handle = open('{0}/{1}{2}.scp'.format(args.egs_dir, args.egs_prefix, archive_index + 1),
-                                   'a' if last_round else 'w')
-        eg_to_output_file_handle = open("{0}/{1}output.{2}.ark".format(args.egs_dir, args.egs_prefix, archive_index + 1),
-                                        'a' if last_round else 'w')
-        eg_to_weight_file_handle = open("{0}/{1}weight.{2}.ark".format(args.egs_dir, args.egs_prefix, archive_index + 1),
-                                        'a' if last_round else 'w')
-
+    archives, num_egs_written = allocate_blocks(
+        lang_to_num_examples, num_archives, args.block_size)
+
+    worker_args = (scp_lists, block_offsets, lang2weight, args.egs_dir,
+                   args.egs_prefix, args.block_size)
+    if args.num_jobs > 1:
+        pool = multiprocessing.Pool(args.num_jobs, _init_worker,
+                                    (worker_args,))
+        try:
+            for archive_index in pool.imap_unordered(
+                    _write_archive, enumerate(archives)):
+                logger.info("Wrote archive {}.".format(archive_index))
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for archive_index, blocks in enumerate(archives):
+            write_archive(archive_index, blocks, *worker_args)
+            logger.info("Wrote archive {}.".format(archive_index))
 
-        for block_index in range(num_blocks_this_archive):
-            # Find the lang with the highest proportion of remaining examples
-            remaining_proportions = [float(remain) / tot for remain, tot in zip(lang_to_num_remaining_egs, lang_to_num_examples)]
-            lang_index, max_proportion = max(enumerate(remaining_proportions), key=lambda a: a[1])
-
-            # Read 'block_size' examples from the selected lang and write them to the current output scp file:
-            example_lines  = read_lines(in_scp_file_handles[lang_index], args.block_size)
-            for eg_line in example_lines:
-                eg_id = eg_line.split()[0]
-                print(eg_line, file=out_scp_file_handle)
-                print("{0} output-{1}".format(eg_id, lang_index), file=eg_to_output_file_handle)
-                print("{0} {1}".format(eg_id, lang2weight[lang_index]), file=eg_to_weight_file_handle)
-
-            num_remaining_egs -= len(example_lines)
-            lang_to_num_remaining_egs[lang_index] -= len(example_lines)
-
-        out_scp_file_handle.close()
-        eg_to_output_file_handle.close()
-        eg_to_weight_file_handle.close()
-
-    for handle in in_scp_file_handles:
-        handle.close()
     logger.info("Finished generating {0}*.scp, {0}output.*.ark "
                 "and {0}weight.*.ark files. Wrote a total of {1} examples "
                 "to {2} archives.".format(args.egs_prefix,
-                                          tot_num_egs - num_remaining_egs, num_archives))
+                                          num_egs_written, num_archives))
 
 
 def main():
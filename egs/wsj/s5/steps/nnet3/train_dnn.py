@@ -21,6 +21,7 @@ import traceback
 sys.path.insert(0, 'steps')
 import libs.nnet3.train.common as common_train_lib
 import libs.common as common_lib
+import libs.job_runner as job_runner
 import libs.nnet3.train.frame_level_objf as train_lib
 import libs.nnet3.report.log_parse as nnet3_log_parse
 
@@ -74,6 +75,21 @@ def get_args():
                         help="The prior computation jobs are single "
                         "threaded and run on the CPU")
 
+    parser.add_argument("--trainer.pipelined-iterations", type=str,
+                        dest='pipelined_iterations', default=False,
+                        action=common_lib.StrToBoolAction,
+                        choices=["true", "false"],
+                        help="""If true, the diagnostic jobs of each iteration
+                        (train/valid objectives and progress logs) and the
+                        removal of old models are run in a background lane
+                        that never delays the launch of the training jobs of
+                        the next iteration; see
+                        --trainer.max-background-jobs.""")
+    parser.add_argument("--trainer.max-background-jobs", type=int,
+                        dest='max_background_jobs', default=4,
+                        help="""With --trainer.pipelined-iterations=true, the
+                        maximum number of diagnostic jobs that run at the same
+                        time; further jobs wait for a free slot.""")
     # Parameters for the optimization
     parser.add_argument("--trainer.optimization.minibatch-size",
                         type=str, dest='minibatch_size', default='512',
@@ -116,6 +132,10 @@ def process_args(args):
     if not common_train_lib.validate_minibatch_size_str(args.minibatch_size):
         raise Exception("--trainer.rnn.num-chunk-per-minibatch has an invalid value")
 
+    if args.max_background_jobs < 1:
+        raise Exception("--trainer.max-background-jobs should have a minimum "
+                        "value of 1")
+
     if (not os.path.exists(args.dir)):
         raise Exception("Directory specified with --dir={0} "
                         "does not exist.".format(args.dir))
@@ -318,113 +338,126 @@ def train(args, run_opts):
     logger.info("Training will run for {0} epochs = "
                 "{1} iterations".format(args.num_epochs, num_iters))
 
-    for iter in range(num_iters):
-        if (args.exit_stage is not None) and (iter == args.exit_stage):
-            logger.info("Exiting early due to --exit-stage {0}".format(iter))
-            return
-
-        current_num_jobs = common_train_lib.get_current_num_jobs(
-            iter, num_iters,
-            args.num_jobs_initial, args.num_jobs_step, args.num_jobs_final)
-
-        if args.stage <= iter:
-            lrate = common_train_lib.get_learning_rate(iter, current_num_jobs,
-                                                       num_iters,
-                                                       num_archives_processed,
-                                                       num_archives_to_process,
-                                                       args.initial_effective_lrate,
-                                                       args.final_effective_lrate)
-            shrinkage_value = 1.0 - (args.proportional_shrink * lrate)
-            if shrinkage_value <= 0.5:
-                raise Exception("proportional-shrink={0} is too large, it gives "
-                                "shrink-value={1}".format(args.proportional_shrink,
-                                                          shrinkage_value))
-
-            percent = num_archives_processed * 100.0 / num_archives_to_process
-            epoch = (num_archives_processed * args.num_epochs
-                     / num_archives_to_process)
-            shrink_info_str = ''
-            if shrinkage_value != 1.0:
-                shrink_info_str = 'shrink: {0:0.5f}'.format(shrinkage_value)
-            logger.info("Iter: {0}/{1}   Jobs: {2}   "
-                        "Epoch: {3:0.2f}/{4:0.1f} ({5:0.1f}% complete)   "
-                        "lr: {6:0.6f}   {7}".format(iter, num_iters - 1,
-                                                    current_num_jobs,
-                                                    epoch, args.num_epochs,
-                                                    percent,
-                                                    lrate, shrink_info_str))
-
-            train_lib.common.train_one_iteration(
-                dir=args.dir,
-                iter=iter,
-                srand=args.srand,
-                egs_dir=egs_dir,
-                num_jobs=current_num_jobs,
-                num_archives_processed=num_archives_processed,
-                num_archives=num_archives,
-                learning_rate=lrate,
-                dropout_edit_string=common_train_lib.get_dropout_edit_string(
-                    args.dropout_schedule,
-                    float(num_archives_processed) / num_archives_to_process,
-                    iter),
-                train_opts=' '.join(args.train_opts),
-                minibatch_size_str=args.minibatch_size,
-                frames_per_eg=args.frames_per_eg,
-                momentum=args.momentum,
-                max_param_change=args.max_param_change,
-                shrinkage_value=shrinkage_value,
-                shuffle_buffer_size=args.shuffle_buffer_size,
-                run_opts=run_opts)
-
-            if args.cleanup:
-                # do a clean up everythin but the last 2 models, under certain
-                # conditions
-                common_train_lib.remove_model(
-                    args.dir, iter-2, num_iters, models_to_combine,
-                    args.preserve_model_interval)
-
-            if args.email is not None:
-                reporting_iter_interval = num_iters * args.reporting_interval
-                if iter % reporting_iter_interval == 0:
-                    # lets do some reporting
-                    [report, times, data] = (
-                        nnet3_log_parse.generate_acc_logprob_report(args.dir))
-                    message = report
-                    subject = ("Update : Expt {dir} : "
-                               "Iter {iter}".format(dir=args.dir, iter=iter))
-                    common_lib.send_mail(message, subject, args.email)
-
-        num_archives_processed = num_archives_processed + current_num_jobs
-
-    if args.stage <= num_iters:
-        if args.do_final_combination:
-            logger.info("Doing final combination to produce final.mdl")
-            train_lib.common.combine_models(
-                dir=args.dir, num_iters=num_iters,
-                models_to_combine=models_to_combine,
-                egs_dir=egs_dir,
-                minibatch_size_str=args.minibatch_size, run_opts=run_opts,
-                max_objective_evaluations=args.max_objective_evaluations)
-
-    if args.stage <= num_iters + 1:
-        logger.info("Getting average posterior for purposes of "
-                    "adjusting the priors.")
-
-        # If args.do_final_combination is true, we will use the combined model.
-        # Otherwise, we will use the last_numbered model.
-        real_iter = 'combined' if args.do_final_combination else num_iters
-        avg_post_vec_file = train_lib.common.compute_average_posterior(
-            dir=args.dir, iter=real_iter,
-            egs_dir=egs_dir, num_archives=num_archives,
-            prior_subset_size=args.prior_subset_size, run_opts=run_opts)
-
-        logger.info("Re-adjusting priors based on computed posteriors")
-        combined_or_last_numbered_model = "{dir}/{iter}.mdl".format(dir=args.dir,
-                iter=real_iter)
-        final_model = "{dir}/final.mdl".format(dir=args.dir)
-        train_lib.common.adjust_am_priors(args.dir, combined_or_last_numbered_model,
-                avg_post_vec_file, final_model, run_opts)
+    background_runner = None
+    if args.pipelined_iterations:
+        background_runner = job_runner.JobRunner(
+            max_concurrent_jobs=args.max_background_jobs, name="diagnostics")
 
+    try:
+        for iter in range(num_iters):
+            if (args.exit_stage is not None) and (iter == args.exit_stage):
+                logger.info("Exiting early due to --exit-stage {0}".format(iter))
+                return
+
+            current_num_jobs = common_train_lib.get_current_num_jobs(
+                iter, num_iters,
+                args.num_jobs_initial, args.num_jobs_step, args.num_jobs_final)
+
+            if args.stage <= iter:
+                lrate = common_train_lib.get_learning_rate(iter, current_num_jobs,
+                                                           num_iters,
+                                                           num_archives_processed,
+                                                           num_archives_to_process,
+                                                           args.initial_effective_lrate,
+                                                           args.final_effective_lrate)
+                shrinkage_value = 1.0 - (args.proportional_shrink * lrate)
+                if shrinkage_value <= 0.5:
+                    raise Exception("proportional-shrink={0} is too large, it gives "
+                                    "shrink-value={1}".format(args.proportional_shrink,
+                                                              shrinkage_value))
+
+                percent = num_archives_processed * 100.0 / num_archives_to_process
+                epoch = (num_archives_processed * args.num_epochs
+                         / num_archives_to_process)
+                shrink_info_str = ''
+                if shrinkage_value != 1.0:
+                    shrink_info_str = 'shrink: {0:0.5f}'.format(shrinkage_value)
+                logger.info("Iter: {0}/{1}   Jobs: {2}   "
+                            "Epoch: {3:0.2f}/{4:0.1f} ({5:0.1f}% complete)   "
+                            "lr: {6:0.6f}   {7}".format(iter, num_iters - 1,
+                                                        current_num_jobs,
+                                                        epoch, args.num_epochs,
+                                                        percent,
+                                                        lrate, shrink_info_str))
+
+                train_lib.common.train_one_iteration(
+                    dir=args.dir,
+                    iter=iter,
+                    srand=args.srand,
+                    egs_dir=egs_dir,
+                    num_jobs=current_num_jobs,
+                    num_archives_processed=num_archives_processed,
+                    num_archives=num_archives,
+                    learning_rate=lrate,
+                    dropout_edit_string=common_train_lib.get_dropout_edit_string(
+                        args.dropout_schedule,
+                        float(num_archives_processed) / num_archives_to_process,
+                        iter),
+                    train_opts=' '.join(args.train_opts),
+                    minibatch_size_str=args.minibatch_size,
+                    frames_per_eg=args.frames_per_eg,
+                    momentum=args.momentum,
+                    max_param_change=args.max_param_change,
+                    shrinkage_value=shrinkage_value,
+                    shuffle_buffer_size=args.shuffle_buffer_size,
+                    run_opts=run_opts,
+                    background_runner=background_runner)
+
+                if args.cleanup:
+                    # do a clean up everythin but the last 2 models, under certain
+                    # conditions
+                    common_train_lib.remove_model(
+                        args.dir, iter-2, num_iters, models_to_combine,
+                        args.preserve_model_interval,
+                        runner=background_runner)
+
+                if args.email is not None:
+                    reporting_iter_interval = num_iters * args.reporting_interval
+                    if iter % reporting_iter_interval == 0:
+                        # lets do some reporting
+                        [report, times, data] = (
+                            nnet3_log_parse.generate_acc_logprob_report(args.dir))
+                        message = report
+                        subject = ("Update : Expt {dir} : "
+                                   "Iter {iter}".format(dir=args.dir, iter=iter))
+                        common_lib.send_mail(message, subject, args.email)
+
+            num_archives_processed = num_archives_processed + current_num_jobs
+
+        if args.stage <= num_iters:
+            if args.do_final_combination:
+                logger.info("Doing final combination to produce final.mdl")
+                train_lib.common.combine_models(
+                    dir=args.dir, num_iters=num_iters,
+                    models_to_combine=models_to_combine,
+                    egs_dir=egs_dir,
+                    minibatch_size_str=args.minibatch_size, run_opts=run_opts,
+                    max_objective_evaluations=args.max_objective_evaluations)
+
+        if args.stage <= num_iters + 1:
+            logger.info("Getting average posterior for purposes of "
+                        "adjusting the priors.")
+
+            # If args.do_final_combination is true, we will use the combined model.
+            # Otherwise, we will use the last_numbered model.
+            real_iter = 'combined' if args.do_final_combination else num_iters
+            avg_post_vec_file = train_lib.common.compute_average_posterior(
+                dir=args.dir, iter=real_iter,
+                egs_dir=egs_dir, num_archives=num_archives,
+                prior_subset_size=args.prior_subset_size, run_opts=run_opts)
+
+            logger.info("Re-adjusting priors based on computed posteriors")
+            combined_or_last_numbered_model = "{dir}/{iter}.mdl".format(dir=args.dir,
+                    iter=real_iter)
+            final_model = "{dir}/final.mdl".format(dir=args.dir)
+            train_lib.common.adjust_am_priors(args.dir, combined_or_last_numbered_model,
+                    avg_post_vec_file, final_model, run_opts)
+    finally:
+        if background_runner is not None:
+            # wait for the diagnostic jobs (also on --exit-stage or an
+            # error, as the runner's thread would not wait for them), which
+            # may still need models that the cleanup below removes.
+            background_runner.close()
 
     if args.cleanup:
         logger.info("Cleaning up the experiment directory "
@@ -26,7 +26,7 @@ def get_args():
         description="Reads an xconfig file and creates config files "
                     "for neural net creation and training",
         epilog='Search egs/*/*/local/{nnet3,chain}/*sh for examples')
-    parser.add_argument('--xconfig-file', required=True,
+    parser.add_argument('--xconfig-file',
                         help='Filename of input xconfig file')
     parser.add_argument('--existing-model',
                         help='Filename of previously trained neural net '
@@ -39,7 +39,7 @@ def get_args():
                              'to the existing model.'
                              'e.g. In Transfer learning: generate new model using '
                              'component nodes in existing model.')
-    parser.add_argument('--config-dir', required=True,
+    parser.add_argument('--config-dir',
                         help='Directory to write config files and variables')
     parser.add_argument('--nnet-edits', type=str, default=None,
                         action=common_lib.NullstrToNoneAction,
@@ -50,6 +50,22 @@ def get_args():
                         new-name=output' if node xxx plays the role of the
                         output node in this network.  This is only used for
                         computing the left/right context.""")
+    parser.add_argument('--batch-file', type=str, default=None,
+                        action=common_lib.NullstrToNoneAction,
+                        help="""If specified, a file with lines of the form
+                        '<xconfig-file> <config-dir>'; the configs for all of
+                        them are generated in this process (with the same
+                        --existing-model and --nnet-edits), instead of for
+                        --xconfig-file and --config-dir.  This is much faster
+                        than calling this script once per xconfig file, e.g.
+                        when generating many variants of an architecture.""")
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        action=common_lib.NullstrToNoneAction,
+                        help="""If specified, a directory in which the parsed
+                        xconfig files and the node names and dims of the
+                        --existing-model are cached, keyed by the hash of the
+                        file contents, so that they are not recomputed by
+                        later invocations.""")
 
     print(' '.join(sys.argv), file=sys.stderr)
 
@@ -60,11 +76,36 @@ def get_args():
 
 
 def check_args(args):
+    if args.batch_file is not None:
+        if args.xconfig_file is not None or args.config_dir is not None:
+            raise Exception("--batch-file cannot be combined with "
+                            "--xconfig-file and --config-dir")
+        return args
+    if args.xconfig_file is None or args.config_dir is None:
+        raise Exception("--xconfig-file and --config-dir are required "
+                        "(unless --batch-file is specified)")
     if not os.path.exists(args.config_dir):
         os.makedirs(args.config_dir)
     return args
 
 
+def read_batch_file(batch_file):
+    """Returns the list of (xconfig-file, config-dir) pairs in batch_file."""
+    pairs = []
+    with open(batch_file) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 0:
+                continue
+            if len(parts) != 2:
+                raise Exception("{0}: bad line '{1}' in batch file {2}; "
+                                "expected '<xconfig-file> <config-dir>'"
+                                "".format(sys.argv[0], line.strip(),
+                                          batch_file))
+            pairs.append((parts[0], parts[1]))
+    return pairs
+
+
 def backup_xconfig_file(xconfig_file, config_dir):
     """we write a copy of the xconfig file just to have a record of the
     original input.
@@ -231,8 +272,15 @@ def write_config_files(config_dir, all_layers):
 
 
 def add_nnet_context_info(config_dir, nnet_edits=None,
-                          existing_model=None):
-    """Create the 'vars' file that specifies model_left_context, etc."""
+                          existing_model=None, contexts=None):
+    """Create the 'vars' file that specifies model_left_context, etc.
+    If 'contexts' (as returned by check_model_contexts()) is given, the
+    context of the 'ref' model is taken from it instead of running
+    nnet3-init and nnet3-info again."""
+
+    if contexts is not None and 'ref' in contexts:
+        write_vars_file(config_dir, contexts['ref'])
+        return
 
     common_lib.execute_command("nnet3-init {0} {1}/ref.config "
                                "{1}/ref.raw"
@@ -256,7 +304,10 @@ def add_nnet_context_info(config_dir, nnet_edits=None,
         if len(parts) != 2:
             continue
         info[parts[0].strip()] = int(parts[1].strip())
+    write_vars_file(config_dir, info)
 
+
+def write_vars_file(config_dir, info):
     # Writing the 'vars' file:
     #   model_left_context=0
     #   model_right_context=7
@@ -265,6 +316,7 @@ def add_nnet_context_info(config_dir, nnet_edits=None,
     vf.write('model_right_context={0}\n'.format(info['right-context']))
     vf.close()
 
+
 def check_model_contexts(config_dir, nnet_edits=None, existing_model=None):
     contexts = {}
     for file_name in ['init', 'ref']:
@@ -311,22 +363,45 @@ def check_model_contexts(config_dir, nnet_edits=None, existing_model=None):
                     " in ref.config. Please use delay=$label_delay in the"
                     " initial fixed-affine-layer of the network, to avoid"
                     " this issue.")
-
+    return contexts
+
+
+def generate_configs(xconfig_file, config_dir, existing_model=None,
+                     nnet_edits=None, cache=None):
+    """Writes the config files and the 'vars' file for xconfig_file to
+    config_dir.  'cache' is an optional xparser.XconfigCache; programs that
+    generate the configs for many xconfig files should call this function with
+    the same cache for all of them."""
+    if not os.path.exists(config_dir):
+        os.makedirs(config_dir)
+    backup_xconfig_file(xconfig_file, config_dir)
+    existing_layers = []
+    if existing_model is not None:
+        existing_layers = xparser.get_model_component_info(existing_model,
+                                                           cache)
+    all_layers = xparser.read_xconfig_file(xconfig_file, existing_layers,
+                                           cache)
+    write_expanded_xconfig_files(config_dir, all_layers)
+    write_config_files(config_dir, all_layers)
+    contexts = check_model_contexts(config_dir, nnet_edits,
+                                    existing_model=existing_model)
+    add_nnet_context_info(config_dir, nnet_edits,
+                          existing_model=existing_model, contexts=contexts)
 
 
 def main():
     args = get_args()
-    backup_xconfig_file(args.xconfig_file, args.config_dir)
-    existing_layers = []
-    if args.existing_model is not None:
-        existing_layers = xparser.get_model_component_info(args.existing_model)
-    all_layers = xparser.read_xconfig_file(args.xconfig_file, existing_layers)
-    write_expanded_xconfig_files(args.config_dir, all_layers)
-    write_config_files(args.config_dir, all_layers)
-    check_model_contexts(args.config_dir, args.nnet_edits,
-                         existing_model=args.existing_model)
-    add_nnet_context_info(args.config_dir, args.nnet_edits,
-                          existing_model=args.existing_model)
+    cache = None
+    if args.batch_file is not None or args.cache_dir is not None:
+        cache = xparser.XconfigCache(args.cache_dir)
+    if args.batch_file is not None:
+        pairs = read_batch_file(args.batch_file)
+    else:
+        pairs = [(args.xconfig_file, args.config_dir)]
+    for xconfig_file, config_dir in pairs:
+        generate_configs(xconfig_file, config_dir,
+                         existing_model=args.existing_model,
+                         nnet_edits=args.nnet_edits, cache=cache)
 
 
 if __name__ == '__main__':
@@ -9,14 +9,22 @@ speech activity detection network. The output is a matrix archive
 with each matrix having 3 columns -- silence, speech and garbage.
 The posterior probabilities of the phones of each of the classes are
 summed up to get the target matrix values.
+
+The arc-info of several jobs can be converted together, in parallel with
+--num-jobs; the targets are then written to the output archive in the order
+of the input files.
 """
 
 import argparse
+import io
 import logging
+import multiprocessing
+import numpy as np
 import sys
 
 sys.path.insert(0, 'steps')
 import libs.common as common_lib
+import libs.matrix_io as matrix_io
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -48,29 +56,164 @@ def get_args():
     parser.add_argument("--max-phone-length", type=int, default=50,
                         help="""Maximum number of frames allowed for a speech
                         phone above which the arc is treated as garbage.""")
+    parser.add_argument("--binary", type=str, default=True,
+                        choices=["true", "false"],
+                        action=common_lib.StrToBoolAction,
+                        help="Write the targets matrix archive in binary "
+                        "format")
+    parser.add_argument("--num-jobs", type=int, default=1,
+                        help="Number of processes used to convert the arc "
+                        "info files, if more than one is given")
 
-    parser.add_argument("arc_info", type=str,
-                        help="Arc info file (output of lattice-arc-post). "
+    parser.add_argument("arc_info", type=str, nargs="+",
+                        help="Arc info file(s) (output of lattice-arc-post). "
                         "See the help for lattice-arc-post for information "
                         "about the format of this input.")
     parser.add_argument("targets_file", type=str,
-                        help="File to write targets matrix archive in text "
-                        "format")
+                        help="File to write targets matrix archive in binary "
+                        "or text format (see --binary)")
     args = parser.parse_args()
+
+    if len(args.arc_info) > 1 and "-" in args.arc_info:
+        raise ValueError("The standard input can only be used if there is "
+                         "only one arc info file")
     return args
 
 
+# These are the columns of the targets matrix.
+SILENCE, SPEECH, GARBAGE = 0, 1, 2
+
+
+class TargetsConverter(object):
+    """Converts the lines of arc-info of utterances into targets matrices.
+
+    The arcs of an utterance are collected by add_arc(), and its targets
+    are computed by get_targets() in a preallocated array, to which the
+    posterior of each arc is added on the range of frames of the arc."""
+
+    def __init__(self, silence_phones, garbage_phones, max_phone_length):
+        self.silence_phones = silence_phones
+        self.garbage_phones = garbage_phones
+        self.max_phone_length = max_phone_length
+        self.reset()
+
+    def reset(self):
+        self.arcs = []
+        self.num_frames = 0
+
+    def add_arc(self, line):
+        """Adds the arc in 'line' (without the utterance-id), which is of
+        the form <start-frame> <num-frames> <posterior> <phone> ..."""
+        parts = line.split()
+        start_frame = int(parts[0])
+        num_frames = int(parts[1])
+        post = float(parts[2])
+        phone = parts[3]
+
+        if phone in self.silence_phones:
+            column = SILENCE
+        elif num_frames > self.max_phone_length:
+            column = GARBAGE
+        elif phone in self.garbage_phones:
+            column = GARBAGE
+        else:
+            column = SPEECH
+        self.arcs.append((start_frame, start_frame + num_frames, column,
+                          post))
+        self.num_frames = max(self.num_frames, start_frame + num_frames)
+
+    def get_targets(self):
+        """Returns the targets of the arcs added since the last call to
+        reset(), as a numpy array."""
+        targets = np.zeros((self.num_frames, 3))
+        for start_frame, end_frame, column, post in self.arcs:
+            targets[start_frame:end_frame, column] += post
+        return targets
+
+
+def convert_arc_info(arc_info, targets_writer, converter, binary):
+    """Converts the arc-info in the file 'arc_info' into targets matrices,
+    and writes them to 'targets_writer'. Returns a tuple
+    (num-utts, num-err)."""
+    num_utts = 0
+    num_err = 0
+    prev_utt = ""
+
+    def write_targets(utt):
+        targets = converter.get_targets()
+        if len(targets) == 0:
+            return False
+        if binary:
+            matrix_io.write_matrix(targets_writer, targets.astype(np.float32),
+                                   key=utt, binary=True)
+        else:
+            common_lib.write_matrix_ascii(targets_writer, targets, key=utt)
+        return True
+
+    with common_lib.smart_open(arc_info) as arc_info_reader:
+        for line in arc_info_reader:
+            try:
+                parts = line.split(None, 1)
+                utt = parts[0]
+
+                if utt != prev_utt:
+                    if prev_utt != "":
+                        if write_targets(prev_utt):
+                            num_utts += 1
+                        else:
+                            num_err += 1
+                    prev_utt = utt
+                    converter.reset()
+
+                converter.add_arc(parts[1])
+            except Exception:
+                logger.error("Failed to process line {line} in {f}"
+                             "".format(line=line.strip(), f=arc_info))
+                logger.error("num-frames = {l}".format(
+                    l=converter.num_frames))
+                raise
+
+    if prev_utt != "":
+        if write_targets(prev_utt):
+            num_utts += 1
+        else:
+            num_err += 1
+    return num_utts, num_err
+
+
+# The arguments of the worker processes, which are set by _init_worker().
+_worker_args = None
+
+
+def _init_worker(args):
+    global _worker_args
+    _worker_args = args
+
+
+def _convert_arc_info(arc_info):
+    """Converts the arc-info in the file 'arc_info' in a worker process, and
+    returns a tuple (archive, num-utts, num-err), where 'archive' contains
+    the targets as it should be written to the output."""
+    converter, binary = _worker_args
+    # io.StringIO only takes unicode strings in python2, where str is bytes.
+    targets_writer = (io.BytesIO() if binary or sys.version_info.major == 2
+                      else io.StringIO())
+    num_utts, num_err = convert_arc_info(arc_info, targets_writer,
+                                         converter, binary)
+    return targets_writer.getvalue(), num_utts, num_err
+
+
 def run(args):
-    silence_phones = {}
+    silence_phones = set()
     with common_lib.smart_open(args.silence_phones) as silence_phones_fh:
         for line in silence_phones_fh:
-            silence_phones[line.strip().split()[0]] = 1
+            silence_phones.add(line.strip().split()[0])
 
     if len(silence_phones) == 0:
         raise RuntimeError("Could not find any phones in {silence}"
                            "".format(silence=args.silence_phones))
 
-    garbage_phones = {}
+    garbage_phones = set()
     with common_lib.smart_open(args.garbage_phones) as garbage_phones_fh:
         for line in garbage_phones_fh:
             word = line.strip().split()[0]
@@ -80,67 +223,45 @@ def run(args):
                                        word=word,
                                        silence=args.silence_phones,
                                        garbage=args.garbage_phones))
-            garbage_phones[word] = 1
+            garbage_phones.add(word)
 
     if len(garbage_phones) == 0:
         raise RuntimeError("Could not find any phones in {garbage}"
                            "".format(garbage=args.garbage_phones))
 
+    converter = TargetsConverter(silence_phones, garbage_phones,
+                                 args.max_phone_length)
     num_utts = 0
     num_err = 0
-    targets = []
-    prev_utt = ""
 
-    with common_lib.smart_open(args.arc_info) as arc_info_reader, \
-            common_lib.smart_open(args.targets_file, 'w') as targets_writer:
-        for line in arc_info_reader:
-            try:
-                parts = line.strip().split()
-                utt = parts[0]
-
-                if utt != prev_utt:
-                    if prev_utt != "":
-                        if len(targets) > 0:
-                            num_utts += 1
-                            common_lib.write_matrix_ascii(
-                                targets_writer, targets, key=prev_utt)
-                        else:
-                            num_err += 1
-                    prev_utt = utt
-                    targets = []
-
-                start_frame = int(parts[1])
-                num_frames = int(parts[2])
-                post = float(parts[3])
-                phone = parts[4]
-
-                if start_frame + num_frames > len(targets):
-                    for t in range(len(targets), start_frame + num_frames):
-                        targets.append([0, 0, 0])
-                    assert start_frame + num_frames == len(targets)
-
-                for t in range(start_frame, start_frame + num_frames):
-                    if phone in silence_phones:
-                        targets[t][0] += post
-                    elif num_frames > args.max_phone_length:
-                        targets[t][2] += post
-                    elif phone in garbage_phones:
-                        targets[t][2] += post
-                    else:
-                        targets[t][1] += post
-            except Exception:
-                logger.error("Failed to process line {line} in {f}"
-                             "".format(line=line.strip(), f=args.arc_info))
-                logger.error("len(targets) = {l}".format(l=len(targets)))
-                raise
+    if args.targets_file == "-":
+        targets_writer = (getattr(sys.stdout, 'buffer', sys.stdout)
+                          if args.binary else sys.stdout)
+    else:
+        targets_writer = open(args.targets_file, 'wb' if args.binary else 'w')
 
-    if prev_utt != "":
-        if len(targets) > 0:
-            num_utts += 1
-            common_lib.write_matrix_ascii(args.targets_file, targets,
-                                          key=prev_utt)
+    try:
+        if args.num_jobs > 1 and len(args.arc_info) > 1:
+            pool = multiprocessing.Pool(args.num_jobs, _init_worker,
+                                        ((converter, args.binary),))
+            try:
+                for archive, this_num_utts, this_num_err in pool.imap(
+                        _convert_arc_info, args.arc_info):
+                    targets_writer.write(archive)
+                    num_utts += this_num_utts
+                    num_err += this_num_err
+            finally:
+                pool.terminate()
+                pool.join()
         else:
-            num_err += 1
+            for arc_info in args.arc_info:
+                this_num_utts, this_num_err = convert_arc_info(
+                    arc_info, targets_writer, converter, args.binary)
+                num_utts += this_num_utts
+                num_err += this_num_err
+    finally:
+        if args.targets_file != "-":
+            targets_writer.close()
 
     logger.info("Wrote {num_utts} targets; failed with {num_err}"
                 "".format(num_utts=num_utts, num_err=num_err))
@@ -8,17 +8,21 @@ This script merges targets matrices corresponding to
 segments into targets matrix for whole recording. The frames that are not
 in any of the segments are assigned the default targets vector, specified by
 the option --default-targets or [ 0 0 0 ] if unspecified.
+
+The targets matrices are read directly from the archives their scp entries
+point to, and the output archive is written in binary format unless
+--binary=false is given.
 """
 from __future__ import division
 
 import argparse
 import logging
 import numpy as np
-import subprocess
 import sys
 
 sys.path.insert(0, 'steps')
 import libs.common as common_lib
+import libs.matrix_io as matrix_io
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -43,6 +47,10 @@ def get_args():
                         "region")
     parser.add_argument("--length-tolerance", type=int, default=4,
                         help="Tolerate length mismatches of this many frames")
+    parser.add_argument("--binary", type=str, default=True,
+                        choices=["true", "false"],
+                        action=common_lib.StrToBoolAction,
+                        help="Write the output archive in binary format")
     parser.add_argument("--verbose", type=int, default=0, choices=[0, 1, 2],
                         help="Verbose level")
 
@@ -61,8 +69,8 @@ def get_args():
                         The matrices are indexed by the utterance-id.""")
     parser.add_argument("out_targets_ark", type=str,
                         help="""Output archive to which the
-                        recording-level matrix will be written in text
-                        format""")
+                        recording-level matrix will be written in binary
+                        or text format (see --binary)""")
 
     args = parser.parse_args()
 
@@ -139,6 +147,37 @@ def read_targets_scp(targets_scp, segments):
     return targets
 
 
+def merge_segment_targets(reco_mat, mat, start_frame, end_frame,
+                          end_frame_accounted):
+    """Writes the targets 'mat' of a segment to the rows start_frame to
+    end_frame - 1 of the recording-level matrix 'reco_mat'. The rows before
+    'end_frame_accounted' already contain the targets of previous segments;
+    where they overlap with this segment, the targets are combined using a
+    weighted interpolation using a triangular window with a weight of 1 at
+    the start/end of overlap and 0 at the end/start of the segment."""
+    num_frames = end_frame - start_frame
+    if start_frame < end_frame_accounted:
+        # Segment overlaps with a previous utterance
+        num_overlap = end_frame_accounted - start_frame
+        weights = np.arange(num_overlap, dtype=np.float64) / num_overlap
+        # The products of the float32 'mat' with the weights are float64, as
+        # they were when the rows were combined one by one as np.matrix
+        # objects (whose * is np.dot(), which gives float64 for a float32
+        # row times a python float).
+        reco_mat[start_frame:end_frame_accounted, :] = (
+            reco_mat[start_frame:end_frame_accounted, :]
+            * (1.0 - weights)[:, np.newaxis]
+            + mat[0:num_overlap, :] * weights[:, np.newaxis])
+
+        if end_frame > end_frame_accounted:
+            reco_mat[end_frame_accounted:end_frame, :] = (
+                mat[num_overlap:num_frames, :])
+    else:
+        # No overlap with the previous utterances.
+        # So just add it to the output.
+        reco_mat[start_frame:end_frame, :] = mat[0:num_frames, :]
+
+
 def run(args):
     reco2utt = read_reco2utt_file(args.reco2utt)
     reco2num_frames = read_reco2num_frames_file(args.reco2num_frames)
@@ -147,7 +186,7 @@ def run(args):
 
     if args.default_targets is not None:
         # Read the vector of default targets for out-of-segment regions
-        default_targets = np.matrix(
+        default_targets = np.array(
             common_lib.read_matrix_ascii(args.default_targets))
     else:
         default_targets = np.zeros([1, 3])
@@ -158,7 +197,17 @@ def run(args):
     num_utt = 0
     num_reco = 0
 
-    with common_lib.smart_open(args.out_targets_ark, 'w') as fh:
+    if args.out_targets_ark == "-":
+        fh = (getattr(sys.stdout, 'buffer', sys.stdout) if args.binary
+              else sys.stdout)
+    else:
+        fh = open(args.out_targets_ark, 'wb' if args.binary else 'w')
+
+    # The targets matrices are read by seeking to their offsets in the
+    # archives, which are kept open.
+    rx_reader = matrix_io.RxfilenameReader()
+
+    try:
         for reco, utts in reco2utt.items():
             # Read a recording and the list of its utterances from the
             # reco2utt dictionary
@@ -175,24 +224,14 @@ def run(args):
                 segment = segments[utt]
 
                 # Read the targets corresponding to the segments
-                cmd = ("copy-feats --binary=false {mat_fn} -"
-                       "".format(mat_fn=targets[utt]))
-                p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-
                 try:
-                    mat = np.matrix(common_lib.read_matrix_ascii(p.stdout),
-                                    dtype='float32')
+                    mat = rx_reader.read(targets[utt]).astype(np.float32,
+                                                              copy=False)
                 except Exception:
-                    logger.error("Command '{cmd}' failed".format(cmd=cmd))
+                    logger.error("Failed to read targets for utterance "
+                                 "{utt} from {rxfilename}".format(
+                                     utt=utt, rxfilename=targets[utt]))
                     raise
-                finally:
-                    [stdout, stderr] = p.communicate()
-                    if p.returncode is not None and p.returncode != 0:
-                        raise RuntimeError(
-                            'Command "{cmd}" failed with status {status}; '
-                            'stderr = {stderr}'.format(cmd=cmd, status=-p.returncode,
-                                                       stderr=stderr))
 
                 start_frame = int(segment[1] / args.frame_shift + 0.5)
                 end_frame = int(segment[2] / args.frame_shift + 0.5)
@@ -238,26 +277,8 @@ def run(args):
                     num_utt_err +=1
                     continue
 
-                if start_frame < end_frame_accounted:
-                    # Segment overlaps with a previous utterance
-                    # Combine targets using a weighted interpolation using a
-                    # triangular window with a weight of 1 at the start/end of
-                    # overlap and 0 at the end/start of the segment
-                    for n in range(0, end_frame_accounted - start_frame):
-                        w = float(n) / float(end_frame_accounted - start_frame)
-                        reco_mat[n + start_frame, :] = (
-                            reco_mat[n + start_frame, :] * (1.0 - w)
-                            + mat[n, :] * w)
-
-                    if end_frame > end_frame_accounted:
-                        reco_mat[end_frame_accounted:end_frame, :] = (
-                            mat[(end_frame_accounted-start_frame):
-                                (end_frame-start_frame), :])
-                else:
-                    # No overlap with the previous utterances.
-                    # So just add it to the output.
-                    reco_mat[start_frame:end_frame, :] = (
-                        mat[0:num_frames, :])
+                merge_segment_targets(reco_mat, mat, start_frame, end_frame,
+                                      end_frame_accounted)
                 logger.debug("reco_mat shape = %s, mat shape = %s, "
                              "start_frame = %d, end_frame = %d", reco_mat.shape,
                              mat.shape, start_frame, end_frame)
@@ -266,9 +287,17 @@ def run(args):
                 num_utt += 1
 
             if reco_mat.shape[0] > 0:
-                common_lib.write_matrix_ascii(fh, reco_mat,
-                                              key=reco)
+                if args.binary:
+                    matrix_io.write_matrix(fh, reco_mat.astype(np.float32),
+                                           key=reco, binary=True)
+                else:
+                    common_lib.write_matrix_ascii(fh, reco_mat,
+                                                  key=reco)
                 num_reco += 1
+    finally:
+        rx_reader.close()
+        if args.out_targets_ark != "-":
+            fh.close()
 
     logger.info("Merged {num_utt} segment targets from {num_reco} recordings; "
                 "failed with {num_utt_err} utterances"
@@ -13,8 +13,12 @@ and '2' for speech frames.
 
 from __future__ import print_function
 import argparse
+from collections import deque
 import logging
+import multiprocessing
 import sys
+import warnings
+import numpy as np
 
 sys.path.insert(0, 'steps')
 import libs.common as common_lib
@@ -67,6 +71,11 @@ and 2 for speech frames.
                              "This is after padding by --segment-padding seconds."
                              "0 means do not merge. Use 'inf' to not limit the duration.")
 
+    parser.add_argument("--num-jobs", type=int, default=1,
+                        help="Number of processes used to process the "
+                        "utterances. The segments are written in the same "
+                        "order as the input.")
+
     parser.add_argument("in_sad", type=str,
                         help="Input file containing alignments in "
                              "text archive format")
@@ -136,60 +145,77 @@ class SegmenterStats(object):
             final_duration=self.final_duration))
 
 
-def process_label(text_label):
-    """Processes an input integer label and returns a 1 or 2,
-    where 1 is for silence and 2 is for speech.
-
-    Arguments:
-        text_label -- input label (must be integer)
+def process_labels(labels):
+    """Converts the input labels (a sequence of integers, or strings that
+    represent integers) to a numpy array of integers, and checks that each
+    of them is 1 or 2, where 1 is for silence and 2 is for speech.
     """
-    prev_label = int(text_label)
-    if prev_label not in [1, 2]:
+    labels = np.asarray(labels)
+    if labels.dtype.kind not in 'iu':
+        labels = labels.astype(np.int64)
+    if not np.all((labels == 1) | (labels == 2)):
+        bad_label = labels[(labels != 1) & (labels != 2)][0]
         raise ValueError("Expecting label to 1 (non-speech) or 2 (speech); "
-                         "got {}".format(prev_label))
-
-    return prev_label
+                         "got {}".format(bad_label))
+    return labels
+
+
+def read_labels(text):
+    """Reads the labels in 'text' (the part of a line of the input archive
+    after the utterance-id) into a numpy array of integers."""
+    with warnings.catch_warnings():
+        # np.fromstring() only warns about text that is not a list of
+        # integers.
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            labels = np.fromstring(text, dtype=np.int32, sep=' ')
+        except (ValueError, DeprecationWarning):
+            raise ValueError("Expecting integer labels; got '{0}'".format(
+                text.strip()))
+    return process_labels(labels)
+
+
+def run_length_encode(labels):
+    """Returns the run-length encoding of the array 'labels' as a tuple
+    (starts, ends, values) of arrays, where the i'th run is
+    labels[starts[i]:ends[i]], all of whose elements are values[i]."""
+    change_points = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+    starts = np.concatenate(([0], change_points))
+    ends = np.concatenate((change_points, [len(labels)]))
+    return starts, ends, labels[starts]
 
 
 class Segmentation(object):
-    """Stores segmentation for an utterances"""
+    """Stores segmentation for an utterances.
+    The segments are stored in the arrays 'starts' and 'ends' (in seconds);
+    all of them are speech segments."""
 
     def __init__(self):
-        self.segments = None
+        self.starts = None
+        self.ends = None
         self.stats = SegmenterStats()
 
+    @property
+    def segments(self):
+        """The segments as a list of [start, end, label]."""
+        return [[start, end, 2] for start, end in
+                zip(self.starts.tolist(), self.ends.tolist())]
+
     def initialize_segments(self, alignment, frame_shift=0.01):
         """Initializes segments from input alignment.
         The alignment is frame-level speech-activity detection marks,
         each of which must be 1 or 2."""
-        self.segments = []
-
         assert len(alignment) > 0
 
-        prev_label = None
-        prev_length = 0
-        for i, text_label in enumerate(alignment):
-            if prev_label is not None and int(text_label) != prev_label:
-                if prev_label == 2:
-                    self.segments.append(
-                        [float(i - prev_length) * frame_shift,
-                         float(i) * frame_shift, prev_label])
-                    self.stats.initial_duration += (prev_length * frame_shift)
-                prev_label = process_label(text_label)
-                prev_length = 0
-            elif prev_label is None:
-                prev_label = process_label(text_label)
-
-            prev_length += 1
-
-        if prev_length > 0 and prev_label == 2:
-            self.segments.append(
-                [float(len(alignment) - prev_length) * frame_shift,
-                 float(len(alignment)) * frame_shift, prev_label])
-            self.stats.initial_duration += (prev_length * frame_shift)
-
-        self.stats.num_segments_initial = len(self.segments)
-        self.stats.num_segments_final = len(self.segments)
+        starts, ends, values = run_length_encode(process_labels(alignment))
+        speech = values == 2
+        self.starts = starts[speech].astype(np.float64) * frame_shift
+        self.ends = ends[speech].astype(np.float64) * frame_shift
+        self.stats.initial_duration = float(
+            np.sum(ends[speech] - starts[speech]) * frame_shift)
+
+        self.stats.num_segments_initial = len(self.starts)
+        self.stats.num_segments_final = len(self.starts)
         self.stats.final_duration = self.stats.initial_duration
 
     def filter_short_segments(self, min_dur):
@@ -197,17 +223,13 @@ class Segmentation(object):
         if min_dur <= 0:
             return
 
-        segments_kept = []
-        for segment in self.segments:
-            assert segment[2] == 2, segment
-            dur = segment[1] - segment[0]
-            if dur < min_dur:
-                self.stats.filter_short_duration += dur
-                self.stats.num_short_segments_filtered += 1
-            else:
-                segments_kept.append(segment)
-        self.segments = segments_kept
-        self.stats.num_segments_final = len(self.segments)
+        durs = self.ends - self.starts
+        short = durs < min_dur
+        self.stats.filter_short_duration += float(np.sum(durs[short]))
+        self.stats.num_short_segments_filtered += int(np.sum(short))
+        self.starts = self.starts[~short]
+        self.ends = self.ends[~short]
+        self.stats.num_segments_final = len(self.starts)
         self.stats.final_duration -= self.stats.filter_short_duration
 
     def pad_speech_segments(self, segment_padding, max_duration=float("inf")):
@@ -216,71 +238,106 @@ class Segmentation(object):
         or the duration of the utterance 'max_duration'."""
         if max_duration == None:
             max_duration = float("inf")
-        for i, segment in enumerate(self.segments):
-            assert segment[2] == 2, segment
-            segment[0] -= segment_padding  # try adding padding on the left side
-            self.stats.padding_duration += segment_padding
-            if segment[0] < 0.0:
-                # Padding takes the segment start to before the beginning of the utterance.
-                # Reduce padding.
-                self.stats.padding_duration += segment[0]
-                segment[0] = 0.0
-            if i >= 1 and self.segments[i - 1][1] > segment[0]:
-                # Padding takes the segment start to before the end the previous segment.
-                # Reduce padding.
-                self.stats.padding_duration -= (
-                        self.segments[i - 1][1] - segment[0])
-                segment[0] = self.segments[i - 1][1]
-
-            segment[1] += segment_padding
-            self.stats.padding_duration += segment_padding
-            if segment[1] >= max_duration:
-                # Padding takes the segment end beyond the max duration of the utterance.
-                # Reduce padding.
-                self.stats.padding_duration -= (segment[1] - max_duration)
-                segment[1] = max_duration
-            if (i + 1 < len(self.segments)
-                    and segment[1] > self.segments[i + 1][0]):
-                # Padding takes the segment end beyond the start of the next segment.
-                # Reduce padding.
-                self.stats.padding_duration -= (
-                        segment[1] - self.segments[i + 1][0])
-                segment[1] = self.segments[i + 1][0]
+        if len(self.starts) == 0:
+            return
+        # The padding of the end of a segment is limited by the (unpadded)
+        # start of the next segment, and the padding of the start of a
+        # segment by the (padded) end of the previous one.
+        ends = np.minimum(self.ends + segment_padding, max_duration)
+        ends[:-1] = np.minimum(ends[:-1], self.starts[1:])
+        starts = np.maximum(self.starts - segment_padding, 0.0)
+        starts[1:] = np.maximum(starts[1:], ends[:-1])
+
+        self.stats.padding_duration += float(
+            np.sum(self.starts - starts) + np.sum(ends - self.ends))
+        self.starts = starts
+        self.ends = ends
         self.stats.final_duration += self.stats.padding_duration
 
     def merge_consecutive_segments(self, max_dur):
         """Merge consecutive segments (happens after padding), provided that
         the merged segment is no longer than 'max_dur'."""
-        if max_dur <= 0 or not self.segments:
+        if max_dur <= 0 or len(self.starts) == 0:
             return
 
-        merged_segments = [self.segments[0]]
-        for segment in self.segments[1:]:
-            assert segment[2] == 2, segment
-            if segment[0] == merged_segments[-1][1] and \
-                    segment[1] - merged_segments[-1][0] <= max_dur:
-                # The segment starts at the same time the last segment ends,
-                # and the merged segment is shorter than 'max_dur'.
-                # Extend the previous segment.
-                merged_segments[-1][1] = segment[1]
-                self.stats.num_merges += 1
-            else:
-                merged_segments.append(segment)
-
-        self.segments = merged_segments
-        self.stats.num_segments_final = len(self.segments)
+        num_segments = len(self.starts)
+        # touching[i] is true if segment i + 1 starts at the same time
+        # segment i ends.
+        touching = self.starts[1:] == self.ends[:-1]
+        if not np.any(touching):
+            return
 
-    def write(self, key, file_handle):
-        """Write segments to file"""
+        # is_first[i] is true if segment i is the first of a merged segment.
+        is_first = np.concatenate(([True], ~touching))
+        # A chain of touching segments is merged into one if the merged
+        # segment is no longer than 'max_dur'; otherwise its segments are
+        # merged greedily from the left.
+        chain_starts = np.flatnonzero(is_first)
+        chain_ends = np.concatenate((chain_starts[1:], [num_segments]))
+        too_long = (self.ends[chain_ends - 1] - self.starts[chain_starts]
+                    > max_dur)
+        for chain_start, chain_end in zip(chain_starts[too_long].tolist(),
+                                          chain_ends[too_long].tolist()):
+            merged_start = self.starts[chain_start]
+            for i in range(chain_start + 1, chain_end):
+                if self.ends[i] - merged_start > max_dur:
+                    is_first[i] = True
+                    merged_start = self.starts[i]
+
+        first_indexes = np.flatnonzero(is_first)
+        last_indexes = np.concatenate((first_indexes[1:], [num_segments])) - 1
+        self.stats.num_merges += num_segments - len(first_indexes)
+        self.starts = self.starts[first_indexes]
+        self.ends = self.ends[last_indexes]
+        self.stats.num_segments_final = len(self.starts)
+
+    def to_lines(self, key):
+        """Returns the segments as a list of lines of a segments file"""
         if global_verbose >= 2:
             logger.info("For key {key}, got stats {stats}".format(
                 key=key, stats=self.stats))
-        for segment in self.segments:
+        lines = []
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
             seg_id = "{key}-{st:07d}-{end:07d}".format(
-                key=key, st=int(segment[0] * 100), end=int(segment[1] * 100))
-            print("{seg_id} {key} {st:.2f} {end:.2f}".format(
-                seg_id=seg_id, key=key, st=segment[0], end=segment[1]),
-                file=file_handle)
+                key=key, st=int(start * 100), end=int(end * 100))
+            lines.append("{seg_id} {key} {st:.2f} {end:.2f}".format(
+                seg_id=seg_id, key=key, st=start, end=end))
+        return lines
+
+    def write(self, key, file_handle):
+        """Write segments to file"""
+        for line in self.to_lines(key):
+            print(line, file=file_handle)
+
+
+def process_utterances(utterances, args):
+    """Segments the utterances in the list 'utterances' of tuples
+    (utt-id, labels-text, max-duration), and returns a tuple (text, stats)
+    with the lines of the segments file and the accumulated stats."""
+    stats = SegmenterStats()
+    lines = []
+    for utt_id, text, max_duration in utterances:
+        segmentation = Segmentation()
+        segmentation.initialize_segments(read_labels(text), args.frame_shift)
+        segmentation.filter_short_segments(args.min_segment_dur)
+        segmentation.pad_speech_segments(args.segment_padding, max_duration)
+        segmentation.merge_consecutive_segments(args.merge_consecutive_max_dur)
+        lines.extend(segmentation.to_lines(utt_id))
+        stats.add(segmentation.stats)
+    return "".join([line + "\n" for line in lines]), stats
+
+
+# The arguments of the worker processes, which are set by _init_worker().
+_worker_args = None
+
+
+def _init_worker(args):
+    global _worker_args
+    _worker_args = args
+
+
+def _process_utterances(utterances):
+    return process_utterances(utterances, _worker_args)
 
 
 def run(args):
@@ -295,28 +352,55 @@ def run(args):
                                        "".format(line.strip(), args.utt2dur))
                 utt2dur[parts[0]] = float(parts[1])
 
-    global_stats = SegmenterStats()
-    with common_lib.smart_open(args.in_sad) as in_sad_fh, \
-            common_lib.smart_open(args.out_segments, 'w') as out_segments_fh:
+    def read_utterances(in_sad_fh, batch_size):
+        """Yields lists of up to 'batch_size' tuples
+        (utt-id, labels-text, max-duration)."""
+        batch = []
         for line in in_sad_fh:
-            parts = line.strip().split()
-            utt_id = parts[0]
-
+            parts = line.strip().split(None, 1)
             if len(parts) < 2:
                 raise RuntimeError("Unable to parse line '{0}' in {1}"
                                    "".format(line.strip(),
                                              in_sad_fh))
+            utt_id = parts[0]
+            batch.append((utt_id, parts[1],
+                          None if args.utt2dur is None else utt2dur[utt_id]))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
 
-            segmentation = Segmentation()
-            segmentation.initialize_segments(
-                parts[1:], args.frame_shift)
-            segmentation.filter_short_segments(args.min_segment_dur)
-            segmentation.pad_speech_segments(args.segment_padding,
-                                             None if args.utt2dur is None
-                                             else utt2dur[utt_id])
-            segmentation.merge_consecutive_segments(args.merge_consecutive_max_dur)
-            segmentation.write(utt_id, out_segments_fh)
-            global_stats.add(segmentation.stats)
+    global_stats = SegmenterStats()
+    with common_lib.smart_open(args.in_sad) as in_sad_fh, \
+            common_lib.smart_open(args.out_segments, 'w') as out_segments_fh:
+        if args.num_jobs <= 1:
+            for batch in read_utterances(in_sad_fh, 1):
+                text, stats = process_utterances(batch, args)
+                out_segments_fh.write(text)
+                global_stats.add(stats)
+        else:
+            pool = multiprocessing.Pool(args.num_jobs, _init_worker, (args,))
+            try:
+                # At most this many batches are in flight at a time, so that
+                # the input is not read much faster than it is processed.
+                max_pending = 2 * args.num_jobs
+                pending = deque()
+                for batch in read_utterances(in_sad_fh, 20):
+                    pending.append(pool.apply_async(_process_utterances,
+                                                    (batch,)))
+                    while len(pending) >= max_pending or (
+                            len(pending) > 0 and pending[0].ready()):
+                        text, stats = pending.popleft().get()
+                        out_segments_fh.write(text)
+                        global_stats.add(stats)
+                while len(pending) > 0:
+                    text, stats = pending.popleft().get()
+                    out_segments_fh.write(text)
+                    global_stats.add(stats)
+            finally:
+                pool.terminate()
+                pool.join()
     logger.info(global_stats)
 
 
@@ -19,16 +19,28 @@ import codecs
 import io
 import argparse
 import re
+import os
+import hashlib
+import pickle
+import multiprocessing
+from collections import deque
 
 # hack for python2/3 compatibility
 from io import open
 argparse.open = open
 
+# This is increased whenever the format of the cache files changes, so that
+# old cache files are ignored.
+CACHE_VERSION = 1
+
 class BPE(object):
 
     def __init__(self, codes, merges=-1, separator='@@', vocab=None, glossaries=None):
 
         codes.seek(0)
+        self.codes_hash = hashlib.sha1(codes.read().encode('utf-8')).hexdigest()
+        self.merges = merges
+        codes.seek(0)
 
         # check version information
         firstline = codes.readline()
@@ -59,6 +71,15 @@ class BPE(object):
 
         self.cache = {}
 
+        # maps each word to its segmentation, as it appears in the output
+        # (i.e. subword units joined by spaces, with the separators).  This is
+        # what is stored in the cache file.
+        self.word_cache = {}
+
+        # if this is a list, the words that are newly added to
+        # self.word_cache are appended to it.
+        self.new_words = None
+
     def process_line(self, line):
         """segment line, dealing with leading and trailing whitespace"""
 
@@ -79,11 +100,22 @@ class BPE(object):
     def segment(self, sentence):
         """segment single sentence (whitespace-tokenized string) with BPE encoding"""
         output = []
+        word_cache = self.word_cache
         for word in sentence.strip().split(' '):
             # eliminate double spaces
             if not word:
                 continue
-            new_word = [out for segment in self._isolate_glossaries(word)
+            segmented = word_cache.get(word)
+            if segmented is None:
+                segmented = self.segment_word(word)
+            output.append(segmented)
+
+        return ' '.join(output)
+
+    def segment_word(self, word):
+        """segment single word with BPE encoding, and return the subword units
+        joined by spaces, with the separator appended to all but the last one"""
+        new_word = [out for segment in self._isolate_glossaries(word)
                         for out in encode(segment,
                                           self.bpe_codes,
                                           self.bpe_codes_reverse,
@@ -93,11 +125,71 @@ class BPE(object):
                                           self.cache,
                                           self.glossaries)]
 
-            for item in new_word[:-1]:
-                output.append(item + self.separator)
-            output.append(new_word[-1])
-
-        return ' '.join(output)
+        output = [item + self.separator for item in new_word[:-1]]
+        output.append(new_word[-1])
+        segmented = ' '.join(output)
+
+        self.word_cache[word] = segmented
+        if self.new_words is not None:
+            self.new_words.append(word)
+        return segmented
+
+    def segment_words(self, words, num_workers=1):
+        """segment the words in 'words' that are not in the cache yet, in
+        'num_workers' processes, and add them to the cache"""
+        words = [word for word in words if word not in self.word_cache]
+        if num_workers <= 1 or len(words) <= num_workers:
+            for word in words:
+                self.segment_word(word)
+            return
+        shard_size = (len(words) + num_workers - 1) // num_workers
+        shards = [words[i:i+shard_size] for i in range(0, len(words), shard_size)]
+        pool = multiprocessing.Pool(num_workers, _init_worker, (self,))
+        try:
+            results = pool.map(_segment_words_shard, shards)
+        finally:
+            pool.close()
+            pool.join()
+        for shard_words, shard_segmented in zip(shards, results):
+            self.word_cache.update(zip(shard_words, shard_segmented))
+
+    def get_cache_key(self):
+        """return a string that identifies the segmentation produced by this
+        object: the hash of the codes file, together with the options that
+        affect the segmentation of a word"""
+        key = hashlib.sha1()
+        key.update(self.codes_hash.encode('utf-8'))
+        key.update(repr((self.merges, self.separator, self.glossaries)).encode('utf-8'))
+        if self.vocab:
+            for word in sorted(self.vocab):
+                key.update((word + '\n').encode('utf-8'))
+        return key.hexdigest()
+
+    def read_cache(self, cache_file):
+        """add the segmentations from 'cache_file' (written by write_cache())
+        to the cache; the file is ignored if it does not exist, or if it was
+        created with different BPE codes or options"""
+        if not os.path.exists(cache_file):
+            return
+        try:
+            with open(cache_file, 'rb') as f:
+                version, key, word_cache = pickle.load(f)
+        except Exception as e:
+            sys.stderr.write('Warning: ignoring cache file {0}: {1}\n'.format(cache_file, e))
+            return
+        if version != CACHE_VERSION or key != self.get_cache_key():
+            sys.stderr.write('Warning: ignoring cache file {0}, which was created with '
+                             'different BPE codes or options\n'.format(cache_file))
+            return
+        self.word_cache.update(word_cache)
+
+    def write_cache(self, cache_file):
+        """write the segmentations in the cache to 'cache_file'"""
+        tmp_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((CACHE_VERSION, self.get_cache_key(), self.word_cache), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_file, cache_file)
 
     def _isolate_glossaries(self, word):
         word_segments = [word]
@@ -144,9 +236,99 @@ def create_parser():
         metavar="STR",
         help="Glossaries. The strings provided in glossaries will not be affected"+
              "by the BPE (i.e. they will neither be broken into subwords, nor concatenated with other subwords")
+    parser.add_argument(
+        '--cache', type=str, default=None,
+        metavar="PATH",
+        help="Cache file with the segmentations of words. If provided, the segmentations in it are reused "
+             "(if it was created with the same BPE codes and options), and the segmentations of "
+             "new words are added to it.")
+    parser.add_argument(
+        '--num-workers', type=int, default=1,
+        metavar="INT",
+        help="Number of processes used to segment the input (default: %(default)s). If the input is a file, "
+             "its vocabulary is segmented first, and the lines are then mapped in parallel; the order "
+             "of the lines is preserved.")
+    parser.add_argument(
+        '--lines-per-chunk', type=int, default=10000,
+        metavar="INT",
+        help="Number of lines that are passed to a worker process at a time, if --num-workers > 1 "
+             "(default: %(default)s)")
 
     return parser
 
+_bpe = None
+
+def _init_worker(bpe):
+    global _bpe
+    _bpe = bpe
+
+def _segment_words_shard(words):
+    return [_bpe.segment_word(word) for word in words]
+
+def _process_lines(lines):
+    """segment a chunk of lines in a worker process; returns the output, and
+    the segmentations of the words that the worker had to segment itself"""
+    _bpe.new_words = []
+    output = ''.join([_bpe.process_line(line) for line in lines])
+    new_words = [(word, _bpe.word_cache[word]) for word in _bpe.new_words]
+    _bpe.new_words = None
+    return output, new_words
+
+def read_chunks(fobj, lines_per_chunk):
+    chunk = []
+    for line in fobj:
+        chunk.append(line)
+        if len(chunk) == lines_per_chunk:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def get_words(fobj):
+    """return the set of words (as split by BPE.segment()) in a text"""
+    words = set()
+    for line in fobj:
+        words.update(line.strip().split(' '))
+    words.discard('')
+    return words
+
+def apply_bpe_parallel(bpe, infile, outfile, num_workers, lines_per_chunk=10000):
+    """segment the lines of 'infile' with 'bpe' in 'num_workers' processes and
+    write them to 'outfile' in the same order.
+
+    If 'infile' is seekable, its vocabulary is segmented first (each word
+    once), so that the lines are then just mapped word-by-word; otherwise the
+    workers segment the words they have not seen themselves, and the
+    segmentations are added to the cache of 'bpe' afterwards.
+    """
+    try:
+        seekable = infile.seekable()
+    except (AttributeError, IOError, ValueError):
+        seekable = False
+    if seekable:
+        bpe.segment_words(get_words(infile), num_workers)
+        infile.seek(0)
+
+    pool = multiprocessing.Pool(num_workers, _init_worker, (bpe,))
+    try:
+        # at most this many chunks are in flight at a time, so that the input
+        # is not read into memory much faster than the output is written.
+        max_pending = 2 * num_workers
+        pending = deque()
+        for chunk in read_chunks(infile, lines_per_chunk):
+            pending.append(pool.apply_async(_process_lines, (chunk,)))
+            if len(pending) >= max_pending:
+                output, new_words = pending.popleft().get()
+                outfile.write(output)
+                bpe.word_cache.update(new_words)
+        while pending:
+            output, new_words = pending.popleft().get()
+            outfile.write(output)
+            bpe.word_cache.update(new_words)
+    finally:
+        pool.terminate()
+        pool.join()
+
 def get_pairs(word):
     """Return set of symbol pairs in a word.
 
@@ -336,5 +518,14 @@ if __name__ == '__main__':
 
     bpe = BPE(args.codes, args.merges, args.separator, vocabulary, args.glossaries)
 
-    for line in args.input:
-        args.output.write(bpe.process_line(line))
+    if args.cache:
+        bpe.read_cache(args.cache)
+
+    if args.num_workers > 1:
+        apply_bpe_parallel(bpe, args.input, args.output, args.num_workers, args.lines_per_chunk)
+    else:
+        for line in args.input:
+            args.output.write(bpe.process_line(line))
+
+    if args.cache:
+        bpe.write_cache(args.cache)
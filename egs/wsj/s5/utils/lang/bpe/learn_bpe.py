@@ -18,9 +18,9 @@ from __future__ import print_function
 
 import sys
 import codecs
-import re
-import copy
 import argparse
+import heapq
+import multiprocessing
 from collections import defaultdict, Counter
 
 # hack for python2/3 compatibility
@@ -49,6 +49,9 @@ def create_parser():
         help='Stop if no symbol pair has frequency >= FREQ (default: %(default)s))')
     parser.add_argument('--dict-input', action="store_true",
         help="If set, input file is interpreted as a dictionary where each line contains a word-count pair")
+    parser.add_argument(
+        '--num-workers', type=int, default=1,
+        help="Number of processes used to compute the initial pair statistics (default: %(default)s))")
     parser.add_argument(
         '--verbose', '-v', action="store_true",
         help="verbose mode.")
@@ -73,67 +76,29 @@ def get_vocabulary(fobj, is_dict=False):
                     vocab[word] += 1
     return vocab
 
-def update_pair_statistics(pair, changed, stats, indices):
-    """Minimally update the indices and frequency of symbol pairs
+class _ReversedPair(object):
+    """Wraps a pair of symbol strings so that, in a min-heap of
+    (-frequency, _ReversedPair(pair), ...) entries, the lexicographically
+    largest pair comes first among pairs with the same frequency; this is the
+    order of max(stats, key=lambda x: (stats[x], x)).
+    """
+    __slots__ = ['pair']
+
+    def __init__(self, pair):
+        self.pair = pair
+
+    def __lt__(self, other):
+        return self.pair > other.pair
 
-    if we merge a pair of symbols, only pairs that overlap with occurrences
-    of this pair are affected, and need to be updated.
+    def __eq__(self, other):
+        return self.pair == other.pair
+
+
+def get_pair_statistics(words, freqs, offset=0):
+    """Count frequency of all symbol pairs in 'words' (lists of symbol ids)
+    with frequencies 'freqs', and create an index from pairs to the number of
+    their occurrences in each word.  The words are numbered from 'offset'.
     """
-    stats[pair] = 0
-    indices[pair] = defaultdict(int)
-    first, second = pair
-    new_pair = first+second
-    for j, word, old_word, freq in changed:
-
-        # find all instances of pair, and update frequency/indices around it
-        i = 0
-        while True:
-            # find first symbol
-            try:
-                i = old_word.index(first, i)
-            except ValueError:
-                break
-            # if first symbol is followed by second symbol, we've found an occurrence of pair (old_word[i:i+2])
-            if i < len(old_word)-1 and old_word[i+1] == second:
-                # assuming a symbol sequence "A B C", if "B C" is merged, reduce the frequency of "A B"
-                if i:
-                    prev = old_word[i-1:i+1]
-                    stats[prev] -= freq
-                    indices[prev][j] -= 1
-                if i < len(old_word)-2:
-                    # assuming a symbol sequence "A B C B", if "B C" is merged, reduce the frequency of "C B".
-                    # however, skip this if the sequence is A B C B C, because the frequency of "C B" will be reduced by the previous code block
-                    if old_word[i+2] != first or i >= len(old_word)-3 or old_word[i+3] != second:
-                        nex = old_word[i+1:i+3]
-                        stats[nex] -= freq
-                        indices[nex][j] -= 1
-                i += 2
-            else:
-                i += 1
-
-        i = 0
-        while True:
-            try:
-                # find new pair
-                i = word.index(new_pair, i)
-            except ValueError:
-                break
-            # assuming a symbol sequence "A BC D", if "B C" is merged, increase the frequency of "A BC"
-            if i:
-                prev = word[i-1:i+1]
-                stats[prev] += freq
-                indices[prev][j] += 1
-            # assuming a symbol sequence "A BC B", if "B C" is merged, increase the frequency of "BC B"
-            # however, if the sequence is A BC BC, skip this step because the count of "BC BC" will be incremented by the previous code block
-            if i < len(word)-1 and word[i+1] != new_pair:
-                nex = word[i:i+2]
-                stats[nex] += freq
-                indices[nex][j] += 1
-            i += 1
-
-
-def get_pair_statistics(vocab):
-    """Count frequency of all symbol pairs, and create index"""
 
     # data structure of pair frequencies
     stats = defaultdict(int)
@@ -141,57 +106,167 @@ def get_pair_statistics(vocab):
     #index from pairs to words
     indices = defaultdict(lambda: defaultdict(int))
 
-    for i, (word, freq) in enumerate(vocab):
+    for i, (word, freq) in enumerate(zip(words, freqs)):
         prev_char = word[0]
         for char in word[1:]:
             stats[prev_char, char] += freq
-            indices[prev_char, char][i] += 1
+            indices[prev_char, char][i + offset] += 1
             prev_char = char
 
     return stats, indices
 
 
-def replace_pair(pair, vocab, indices):
-    """Replace all occurrences of a symbol pair ('A', 'B') with a new symbol 'AB'"""
-    first, second = pair
-    pair_str = ''.join(pair)
-    pair_str = pair_str.replace('\\','\\\\')
-    changes = []
-    pattern = re.compile(r'(?<!\S)' + re.escape(first + ' ' + second) + r'(?!\S)')
-    if sys.version_info < (3, 0):
-        iterator = indices[pair].iteritems()
-    else:
-        iterator = indices[pair].items()
-    for j, freq in iterator:
-        if freq < 1:
-            continue
-        word, freq = vocab[j]
-        new_word = ' '.join(word)
-        new_word = pattern.sub(pair_str, new_word)
-        new_word = tuple(new_word.split(' '))
-
-        vocab[j] = (new_word, freq)
-        changes.append((j, new_word, word, freq))
-
-    return changes
-
-def prune_stats(stats, big_stats, threshold):
-    """Prune statistics dict for efficiency of max()
-
-    The frequency of a symbol pair never increases, so pruning is generally safe
-    (until we the most frequent pair is less frequent than a pair we previously pruned)
-    big_stats keeps full statistics for when we need to access pruned items
-    """
-    for item,freq in list(stats.items()):
-        if freq < threshold:
-            del stats[item]
-            if freq < 0:
-                big_stats[item] += freq
-            else:
-                big_stats[item] = freq
+def _get_pair_statistics_shard(args):
+    words, freqs, offset = args
+    stats, indices = get_pair_statistics(words, freqs, offset)
+    return dict(stats), dict((pair, dict(index))
+                             for pair, index in indices.items())
+
 
+class BpeLearner(object):
+    """Learns BPE operations from a vocabulary.
 
-def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False):
+    The words are stored as lists of integer symbol ids that are updated in
+    place when a pair is merged, and the pair frequencies are kept in a
+    max-heap with lazy deletion: whenever the frequency of a pair changes, a
+    new entry is pushed, and entries whose frequency is out of date are
+    discarded when they reach the top.  A merge only touches the words that
+    contain the merged pair, so the cost of each merge is proportional to the
+    number of its occurrences rather than to the number of distinct pairs.
+    """
+
+    def __init__(self, vocab, num_workers=1):
+        """'vocab' is a list of (word, frequency), where each word is a tuple
+        of symbols (e.g. characters)."""
+        self.symbols = []
+        self.symbol_ids = {}
+        self.words = [[self.get_symbol_id(x) for x in word]
+                      for word, freq in vocab]
+        self.freqs = [freq for word, freq in vocab]
+
+        if num_workers > 1 and len(self.words) > num_workers:
+            self.stats, self.indices = self._get_pair_statistics_sharded(
+                num_workers)
+        else:
+            self.stats, self.indices = get_pair_statistics(self.words,
+                                                           self.freqs)
+
+        self.heap = [(-freq, _ReversedPair(self.pair_symbols(pair)), pair)
+                     for pair, freq in self.stats.items() if freq > 0]
+        heapq.heapify(self.heap)
+
+    def get_symbol_id(self, symbol):
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self.symbols)
+            self.symbols.append(symbol)
+            self.symbol_ids[symbol] = symbol_id
+        return symbol_id
+
+    def pair_symbols(self, pair):
+        return (self.symbols[pair[0]], self.symbols[pair[1]])
+
+    def _get_pair_statistics_sharded(self, num_workers):
+        """Computes the initial pair statistics in 'num_workers' processes,
+        each on a contiguous range of the words."""
+        shard_size = (len(self.words) + num_workers - 1) // num_workers
+        shards = [(self.words[i:i+shard_size], self.freqs[i:i+shard_size], i)
+                  for i in range(0, len(self.words), shard_size)]
+        pool = multiprocessing.Pool(num_workers)
+        try:
+            results = pool.map(_get_pair_statistics_shard, shards)
+        finally:
+            pool.close()
+            pool.join()
+        stats = defaultdict(int)
+        indices = defaultdict(lambda: defaultdict(int))
+        for shard_stats, shard_indices in results:
+            for pair, freq in shard_stats.items():
+                stats[pair] += freq
+            for pair, index in shard_indices.items():
+                # the shards contain disjoint sets of words.
+                indices[pair].update(index)
+        return stats, indices
+
+    def most_frequent_pair(self):
+        """Returns the most frequent pair (as a pair of symbol strings) and
+        its frequency, or (None, 0) if there are no pairs left; among pairs
+        with the same frequency, the lexicographically largest one is chosen.
+        """
+        heap = self.heap
+        stats = self.stats
+        while heap:
+            neg_freq, reversed_pair, pair = heap[0]
+            if stats.get(pair) == -neg_freq:
+                return reversed_pair.pair, -neg_freq
+            heapq.heappop(heap)
+        return None, 0
+
+    def merge(self, pair_symbols):
+        """Replaces all occurrences of the pair of symbols ('A', 'B') with a
+        new symbol 'AB' (non-overlapping, from left to right, e.g. "A A A"
+        becomes "AA A"), and updates the pair statistics."""
+        first = self.symbol_ids[pair_symbols[0]]
+        second = self.symbol_ids[pair_symbols[1]]
+        pair = (first, second)
+        new_symbol = self.get_symbol_id(pair_symbols[0] + pair_symbols[1])
+        stats = self.stats
+        indices = self.indices
+        # the frequencies before this merge of the pairs that were touched.
+        old_freqs = {}
+
+        for j, count in list(indices[pair].items()):
+            if count < 1:
+                continue
+            word = self.words[j]
+            freq = self.freqs[j]
+            # the changes of the counts of pairs in this word; only the pairs
+            # next to an occurrence of the merged pair can change.  E.g. if
+            # "B C" is merged in "A B C D", "A B" and "C D" are replaced by
+            # "A BC" and "BC D".  The count of the merged pair itself is
+            # discarded below.
+            deltas = defaultdict(int)
+            k = 0
+            while True:
+                try:
+                    k = word.index(first, k)
+                except ValueError:
+                    break
+                if k < len(word) - 1 and word[k + 1] == second:
+                    if k > 0:
+                        # word[k - 1] is the merged symbol if the previous
+                        # symbols were an occurrence too, as in "A B A B".
+                        deltas[word[k - 1], first] -= 1
+                        deltas[word[k - 1], new_symbol] += 1
+                    if k < len(word) - 2:
+                        deltas[second, word[k + 2]] -= 1
+                        deltas[new_symbol, word[k + 2]] += 1
+                    word[k:k + 2] = [new_symbol]
+                k += 1
+
+            for p, delta in deltas.items():
+                if delta == 0 or p == pair:
+                    continue
+                if p not in old_freqs:
+                    old_freqs[p] = stats.get(p, 0)
+                stats[p] += delta * freq
+                index = indices[p]
+                index[j] += delta
+                if index[j] == 0:
+                    del index[j]
+
+        del stats[pair]
+        del indices[pair]
+        for p, old_freq in old_freqs.items():
+            freq = stats.get(p, 0)
+            if freq != old_freq and freq > 0:
+                heapq.heappush(self.heap, (-freq,
+                                           _ReversedPair(self.pair_symbols(p)),
+                                           p))
+
+
+def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False,
+         num_workers=1):
     """Learn num_symbols BPE operations from vocabulary, and write to outfile.
     """
 
@@ -203,35 +278,18 @@ def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=F
     vocab = dict([(tuple(x[:-1])+(x[-1]+'</w>',) ,y) for (x,y) in vocab.items()])
     sorted_vocab = sorted(vocab.items(), key=lambda x: x[1], reverse=True)
 
-    stats, indices = get_pair_statistics(sorted_vocab)
-    big_stats = copy.deepcopy(stats)
-    # threshold is inspired by Zipfian assumption, but should only affect speed
-    threshold = max(stats.values()) / 10
+    learner = BpeLearner(sorted_vocab, num_workers)
     for i in range(num_symbols):
-        if stats:
-            most_frequent = max(stats, key=lambda x: (stats[x], x))
-
-        # we probably missed the best pair because of pruning; go back to full statistics
-        if not stats or (i and stats[most_frequent] < threshold):
-            prune_stats(stats, big_stats, threshold)
-            stats = copy.deepcopy(big_stats)
-            most_frequent = max(stats, key=lambda x: (stats[x], x))
-            # threshold is inspired by Zipfian assumption, but should only affect speed
-            threshold = stats[most_frequent] * i/(i+10000.0)
-            prune_stats(stats, big_stats, threshold)
-
-        if stats[most_frequent] < min_frequency:
+        most_frequent, freq = learner.most_frequent_pair()
+
+        if most_frequent is None or freq < min_frequency:
             sys.stderr.write('no pair has frequency >= {0}. Stopping\n'.format(min_frequency))
             break
 
         if verbose:
-            sys.stderr.write('pair {0}: {1} {2} -> {1}{2} (frequency {3})\n'.format(i, most_frequent[0], most_frequent[1], stats[most_frequent]))
+            sys.stderr.write('pair {0}: {1} {2} -> {1}{2} (frequency {3})\n'.format(i, most_frequent[0], most_frequent[1], freq))
         outfile.write('{0} {1}\n'.format(*most_frequent))
-        changes = replace_pair(most_frequent, sorted_vocab, indices)
-        update_pair_statistics(most_frequent, changes, stats, indices)
-        stats[most_frequent] = 0
-        if not i % 100:
-            prune_stats(stats, big_stats, threshold)
+        learner.merge(most_frequent)
 
 
 if __name__ == '__main__':
@@ -255,4 +313,5 @@ if __name__ == '__main__':
     if args.output.name != '<stdout>':
         args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
 
-    main(args.input, args.output, args.symbols, args.min_frequency, args.verbose, is_dict=args.dict_input)
+    main(args.input, args.output, args.symbols, args.min_frequency, args.verbose, is_dict=args.dict_input,
+         num_workers=args.num_workers)
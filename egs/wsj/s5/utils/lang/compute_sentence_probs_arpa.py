@@ -6,9 +6,16 @@
 
 from __future__ import print_function
 import argparse
+import os
+import shutil
 import sys
 import math
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 parser = argparse.ArgumentParser(description="This script evaluates the log probabilty (default log base is e) of each sentence "
                                              "from data (in text form), given a language model in arpa form "
                                              "and a specific ngram order.",
@@ -24,6 +31,20 @@ parser.add_argument("prob_file", type=str,
                     help="Filename of output probability file.")
 parser.add_argument("--log-base", type=float, default=math.exp(1),
                     help="Log base for log porbability")
+parser.add_argument("--use-compiled-model", type=str, default="false",
+                    choices=["true", "false"],
+                    help="If true, the language model is compiled into sorted integer-id "
+                         "n-gram tables (requires numpy) that are memory-mapped instead of "
+                         "being loaded into a dictionary, and the sentences are scored in "
+                         "batches. The output is the same.")
+parser.add_argument("--compiled-model-dir", type=str, default="",
+                    help="Directory where the compiled language model is cached; if it "
+                         "is up to date with the arpa file it is reused, otherwise it is "
+                         "rebuilt. Defaults to ARPA_LM.compiled. Only used with "
+                         "--use-compiled-model=true.")
+parser.add_argument("--batch-size", type=int, default=10000,
+                    help="Number of sentences scored together with "
+                         "--use-compiled-model=true.")
 args = parser.parse_args()
 
 def check_args(args):
@@ -31,6 +52,13 @@ def check_args(args):
     args.prob_file_handle = sys.stdout if args.prob_file == "-" else open(args.prob_file, "w")
     if args.log_base <= 0:
         sys.exit("compute_sentence_probs_arpa.py: Invalid log base (must be greater than 0)")
+    args.use_compiled_model = (args.use_compiled_model == "true")
+    if args.use_compiled_model and np is None:
+        sys.exit("compute_sentence_probs_arpa.py: --use-compiled-model=true requires numpy")
+    if args.compiled_model_dir == "":
+        args.compiled_model_dir = args.arpa_lm + ".compiled"
+    if args.batch_size <= 0:
+        sys.exit("compute_sentence_probs_arpa.py: Invalid batch size (must be greater than 0)")
 
 def is_logprob(input):
     if input[0] == "-":
@@ -141,8 +169,260 @@ def output_result(text_in_handle, output_file_handle, ngram_order):
     output_file_handle.close()
 
 
+# The compiled language model consists of one table per ngram order n, each
+# stored as numpy arrays in the directory ARPA_LM.compiled:
+#   keys.n.npy: sorted int64 keys; the key of the ngram (word_1 ... word_n) is
+#               index_of(word_1 ... word_(n-1)) * vocab_size + id(word_n),
+#               where index_of() is the position in the table of order n-1
+#               (and index_of() of an empty history is 0).
+#   prob.n.npy: the log-probabilities, as read from the arpa file.
+#   bow.n.npy:  the backoff weights, or 0.0 if there are none.
+#   present.n.npy: 0 for the ngrams that are not in the arpa file and are
+#               only in the table because they are histories of higher
+#               order ngrams.
+# together with the vocabulary (words.txt) and some information about the
+# arpa file that it was compiled from (info.txt).
+# Words are read exactly as load_model() does, so that the scores are
+# identical.
+def compile_model(model_file, compiled_dir):
+    entries = {}
+    max_ngram_order = 0
+    header_count = 0
+    in_header = True
+    with open(model_file) as model:
+        line = model.readline()
+        if line[:-1] != "\\data\\":
+            sys.exit("compute_sentence_probs_arpa.py: Please make sure that language model is in arpa form.")
+        for line in model:
+            if in_header:
+                if "=" in line:
+                    header_count += int(line.split("=")[-1])
+                    max_ngram_order = int(line.split("=")[0].split()[-1])
+                    continue
+                in_header = False
+            if line[0] != "-":
+                continue
+            line_split = line.split()
+            if is_logprob(line_split[-1]):
+                ngram_key = tuple(line_split[1:-1])
+                value = (float(line_split[0]), float(line_split[-1]))
+            else:
+                ngram_key = tuple(line_split[1:])
+                value = (float(line_split[0]), 0.0)
+            if ngram_key in entries:
+                sys.exit("compute_sentence_probs_arpa.py: Duplicated ngram in arpa language model: {}.".format(" ".join(ngram_key)))
+            entries[ngram_key] = value
+
+    if header_count != len(entries):
+        sys.exit("compute_sentence_probs_arpa.py: Wrong loading model.")
+
+    words = sorted(set(word for ngram_key in entries for word in ngram_key))
+    word2id = dict((word, i) for i, word in enumerate(words))
+    vocab_size = len(words)
+
+    # Group the ngrams by order; histories that are not in the arpa file
+    # are added with present = 0.
+    ngrams_by_order = {}
+    for ngram_key in entries:
+        ids = tuple(word2id[word] for word in ngram_key)
+        for n in range(1, len(ids) + 1):
+            ngrams_by_order.setdefault(n, {})
+            if n == len(ids):
+                ngrams_by_order[n][ids] = entries[ngram_key]
+            elif ids[:n] not in ngrams_by_order[n]:
+                ngrams_by_order[n][ids[:n]] = None
+    del entries
+
+    tmp_dir = "{0}.tmp.{1}".format(compiled_dir, os.getpid())
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    prev_index = {(): 0}
+    num_orders = len(ngrams_by_order)
+    for n in range(1, num_orders + 1):
+        ngrams = ngrams_by_order.pop(n)
+        if len(prev_index) * vocab_size >= 2 ** 63:
+            sys.exit("compute_sentence_probs_arpa.py: Language model is too large to compile.")
+        ordered = sorted(ngrams.keys(), key=lambda ids: (prev_index[ids[:-1]], ids[-1]))
+        keys = np.array([prev_index[ids[:-1]] * vocab_size + ids[-1] for ids in ordered],
+                        dtype=np.int64)
+        prob = np.zeros(len(ordered), dtype=np.float64)
+        bow = np.zeros(len(ordered), dtype=np.float64)
+        present = np.zeros(len(ordered), dtype=np.int8)
+        for i, ids in enumerate(ordered):
+            if ngrams[ids] is not None:
+                prob[i], bow[i] = ngrams[ids]
+                present[i] = 1
+        for name, array in [("keys", keys), ("prob", prob), ("bow", bow), ("present", present)]:
+            np.save(os.path.join(tmp_dir, "{0}.{1}.npy".format(name, n)), array)
+        prev_index = dict((ids, i) for i, ids in enumerate(ordered))
+
+    with open(os.path.join(tmp_dir, "words.txt"), "w") as f:
+        for word in words:
+            f.write(word + "\n")
+    with open(os.path.join(tmp_dir, "info.txt"), "w") as f:
+        f.write(get_model_file_info(model_file) + "\n")
+        f.write("{0} {1}\n".format(num_orders, max_ngram_order))
+
+    if os.path.exists(compiled_dir):
+        shutil.rmtree(compiled_dir)
+    os.rename(tmp_dir, compiled_dir)
+
+
+def get_model_file_info(model_file):
+    stat = os.stat(model_file)
+    return "{0} {1}".format(stat.st_size, stat.st_mtime)
+
+
+class CompiledModel(object):
+    """Language model compiled by compile_model(), with its tables
+    memory-mapped so that they are loaded lazily and shared between
+    processes that use the same model."""
+    def __init__(self, compiled_dir):
+        with open(os.path.join(compiled_dir, "info.txt")) as f:
+            f.readline()
+            num_orders, self.max_ngram_order = [int(x) for x in f.readline().split()]
+        with open(os.path.join(compiled_dir, "words.txt")) as f:
+            self.word2id = dict((line[:-1], i) for i, line in enumerate(f))
+        self.vocab_size = len(self.word2id)
+        self.tables = [None]
+        for n in range(1, num_orders + 1):
+            self.tables.append(tuple(
+                np.load(os.path.join(compiled_dir, "{0}.{1}.npy".format(name, n)), mmap_mode="r")
+                for name in ["keys", "prob", "bow", "present"]))
+
+        # Words that are not unigrams in the model are replaced by <unk>,
+        # as in compute_sentence_prob().
+        unk_id = self.word2id.get("<unk>", -1)
+        self.unigram_ids = {}
+        keys, _, _, present = self.tables[1]
+        for word, word_id in self.word2id.items():
+            index = np.searchsorted(keys, word_id)
+            if index < len(keys) and keys[index] == word_id and present[index]:
+                self.unigram_ids[word] = word_id
+        self.unk_id = unk_id
+
+    def lookup(self, ngrams):
+        """Returns (index, found) for an array of ngrams (each row is a sequence of
+        word ids), where index is the position of each ngram in the table of its
+        order, and found is False for the ngrams that are not in that table."""
+        num_ngrams, order = ngrams.shape
+        index = np.zeros(num_ngrams, dtype=np.int64)
+        found = np.ones(num_ngrams, dtype=bool)
+        if order >= len(self.tables):
+            return index, np.zeros(num_ngrams, dtype=bool)
+        for n in range(1, order + 1):
+            keys = self.tables[n][0]
+            query = index * self.vocab_size + ngrams[:, n - 1]
+            index = np.searchsorted(keys, query)
+            in_range = index < len(keys)
+            index[~in_range] = 0
+            found &= in_range & (ngrams[:, n - 1] >= 0)
+            if len(keys) > 0:
+                found &= (keys[index] == query)
+        return index, found
+
+    def compute_ngram_probs(self, ngrams):
+        """Computes the same as compute_sublist_prob() for each row of ngrams,
+        with the backoff weights added in the same order."""
+        num_ngrams, order = ngrams.shape
+        prob = np.zeros(num_ngrams, dtype=np.float64)
+        # The start of the longest suffix that is in the model.
+        start = np.full(num_ngrams, order, dtype=np.int64)
+        for k in range(order - 1, -1, -1):
+            index, found = self.lookup(ngrams[:, k:])
+            if order - k < len(self.tables):
+                present = self.tables[order - k][3]
+                found &= (present[index] == 1)
+                prob = np.where(found, self.tables[order - k][1][index], prob)
+                start[found] = k
+        if np.any(start == order):
+            sys.exit("compute_sentence_probs_arpa.py: Ngram substring not found in arpa language model, please check.")
+        for k in range(order - 2, -1, -1):
+            index, found = self.lookup(ngrams[:, k:order - 1])
+            bow = np.where(found, self.tables[order - 1 - k][2][index], 0.0)
+            prob = np.where(k < start, prob + bow, prob)
+        return prob
+
+    def compute_sentence_probs(self, sentences, ngram_order):
+        """Computes the same as compute_sentence_prob() for a batch of
+        sentences (each a list of words including <s> and </s>)."""
+        # The ngrams to score, grouped by their length, as lists of
+        # (sentence index, is begin prob, word ids).
+        ngrams_by_length = {}
+        for s, sentence in enumerate(sentences):
+            ids = [self.unigram_ids.get(word, self.unk_id) for word in sentence]
+            sen_length = len(ids)
+            begin_length = min(sen_length, ngram_order)
+            for i in range(1, begin_length - 1):
+                ngrams_by_length.setdefault(i + 1, []).append((s, True, ids[:i + 1]))
+            if sen_length >= ngram_order:
+                for i in range(sen_length - ngram_order + 1):
+                    ngrams_by_length.setdefault(ngram_order, []).append(
+                        (s, False, ids[i:i + ngram_order]))
+
+        begin_probs = [[] for sentence in sentences]
+        probs = [[] for sentence in sentences]
+        # The probs are accumulated in the order of the ngrams in each
+        # sentence, as in compute_sentence_prob(); begin ngrams are shorter
+        # than the rest, so they come first within each sentence.
+        for length in sorted(ngrams_by_length.keys()):
+            ngrams = ngrams_by_length[length]
+            ngram_probs = self.compute_ngram_probs(
+                np.array([ids for _, _, ids in ngrams], dtype=np.int64))
+            for (s, is_begin, _), prob in zip(ngrams, ngram_probs.tolist()):
+                (begin_probs if is_begin else probs)[s].append(prob)
+
+        logprobs = []
+        for s, sentence in enumerate(sentences):
+            if len(sentence) < ngram_order:
+                logprobs.append(sum(begin_probs[s]))
+            else:
+                logprobs.append(sum([sum(begin_probs[s])] + probs[s]))
+        return logprobs
+
+
+def load_compiled_model(model_file, compiled_dir):
+    """Returns the CompiledModel for model_file, compiling it first if the
+    cached one in compiled_dir is missing or out of date."""
+    info_file = os.path.join(compiled_dir, "info.txt")
+    up_to_date = False
+    if os.path.exists(info_file):
+        with open(info_file) as f:
+            up_to_date = (f.readline().strip() == get_model_file_info(model_file))
+    if not up_to_date:
+        compile_model(model_file, compiled_dir)
+    return CompiledModel(compiled_dir)
+
+
+def output_result_compiled(model, text_in_handle, output_file_handle, ngram_order, batch_size):
+    logbase_modifier = math.log(10, args.log_base)
+    batch = []
+    for line in text_in_handle:
+        batch.append(("<s> " + line[:-1] + " </s>").split())
+        if len(batch) == batch_size:
+            for logprob in model.compute_sentence_probs(batch, ngram_order):
+                output_file_handle.write("{}\n".format(logprob * logbase_modifier))
+            batch = []
+    if len(batch) > 0:
+        for logprob in model.compute_sentence_probs(batch, ngram_order):
+            output_file_handle.write("{}\n".format(logprob * logbase_modifier))
+    text_in_handle.close()
+    output_file_handle.close()
+
+
 if __name__ == "__main__":
     check_args(args)
+    if args.use_compiled_model:
+        model = load_compiled_model(args.arpa_lm, args.compiled_model_dir)
+        if args.ngram_order <= 0 or args.ngram_order > model.max_ngram_order:
+            sys.exit("compute_sentence_probs_arpa.py: " +
+                "Invalid ngram_order (either negative or greater than maximum ngram number ({}) allowed)".format(model.max_ngram_order))
+        output_result_compiled(model, args.text_in_handle, args.prob_file_handle,
+                               args.ngram_order, args.batch_size)
+        sys.exit(0)
+
     ngram_dict, tot_num = load_model(args.arpa_lm)
 
     num_valid, max_ngram_order = check_number(args.arpa_lm, tot_num)
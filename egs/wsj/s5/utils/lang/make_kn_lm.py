@@ -21,8 +21,14 @@ import re
 import io
 import math
 import argparse
+import multiprocessing
 from collections import Counter, defaultdict
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 parser = argparse.ArgumentParser(description="""
     Generate kneser-ney language model as arpa format. By default,
@@ -32,6 +38,10 @@ parser.add_argument("-ngram-order", type=int, default=4, choices=[2, 3, 4, 5, 6,
 parser.add_argument("-text", type=str, default=None, help="Path to the corpus file")
 parser.add_argument("-lm", type=str, default=None, help="Path to output arpa file for language models")
 parser.add_argument("-verbose", type=int, default=0, choices=[0, 1, 2, 3, 4, 5], help="Verbose level")
+parser.add_argument("-num-jobs", type=int, default=1,
+                    help="If > 1, the n-grams are counted in this many processes, each on a range of "
+                         "lines of the corpus, and the language model is estimated from array-backed "
+                         "tables (requires numpy and -text). The output is the same.")
 args = parser.parse_args()
 
 default_encoding = "latin-1"  # For encoding-agnostic scripts, we assume byte stream as input.
@@ -358,15 +368,300 @@ class NgramCounts:
         print('\\end\\', file=fout)
 
 
-if __name__ == "__main__":
+def count_ngrams_in_shard(task):
+    # Counts the n-grams in the lines of 'filename' that start in the byte range
+    # [start, end), which must begin at the start of a line, in the same way as
+    # NgramCounts.add_raw_counts_from_line().  Words are mapped to integer ids
+    # local to this shard.  Returns (words, counts, lines_processed, stopped),
+    # where counts[n] is a tuple (ngrams, ngram_counts) of numpy arrays for the
+    # n-grams of order n+1, in the order in which they were first seen, and
+    # 'stopped' is True if an empty line was seen (which ends the input).
+    filename, start, end, ngram_order, bos_symbol, eos_symbol = task
+    with open(filename, 'rb') as fp:
+        fp.seek(start)
+        text = fp.read(end - start).decode(default_encoding)
+    # Split lines the same way as a file opened in text mode does.
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+
+    word_to_id = dict()
+    counts = [dict() for n in range(ngram_order)]
+    lines_processed = 0
+    stopped = False
+    for line in lines:
+        line = line.strip(strip_chars)
+        if line == '':
+            stopped = True
+            break
+        words = [bos_symbol] + whitespace.split(line) + [eos_symbol]
+        ids = [word_to_id.setdefault(word, len(word_to_id)) for word in words]
+        for i in range(len(ids)):
+            for n in range(1, ngram_order + 1):
+                if i + n > len(ids):
+                    break
+                ngram = tuple(ids[i: i + n])
+                this_order_counts = counts[n - 1]
+                this_order_counts[ngram] = this_order_counts.get(ngram, 0) + 1
+        lines_processed += 1
+
+    words = [None] * len(word_to_id)
+    for word, i in word_to_id.items():
+        words[i] = word
+    array_counts = []
+    for n in range(ngram_order):
+        ngrams = np.array(list(counts[n].keys()), dtype=np.int32).reshape(-1, n + 1)
+        array_counts.append((ngrams, np.array(list(counts[n].values()), dtype=np.int64)))
+    return words, array_counts, lines_processed, stopped
+
+
+def sequential_segment_sums(values, seg_starts, seg_lengths):
+    # Returns the sums of values[seg_starts[i]: seg_starts[i] + seg_lengths[i]]
+    # for each i.  The elements of each segment are added one by one from left to
+    # right (unlike numpy.add.reduceat, which may use pairwise summation), so the
+    # result is the same as summing them in a python loop.
+    sums = np.zeros(len(seg_starts), dtype=np.float64)
+    order = np.argsort(-seg_lengths, kind='stable')
+    starts = seg_starts[order]
+    lengths = seg_lengths[order]
+    num_active = len(order)
+    for k in range(int(lengths.max()) if len(lengths) > 0 else 0):
+        while num_active > 0 and lengths[num_active - 1] <= k:
+            num_active -= 1
+        sums[order[:num_active]] += values[starts[:num_active] + k]
+    return sums
+
+
+class NgramTable:
+    # This class (which is more like a struct) stores the n-grams of one order
+    # in ShardedNgramCounts as arrays, in the order in which NgramCounts would
+    # store (and print) them: grouped by history, with the histories in the order
+    # in which they were first seen, and the words of each history in the order in
+    # which they were first seen after it.  For the i'th n-gram:
+    #  hist[i] is the index of its history in the table of the next lower order
+    #   (0 for unigrams, whose history is empty),
+    #  word[i] is its last word,
+    #  suffix[i] is the index in the table of the next lower order of the n-gram
+    #   without its first word (0 for unigrams),
+    #  count[i] is its raw count.
+    # seg_starts and seg_lengths describe the runs of n-grams with the same
+    # history.  key[i] = hist[i] * vocab_size + word[i] is unique; sorted_keys and
+    # sorted_index are used to look it up.
+    def __init__(self, hist, word, count, vocab_size):
+        self.hist = hist
+        self.word = word
+        self.count = count
+        self.key = hist * vocab_size + word
+        self.sorted_index = np.argsort(self.key, kind='stable')
+        self.sorted_keys = self.key[self.sorted_index]
+        boundaries = np.flatnonzero(np.diff(hist)) + 1
+        self.seg_starts = np.concatenate(([0], boundaries)).astype(np.int64)
+        self.seg_lengths = np.diff(np.concatenate((self.seg_starts, [len(hist)])))
+        self.suffix = np.zeros(len(hist), dtype=np.int64)
+        self.f = None
+        self.bow = None
+
+    def lookup(self, keys):
+        # Returns the indexes of the n-grams with the given keys, which must exist.
+        positions = np.searchsorted(self.sorted_keys, keys)
+        assert np.all(self.sorted_keys[np.minimum(positions, len(self.sorted_keys) - 1)] == keys)
+        return self.sorted_index[positions]
+
+
+class ShardedNgramCounts:
+    # This class computes the same language model as NgramCounts, but the raw
+    # counts are accumulated in parallel processes, each on a range of lines of
+    # the corpus, and the rest of the computation is done on array-backed tables
+    # (see class NgramTable) instead of dicts of CountsForHistory objects.
+    #
+    # The number of unique left-contexts of an n-gram, which NgramCounts keeps as
+    # sets, is the number of (n+1)-grams whose suffix is that n-gram, so it is
+    # computed from the table of the next higher order.
+    def __init__(self, ngram_order, bos_symbol='<s>', eos_symbol='</s>'):
+        assert ngram_order >= 2
+        if np is None:
+            sys.exit("make_kn_lm.py: -num-jobs > 1 requires numpy")
 
-    ngram_counts = NgramCounts(args.ngram_order)
+        self.ngram_order = ngram_order
+        self.bos_symbol = bos_symbol
+        self.eos_symbol = eos_symbol
 
-    if args.text is None:
-        ngram_counts.add_raw_counts_from_standard_input()
-    else:
+        self.words = []
+        self.tables = []  # self.tables[n] is the NgramTable for history-length n.
+        self.d = []
+
+    def add_raw_counts_from_file(self, filename, num_jobs):
+        size = os.path.getsize(filename)
+        boundaries = [0]
+        with open(filename, 'rb') as fp:
+            for job in range(1, num_jobs):
+                fp.seek(max(job * size // num_jobs, boundaries[-1]))
+                fp.readline()
+                boundaries.append(min(fp.tell(), size))
+        boundaries.append(size)
+        tasks = [(filename, boundaries[i], boundaries[i + 1], self.ngram_order,
+                  self.bos_symbol, self.eos_symbol)
+                 for i in range(num_jobs) if boundaries[i] < boundaries[i + 1]]
+
+        pool = multiprocessing.Pool(min(num_jobs, max(len(tasks), 1)))
+        try:
+            shards = []
+            for shard in pool.imap(count_ngrams_in_shard, tasks):
+                shards.append(shard)
+                if shard[3]:
+                    # An empty line ends the input; the later shards are ignored.
+                    break
+        finally:
+            pool.terminate()
+
+        lines_processed = sum(shard[2] for shard in shards)
+        if lines_processed == 0 or args.verbose > 0:
+            print("make_phone_lm.py: processed {0} lines of input".format(lines_processed), file=sys.stderr)
+        self.merge_shards(shards)
+
+    def merge_shards(self, shards):
+        # Maps the words of each shard to global ids, sums the counts of the
+        # n-grams over the shards, and builds the tables.  The shards cover
+        # consecutive ranges of lines, so concatenating them keeps the order in
+        # which the n-grams were first seen.
+        word_to_id = dict()
+        id_maps = []
+        for words, _, _, _ in shards:
+            id_maps.append(np.array([word_to_id.setdefault(word, len(word_to_id)) for word in words],
+                                    dtype=np.int64))
+        self.words = [None] * len(word_to_id)
+        for word, i in word_to_id.items():
+            self.words[i] = word
+        vocab_size = len(self.words)
+
+        self.tables = []
+        for n in range(self.ngram_order):
+            ngrams = np.concatenate([id_map[counts[n][0]] for id_map, (_, counts, _, _) in zip(id_maps, shards)]
+                                    + [np.zeros((0, n + 1), dtype=np.int64)])
+            ngram_counts = np.concatenate([counts[n][1] for (_, counts, _, _) in shards]
+                                          + [np.zeros(0, dtype=np.int64)])
+            ngrams, first_seen, inverse = np.unique(ngrams, axis=0, return_index=True, return_inverse=True)
+            ngram_counts = np.bincount(inverse.reshape(-1), weights=ngram_counts,
+                                       minlength=len(ngrams)).astype(np.int64)
+            seen_order = np.argsort(first_seen, kind='stable')
+            ngrams = ngrams[seen_order]
+            ngram_counts = ngram_counts[seen_order]
+
+            # Find the index of the history of each n-gram in the lower-order tables.
+            hist = np.zeros(len(ngrams), dtype=np.int64)
+            for m in range(n):
+                hist = self.tables[m].lookup(hist * vocab_size + ngrams[:, m])
+            # Group by history, with the histories in the order in which they were
+            # first seen.
+            if n > 0:
+                hist_first_seen = np.full(len(self.tables[n - 1].word), len(ngrams), dtype=np.int64)
+                np.minimum.at(hist_first_seen, hist, np.arange(len(ngrams)))
+                order = np.argsort(hist_first_seen[hist], kind='stable')
+            else:
+                order = np.arange(len(ngrams))
+            table = NgramTable(hist[order], ngrams[order, -1], ngram_counts[order], vocab_size)
+            if n > 0:
+                lower_table = self.tables[n - 1]
+                table.suffix = lower_table.lookup(lower_table.suffix[table.hist] * vocab_size
+                                                  + table.word)
+            self.tables.append(table)
+
+    def cal_discounting_constants(self):
+        # See NgramCounts.cal_discounting_constants().
+        self.d = [0]
+        for n in range(1, self.ngram_order):
+            counts = self.tables[n].count
+            n1 = int(np.count_nonzero(counts == 1))
+            n2 = int(np.count_nonzero(counts == 2))
+            assert n1 + 2 * n2 > 0
+            self.d.append(n1 * 1.0 / (n1 + 2 * n2))
+
+    def cal_f(self):
+        # See NgramCounts.cal_f().
+        for n in range(self.ngram_order):
+            table = self.tables[n]
+            seg_index = np.repeat(np.arange(len(table.seg_starts)), table.seg_lengths)
+            total_count = np.add.reduceat(table.count, table.seg_starts)[seg_index]
+            raw_f = np.maximum(table.count - self.d[n], 0) * 1.0 / total_count
+            if n == self.ngram_order - 1:
+                table.f = raw_f
+                continue
+            # the number of unique contexts of each n-gram.
+            n_star_z = np.bincount(self.tables[n + 1].suffix, minlength=len(table.word))
+            n_star_star = np.add.reduceat(n_star_z, table.seg_starts)[seg_index]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                modified_f = np.maximum(n_star_z - self.d[n], 0) * 1.0 / n_star_star
+            table.f = np.where(n_star_star != 0, modified_f, raw_f)
+
+    def cal_bow(self):
+        # See NgramCounts.cal_bow().  bow is NaN for the n-grams that have no
+        # back-off weight.
+        eos_id = self.words.index(self.eos_symbol)
+        self.tables[-1].bow = np.full(len(self.tables[-1].word), np.nan)
+        for n in range(self.ngram_order - 1):
+            table = self.tables[n]
+            higher_table = self.tables[n + 1]
+            sum_z1_f_a_z = sequential_segment_sums(higher_table.f, higher_table.seg_starts,
+                                                   higher_table.seg_lengths)
+            sum_z1_f_z = sequential_segment_sums(table.f[higher_table.suffix], higher_table.seg_starts,
+                                                 higher_table.seg_lengths)
+            a_ = higher_table.hist[higher_table.seg_starts]
+
+            table.bow = np.full(len(table.word), np.nan)
+            has_bow = np.zeros(len(table.word), dtype=bool)
+            has_bow[a_] = True
+            assert np.all(has_bow | (table.word == eos_id))
+            if np.any(sum_z1_f_z[table.word[a_] != eos_id] == 1.0):
+                raise ZeroDivisionError("float division by zero")
+            with np.errstate(divide='ignore', invalid='ignore'):
+                table.bow[a_] = (1.0 - sum_z1_f_a_z) / (1.0 - sum_z1_f_z)
+            table.bow[table.word == eos_id] = np.nan
+
+    def print_as_arpa(self, fout=io.TextIOWrapper(sys.stdout.buffer, encoding='latin-1')):
+        # print as ARPA format; see NgramCounts.print_as_arpa().
+        print('\\data\\', file=fout)
+        for hist_len in range(self.ngram_order):
+            print('ngram {0}={1}'.format(hist_len + 1, len(self.tables[hist_len].word)), file=fout)
+
+        print('', file=fout)
+
+        ngrams = np.zeros((1, 0), dtype=np.int64)
+        for hist_len in range(self.ngram_order):
+            print('\\{0}-grams:'.format(hist_len + 1), file=fout)
+
+            table = self.tables[hist_len]
+            ngrams = np.concatenate((ngrams[table.hist], table.word[:, None]), axis=1)
+            lines = []
+            for ngram, prob, bow in zip(ngrams.tolist(), table.f.tolist(), table.bow.tolist()):
+                if prob == 0:  # f(<s>) is always 0
+                    prob = 1e-99
+
+                line = '{0}\t{1}'.format('%.7f' % math.log10(prob), ' '.join([self.words[w] for w in ngram]))
+                if not math.isnan(bow):
+                    line += '\t{0}'.format('%.7f' % math.log10(bow))
+                lines.append(line)
+            if len(lines) > 0:
+                fout.write('\n'.join(lines) + '\n')
+            print('', file=fout)
+        print('\\end\\', file=fout)
+
+
+if __name__ == "__main__":
+
+    if args.num_jobs > 1:
+        if args.text is None:
+            sys.exit("make_kn_lm.py: -num-jobs > 1 requires -text")
         assert os.path.isfile(args.text)
-        ngram_counts.add_raw_counts_from_file(args.text)
+        ngram_counts = ShardedNgramCounts(args.ngram_order)
+        ngram_counts.add_raw_counts_from_file(args.text, args.num_jobs)
+    else:
+        ngram_counts = NgramCounts(args.ngram_order)
+
+        if args.text is None:
+            ngram_counts.add_raw_counts_from_standard_input()
+        else:
+            assert os.path.isfile(args.text)
+            ngram_counts.add_raw_counts_from_file(args.text)
 
     ngram_counts.cal_discounting_constants()
     ngram_counts.cal_f()
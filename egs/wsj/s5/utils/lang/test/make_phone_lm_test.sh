@@ -0,0 +1,85 @@
+#!/usr/bin/env bash
+
+# Apache 2.0.
+
+# This script checks that utils/lang/make_phone_lm.py still produces the same
+# language models as before, for a few configurations, on the small phone
+# corpus make_phone_lm/phones.txt (300 synthetic phone sequences over 16
+# phones).  The expected outputs in make_phone_lm/ were written by the
+# version of make_phone_lm.py before its pruning was sped up (run with
+# python2, as that version did not run with python3).
+#
+# The FSTs are compared after numbering their states in breadth-first order
+# from the start state, as the state numbers (and the order of the lines)
+# depend on the iteration order of python dicts, which differs between
+# python versions; and the costs are compared to 8 significant digits, as
+# python2 prints fewer digits than python3.
+#
+# Usage: utils/lang/test/make_phone_lm_test.sh
+# It exits with status 0 if all the outputs are as expected.
+
+dir=$(dirname $0)
+data=$dir/make_phone_lm
+script=$dir/../make_phone_lm.py
+
+tmpdir=$(mktemp -d)
+trap "rm -r $tmpdir" EXIT
+
+# Prints the FST in text form in $1 with its states numbered in breadth-first
+# order from the start state, visiting the arcs of each state in order of
+# their input labels, and with the costs rounded to 8 significant digits.
+canonicalize_fst() {
+  start=$(head -n 1 $1 | awk '{print $1}')
+  sort -k1,1n -k3,3n $1 | \
+    awk -v start=$start '
+      { num_lines[$1]++; line[$1, num_lines[$1]] = $0; }
+      END {
+        id[start] = 0; queue[0] = start; num_states = 1;
+        for (q = 0; q < num_states; q++) {
+          s = queue[q];
+          for (k = 1; k <= num_lines[s]; k++) {
+            if (split(line[s, k], f, " ") == 2) {
+              print id[s], sprintf("%.8g", f[2]);
+            } else {
+              if (!(f[2] in id)) { id[f[2]] = num_states; queue[num_states++] = f[2]; }
+              print id[s], id[f[2]], f[3], f[4], sprintf("%.8g", f[5]);
+            }
+          }
+        }
+        for (s in num_lines)
+          if (!(s in id)) print "unreachable state " s;
+      }'
+}
+
+# Prints the ARPA file in $1 with its lines sorted (the n-grams of each order
+# are printed in the iteration order of a python dict).
+canonicalize_arpa() {
+  LC_ALL=C sort $1
+}
+
+# check <name> <type> <options>: runs make_phone_lm.py with <options> and
+# compares its output with $data/<name>.
+check() {
+  name=$1; type=$2; shift 2
+  if ! python $script "$@" <$data/phones.txt >$tmpdir/$name 2>$tmpdir/$name.log; then
+    echo "$0: make_phone_lm.py $@ failed, see below:"
+    cat $tmpdir/$name.log
+    return 1
+  fi
+  canonicalize_$type $data/$name >$tmpdir/$name.expected
+  canonicalize_$type $tmpdir/$name >$tmpdir/$name.canonical
+  if ! cmp -s $tmpdir/$name.expected $tmpdir/$name.canonical; then
+    echo "$0: make_phone_lm.py $@ gave a different $name; the diff is:"
+    diff $tmpdir/$name.expected $tmpdir/$name.canonical | head -n 20
+    return 1
+  fi
+  echo "$0: $name OK"
+}
+
+status=0
+check 4gram.fst.txt fst --phone-disambig-symbol=17 --num-extra-ngrams=300 || status=1
+check 5gram.fst.txt fst --phone-disambig-symbol=17 --ngram-order=5 \
+  --num-extra-ngrams=150 || status=1
+check 5gram.arpa arpa --print-as-arpa=true --no-backoff-ngram-order=1 \
+  --ngram-order=5 --num-extra-ngrams=200 || status=1
+exit $status
@@ -7,6 +7,8 @@
 import os
 import argparse
 import sys
+import multiprocessing
+from collections import defaultdict, deque
 
 import re
 
@@ -32,6 +34,20 @@ parser.add_argument("--data-weights-file", type=str, default='', required=True,
                     "like 'foo 1 0.5' and 'bar 2 1.5'.  These don't have to sum to one.")
 parser.add_argument("--num-splits", type=int, required=True,
                     help="The number of pieces to split up the data into.")
+parser.add_argument("--num-jobs", type=int, default=1,
+                    help="The number of processes used to convert the text to integer form.")
+parser.add_argument("--unigram-probs-file", type=str, default='',
+                    help="If supplied, the unigram probabilities of the words, as computed "
+                    "by rnnlm/get_unigram_probs.py, are written to this file; they are "
+                    "computed from the word counts of the data sources, which are "
+                    "accumulated while the data is split.")
+parser.add_argument("--smooth-unigram-counts", type=float, default=1.0,
+                    help="The constant for smoothing the unigram counts, if "
+                    "--unigram-probs-file is supplied; see rnnlm/get_unigram_probs.py.")
+parser.add_argument("--write-counts", type=str, default='false', choices=['true', 'false'],
+                    help="If true, write the unigram counts of each data source <name>.txt "
+                    "in <text_dir> to <text_dir>/<name>.counts, as rnnlm/ensure_counts_present.sh "
+                    "would.")
 parser.add_argument("text_dir",
                     help="Directory in which to look for source data, as validated by validate_text_dir.py")
 parser.add_argument("split_dir",
@@ -88,33 +104,191 @@ def read_data_weights(weights_file, data_sources):
 
 
 
-# This function opens the file with filename 'source_filename',
-# reads from it line by line, and writes the lines round-robin
-# to the filehandles in the array 'output_filehandles',
-# each prepended by the weights in 'weight'.
-def distribute_to_outputs(source_filename, weight, output_filehandles):
-    weight_str = str(weight) + ' '
+# read the vocab, and return a dict from the word (as bytes) to its
+# integer id (as bytes, as it should be written to the output).
+def read_vocab(vocab_file):
+    vocab = {}
+    with open(vocab_file, 'rb') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) != 2:
+                sys.exit(sys.argv[0] + ": bad line in vocab file {0}: {1}".format(
+                    vocab_file, line.decode('utf-8', 'replace').rstrip("\n")))
+            vocab[fields[0]] = str(int(fields[1])).encode()
+    return vocab
+
+
+# The arguments that are the same for every call of integerize_lines();
+# in the worker processes they are set by init_worker().
+vocab = None
+unk_id = None
+count_words = False
+
+
+def init_worker(worker_vocab, worker_unk_id, worker_count_words):
+    global vocab, unk_id, count_words
+    vocab = worker_vocab
+    unk_id = worker_unk_id
+    count_words = worker_count_words
+
+
+# This function converts the lines in the list 'lines' (of bytes) to integer
+# form, as utils/sym2int.pl would, and prepends the prefix 'prefix' (e.g. the
+# data-weight followed by a space) to each of them; empty lines are
+# converted to 'empty_line'.  The line with index i in 'lines' goes to output
+# (first_output + i) % num_outputs.  If 'prefix' is None, the lines are only
+# counted.
+# It returns a tuple (outputs, word_counts, num_oovs), where 'outputs'
+# contains the integerized text for each output, 'word_counts' is a dict
+# from word to its count in the lines (with </s> counted once per line),
+# if 'count_words' is true, and 'num_oovs' is the number of words that
+# were mapped to the unknown word.
+def integerize_lines(lines, prefix, empty_line, first_output, num_outputs):
+    outputs = [[] for n in range(num_outputs)]
+    word_counts = defaultdict(int)
+    num_oovs = 0
+    for i, line in enumerate(lines):
+        words = line.split()
+        if count_words:
+            for word in words:
+                word_counts[word] += 1
+        if prefix is None:
+            continue
+        try:
+            ids = [vocab[word] for word in words]
+        except KeyError:
+            ids = []
+            for pos, word in enumerate(words):
+                if word in vocab:
+                    ids.append(vocab[word])
+                elif unk_id is not None:
+                    ids.append(unk_id)
+                    num_oovs += 1
+                else:
+                    raise ValueError("undefined symbol {0} (in position {1})".format(
+                        word.decode('utf-8', 'replace'), pos + 2))
+        outputs[(first_output + i) % num_outputs].append(
+            prefix + b' '.join(ids) + b'\n' if ids else empty_line)
+    if count_words:
+        word_counts[b'</s>'] += len(lines)
+    return [b''.join(x) for x in outputs], dict(word_counts), num_oovs
+
+
+# This function reads the file with filename 'source_filename' in chunks of
+# lines, converts them to integer form with integerize_lines() (in the
+# worker processes of 'pool', if it is not None), and writes the lines
+# round-robin to the filehandles in the array 'output_filehandles'.
+# It returns a tuple (word_counts, num_oovs); see integerize_lines().
+def integerize_to_outputs(source_filename, prefix, empty_line, output_filehandles, pool):
     num_outputs = len(output_filehandles)
-    n = 0
+    word_counts = defaultdict(int)
+    num_oovs = 0
+    # At most this many chunks are in flight at a time, so that the input
+    # is not read much faster than the output is written.
+    max_pending = 2 * args.num_jobs
+    pending = deque()
+
+    def write_outputs(result):
+        nonlocal num_oovs
+        outputs, chunk_word_counts, chunk_num_oovs = result
+        for output_filehandle, output in zip(output_filehandles, outputs):
+            output_filehandle.write(output)
+        for word, count in chunk_word_counts.items():
+            word_counts[word] += count
+        num_oovs += chunk_num_oovs
+
     try:
-        f = open(source_filename, 'r', encoding="utf-8")
+        f = open(source_filename, 'rb')
     except Exception as e:
         sys.exit(sys.argv[0] + ": failed to open file {0} for reading: {1} ".format(
             source_filename, str(e)))
-    for line in f:
-        output_filehandle = output_filehandles[n % num_outputs]
-        # the line 'line' will already have a terminating newline, so we
-        # suppress the extra newline by specifying end=''.
-        try:
-            print(weight_str + line, end='', file=output_filehandle)
-        except:
-            sys.exit(sys.argv[0] + ": failed to write to temporary file (disk full?)")
-        n += 1
-        print
-    f.close()
+    try:
+        num_lines = 0
+        while True:
+            lines = f.readlines(1 << 22)
+            if not lines:
+                break
+            task = (lines, prefix, empty_line, num_lines % num_outputs, num_outputs)
+            if pool is None:
+                write_outputs(integerize_lines(*task))
+            else:
+                pending.append(pool.apply_async(integerize_lines, task))
+                while len(pending) >= max_pending or (len(pending) > 0 and pending[0].ready()):
+                    write_outputs(pending.popleft().get())
+            num_lines += len(lines)
+        while len(pending) > 0:
+            write_outputs(pending.popleft().get())
+    except ValueError as e:
+        sys.exit(sys.argv[0] + ": error converting {0} to integer form: {1}".format(
+            source_filename, str(e)))
+    except IOError:
+        sys.exit(sys.argv[0] + ": failed to write to output file (disk full?)")
+    finally:
+        f.close()
+    return word_counts, num_oovs
+
+
+# This function appends the byte range [start, end) of the file
+# 'source_filename' to the filehandle 'output_filehandle'.
+def copy_range(source_filename, start, end, output_filehandle):
+    with open(source_filename, 'rb') as f:
+        f.seek(start)
+        while start < end:
+            data = f.read(min(end - start, 1 << 22))
+            if not data:
+                sys.exit(sys.argv[0] + ": unexpected end of file {0}".format(source_filename))
+            output_filehandle.write(data)
+            start += len(data)
+
+
+# This function writes the unigram counts in 'word_counts' to 'counts_file'
+# in the format of the *.counts files (see rnnlm/ensure_counts_present.sh).
+def write_counts(word_counts, counts_file):
+    with open(counts_file, 'wb') as f:
+        f.write(b''.join([word + b' ' + str(count).encode() + b'\n'
+                          for word, count in sorted(word_counts.items())]))
+
+
+# This function computes the unigram probabilities of the words in the
+# vocabulary from the unigram counts of the data sources, in the same way as
+# rnnlm/get_unigram_probs.py, and writes them to 'probs_file'.
+def write_unigram_probs(source_word_counts, data_weights, vocab, unk_id, smooth_constant,
+                        probs_file):
+    id_to_word = dict([(int(word_id), word) for word, word_id in vocab.items()])
+    counts = [0.0] * len(vocab)
+    for name, word_counts in source_word_counts.items():
+        weight = data_weights[name][0] * data_weights[name][1]
+        if weight == 0.0:
+            continue
+        for word, count in word_counts.items():
+            word_id = vocab.get(word, unk_id)
+            counts[int(word_id)] += weight * count
+
+    special_symbol_ids = [int(vocab[x]) for x in [b"<eps>", b"<s>", b"<brk>"]]
+    vocab_size = len(vocab) - len(special_symbol_ids)
+    num_words_with_non_zero_counts = 0
+    for word_id, count in enumerate(counts):
+        if word_id in special_symbol_ids:
+            continue
+        if count > 0:
+            num_words_with_non_zero_counts += 1
+
+    if num_words_with_non_zero_counts < vocab_size and smooth_constant == 0.0:
+        sys.exit(sys.argv[0] + ": --smooth-unigram-counts should not be zero, "
+                               "since there are words with zero-counts")
 
+    smooth_count = smooth_constant * num_words_with_non_zero_counts / vocab_size
 
+    total_counts = 0.0
+    for word_id, count in enumerate(counts):
+        if word_id in special_symbol_ids:
+            continue
+        counts[word_id] += smooth_count
+        total_counts += counts[word_id]
 
+    with open(probs_file, 'w', encoding="utf-8") as f:
+        f.write(''.join(["{0} {1}\n".format(idx, count / total_counts)
+                         for idx, count in enumerate(counts)]))
 
 
 data_sources = get_all_data_sources_except_dev(args.text_dir)
@@ -127,16 +301,22 @@ if not os.path.exists(args.split_dir + "/info"):
 with open("{0}/info/num_splits".format(args.split_dir), 'w', encoding="utf-8") as f:
     print(args.num_splits, file=f)
 
-# e.g. set temp_files = [ 'foo/1.tmp', 'foo/2.tmp', ..., 'foo/5.tmp' ]
-# we write the text data to here, later we convert to integer
-# while writing to the *.txt files.
-temp_files = [ "{0}/{1}.tmp".format(args.split_dir, n) for n in range(1, args.num_splits + 1) ]
-
-# create filehandles for writing to each of these '.tmp' output files.
-temp_filehandles = []
-for fname in temp_files:
+vocab = read_vocab(args.vocab_file)
+if args.unk_word != None and args.unk_word != '':
+    if args.unk_word.encode('utf-8') not in vocab:
+        sys.exit(sys.argv[0] + ": --unk-word={0} does not appear in vocab file {1}".format(
+            args.unk_word, args.vocab_file))
+    unk_id = vocab[args.unk_word.encode('utf-8')]
+count_words = (args.unigram_probs_file != '' or args.write_counts == 'true')
+
+# e.g. set output_files = [ 'foo/1.txt', 'foo/2.txt', ..., 'foo/5.txt' ]
+output_files = [ "{0}/{1}.txt".format(args.split_dir, n) for n in range(1, args.num_splits + 1) ]
+
+# create filehandles for writing to each of these output files.
+output_filehandles = []
+for fname in output_files:
     try:
-        temp_filehandles.append(open(fname, 'w', encoding="utf-8"))
+        output_filehandles.append(open(fname, 'wb', buffering=(1 << 20)))
     except Exception as e:
         sys.exit(sys.argv[0] + ": failed to open file: " + str(e) +
                  ".. if this is a max-open-filehandles limitation, you may "
@@ -144,77 +324,89 @@ for fname in temp_files:
                  "is to use fewer splits of the data (or change your OS "
                  "ulimits)")
 
+if args.num_jobs > 1:
+    pool = multiprocessing.Pool(args.num_jobs, init_worker, (vocab, unk_id, count_words))
+else:
+    pool = None
 
-print(sys.argv[0] + ": distributing data to temporary files")
+print(sys.argv[0] + ": distributing data to output files in integer form")
 
-# this loop appends text data (prepended by data-weights), from each of
-# the source .txt files, to the filehandles in 'temp_filehandles'.
+num_oovs = 0
+source_word_counts = {}
+# this loop appends integerized text data (prepended by data-weights), from
+# each of the source .txt files, to the filehandles in 'output_filehandles'.
 for name in data_sources.keys():
     source_file = data_sources[name]
     multiplicity = data_weights[name][0]
     weight = data_weights[name][1]
     assert multiplicity >= 0
-
-    for n in range(multiplicity):
-        # 'offset' will be zero for the first copy of any data, and
-        # from there it will increase up to some value less than
-        # args.num_splits.  The point of this offset, which you can
-        # think of as a rotation modulo args.num_splits, is so that
-        # when we write the same data multiple times, we don't end
-        # up writing the same lines to the same file.
+    if multiplicity == 0 and not count_words:
+        continue
+
+    # The first copy of the data is converted to integer form and written to
+    # the output files round-robin.  For the other copies, there is an
+    # 'offset', which will increase up to some value less than
+    # args.num_splits.  The point of this offset, which you can think of as
+    # a rotation modulo args.num_splits, is so that when we write the same
+    # data multiple times, we don't end up writing the same lines to the same
+    # file.  The lines of the n'th copy that go to output file i are the
+    # lines of the first copy that went to output file i - offset (modulo
+    # args.num_splits), so they are copied from there.
+    start_offsets = [f.tell() for f in output_filehandles]
+    if multiplicity > 0:
+        word_counts, this_num_oovs = integerize_to_outputs(
+            source_file, (str(weight) + ' ').encode(), (str(weight) + '\n').encode(),
+            output_filehandles, pool)
+    else:
+        # we only need the counts.
+        with open(os.devnull, 'wb') as null_filehandle:
+            word_counts, this_num_oovs = integerize_to_outputs(
+                source_file, None, None, [null_filehandle], pool)
+    num_oovs += this_num_oovs
+    source_word_counts[name] = word_counts
+    end_offsets = [f.tell() for f in output_filehandles]
+
+    for f in output_filehandles:
+        f.flush()
+    for n in range(1, multiplicity):
         offset = (n * args.num_splits) // multiplicity
         assert offset < args.num_splits
-        rotated_filehandles = temp_filehandles[offset:] + temp_filehandles[:offset]
+        for i in range(args.num_splits):
+            j = (i - offset) % args.num_splits
+            copy_range(output_files[j], start_offsets[j], end_offsets[j],
+                       output_filehandles[i])
 
-        # The following line is the core of what we're doing; see the
-        # documentation for this function for more details.
-        distribute_to_outputs(source_file, weight, rotated_filehandles)
+    if args.write_counts == 'true':
+        write_counts(word_counts, source_file[0:-4] + ".counts")
 
 
-for f in temp_filehandles:
+for f in output_filehandles:
     try:
         f.close()
     except:
-        sys.exit(sys.argv[0] + ": error closing temporary file (disk full?)");
-
-
-print(sys.argv[0] + ": converting from text to integer form.")
-
-if args.unk_word != None and args.unk_word != '':
-    unk_opt = "--map-oov '{0}'".format(args.unk_word)
-else:
-    unk_opt = ""
-
-# Convert from text to integer form using the vocabulary file,
-# moving data from *.tmp to *.txt.
-for n in range(1, args.num_splits + 1):
-    command = "utils/sym2int.pl {unk_opt} -f 2- {vocab_file} <{input_file} >{output_file}".format(
-        vocab_file=args.vocab_file,
-        unk_opt=unk_opt,
-        input_file="{0}/{1}.tmp".format(args.split_dir, n),
-        output_file="{0}/{1}.txt".format(args.split_dir, n))
-    ret = os.system(command)
-    if ret != 0:
-        sys.exit(sys.argv[0] + ": command '{0}' returned with status {1}".format(
-            command, ret))
-    os.remove("{0}/{1}.tmp".format(args.split_dir, n))
+        sys.exit(sys.argv[0] + ": error closing output file (disk full?)");
 
 
 print(sys.argv[0] + ": converting dev data from text to integer form.")
 
-
-command = "utils/sym2int.pl {unk_opt} {vocab_file} <{input_file} | {awk_command} >{output_file}".format(
-    vocab_file=args.vocab_file,
-    unk_opt=unk_opt,
-    awk_command="awk '{print 1.0, $0;}'",  # this is passed as a variable
-                                           # because it has {}'s awhich would
-                                           # otherwise be interpreted.
-    input_file="{0}/dev.txt".format(args.text_dir),
-    output_file="{0}/dev.txt".format(args.split_dir))
-ret = os.system(command)
-if ret != 0:
-    sys.exit(sys.argv[0] + ": command '{0}' returned with status {1}".format(
-            command, ret))
-
+with open("{0}/dev.txt".format(args.split_dir), 'wb') as f:
+    word_counts, this_num_oovs = integerize_to_outputs(
+        "{0}/dev.txt".format(args.text_dir), b'1 ', b'1 \n', [f], pool)
+    num_oovs += this_num_oovs
+if args.write_counts == 'true':
+    write_counts(word_counts, "{0}/dev.counts".format(args.text_dir))
+
+if pool is not None:
+    pool.close()
+    pool.join()
+
+if num_oovs > 0:
+    print(sys.argv[0] + ": replaced {0} instances of OOVs with {1}".format(
+        num_oovs, args.unk_word))
+
+if args.unigram_probs_file != '':
+    write_unigram_probs(source_word_counts, data_weights, vocab, unk_id,
+                        args.smooth_unigram_counts, args.unigram_probs_file)
+    print(sys.argv[0] + ": wrote unigram probs to {0}".format(args.unigram_probs_file))
 
 print(sys.argv[0] + ": created split data in {0}".format(args.split_dir))
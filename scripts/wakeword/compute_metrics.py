@@ -5,6 +5,19 @@
 # Apache 2.0
 
 """ This script computes several metrics for wake word detection.
+
+    By default the hypothesis is the decoded text of each utterance, and the
+    metrics are computed for that single operating point. With --scores, the
+    hypothesis is instead a detection score for each utterance (e.g. the
+    wake word posterior, or a log-likelihood ratio), with lines of the form
+    "<utt-id> <score>"; the metrics are then computed in a single pass for
+    every threshold (an utterance is a detection if its score is >= the
+    threshold), and written as a table, one threshold per line:
+        # threshold TP FP TN FN precision recall FPR FNR FP_per_hour
+    The first line of the table is for an infinite threshold (no
+    detections). The table gives the DET/ROC curves and the false alarms per
+    hour curve, and can be passed to plot_det.py directly.
+    e.g.: compute_metrics.py --scores --duration 36000 ref.txt scores.txt > det_table
 """
 
 
@@ -13,6 +26,49 @@ import os
 import io
 import sys
 import codecs
+import numpy as np
+
+
+def compute_det_table(labels, scores, duration):
+    """ Computes the metrics for all the thresholds at once, given the
+        labels (true for the utterances that contain the wake word) and the
+        detection scores of the utterances. Returns a list of numpy arrays:
+        [threshold, TP, FP, TN, FN, precision, recall, FPR, FNR, FP_per_hour],
+        with the thresholds in decreasing order, starting with infinity.
+    """
+    labels = np.asarray(labels, dtype=bool)
+    scores = np.asarray(scores, dtype=np.float64)
+    order = np.argsort(-scores, kind='mergesort')
+    scores = scores[order]
+    labels = labels[order]
+    # The number of positives and negatives with a score >= the score of
+    # each utterance; for tied scores, only the last one counts.
+    TP = np.cumsum(labels)
+    FP = np.cumsum(~labels)
+    last = np.append(scores[1:] != scores[:-1], True) if len(scores) > 0 else np.zeros(0, dtype=bool)
+    threshold = np.append(np.inf, scores[last])
+    TP = np.append(0, TP[last]).astype(np.float64)
+    FP = np.append(0, FP[last]).astype(np.float64)
+    FN = labels.sum() - TP
+    TN = (~labels).sum() - FP
+
+    def divide(a, b):
+        return np.where(b > 0, a / np.maximum(b, 1), 0.0)
+
+    precision = divide(TP, TP + FP)
+    recall = divide(TP, TP + FN)
+    false_positive_rate = divide(FP, FP + TN)
+    false_negative_rate = divide(FN, FN + TP)
+    false_alarms_per_hour = FP / (duration / 3600) if duration > 0.0 else np.zeros(len(FP))
+    return [threshold, TP, FP, TN, FN, precision, recall,
+            false_positive_rate, false_negative_rate, false_alarms_per_hour]
+
+
+def write_det_table(table, f):
+    print("# threshold TP FP TN FN precision recall FPR FNR FP_per_hour", file=f)
+    for row in zip(*[column.tolist() for column in table]):
+        print("{0} %d %d %d %d %.5f %.5f %.5f %.5f %.5f".format(row[0]) % row[1:], file=f)
+
 
 def main():
     parser = argparse.ArgumentParser(description="""Computes metrics for evalutuon.""")
@@ -24,7 +80,13 @@ def main():
                         help='path to the hypothesis')
     parser.add_argument('--wake-word', type=str, dest='wake_word', default='嗨小问',
                         help='wake word')
-    parser.add_argument('--duration', type=float, dest='duration', default=0.0)
+    parser.add_argument('--duration', type=float, dest='duration', default=0.0,
+                        help='total duration (in seconds) of the negative examples, '
+                        'for the false alarms per hour')
+    parser.add_argument('--scores', action='store_true',
+                        help='the hypothesis contains a detection score for each '
+                        'utterance; write the metrics for all thresholds (see the '
+                        'top of the script)')
     args = parser.parse_args()
 
     f = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8') if args.ref == "-" else codecs.open(args.ref, 'r', encoding='utf-8')
@@ -41,6 +103,22 @@ def main():
 
     if len(ref) != len(hyp):
         print("The lengths of reference and hypothesis do not match. ref: {} vs hyp: {}.".format(len(ref), len(hyp)), file=sys.stderr)
+
+    if args.scores:
+        labels = []
+        scores = []
+        for i in range(len(ref)):
+            if ref[i][0] not in hyp:
+                print("reference {} does not exist in hypothesis.".format(ref[i][0]), file=sys.stderr)
+                continue
+            try:
+                scores.append(float(hyp[ref[i][0]]))
+            except ValueError:
+                raise Exception("Bad score for utterance {}: '{}'".format(ref[i][0], hyp[ref[i][0]]))
+            labels.append(ref[i][1] == args.wake_word)
+        write_det_table(compute_det_table(labels, scores, args.duration), sys.stdout)
+        return
+
     TP = TN = FP = FN = 0.0
     for i in range(len(ref)):
         if ref[i][0] not in hyp:
@@ -3,7 +3,10 @@
 # Copyright 2018-2020  Yiming Wang
 # Apache 2.0
 
-""" This script plots the DET curves
+""" This script plots the DET curves. Each result file is either a file with
+    lines of metrics as printed by compute_metrics.py (one line per operating
+    point), or a table of all the thresholds as written by
+    compute_metrics.py --scores.
 """
 
 
@@ -24,7 +27,27 @@ except ImportError:
         Please install it to generate plots.
         If you are on a cluster where you do not have admin rights you could
         try using virtualenv.""")
-    
+
+
+def read_det_table(lines):
+    """ Reads a table written by compute_metrics.py --scores and returns the
+        lists FPR, FNR and FP_per_hour. """
+    columns = lines[0].lstrip("#").split()
+    fpr_index = columns.index("FPR")
+    fnr_index = columns.index("FNR")
+    fp_per_hour_index = columns.index("FP_per_hour")
+    FPR = []
+    FNR = []
+    FP_per_hour = []
+    for line in lines[1:]:
+        fields = line.split()
+        if len(fields) == 0 or fields[0].startswith("#"):
+            continue
+        FPR.append(float(fields[fpr_index]))
+        FNR.append(float(fields[fnr_index]))
+        FP_per_hour.append(float(fields[fp_per_hour_index]))
+    return FPR, FNR, FP_per_hour
+
 
 def main():
     parser = argparse.ArgumentParser(description="""Computes metrics for evalutuon.""")
@@ -59,6 +82,8 @@ def main():
         FPR = []
         FNR = []
         FP_per_hour = []
+        if len(lines) > 0 and lines[0].startswith("# threshold"):
+            FPR, FNR, FP_per_hour = read_det_table(lines)
         for line in lines:
             m = prog.match(line)
             if m: